@@ -1,5 +1,5 @@
 from gillespy3d import *
-from libcgillespy3d import CPropensityFunction, ModelContext, Simulation
+from libcgillespy3d import CGroupPropensityFunction, CPropensityFunction, CVoxelPropensityFunction, ModelContext, Simulation
 import ctypes
 import numba
 
@@ -46,3 +46,40 @@ jit_pfn = CPropensityFunction(jit_fn.value)
 jit_ctx.reactions().set_propensity_function(Rx_id, jit_pfn)
 jit_ctx.reactions().set_propensity_function(Ry_id, jit_pfn)
 Simulation(jit_ctx)
+
+# evaluate every reaction in a single call, so the JIT-compiled function can vectorize across reactions
+group_ctx = ModelContext(model)
+Rx_id, Ry_id = group_ctx.reactions().get_reaction_id(Rx), group_ctx.reactions().get_reaction_id(Ry)
+
+group_cdef = numba.types.void(
+    numba.types.CPointer(numba.types.double),
+    numba.types.CPointer(numba.types.double),
+    numba.types.CPointer(numba.types.double),
+)
+
+@numba.cfunc(group_cdef)
+def jit_group_propensity(state, parameters, out):
+    out[Rx_id] = parameters[0] * state[0] * state[1]
+    out[Ry_id] = parameters[1] * state[0] * state[1]
+
+
+group_fn = ctypes.cast(jit_group_propensity.ctypes, ctypes.c_void_p)
+group_ctx.reactions().set_group_propensity_function(CGroupPropensityFunction(group_fn.value))
+Simulation(group_ctx)
+
+# evaluate one reaction in a batch of voxels in a single call; states hold the species of each voxel in turn
+voxel_cdef = numba.types.void(
+    numba.types.uintp,
+    numba.types.CPointer(numba.types.double),
+    numba.types.CPointer(numba.types.double),
+    numba.types.CPointer(numba.types.double),
+)
+
+@numba.cfunc(voxel_cdef)
+def jit_voxel_propensity(num_voxels, states, parameters, out):
+    for voxel in range(num_voxels):
+        out[voxel] = parameters[0] * states[2 * voxel] * states[2 * voxel + 1]
+
+
+voxel_fn = ctypes.cast(jit_voxel_propensity.ctypes, ctypes.c_void_p)
+group_ctx.reactions().set_voxel_propensity_function(Rx_id, CVoxelPropensityFunction(voxel_fn.value))
@@ -118,15 +118,21 @@ class BoundaryCondition():
         self.model = model
 
 
-    def expression(self):
+    def expression(self, value=None):
         """
         Creates evaluable string expression of boundary condition.
 
+        :param value: C++ expression of the value to use instead of the value of the boundary condition, e.g. to
+            read it at runtime; a list of three expressions if the target is 'v'.
+        :type value: str | list[str]
+
         :returns: A string representation of the boundary condition.
         :rtype: str
         """
         if self.value is None:
             raise BoundaryConditionError("Must set value")
+        if value is None:
+            value = self.value
         cond=[]
         if self.xmin is not None:
             cond.append(f"(me->x[0] >= {self.xmin})")
@@ -148,7 +154,7 @@ class BoundaryCondition():
         if self.target in self.model.listOfSpecies:
             if self.deterministic:
                 s_ndx = self.model.species_map[self.model.listOfSpecies[self.target]]
-                bcstr += f"me->C[{s_ndx}] = {self.value};"
+                bcstr += f"me->C[{s_ndx}] = {value};"
             else:
                 raise BoundaryConditionError(
                     "BoundaryConditions don't work for stochastic species yet."
@@ -156,11 +162,11 @@ class BoundaryCondition():
         elif self.target is not None:
             if self.target == 'v':
                 for i in range(3):
-                    bcstr+= f"me->v[{i}]={self.value[i]};"
+                    bcstr+= f"me->v[{i}]={value[i]};"
             elif self.target == 'nu':
-                bcstr += f"me->nu={self.value};"
+                bcstr += f"me->nu={value};"
             elif self.target == 'rho':
-                bcstr += f"me->rho={self.value};"
+                bcstr += f"me->rho={value};"
             else:
                 raise BoundaryConditionError(f"Unable handle boundary condition for property '{self.target}'")
         bcstr+= "}"
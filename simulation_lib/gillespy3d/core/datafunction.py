@@ -13,6 +13,8 @@
 
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import numpy
+
 from gillespy3d.core.error import DataFunctionError
 
 class DataFunction():
@@ -45,3 +47,19 @@ class DataFunction():
         :rtype: float
         """
         raise DataFunctionError(f"{self.name}: DataFunction.map() must be implemented.")
+
+    def map_many(self, coordinates):
+        """
+        Evaluate the function at many points at once. Override it with a vectorized implementation for large
+        domains; by default, map() is called for each point.
+
+        NOTE: The solver caches the values for the coordinates of its domain, so the function must only depend on
+              the position.
+
+        :param coordinates: The x, y, z positions, one per row.
+        :type coordinates: numpy.ndarray
+
+        :returns: Value of function at each spatial location.
+        :rtype: numpy.ndarray
+        """
+        return numpy.array([self.map(point) for point in coordinates], dtype=float)
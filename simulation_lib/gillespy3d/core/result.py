@@ -28,7 +28,7 @@ from plotly.offline import init_notebook_mode, iplot
 
 # from gillespy3d.core.model import *
 from gillespy3d.core.visualization import Visualization
-from gillespy3d.core.vtkreader import VTKReader
+from gillespy3d.core.vtkreader import VTKReader, VTUReader
 from gillespy3d.core.error import ResultError
 
 try:
@@ -156,6 +156,7 @@ class Result():
         self.timeout = False
         self.official_vtk = False
         self.result_dir = result_dir
+        self.stats = {}
         self.listOfResultObjects = [self]
 
     def __len__(self):
@@ -270,7 +271,8 @@ class Result():
     def read_step(self, step_num, debug=False):
         """
         Read the data for simulation step 'step_num'. Returns a tuple containing a numpy.ndarray \
-        of point coordinates [0] along with a dictionary of property and species data [1]
+        of point coordinates [0] along with a dictionary of property and species data [1]. \
+        Both the legacy ASCII (.vtk) and binary XML (.vtu) output formats are supported.
 
         :param step_num: The index in the timespan.
         :type step_num: int
@@ -285,12 +287,19 @@ class Result():
         """
         if debug:
             print(f"read_step({step_num}) ", end='')
-        filename = os.path.join(self.result_dir, f"output{step_num}.vtk")
+        filename = os.path.join(self.result_dir, f"output{step_num}.vtu")
+        if not os.path.exists(filename):
+            filename = os.path.join(self.result_dir, f"output{step_num}.vtk")
 
         if debug:
             print(f"opening '{filename}'")
 
-        if self.official_vtk:
+        if filename.endswith(".vtu"):
+            reader = VTUReader(filename=filename, debug=debug)
+            reader.read_file()
+            points = reader.get_points()
+            vtk_data = reader.get_arrays()
+        elif self.official_vtk:
             reader = vtk.vtkGenericDataObjectReader()
             reader.SetFileName(filename)
             reader.Update()
@@ -320,6 +329,31 @@ class Result():
 
         return (points, vtk_data)
 
+    def read_stats(self):
+        """
+        Read the run statistics written by the solver (e.g. 'neighbor_rebuilds', the number of
+        neighbor searches performed). The statistics are also stored in Result.stats.
+
+        :returns: A dictionary mapping each statistic name to its value, empty if no statistics were written.
+        :rtype: dict
+
+        :raises ResultError: The statistics file could not be parsed.
+        """
+        filename = os.path.join(self.result_dir, "stats.txt")
+        if not os.path.isfile(filename):
+            return self.stats
+
+        with open(filename, "r", encoding="utf-8") as stats_file:
+            for line in stats_file:
+                if not line.strip():
+                    continue
+                try:
+                    name, value = line.split()
+                    self.stats[name] = int(value) if value.lstrip("-").isdigit() else float(value)
+                except ValueError as err:
+                    raise ResultError(f"Could not parse run statistics line '{line.strip()}'") from err
+        return self.stats
+
     def get_timespan(self):
         """
         Get the model time span. Returns a numpy array containing the time span of the model.
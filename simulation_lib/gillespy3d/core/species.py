@@ -32,10 +32,27 @@ class Species(libcgillespy3d.Species):
     :param restrict_to: Set the diffusion coefficient to zero for 'species' in all types not in 'listOfTypes'. \
     This effectively restricts the movement of 'species' to the types specified in 'listOfTypes'.
     :type restrict_to: int, str, list of ints or list of strs
+
+    :param mode: How the Species is simulated by the 'hybrid' RDME method: 'continuous' or 'discrete' everywhere,
+        or 'dynamic' to choose between them in every voxel, from its population, before each step.
+    :type mode: str
+
+    :param switch_tol: Coefficient of variation of the population below which a dynamic Species is simulated
+        continuously in a voxel. Ignored if switch_min is set.
+    :type switch_tol: float
+
+    :param switch_min: If nonzero, a dynamic Species is simulated continuously in the voxels where its
+        population exceeds switch_min.
+    :type switch_min: int
     """
-    def __init__(self, name=None, diffusion_coefficient=None, restrict_to=None, initial_value=None):
+    MODES = ('continuous', 'discrete', 'dynamic')
+
+    def __init__(self, name=None, diffusion_coefficient=None, restrict_to=None, initial_value=None,
+                 mode='dynamic', switch_tol=0.03, switch_min=0):
         if not (restrict_to is None or isinstance(restrict_to, (str, int, list))):
             raise SpeciesError("Restrict_to must be an int, str or list of ints or strs.")
+        if mode not in self.MODES:
+            raise SpeciesError(f"mode must be one of {list(self.MODES)}.")
         if restrict_to is not None and isinstance(restrict_to, (int, str)):
             restrict_to = [restrict_to]
 
@@ -47,6 +64,9 @@ class Species(libcgillespy3d.Species):
             self.restrict_to = []
             for type_id in restrict_to:
                 self.restrict_to.append(f"type_{type_id}")
+        self.mode = mode
+        self.switch_tol = switch_tol
+        self.switch_min = switch_min
 
         #self.validate()
         super().__init__(name)
@@ -109,3 +129,12 @@ class Species(libcgillespy3d.Species):
                 raise SpeciesError("restrict_to must be None or of type int, str, or list")
             if self.restrict_to is not None and len(self.restrict_to) == 0:
                 raise SpeciesError("restrict_to can't be an empty list.")
+
+        # Check hybrid partitioning
+        if coverage in ("all", "mode"):
+            if self.mode not in self.MODES:
+                raise SpeciesError(f"mode must be one of {list(self.MODES)}.")
+            if not isinstance(self.switch_tol, (float, int)) or self.switch_tol <= 0:
+                raise SpeciesError("switch_tol must be a positive value.")
+            if not isinstance(self.switch_min, int) or self.switch_min < 0:
+                raise SpeciesError("switch_min must be a non-negative int.")
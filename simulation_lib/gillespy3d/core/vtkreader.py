@@ -192,3 +192,125 @@ class VTKReader:
                 break
 
             self.arrays = _read_arrays(data_file)
+
+class VTUReader:
+    """
+    VTUReader.py: GillesPy3D minimal reader for the binary VTK XML UnstructuredGrid (.vtu) files
+    written by the solver, with raw appended data.
+    Reference: https://docs.vtk.org/en/latest/design_documents/VTKFileFormats.html
+
+    :param filename: name of GillesPy3D VTU file
+    :type filename: str
+
+    :param debug: If true, will print debugging information.
+    :type debug: bool
+    """
+    def __init__(self, filename=None, debug=False):
+
+        self.filename = filename
+        self.numpoints = None
+        self.points = None
+        self.arrays = None
+        self.debug = debug
+        self.datatypes = {
+            "Int8": "i1", "UInt8": "u1",
+            "Int32": "i4", "UInt32": "u4",
+            "Int64": "i8", "UInt64": "u8",
+            "Float32": "f4", "Float64": "f8",
+        }
+
+    def set_filename(self, filename):
+        """
+        Set the filename.
+
+        :params filename: Filename
+        :type filename: str
+        """
+        self.filename = filename
+
+    def get_arrays(self):
+        """
+        Get the dictionary of point data arrays.
+
+        :returns: dictionary of data arrays
+        :rtype: dict
+        """
+        return self.arrays
+
+    def get_num_points(self):
+        """
+        Get the number of points.
+
+        :returns: Number of points
+        :rtype: int
+        """
+        return self.numpoints
+
+    def get_points(self):
+        """
+        Get the list of points.
+
+        :returns: List of points.
+        :rtype: numpy.ndarray
+        """
+        return self.points
+
+    def __read_array(self, appended, offset, attributes, byte_order, header_type):
+        dtype = numpy.dtype(self.datatypes[attributes["type"]]).newbyteorder(byte_order)
+        header = numpy.dtype(self.datatypes[header_type]).newbyteorder(byte_order)
+        nbytes = int(numpy.frombuffer(appended, dtype=header, count=1, offset=offset)[0])
+        array = numpy.frombuffer(
+            appended, dtype=dtype, count=nbytes // dtype.itemsize, offset=offset + header.itemsize
+        )
+        array = array.astype(dtype.newbyteorder("="))
+        num_components = int(attributes.get("NumberOfComponents", 1))
+        if num_components > 1:
+            array = array.reshape(-1, num_components)
+        return array
+
+    def read_file(self):
+        """
+        Read VTU file.
+
+        :raises VTKReaderIOError: Invalid or unsupported VTU file
+        """
+        import xml.etree.ElementTree as ET # pylint: disable=import-outside-toplevel
+
+        with open(self.filename, "rb") as data_file:
+            if self.debug:
+                print(f"open({self.filename})")
+            contents = data_file.read()
+
+        # The appended data is not valid XML, so only the header is parsed.
+        start = contents.find(b"<AppendedData")
+        if start < 0:
+            raise VTKReaderIOError(f"{self.filename} doesn't look like a VTU file with appended data.")
+        data_start = contents.find(b"_", contents.find(b">", start)) + 1
+        try:
+            root = ET.fromstring(contents[:start] + b"</VTKFile>")
+        except ET.ParseError as err:
+            raise VTKReaderIOError(f"{self.filename} doesn't look like a valid VTU file.") from err
+        piece = root.find("UnstructuredGrid/Piece")
+        if root.get("type") != "UnstructuredGrid" or piece is None:
+            raise VTKReaderIOError(f"{self.filename} doesn't look like a valid VTU file.")
+
+        byte_order = "<" if root.get("byte_order", "LittleEndian") == "LittleEndian" else ">"
+        header_type = root.get("header_type", "UInt32")
+        appended = memoryview(contents)[data_start:]
+
+        def read(element):
+            if element.get("format") != "appended":
+                raise VTKReaderIOError(
+                    f"{self.filename}: only appended raw data arrays are supported."
+                )
+            return self.__read_array(
+                appended, int(element.get("offset")), element.attrib, byte_order, header_type
+            )
+
+        self.numpoints = int(piece.get("NumberOfPoints"))
+        self.points = read(piece.find("Points/DataArray"))
+        self.arrays = {}
+        for element in piece.findall("PointData/DataArray"):
+            if self.debug:
+                print(element.get("Name"))
+            self.arrays[element.get("Name")] = read(element)
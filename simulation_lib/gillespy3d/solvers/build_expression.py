@@ -305,6 +305,27 @@ class BuildExpression:
         expr = ast.parse(statement)
         return self.__get_expr(PythonConverter(expr))
 
+    def getexpr_ast(self, statement):
+        """
+        Validates the expression and returns its syntax tree, with names substituted if sanitizing.
+
+        :param statement: Python expression to be parsed.
+        :type statement: str
+
+        :returns: Syntax tree of the expression, if valid. Returns None if validation fails.
+        :rtype: ast.Expression | None
+
+        :raises SyntaxError: If the statement is not a valid Python expression.
+        """
+        statement = ExpressionConverter.convert_str(statement)
+        expr = ast.parse(statement, mode='eval')
+        validator = BuildExpression.ValidationVisitor(self.namespace, self.blacklist, self.sanitize)
+        validator.visit(expr)
+
+        if validator.invalid_operators or validator.invalid_names:
+            return None
+        return expr
+
     def getexpr_cpp(self, statement):
         """
         Converts the expression object into a C++ expression string.
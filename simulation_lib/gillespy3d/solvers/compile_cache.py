@@ -0,0 +1,189 @@
+# GillesPy3D is a Python 3 package for simulation of
+# spatial/non-spatial deterministic/stochastic reaction-diffusion-advection problems
+# Copyright (C) 2023 GillesPy3D developers.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU GENERAL PUBLIC LICENSE Version 3 as
+# published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU GENERAL PUBLIC LICENSE Version 3 for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from gillespy3d.__version__ import __version__
+
+class CompileCache:
+    """
+    Persistent cache of compiled solver executables, shared by every solver (and process) using the same
+    directory.
+
+    Entries are keyed on a hash of the generated model source, the build flags and the engine version, so an
+    unchanged model is never rebuilt. Each entry is a directory holding the executable; the least recently
+    used entries are evicted once the cache grows over `max_size` bytes.
+
+    :param cache_dir: Directory of the cache, created if needed.
+    :type cache_dir: str
+
+    :param max_size: Largest total size of the cached executables, in bytes.
+    :type max_size: int
+    """
+    def __init__(self, cache_dir, max_size=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def engine_version(engine_root):
+        """
+        Identify the engine sources: the package version, and the size and modification time of every file
+        under `engine_root`, so that rebuilt or edited engines do not reuse stale executables.
+
+        :param engine_root: Root directory of the engine sources.
+        :type engine_root: str
+
+        :returns: Version string of the engine.
+        :rtype: str
+        """
+        digest = hashlib.sha256(__version__.encode("utf-8"))
+        for dirpath, dirnames, filenames in os.walk(engine_root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                digest.update(f"{os.path.relpath(path, engine_root)}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+        return f"{__version__}+{digest.hexdigest()[:16]}"
+
+    @staticmethod
+    def key(source_file, flags, engine_version):
+        """
+        Key of a build.
+
+        :param source_file: Path of the generated model source.
+        :type source_file: str
+
+        :param flags: Build flags which change the executable.
+        :type flags: list[str]
+
+        :param engine_version: Version of the engine, see :py:meth:`engine_version`.
+        :type engine_version: str
+
+        :returns: Hexadecimal key.
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        with open(source_file, "rb") as source:
+            digest.update(source.read())
+        for item in [*flags, engine_version]:
+            digest.update(b"\0" + str(item).encode("utf-8"))
+        return digest.hexdigest()
+
+    def fetch(self, key, executable):
+        """
+        Copy the executable of a cached build to `executable`.
+
+        :returns: Whether the build was cached.
+        :rtype: bool
+        """
+        cached = os.path.join(self.cache_dir, key, os.path.basename(executable))
+        try:
+            shutil.copy2(cached, executable)
+            # The modification time orders entries for eviction
+            os.utime(cached)
+        except OSError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key, executable):
+        """
+        Add the executable of a build to the cache, then evict the least recently used entries over the size
+        limit.
+        """
+        entry = os.path.join(self.cache_dir, key)
+        os.makedirs(entry, exist_ok=True)
+        # Copy under a temporary name, so that concurrent solvers never see a partial executable
+        fd, tmp_path = tempfile.mkstemp(dir=entry)
+        os.close(fd)
+        try:
+            shutil.copy2(executable, tmp_path)
+            os.replace(tmp_path, os.path.join(entry, os.path.basename(executable)))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict(keep=key)
+
+    def __entries(self):
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, key)
+            if not os.path.isdir(entry):
+                continue
+            size, last_used = 0, 0
+            for filename in os.listdir(entry):
+                try:
+                    stat = os.stat(os.path.join(entry, filename))
+                except OSError:
+                    continue
+                size += stat.st_size
+                last_used = max(last_used, stat.st_mtime)
+            entries.append((last_used, size, key))
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache is no larger than its size limit.
+
+        :param keep: Key of an entry which is never removed.
+        :type keep: str
+        """
+        entries = sorted(self.__entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Remove every entry of the cache.
+        """
+        for _, _, key in self.__entries():
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def stats(self):
+        """
+        Statistics of the cache: hits, misses and evictions by this object, and the entries and total size of the
+        cache.
+
+        :rtype: dict
+        """
+        entries = self.__entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'size': sum(size for _, size, _ in entries),
+            'max_size': self.max_size,
+        }
@@ -0,0 +1,474 @@
+# GillesPy3D is a Python 3 package for simulation of
+# spatial/non-spatial deterministic/stochastic reaction-diffusion-advection problems
+# Copyright (C) 2023 GillesPy3D developers.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU GENERAL PUBLIC LICENSE Version 3 as
+# published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU GENERAL PUBLIC LICENSE Version 3 for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ast
+import copy
+
+from gillespy3d.solvers.build_expression import CppConverter
+
+# <cmath> functions returning a double, which may be evaluated ahead of time
+MATH_FUNCTIONS = {
+    'exp', 'log', 'log10', 'log2', 'sqrt', 'cbrt', 'pow', 'sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'atan2',
+    'sinh', 'cosh', 'tanh', 'fabs', 'floor', 'ceil', 'fmin', 'fmax',
+}
+ARITHMETIC_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div)
+
+def count_operations(node):
+    """
+    Number of arithmetic operations, comparisons and calls evaluated by an expression.
+
+    :param node: Syntax tree of the expression.
+    :type node: ast.AST
+
+    :rtype: int
+    """
+    count = 0
+    for child in ast.walk(node):
+        if isinstance(child, (ast.BinOp, ast.UnaryOp, ast.Call, ast.IfExp)):
+            count += 1
+        elif isinstance(child, ast.Compare):
+            count += len(child.ops)
+        elif isinstance(child, ast.BoolOp):
+            count += len(child.values) - 1
+    return count
+
+class OptimizationReport:
+    """
+    Container struct for the operations saved by an ExpressionOptimizer.
+    Operations are counted per evaluation of every expression on one voxel.
+
+    :param operations_before: Operations of the original expressions.
+    :type operations_before: int
+
+    :param operations_after: Operations of the optimized expressions and of their prelude, including the call to
+        the prelude from each expression reading it and its comparison of every voxel value it is keyed on.
+    :type operations_after: int
+
+    :param constants: Number of parameter-only sub-expressions folded into constants.
+    :type constants: int
+
+    :param constant_operations: Operations of the folded constants, evaluated once at startup.
+    :type constant_operations: int
+
+    :param shared: Number of common sub-expressions hoisted into the prelude.
+    :type shared: int
+
+    :param prelude_inputs: Number of voxel values which the prelude is keyed on.
+    :type prelude_inputs: int
+    """
+    def __init__(self, operations_before=0, operations_after=0, constants=0, constant_operations=0,
+                 shared=0, prelude_inputs=0):
+        self.operations_before = operations_before
+        self.operations_after = operations_after
+        self.constants = constants
+        self.constant_operations = constant_operations
+        self.shared = shared
+        self.prelude_inputs = prelude_inputs
+
+    @property
+    def operations_saved(self):
+        """
+        Operations no longer evaluated on each voxel.
+
+        :rtype: int
+        """
+        return self.operations_before - self.operations_after
+
+    def __str__(self):
+        return (f"{self.operations_before} -> {self.operations_after} operations per voxel "
+                f"({self.operations_saved} saved): {self.constants} constants folded "
+                f"({self.constant_operations} operations at startup), {self.shared} common sub-expressions "
+                f"shared through a prelude keyed on {self.prelude_inputs} values")
+
+class ExpressionOptimizer:
+    """
+    Optimizes expressions evaluated together on the same voxel, such as the propensities of the reactions of a
+    model.
+
+    Products and sums are first put in a canonical order, so that the same factors or terms written in another
+    order, or around different constants, give the same sub-expression: constant operands come first, grouped
+    apart from the others, and the operands reading the voxel are sorted by the first name they read, which puts
+    a species next to the factors reading it; quotients and negations are taken out of products, so that constant
+    divisors and signs are folded. For instance, the stochastic mass-action propensities `(k1 * S) * (S - 1) / vol`
+    and `(k2 * S) * (S - 1) / vol` both become `k * (S / vol * (S - 1))`. An integer product or quotient which was
+    computed in double is never introduced, so populations cannot overflow nor be divided as integers; reordering
+    may still change results by rounding.
+
+    Sub-expressions which only read constants (the parameters) are folded into constants, computed once when the
+    solver starts. Sub-expressions common to several expressions (or repeated in one) are then hoisted into a
+    prelude, computed once per voxel and shared by the expressions; as the expressions are evaluated by separate
+    functions, the prelude caches its values along with the voxel values they read, and is only recomputed when
+    those change. Every expression reading the prelude then pays for calling it and comparing those values, so
+    sub-expressions are only hoisted if they save more operations than these checks add.
+
+    Only unconditionally evaluated arithmetic sub-expressions of a known C++ type are hoisted: the operands of
+    conditional expressions and of logical operators are left in place.
+
+    :param constants: Names whose (double) value is fixed for the whole simulation.
+    :type constants: set[str]
+
+    :param variables: C++ type ('double' or 'int') of each name read from the voxel.
+    :type variables: dict[str, str]
+
+    :param prefix: Prefix of the names of the folded constants.
+    :type prefix: str
+
+    :param prelude: Name of the prelude values in the optimized expressions.
+    :type prelude: str
+    """
+    def __init__(self, constants, variables, prefix="opt", prelude="prelude"):
+        self.constants = set(constants)
+        self.variables = dict(variables)
+        self.prefix = prefix
+        self.prelude = prelude
+        self.trees = []
+        self.shared = []
+        # Names introduced by the optimization: folded constants, and values of the prelude with their type
+        self.__folded = set()
+        self.__hoisted = {}
+
+    def add(self, tree, shared=True):
+        """
+        Add an expression to optimize.
+
+        :param tree: Sanitized syntax tree of the expression, see BuildExpression.getexpr_ast.
+        :type tree: ast.Expression
+
+        :param shared: Whether the expression is evaluated on every voxel and may use the prelude. Expressions
+            evaluated conditionally (e.g. restricted to some types) are only folded.
+        :type shared: bool
+
+        :returns: Index of the expression.
+        :rtype: int
+        """
+        self.trees.append(tree.body if isinstance(tree, ast.Expression) else tree)
+        self.shared.append(shared)
+        return len(self.trees) - 1
+
+    def __type(self, node):
+        # C++ type of an expression and whether it is constant, or (None, False) for unknown types
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return ('int' if isinstance(node.value, int) else 'double'), True
+        if isinstance(node, ast.Name):
+            if node.id in self.constants or node.id in self.__folded:
+                return 'double', True
+            if node.id in self.__hoisted:
+                return self.__hoisted[node.id], False
+            return self.variables.get(node.id), False
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            return self.__type(node.operand)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ARITHMETIC_OPERATORS + (ast.Pow,)):
+            (left, left_const), (right, right_const) = self.__type(node.left), self.__type(node.right)
+            if left is None or right is None:
+                return None, False
+            is_double = isinstance(node.op, ast.Pow) or 'double' in (left, right)
+            return ('double' if is_double else 'int'), left_const and right_const
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in MATH_FUNCTIONS \
+                and not node.keywords:
+            types = [self.__type(arg) for arg in node.args]
+            if any(arg_type is None for arg_type, _ in types):
+                return None, False
+            return 'double', all(is_const for _, is_const in types)
+        return None, False
+
+    def __sort_key(self, node):
+        # Constants first, then by the first name read, a name before the other operands reading it
+        functions = {id(child.func) for child in ast.walk(node) if isinstance(child, ast.Call)}
+        names = [child.id for child in ast.walk(node) if isinstance(child, ast.Name) and id(child) not in functions]
+        return (not self.__type(node)[1], names[0] if names else "", not isinstance(node, ast.Name), ast.dump(node))
+
+    @staticmethod
+    def __chain(head, operations):
+        # Left-associative chain of (operator, operand) applied to head
+        for operator, operand in operations:
+            head = ast.BinOp(left=head, op=operator, right=operand)
+        return head
+
+    def __factors(self, node, numerators, denominators, operations):
+        # Operands of a chain of products and quotients, and its operations; returns whether it is negated
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return not self.__factors(node.operand, numerators, denominators, operations)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Mult, ast.Div)):
+            operations.append(node)
+            negated = self.__factors(node.left, numerators, denominators, operations)
+            if isinstance(node.op, ast.Mult):
+                return negated != self.__factors(node.right, numerators, denominators, operations)
+            return negated != self.__factors(node.right, denominators, numerators, operations)
+        numerators.append(node)
+        return False
+
+    def __terms(self, node, positive, terms):
+        # Operands of a chain of sums and differences, with their sign
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub)):
+            self.__terms(node.left, positive, terms)
+            self.__terms(node.right, positive == isinstance(node.op, ast.Add), terms)
+        else:
+            terms.append((positive, node))
+
+    def __canonical_product(self, node, node_type):
+        numerators, denominators, operations = [], [], []
+        negated = self.__factors(node, numerators, denominators, operations)
+        # Integer quotients do not commute with products, and a double chain must stay in double
+        if node_type == 'int' and denominators:
+            return node
+        if node_type == 'double' and any(self.__type(operation)[0] != 'double' for operation in operations):
+            return node
+        numerators.sort(key=self.__sort_key)
+        denominators.sort(key=self.__sort_key)
+        constant_numerators = [factor for factor in numerators if self.__type(factor)[1]]
+        constant_denominators = [factor for factor in denominators if self.__type(factor)[1]]
+        variable_numerators = numerators[len(constant_numerators):]
+        variable_denominators = [factor for factor in denominators if not self.__type(factor)[1]]
+        if negated and constant_numerators:
+            # Negate a constant, which is folded, rather than the product
+            constant_numerators[0] = ast.UnaryOp(op=ast.USub(), operand=constant_numerators[0])
+            negated = False
+
+        if not variable_numerators:
+            canonical = self.__chain(constant_numerators[0],
+                                     [(ast.Mult(), factor) for factor in constant_numerators[1:]] +
+                                     [(ast.Div(), factor) for factor in constant_denominators + variable_denominators])
+        else:
+            rest = [(ast.Mult(), factor) for factor in variable_numerators[1:]]
+            rest += [(ast.Div(), factor) for factor in variable_denominators]
+            if node_type == 'double' and rest and self.__type(variable_numerators[0])[0] == 'int':
+                # Start with a double operand, e.g. S / vol * (S - 1) rather than the integer S * (S - 1)
+                promoted = [i for i, (_, factor) in enumerate(rest) if self.__type(factor)[0] == 'double']
+                if not promoted:
+                    return node
+                rest.insert(0, rest.pop(promoted[0]))
+            canonical = self.__chain(variable_numerators[0], rest)
+            if constant_numerators:
+                constant = self.__chain(constant_numerators[0],
+                                        [(ast.Mult(), factor) for factor in constant_numerators[1:]] +
+                                        [(ast.Div(), factor) for factor in constant_denominators])
+                canonical = ast.BinOp(left=constant, op=ast.Mult(), right=canonical)
+            else:
+                canonical = self.__chain(canonical, [(ast.Div(), factor) for factor in constant_denominators])
+        # Constant integer quotients would be truncated
+        for child in ast.walk(canonical):
+            if isinstance(child, ast.BinOp) and isinstance(child.op, ast.Div) and self.__type(child)[0] != 'double':
+                return node
+        return ast.UnaryOp(op=ast.USub(), operand=canonical) if negated else canonical
+
+    def __canonical_sum(self, node):
+        terms = []
+        self.__terms(node, True, terms)
+        terms.sort(key=lambda term: self.__sort_key(term[1]))
+        constants = [term for term in terms if self.__type(term[1])[1]]
+        variables = [term for term in terms if not self.__type(term[1])[1]]
+
+        def chain(group):
+            # The group starts with its first positive term, or is None if it has none
+            heads = [i for i, (positive, _) in enumerate(group) if positive]
+            if not heads:
+                return None
+            rest = group[:heads[0]] + group[heads[0] + 1:]
+            return self.__chain(group[heads[0]][1], [(ast.Add() if positive else ast.Sub(), term)
+                                                     for positive, term in rest])
+        constant, variable = chain(constants), chain(variables)
+        if constant is None or variable is None:
+            # Constants subtracted, or only subtracted terms reading the voxel: a single chain
+            canonical = chain(terms)
+            return node if canonical is None else canonical
+        return ast.BinOp(left=constant, op=ast.Add(), right=variable)
+
+    def __canonical(self, node):
+        # Put the products and sums in canonical order, children first; returns the new node
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, ast.AST):
+                setattr(node, field, self.__canonical(value))
+            elif isinstance(value, list):
+                setattr(node, field, [self.__canonical(item) if isinstance(item, ast.AST) else item
+                                      for item in value])
+        if not isinstance(node, ast.BinOp):
+            return node
+        node_type = self.__type(node)[0]
+        if node_type is None:
+            return node
+        if isinstance(node.op, (ast.Mult, ast.Div)):
+            return self.__canonical_product(node, node_type)
+        if isinstance(node.op, (ast.Add, ast.Sub)):
+            return self.__canonical_sum(node)
+        return node
+
+    def __reads_constant(self, node):
+        return any(isinstance(child, ast.Name) and child.id in self.constants for child in ast.walk(node))
+
+    def __fold(self, node, constants):
+        # Replace the largest constant sub-expressions by names, in place; returns the new node
+        node_type, is_const = self.__type(node)
+        if node_type is not None and is_const and count_operations(node) > 0 and self.__reads_constant(node):
+            key = ast.dump(node)
+            if key not in constants:
+                constants[key] = (f"{self.prefix}_c{len(constants)}", node)
+                self.__folded.add(constants[key][0])
+            return ast.Name(id=constants[key][0], ctx=ast.Load())
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, ast.AST):
+                setattr(node, field, self.__fold(value, constants))
+            elif isinstance(value, list):
+                setattr(node, field, [self.__fold(item, constants) if isinstance(item, ast.AST) else item
+                                      for item in value])
+        return node
+
+    def __candidates(self, node, found):
+        # Unconditionally evaluated sub-expressions of a known type: key -> [occurrences, operations, node]
+        if isinstance(node, (ast.BoolOp, ast.IfExp)):
+            return
+        node_type, is_const = self.__type(node)
+        operations = count_operations(node)
+        # Constant sub-expressions are either folded, or only read literals and left to the compiler
+        if node_type is not None and not is_const and operations > 0:
+            key = ast.dump(node)
+            if key in found:
+                found[key][0] += 1
+            else:
+                found[key] = [1, operations, node]
+        for child in ast.iter_child_nodes(node):
+            self.__candidates(child, found)
+
+    def __prelude_inputs(self, prelude):
+        # Voxel values read by the prelude, which it is keyed on
+        inputs = []
+        for _, _, node in prelude:
+            for child in ast.walk(node):
+                if isinstance(child, ast.Name) and child.id in self.variables and child.id not in inputs:
+                    inputs.append(child.id)
+        return inputs
+
+    def __uses_prelude(self, trees, prelude):
+        prelude_names = {name for name, _, _ in prelude}
+        return [any(isinstance(child, ast.Name) and child.id in prelude_names for child in ast.walk(tree))
+                for tree in trees]
+
+    def __operations(self, trees, prelude):
+        # Operations of the expressions and of their prelude, with the call and cache check of each reader
+        operations = sum(count_operations(tree) for tree in trees)
+        operations += sum(count_operations(node) for _, _, node in prelude)
+        operations += sum(self.__uses_prelude(trees, prelude)) * (len(self.__prelude_inputs(prelude)) + 1)
+        return operations
+
+    def __replace(self, node, key, name):
+        if ast.dump(node) == key:
+            return ast.Name(id=name, ctx=ast.Load())
+        if isinstance(node, (ast.BoolOp, ast.IfExp)):
+            return node
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, ast.AST):
+                setattr(node, field, self.__replace(value, key, name))
+            elif isinstance(value, list):
+                setattr(node, field, [self.__replace(item, key, name) if isinstance(item, ast.AST) else item
+                                      for item in value])
+        return node
+
+    def optimize(self):
+        """
+        Optimize the expressions added so far.
+
+        :returns: The optimized expressions, their constants and their prelude.
+        :rtype: OptimizedExpressions
+        """
+        report = OptimizationReport(operations_before=sum(count_operations(tree) for tree in self.trees))
+        self.__folded = set()
+        self.__hoisted = {}
+
+        # Canonical order, then constant folding
+        constants = {}
+        trees = [self.__fold(self.__canonical(copy.deepcopy(tree)), constants) for tree in self.trees]
+        constant_defs = [(name, node) for name, node in constants.values()]
+        report.constants = len(constant_defs)
+        report.constant_operations = sum(count_operations(node) for _, node in constant_defs)
+
+        # Common sub-expressions, largest savings first; hoisted expressions are searched as well. The fewest
+        # operations are kept: as the cache check grows with the readers and inputs of the prelude, hoisting a
+        # small sub-expression, or the first of several, may cost more than it saves.
+        prelude = []
+        best = (self.__operations(trees, prelude), copy.deepcopy(trees), [])
+        while True:
+            found = {}
+            for tree, shared in zip(trees, self.shared):
+                if shared:
+                    self.__candidates(tree, found)
+            for _, _, node in prelude:
+                for child in ast.iter_child_nodes(node):
+                    self.__candidates(child, found)
+            savings = [((count - 1) * operations, key) for key, (count, operations, _) in found.items() if count > 1]
+            if not savings:
+                break
+            _, key = max(savings, key=lambda saving: saving[0])
+            node = found[key][2]
+            name = f"{self.prelude}.v{len(prelude)}"
+            self.__hoisted[name] = self.__type(node)[0]
+            prelude.append((name, self.__hoisted[name], node))
+            trees = [self.__replace(tree, key, name) if shared else tree for tree, shared in zip(trees, self.shared)]
+            for _, _, other in prelude[:-1]:
+                for field, value in ast.iter_fields(other):
+                    if isinstance(value, ast.AST):
+                        setattr(other, field, self.__replace(value, key, name))
+                    elif isinstance(value, list):
+                        setattr(other, field, [self.__replace(item, key, name) if isinstance(item, ast.AST) else item
+                                               for item in value])
+            operations = self.__operations(trees, prelude)
+            if operations < best[0]:
+                best = (operations, copy.deepcopy(trees), copy.deepcopy(prelude))
+        report.operations_after, trees, prelude = best
+
+        # Values are defined after those they read, which were hoisted later
+        prelude.reverse()
+        report.shared = len(prelude)
+        inputs = self.__prelude_inputs(prelude)
+        report.prelude_inputs = len(inputs)
+        uses_prelude = self.__uses_prelude(trees, prelude)
+        return OptimizedExpressions(
+            expressions=[CppConverter(tree).get_str() for tree in trees],
+            uses_prelude=uses_prelude,
+            constants=[(name, CppConverter(node).get_str()) for name, node in constant_defs],
+            prelude=[(name.split('.')[-1], value_type, CppConverter(node).get_str())
+                     for name, value_type, node in prelude],
+            prelude_inputs=inputs,
+            report=report
+        )
+
+class OptimizedExpressions:
+    """
+    Container struct for the results of an ExpressionOptimizer.
+
+    :param expressions: C++ string of each expression, in the order they were added.
+    :type expressions: list[str]
+
+    :param uses_prelude: Whether each expression reads values of the prelude.
+    :type uses_prelude: list[bool]
+
+    :param constants: Name and C++ string of each folded constant (a double), in order of definition.
+    :type constants: list[tuple(str, str)]
+
+    :param prelude: Member name, C++ type and C++ string of each value of the prelude, in order of definition.
+    :type prelude: list[tuple(str, str, str)]
+
+    :param prelude_inputs: Voxel values read by the prelude.
+    :type prelude_inputs: list[str]
+
+    :param report: Operations saved.
+    :type report: OptimizationReport
+    """
+    def __init__(self, expressions, uses_prelude, constants, prelude, prelude_inputs, report):
+        self.expressions = expressions
+        self.uses_prelude = uses_prelude
+        self.constants = constants
+        self.prelude = prelude
+        self.prelude_inputs = prelude_inputs
+        self.report = report
@@ -0,0 +1,48 @@
+# GillesPy3D is a Python 3 package for simulation of
+# spatial/non-spatial deterministic/stochastic reaction-diffusion-advection problems
+# Copyright (C) 2023 GillesPy3D developers.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU GENERAL PUBLIC LICENSE Version 3 as
+# published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU GENERAL PUBLIC LICENSE Version 3 for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+import numpy
+
+# Must match GillesPy3D::InputFile (libcGillesPy3D/include/input_file.hpp)
+INPUT_FILE_MAGIC = b"GPY3DIN\0"
+INPUT_FILE_VERSION = 1
+INPUT_FILE_TYPES = {'d': numpy.float64, 'i': numpy.int32, 'I': numpy.uint32, 'Q': numpy.uint64}
+
+def _padded(data):
+    return data + b"\0" * (-len(data) % 8)
+
+def write_input_file(file_name, arrays):
+    """
+    Write the arrays read by the engine at startup.
+
+    :param file_name: Path of the input file.
+    :type file_name: str
+
+    :param arrays: Type code ('d' double, 'i' int32, 'I' uint32 or 'Q' uint64) and values of each array,
+        by name. Multidimensional values are written in C order.
+    :type arrays: dict[str, tuple(str, numpy.ndarray)]
+    """
+    with open(file_name, "wb") as input_file:
+        input_file.write(INPUT_FILE_MAGIC)
+        input_file.write(struct.pack("=II", INPUT_FILE_VERSION, len(arrays)))
+        for name, (type_code, values) in arrays.items():
+            data = numpy.ascontiguousarray(values, dtype=INPUT_FILE_TYPES[type_code]).ravel()
+            name = name.encode("utf-8")
+            input_file.write(struct.pack("=Ic3xQ", len(name), type_code.encode("ascii"), data.size))
+            input_file.write(_padded(name))
+            input_file.write(_padded(data.tobytes()))
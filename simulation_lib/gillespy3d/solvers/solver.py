@@ -20,14 +20,20 @@ import signal
 import subprocess
 import tempfile
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 import time
 import getpass
+import hashlib
 import re
+import shlex
 import sys
 
 import numpy
 
 from gillespy3d.core.error import ModelError, SimulationError
+from gillespy3d.solvers.compile_cache import CompileCache
+from gillespy3d.solvers.expression_optimizer import ExpressionOptimizer
+from gillespy3d.solvers.input_file import write_input_file
 
 def _read_from_stdout(stdout ,verbose=True):
     try:
@@ -52,13 +58,104 @@ class Solver:
 
     :param debug_level: Target level of debugging.
     :type debug_level: int
+
+    :param neighbor_search: Neighbor search backend used by the engine: 'kdtree' (kd-tree queried by all
+        threads at once), 'kdtree_serial' (the same kd-tree with its queries serialized behind a lock, as in the
+        legacy engine) or 'cell_list' (uniform grid of cells of width h). If None, the backend is chosen from the
+        number of particles and the dimension of the domain.
+    :type neighbor_search: str
+
+    :param neighbor_skin: Verlet list skin distance. Neighbors are searched within h + neighbor_skin and
+        the search is only repeated once a particle has moved more than neighbor_skin / 2.
+        The default of 0 searches every timestep.
+    :type neighbor_skin: float
+
+    :param half_neighbor_list: If True, the engine evaluates the pairwise forces and diffusion fluxes once per
+        pair and applies them to both particles, roughly halving the work. Results match the default full
+        neighbor list up to floating-point rounding.
+    :type half_neighbor_list: bool
+
+    :param kernel: SPH weight function, one of 'lucy', 'wendland_c2', 'wendland_c4' or 'cubic_spline'.
+    :type kernel: str
+
+    :param kernel_table_size: If nonzero, the engine tabulates the kernel and its derivative at this many
+        intervals over the support and interpolates instead of evaluating them exactly.
+    :type kernel_table_size: int
+
+    :param output_format: Format of the per-step output files, 'vtk' for legacy ASCII VTK or 'vtu' for
+        binary VTK XML files indexed by an 'output.pvd' collection, which can be opened directly in ParaView.
+    :type output_format: str
+
+    :param output_buffers: Number of output snapshots the engine may queue for its writer thread. The simulation
+        only waits for the writer when it falls this many snapshots behind; the total wait is reported as
+        'output_wait_seconds' in Result.stats.
+    :type output_buffers: int
+
+    :param rdme_method: Simulation of the stochastic species, 'nsm' for the exact Next Subvolume Method,
+        'tau_leaping' for spatial tau-leaping, which leaps the reactions and diffusion jumps of every voxel
+        together and only simulates the channels consuming species with low populations exactly, or 'hybrid'
+        to simulate each species deterministically in the voxels where its population is high and stochastically
+        elsewhere, as set by the mode, switch_tol and switch_min of the Species.
+    :type rdme_method: str
+
+    :param tau_tol: Relative change of the populations allowed in one leap when rdme_method is 'tau_leaping';
+        must be between 0 and 1.
+    :type tau_tol: float
+
+    :param compile_cache: If True, compiled solvers are kept in a cache under core_dir, keyed on the generated
+        model source, the build flags and the engine version, and compiling an unchanged model reuses them
+        without building. Hits and misses are reported by compile_cache_stats().
+    :type compile_cache: bool
+
+    :param compile_cache_size: Largest total size of the cached solvers, in bytes; the least recently used are
+        removed beyond it.
+    :type compile_cache_size: int
+
+    :param optimize_expressions: If True, the propensities are optimized before compiling: sub-expressions
+        reading only parameters are computed once at startup, and sub-expressions shared by several reactions
+        once per voxel. The operations saved are reported in expression_report.
+    :type optimize_expressions: bool
     """
-    def __init__(self, model, debug_level=0):
+    NEIGHBOR_SEARCH_METHODS = {'kdtree_serial': 'KDTREE_SERIAL', 'kdtree': 'KDTREE', 'cell_list': 'CELL_LIST'}
+    # A cell list is only used if its grid holds at most this many cells per particle;
+    # sparser grids are widened by the engine and lose their advantage over the kd-tree.
+    CELL_LIST_MAX_CELLS_PER_PARTICLE = 8
+    OUTPUT_FORMATS = {'vtk': 'OUTPUT_VTK_ASCII', 'vtu': 'OUTPUT_VTU_BINARY'}
+    KERNEL_FUNCTIONS = {
+        'lucy': 'LUCY', 'wendland_c2': 'WENDLAND_C2', 'wendland_c4': 'WENDLAND_C4', 'cubic_spline': 'CUBIC_SPLINE'
+    }
+    RDME_METHODS = {'nsm': 'RDME_NSM', 'tau_leaping': 'RDME_TAU_LEAPING', 'hybrid': 'RDME_HYBRID'}
+    SPECIES_MODES = {'continuous': 'CONTINUOUS', 'discrete': 'DISCRETE', 'dynamic': 'DYNAMIC'}
+
+    def __init__(self, model, debug_level=0, neighbor_search=None, neighbor_skin=0.0, half_neighbor_list=False,
+                 kernel='lucy', kernel_table_size=0, output_format='vtk', output_buffers=2,
+                 rdme_method='nsm', tau_tol=0.03, compile_cache=True, compile_cache_size=1 << 30,
+                 optimize_expressions=True):
         from gillespy3d.core.model import Model # pylint: disable=import-outside-toplevel
         if not (isinstance(model, Model) or type(model).__name__ == 'Model'):
             raise SimulationError("Model must be of type gillespy3d.Model.")
         if not issubclass(self.__class__, Solver):
             raise SimulationError("Solver classes must be a subclass of gillespy3d.Solver.")
+        if neighbor_search is not None and neighbor_search not in self.NEIGHBOR_SEARCH_METHODS:
+            raise SimulationError(
+                f"neighbor_search must be one of {list(self.NEIGHBOR_SEARCH_METHODS)} or None."
+            )
+        if neighbor_skin < 0:
+            raise SimulationError("neighbor_skin must be non-negative.")
+        if kernel not in self.KERNEL_FUNCTIONS:
+            raise SimulationError(f"kernel must be one of {list(self.KERNEL_FUNCTIONS)}.")
+        if kernel_table_size < 0:
+            raise SimulationError("kernel_table_size must be non-negative.")
+        if output_format not in self.OUTPUT_FORMATS:
+            raise SimulationError(f"output_format must be one of {list(self.OUTPUT_FORMATS)}.")
+        if output_buffers < 2:
+            raise SimulationError("output_buffers must be at least 2.")
+        if rdme_method not in self.RDME_METHODS:
+            raise SimulationError(f"rdme_method must be one of {list(self.RDME_METHODS)}.")
+        if not 0 < tau_tol < 1:
+            raise SimulationError("tau_tol must be between 0 and 1.")
+        if compile_cache_size < 0:
+            raise SimulationError("compile_cache_size must be non-negative.")
 
         self.model = model
         self.is_compiled = False
@@ -67,8 +164,24 @@ class Solver:
         self.build_dir = None
         self.propfilename = None
         self.prop_file_name = None
+        self.input_file_name = None
+        # Values of each data function over the domain, by name: (data function, coordinates digest, values)
+        self.data_function_cache = {}
         self.executable_name = 'ssa_sdpd.exe'
         self.h = None  # basis function width
+        self.neighbor_search = neighbor_search
+        self.neighbor_skin = neighbor_skin
+        self.half_neighbor_list = half_neighbor_list
+        self.kernel = kernel
+        self.kernel_table_size = int(kernel_table_size)
+        self.output_format = output_format
+        self.output_buffers = int(output_buffers)
+        self.rdme_method = rdme_method
+        self.tau_tol = tau_tol
+        self.optimize_expressions = optimize_expressions
+        # Operations saved by the optimization of the propensities, by kind ('ssa', 'ode' and, for
+        # rdme_method='hybrid', 'hybrid')
+        self.expression_report = {}
 
         self.gillespy3d_root = os.path.dirname(
             os.path.abspath(__file__)) + "/c_base/ssa_sdpd-c-simulation-engine"
@@ -84,6 +197,10 @@ class Solver:
         if not os.path.isdir(self.core_dir):
             os.mkdir(self.core_dir)
 
+        self.compile_cache = None
+        if compile_cache:
+            self.compile_cache = CompileCache(os.path.join(self.core_dir, 'compile_cache'), compile_cache_size)
+
         self.debugger_url = None
         self.debugger_process = None
 
@@ -117,8 +234,14 @@ class Solver:
             num_stoch_rxns = 0
         num_data_fn = len(self.model.listOfDataFunctions)
 
+        # Per-particle and per-voxel data go to the input file, read by the solver at startup
+        input_arrays = self.__get_input_arrays(nspecies, ncells, stoich_matrix, dep_graph)
+        write_input_file(self.input_file_name, input_arrays)
+
         # Reactions
         funcs, funcinits = self.__get_reaction_prop()
+        if self.rdme_method == 'hybrid' and len(self.model.listOfSpecies) > 0:
+            funcs += self.__get_hybrid_prop()
         deterministic_chem_rxn_functions, deterministic_chem_rxn_function_init = self.__get_chem_rxn_prop()
 
         # End of pyurdme replacements
@@ -129,8 +252,19 @@ class Solver:
             init_rdme=''
 
         init_bc = ""
+        if len(self.model.listOfBoundaryConditions) > 0:
+            # Boundary values are read at runtime, so that Solver.run(variables=...) can change them
+            init_bc += "static const double *input_boundary_values = "
+            init_bc += "GillesPy3D::InputFile::instance().data<double>(\"input_boundary_values\");\n"
+        offset = 0
         for bound_cond in self.model.listOfBoundaryConditions:
-            init_bc += bound_cond.expression()
+            if isinstance(bound_cond.value, list):
+                value = [f"input_boundary_values[{offset + i}]" for i in range(len(bound_cond.value))]
+                offset += len(bound_cond.value)
+            else:
+                value = f"input_boundary_values[{offset}]"
+                offset += 1
+            init_bc += bound_cond.expression(value=value)
 
         replacements = {
             "__NUMBER_OF_REACTIONS__": str(self.model.get_num_reactions()),
@@ -143,7 +277,7 @@ class Solver:
             "__DEFINE_CHEM_FUN_INITS__": deterministic_chem_rxn_function_init,
             "__INIT_PARTICLES__": self.__get_particle_inits(num_chem_species),
             "__DATA_FUNCTION_ASSIGN__": self.__get_data_fn_assign(ncells),
-            "__INPUT_CONSTANTS__": self.__get_input_constants(nspecies, ncells, stoich_matrix, dep_graph),
+            "__INPUT_CONSTANTS__": self.__get_input_constants(input_arrays),
             "__SYSTEM_CONFIG__": self.__get_system_config(num_types, num_chem_species, num_chem_rxns,
                                                           num_stoch_species, num_stoch_rxns, num_data_fn),
             "__INIT_RDME__": init_rdme,
@@ -160,12 +294,15 @@ class Solver:
     def __get_chem_rxn_prop(self):
         funheader = "double det__NAME__(const double *x, double t, const double vol, const double *data_fn, int sd)"
 
-        deterministic_chem_rxn_functions = ""
+        propensity_functions, uses_prelude, prelude = self.__get_propensity_exprs(ode=True)
+        deterministic_chem_rxn_functions = prelude
         deterministic_chem_rxn_function_init = ""
         for i, (rname, reac) in enumerate(self.model.listOfReactions.items()):
-            ode_propensity_function = self.model.expr.getexpr_cpp(reac.ode_propensity_function)
+            ode_propensity_function = propensity_functions[i]
             func = funheader.replace("__NAME__", rname)
             func += "\n{\n"
+            if uses_prelude[i]:
+                func += "const auto &prelude = ode_prelude(x, t, vol, data_fn, sd);\n"
             if reac.restrict_to is None or (isinstance(reac.restrict_to, list) and len(reac.restrict_to) == 0):
                 func += f"return {ode_propensity_function};"
             else:
@@ -197,64 +334,126 @@ class Solver:
 
         return data_fn_assign
 
-    def __get_input_constant(self, header, data, to_int=False):
-        outstr = f"{header}[{len(data)}] = "
-        outstr += "{"
-        outstr += ",".join([str(int(val) if to_int else val) for val in data])
-        outstr += "};\n"
-
-        return outstr
-
-    def __get_input_constants(self, nspecies, ncells, stoich_matrix, dep_graph):
-        input_constants = ""
-
-        outstr = f"unsigned int input_u0[{nspecies * ncells}] = "
-        outstr += "{"
+    def __get_input_arrays(self, nspecies, ncells, stoich_matrix, dep_graph):
+        arrays = {}
         if len(self.model.listOfSpecies) > 0:
-            for i in range(ncells):
-                for j in range(nspecies):
-                    if i + j > 0:
-                        outstr += ','
-                    outstr += str(int(self.model.u0[j, i]))
-        outstr += "};\n"
-        input_constants += outstr
+            # Voxel-major: the populations of all species in voxel 0, then in voxel 1, ...
+            arrays['input_u0'] = ('I', numpy.asarray(self.model.u0).T.astype(numpy.int64))
+        else:
+            arrays['input_u0'] = ('I', [])
 
         if len(self.model.listOfSpecies) > 0:
             if min(stoich_matrix.shape) > 0:
-                dense_matrix = stoich_matrix.todense() # this will not work if Nrxn or Nspecies is zero
-                outstr = f"static int input_N_dense[{dense_matrix.shape[0] * dense_matrix.shape[1]}] = "
-                outstr += "{"
-                for i in range(dense_matrix.shape[0]):
-                    for j in range(dense_matrix.shape[1]):
-                        if j + i > 0:
-                            outstr += ','
-                        outstr += f"{int(dense_matrix[i, j])}"
-                outstr += "};\n"
-                input_constants += outstr
-
-                input_constants += self.__get_input_constant("static size_t input_irN", stoich_matrix.indices)
-                input_constants += self.__get_input_constant("static size_t input_jcN", stoich_matrix.indptr)
-                input_constants += self.__get_input_constant("static int input_prN", stoich_matrix.data, to_int=True)
+                arrays['input_irN'] = ('Q', stoich_matrix.indices)
+                arrays['input_jcN'] = ('Q', stoich_matrix.indptr)
+                arrays['input_prN'] = ('i', numpy.asarray(stoich_matrix.data).astype(numpy.int64))
 
                 if len(self.model.listOfDataFunctions) > 0:
-                    outstr = f"static double input_data_fn[{len(self.model.listOfDataFunctions) * ncells}] = "
-                    outstr += "{"
-                    coords = self.model.domain.coordinates()
-                    for ndf, data_fn in enumerate(self.model.listOfDataFunctions.values()):
-                        for i in range(ncells):
-                            if i > 0 and ndf == 0:
-                                outstr += ','
-                            outstr += str(data_fn.map([coords[i, 0], coords[i, 1], coords[i, 2]]))
-                    outstr += "};\n"
-                    input_constants += outstr
+                    # Function-major: input_data_fn[ndf * ncells + i]
+                    coords = numpy.asarray(self.model.domain.coordinates(), dtype=float)[:ncells]
+                    arrays['input_data_fn'] = ('d', numpy.concatenate([
+                        self.__map_data_function(data_fn, coords)
+                        for data_fn in self.model.listOfDataFunctions.values()
+                    ]))
             else:
-                input_constants += "static int input_N_dense[0] = {};\n"
-                input_constants += "static size_t input_irN[0] = {};\n"
-                input_constants += "static size_t input_jcN[0] = {};\n"
-                input_constants += "static int input_prN[0] = {};\n"
-
-            input_constants += self.__get_input_constant("static size_t input_irG", dep_graph.indices)
-            input_constants += self.__get_input_constant("static size_t input_jcG", dep_graph.indptr)
+                for name, type_code in (('input_irN', 'Q'), ('input_jcN', 'Q'), ('input_prN', 'i')):
+                    arrays[name] = (type_code, [])
+
+            arrays['input_irG'] = ('Q', dep_graph.indices)
+            arrays['input_jcG'] = ('Q', dep_graph.indptr)
+
+        arrays['input_parameters'] = ('d', self.__get_parameter_values())
+        arrays['input_boundary_values'] = ('d', self.__get_boundary_values())
+        arrays.update(self.__get_particle_arrays())
+        return arrays
+
+    def __get_parameter_values(self):
+        return [float(parameter.value) for parameter in self.model.listOfParameters.values()]
+
+    def __get_boundary_values(self, overrides=None):
+        values = []
+        for ndx, bound_cond in enumerate(self.model.listOfBoundaryConditions):
+            value = bound_cond.value
+            if overrides is not None and ndx in overrides:
+                value = overrides[ndx]
+                if isinstance(bound_cond.value, list) != isinstance(value, (list, tuple, numpy.ndarray)) or \
+                        isinstance(bound_cond.value, list) and len(value) != len(bound_cond.value):
+                    raise SimulationError(
+                        f"The value of boundary condition {ndx} must have the shape of {bound_cond.value}."
+                    )
+            if isinstance(bound_cond.value, list):
+                values.extend(float(val) for val in value)
+            elif value is not None:
+                values.append(float(value))
+        return values
+
+    def __get_variable_arrays(self, variables):
+        # Only the arrays which change are written; the engine applies them over the input file
+        arrays = {}
+        parameter_names = list(self.model.listOfParameters)
+        species_names = list(self.model.listOfSpecies)
+        parameter_values = None
+        u0 = None
+        for name, value in variables.items():
+            if name in self.model.listOfParameters:
+                if parameter_values is None:
+                    parameter_values = self.__get_parameter_values()
+                parameter_values[parameter_names.index(name)] = float(value)
+            elif name in self.model.listOfSpecies:
+                if u0 is None:
+                    u0 = numpy.array(self.model.u0, dtype=numpy.int64)
+                counts = numpy.asarray(value)
+                if counts.shape != (u0.shape[1],) or numpy.any(counts < 0):
+                    raise SimulationError(
+                        f"The initial populations of '{name}' must be {u0.shape[1]} non-negative counts, "
+                        "one per voxel."
+                    )
+                u0[species_names.index(name), :] = counts
+            elif name == 'boundary_conditions':
+                if not isinstance(value, dict) or \
+                        any(ndx not in range(len(self.model.listOfBoundaryConditions)) for ndx in value):
+                    raise SimulationError(
+                        "boundary_conditions must map indices of model.listOfBoundaryConditions to values."
+                    )
+                arrays['input_boundary_values'] = ('d', self.__get_boundary_values(overrides=value))
+            else:
+                raise SimulationError(f"'{name}' is not a parameter or species of the model.")
+
+        if parameter_values is not None:
+            arrays['input_parameters'] = ('d', parameter_values)
+        if u0 is not None:
+            arrays['input_u0'] = ('I', u0.T)
+        return arrays
+
+    def __map_data_function(self, data_fn, coords):
+        # Values are cached by the coordinates they were computed for, so compiling again for the same domain
+        # (e.g. with other parameters) does not evaluate the function again.
+        digest = hashlib.sha1(numpy.ascontiguousarray(coords).tobytes()).hexdigest()
+        cached = self.data_function_cache.get(data_fn.name)
+        if cached is not None and cached[0] is data_fn and cached[1] == digest:
+            return cached[2]
+
+        values = numpy.asarray(data_fn.map_many(coords), dtype=float)
+        if values.shape != (coords.shape[0],):
+            raise SimulationError(
+                f"DataFunction '{data_fn.name}' returned {values.shape} values for {coords.shape[0]} points."
+            )
+        self.data_function_cache[data_fn.name] = (data_fn, digest, values)
+        return values
+
+    def __get_input_constants(self, input_arrays):
+        # The arrays are read from the input file when the solver starts, so that the generated source, and the
+        # time to compile it, do not depend on the size of the domain.
+        c_types = {'d': 'double', 'i': 'int', 'I': 'unsigned int', 'Q': 'size_t'}
+        input_constants = '#include "input_file.hpp"\n'
+        input_constants += "static GillesPy3D::InputFile &input_file = GillesPy3D::InputFile::instance();\n"
+        for name, (type_code, _) in input_arrays.items():
+            if name in ('input_parameters', 'input_boundary_values'):
+                # Read where they are used, see __get_param_defs and __create_propensity_file
+                continue
+            c_type = c_types[type_code]
+            storage = "" if name == 'input_u0' else "static "
+            input_constants += f'{storage}{c_type} *{name} = input_file.data<{c_type}>("{name}");\n'
 
         if len(self.model.listOfSpecies) > 0:
             outstr = "const char* const input_species_names[] = {"
@@ -287,49 +486,127 @@ class Solver:
 
         return input_constants
 
+    def __get_neighbor_search(self):
+        if self.neighbor_search is not None:
+            return self.neighbor_search
+
+        # A uniform grid with cells of width h answers each query by scanning 3^dim cells,
+        # which beats the kd-tree whenever the grid is not mostly empty.
+        limits = (self.model.domain.xlim, self.model.domain.ylim, self.model.domain.zlim)
+        num_cells = 1
+        for lower, upper in limits[:self.model.domain.dimensions]:
+            num_cells *= int((upper - lower) / self.h) + 1
+        num_particles = self.model.domain.get_num_voxels()
+        if num_cells <= self.CELL_LIST_MAX_CELLS_PER_PARTICLE * max(num_particles, 1):
+            return 'cell_list'
+        return 'kdtree'
+
     def __get_next_output(self):
         output_step = "unsigned int get_next_output(ParticleSystem* system)\n{\n"
-        output_step += "static int index = 0;\n"
-        output_step += "const std::vector<unsigned int> output_steps = {"
+        output_step += "static const std::vector<unsigned int> output_steps = {"
         output_step += f"{', '.join(self.model.tspan.output_steps.astype(str).tolist())}"
-        output_step += "};\nunsigned int next_step = output_steps[index];\n"
-        output_step += "index++;\n"
-        output_step += "return next_step;\n}\n"
+        output_step += "};\n"
+        # The position is kept by the system, which resets it for each trajectory of a batched run
+        output_step += "return output_steps[system->output_index++];\n}\n"
 
         return output_step
 
     def __get_param_defs(self):
         sanitized_parameters = self.model.sanitized_parameter_names()
-        parameters = ""
-        for pname in self.model.listOfParameters:
+        # Values are read from the input file at startup, so that changing them does not need a new build
+        parameters = '#include "input_file.hpp"\n'
+        for ndx, pname in enumerate(self.model.listOfParameters):
             param = sanitized_parameters[pname]
-            parameters += f"const double {param} = {self.model.listOfParameters[pname].value};\n"
+            parameters += f"static const double {param} = "
+            parameters += f"GillesPy3D::InputFile::instance().data<double>(\"input_parameters\")[{ndx}];\n"
 
         for name, ndx in self.model.domain.typeNdxMapping.items():
             parameters += f"const size_t {name} = {ndx};\n"
         return parameters
 
-    def __get_particle_inits(self, num_chem_species):
-        init_particles = ""
+    def __get_particle_arrays(self):
         if self.model.domain.type_id is None:
             self.model.domain.type_id = ["type_1"] * self.model.domain.get_num_voxels()
-        for i, type_id in enumerate(self.model.domain.type_id):
+        for type_id in self.model.domain.type_id:
             if "UnAssigned" in type_id:
                 errmsg = "Not all particles have been defined in a type. Mass and other properties must be defined"
                 raise SimulationError(errmsg)
-            x = self.model.domain.coordinates()[i, 0]
-            y = self.model.domain.coordinates()[i, 1]
-            z = self.model.domain.coordinates()[i, 2]
-            nu = self.model.domain.nu[i]
-            mass = self.model.domain.mass[i]
-            c = self.model.domain.c[i]
-            rho = self.model.domain.rho[i]
-            fixed = int(self.model.domain.fixed[i])
-            init_particles += "init_create_particle(sys,id++,"
-            init_particles += f"{x},{y},{z},{type_id},{nu},{mass},{c},{rho},{fixed},{num_chem_species});\n"
+
+        domain = self.model.domain
+        coords = numpy.asarray(domain.coordinates(), dtype=float)
+        return {
+            'input_particle_x': ('d', coords[:, 0]),
+            'input_particle_y': ('d', coords[:, 1]),
+            'input_particle_z': ('d', coords[:, 2]),
+            'input_particle_type': ('i', [domain.typeNdxMapping[type_id] for type_id in domain.type_id]),
+            'input_particle_nu': ('d', domain.nu),
+            'input_particle_mass': ('d', domain.mass),
+            'input_particle_c': ('d', domain.c),
+            'input_particle_rho': ('d', domain.rho),
+            'input_particle_fixed': ('i', numpy.asarray(domain.fixed).astype(int)),
+        }
+
+    def __get_particle_inits(self, num_chem_species):
+        init_particles = "for (size_t i = 0; i < input_file.size(\"input_particle_x\"); ++i) {\n"
+        init_particles += "init_create_particle(sys,id++,"
+        init_particles += "input_particle_x[i],input_particle_y[i],input_particle_z[i],input_particle_type[i],"
+        init_particles += "input_particle_nu[i],input_particle_mass[i],input_particle_c[i],input_particle_rho[i],"
+        init_particles += f"input_particle_fixed[i],{num_chem_species});\n}}\n"
 
         return init_particles
 
+    def __get_propensity_exprs(self, ode=False, hybrid=False):
+        # C++ propensity of each reaction, whether it reads the prelude, and the definitions of the constants and
+        # prelude it reads. Hybrid propensities are the stochastic ones evaluated on real-valued populations.
+        kind = "ode" if ode else "hybrid" if hybrid else "ssa"
+        reactions = list(self.model.listOfReactions.values())
+        statements = [reac.ode_propensity_function if ode else reac.propensity_function for reac in reactions]
+        if not self.optimize_expressions:
+            return [self.model.expr.getexpr_cpp(statement) for statement in statements], [False] * len(reactions), ""
+
+        variables = {name: "double" for name in self.model.sanitized_data_function_names().values()}
+        state_type = "double" if ode or hybrid else "int"
+        variables.update({name: state_type for name in self.model.sanitized_species_names().values()})
+        variables.update({'vol': "double", 't': "double", 'sd': "int"})
+        optimizer = ExpressionOptimizer(
+            self.model.sanitized_parameter_names().values(), variables, prefix=f"{kind}_propensity"
+        )
+        indices = {}
+        for i, (reac, statement) in enumerate(zip(reactions, statements)):
+            tree = self.model.expr.getexpr_ast(statement)
+            if tree is not None:
+                # Restricted reactions are not evaluated in every voxel, so they do not read the prelude
+                shared = reac.restrict_to is None or (isinstance(reac.restrict_to, list) and len(reac.restrict_to) == 0)
+                indices[i] = optimizer.add(tree, shared=shared)
+        optimized = optimizer.optimize()
+        self.expression_report[kind] = optimized.report
+
+        propensity_functions = [None] * len(reactions)
+        uses_prelude = [False] * len(reactions)
+        for i, ndx in indices.items():
+            propensity_functions[i] = optimized.expressions[ndx]
+            uses_prelude[i] = optimized.uses_prelude[ndx]
+
+        # Folded constants are defined after the parameters, which are initialized first
+        prelude = "".join(f"static const double {name} = {value};\n" for name, value in optimized.constants)
+        if len(optimized.prelude) > 0:
+            prelude += f"struct {kind}_prelude_values\n{{\n    bool valid = false;\n"
+            prelude += "".join(f"    double in{i};\n" for i in range(len(optimized.prelude_inputs)))
+            prelude += "".join(f"    {value_type} {name};\n" for name, value_type, _ in optimized.prelude)
+            prelude += "};\n\n"
+            prelude += f"static inline const {kind}_prelude_values &{kind}_prelude("
+            prelude += f"const {state_type} *x, double t, const double vol, const double *data_fn, int sd)\n{{\n"
+            prelude += "    // Shared sub-expressions, recomputed when the voxel values they read change\n"
+            prelude += f"    static thread_local {kind}_prelude_values prelude;\n"
+            changed = [f"prelude.in{i} != {name}" for i, name in enumerate(optimized.prelude_inputs)]
+            prelude += f"    if (!prelude.valid || {' || '.join(changed)})\n    {{\n" if changed else \
+                       "    if (!prelude.valid)\n    {\n"
+            prelude += "        prelude.valid = true;\n"
+            prelude += "".join(f"        prelude.in{i} = {name};\n" for i, name in enumerate(optimized.prelude_inputs))
+            prelude += "".join(f"        prelude.{name} = {value};\n" for name, _, value in optimized.prelude)
+            prelude += "    }\n    return prelude;\n}\n"
+        return propensity_functions, uses_prelude, f"{prelude}\n" if prelude else ""
+
     def __get_propfile_str(self, replacements):
         temp_path = os.path.abspath(os.path.dirname(__file__))
         temp_path += '/c_base/ssa_sdpd-c-simulation-engine/propensity_file_template.cpp'
@@ -344,12 +621,15 @@ class Solver:
     def __get_reaction_prop(self):
         funheader = "double __NAME__(const int *x, double t, const double vol, const double *data_fn, int sd)"
 
-        funcs = ""
+        propensity_functions, uses_prelude, prelude = self.__get_propensity_exprs(ode=False)
+        funcs = prelude
         funcinits = ""
         for i, (rname, reac) in enumerate(self.model.listOfReactions.items()):
-            propensity_function = self.model.expr.getexpr_cpp(reac.propensity_function)
+            propensity_function = propensity_functions[i]
             func = funheader.replace("__NAME__", rname)
             func +=  "\n{\n"
+            if uses_prelude[i]:
+                func += "const auto &prelude = ssa_prelude(x, t, vol, data_fn, sd);\n"
             if reac.restrict_to is None or (isinstance(reac.restrict_to, list) and len(reac.restrict_to) == 0):
                 func += f"return {propensity_function};"
             else:
@@ -372,6 +652,41 @@ class Solver:
 
         return funcs, funcinits
 
+    def __get_hybrid_prop(self):
+        # The stochastic propensities on real-valued populations, for SpatialHybrid, and their allocation
+        funheader = "double hyb__NAME__(const double *x, double t, const double vol, const double *data_fn, int sd)"
+
+        propensity_functions, uses_prelude, prelude = self.__get_propensity_exprs(hybrid=True)
+        funcs = prelude
+        funcinits = ""
+        for i, (rname, reac) in enumerate(self.model.listOfReactions.items()):
+            propensity_function = propensity_functions[i]
+            func = funheader.replace("__NAME__", rname)
+            func += "\n{\n"
+            if uses_prelude[i]:
+                func += "const auto &prelude = hybrid_prelude(x, t, vol, data_fn, sd);\n"
+            if reac.restrict_to is None or (isinstance(reac.restrict_to, list) and len(reac.restrict_to) == 0):
+                func += f"return {propensity_function};"
+            else:
+                func += "if("
+                if isinstance(reac.restrict_to, list) and len(reac.restrict_to) > 0:
+                    func += "||".join(f"sd == {type_id}" for type_id in reac.restrict_to)
+                else:
+                    errmsg = "When restricting reaction to types, you must specify either a list or an int"
+                    raise SimulationError(errmsg)
+                func += "){\n"
+                func += f"return {propensity_function};"
+                func += "\n}else{"
+                func += "\n\treturn 0.0;}"
+            func += "\n}"
+            funcs += f"{func}\n\n"
+            funcinits += f"    ptr[{i}] = (ChemRxnFun) hyb{rname};\n"
+
+        funcs += "ChemRxnFun *ALLOC_hybrid_propensities(void)\n{\n"
+        funcs += f"    ChemRxnFun *ptr = new ChemRxnFun[{len(self.model.listOfReactions)}];\n"
+        funcs += f"{funcinits}    return ptr;\n}}\n\n"
+        return funcs
+
     def __get_system_config(self, num_types, num_chem_species, num_chem_rxns,
                             num_stoch_species, num_stoch_rxns, num_data_fn):
         system_config = f"debug_flag = {self.debug_level};\n"
@@ -379,9 +694,15 @@ class Solver:
         system_config += f"{num_types-1},{num_chem_species},{num_chem_rxns},"
         system_config += f"{num_stoch_species},{num_stoch_rxns},{num_data_fn});\n"
         system_config += f"system->static_domain = {int(self.model.staticDomain)};\n"
+        system_config += f"system->debug_level = {self.debug_level};\n"
+        system_config += f"system->num_boundary_conditions = {len(self.model.listOfBoundaryConditions)};\n"
+        system_config += "system->boundary_condition_function = applyBoundaryConditions;\n"
+        system_config += "system->next_output_function = get_next_output;\n"
         if len(self.model.listOfSpecies) > 0:
             system_config += "system->subdomain_diffusion_matrix = input_subdomain_diffusion_matrix;\n"
-            system_config += "system->stoichiometric_matrix = input_N_dense;\n"
+            system_config += "system->stoich_irN = input_irN;\n"
+            system_config += "system->stoich_jcN = input_jcN;\n"
+            system_config += "system->stoich_prN = input_prN;\n"
             system_config += "system->chem_rxn_rhs_functions = ALLOC_ChemRxnFun();\n"
             system_config += "system->stoch_rxn_propensity_functions = ALLOC_propensities();\n"
             system_config += "system->species_names = input_species_names;\n"
@@ -411,6 +732,23 @@ class Solver:
         else:
             self.model.domain.dimensions = 3
         system_config += f"system->dimension = {self.model.domain.dimensions};\n"
+        neighbor_search = self.__get_neighbor_search()
+        system_config += f"system->neighbor_search = {self.NEIGHBOR_SEARCH_METHODS[neighbor_search]};\n"
+        system_config += f"system->neighbor_skin = {self.neighbor_skin};\n"
+        system_config += f"system->half_neighbor_list = {'true' if self.half_neighbor_list else 'false'};\n"
+        system_config += f"system->kernel_function = {self.KERNEL_FUNCTIONS[self.kernel]};\n"
+        system_config += f"system->kernel_table_size = {self.kernel_table_size};\n"
+        system_config += f"system->output_format = {self.OUTPUT_FORMATS[self.output_format]};\n"
+        system_config += f"system->output_buffers = {self.output_buffers};\n"
+        system_config += f"system->rdme_method = {self.RDME_METHODS[self.rdme_method]};\n"
+        system_config += f"system->tau_tol = {self.tau_tol};\n"
+        if self.rdme_method == 'hybrid' and len(self.model.listOfSpecies) > 0:
+            modes = ",".join(
+                f"{{SimulationState::{self.SPECIES_MODES[species.mode]}, {species.switch_min}, {species.switch_tol}}}"
+                for species in self.model.listOfSpecies.values()
+            )
+            system_config += f"system->hybrid_species = {{{modes}}};\n"
+            system_config += "system->hybrid_propensity_functions = ALLOC_hybrid_propensities();\n"
 
         if self.model.domain.gravity is not None:
             for i, val in enumerate(self.model.domain.gravity):
@@ -462,6 +800,7 @@ class Solver:
         propfilename = re.sub(r'[^\w\_]', '', self.model_name)
         self.propfilename = f"{propfilename}_generated_model"
         self.prop_file_name = os.path.join(self.build_dir, f'{self.propfilename}.cpp')
+        self.input_file_name = os.path.join(self.build_dir, f'{self.propfilename}_input.bin')
 
         if self.debug_level >= 1:
             print(f"Compiling Solver.  Build dir: {self.build_dir}")
@@ -469,6 +808,9 @@ class Solver:
         if self.debug_level >= 1:
             print(f"Creating propensity file {self.prop_file_name}")
         self.__create_propensity_file(stoich_matrix, dep_graph, file_name=self.prop_file_name)
+        if self.debug_level >= 1:
+            for kind, report in self.expression_report.items():
+                print(f"Optimized {kind} propensities: {report}")
 
         # Build the solver
         makefile = self.gillespy3d_rootdir+'/build/SConstruct'
@@ -485,6 +827,21 @@ class Solver:
             make_cmd.append('GPROFFLAG=-pg')
         if profile or debug:
             make_cmd.append('GDB_FLAG=-g')
+
+        executable = os.path.join(self.build_dir, self.executable_name)
+        cache_key = None
+        if self.compile_cache is not None:
+            # The build directory and model path change with every call, the other arguments do not
+            flags = [arg for arg in make_cmd[3:] if not arg.startswith(('-C', 'MODEL=', 'BUILD='))]
+            cache_key = CompileCache.key(
+                self.prop_file_name, flags, CompileCache.engine_version(self.gillespy3d_root)
+            )
+            if self.compile_cache.fetch(cache_key, executable):
+                if self.debug_level >= 1:
+                    print(f"Using cached solver {cache_key}")
+                self.is_compiled = True
+                return
+
         if self.debug_level > 1:
             cmd = " ".join(make_cmd)
             print(f"cmd: {cmd}\n")
@@ -504,11 +861,147 @@ class Solver:
             print(f"cmd = {cmd}")
             raise SimulationError("Compilation of solver failed") from err
 
+        if cache_key is not None:
+            try:
+                self.compile_cache.store(cache_key, executable)
+            except OSError as err:
+                if self.debug_level >= 1:
+                    print(f"Could not cache the solver: {err}")
         self.is_compiled = True
 
+    def compile_cache_stats(self):
+        """
+        Statistics of the compile cache: hits, misses and evictions by this solver, and the number of entries,
+        total size and size limit of the cache, which may be shared by other solvers.
+
+        :returns: The statistics, or None if the solver does not use the compile cache.
+        :rtype: dict
+        """
+        if self.compile_cache is None:
+            return None
+        return self.compile_cache.stats()
+
+
+    def __execute(self, solver_cmd, cwd, timeout, verbose, variables_file=None, processes=None, interrupted=None):
+        """
+        Run the solver executable and wait for it to finish.
+
+        :param processes: If given, the solver process is added to it while it runs, so that another thread can
+            interrupt it.
+        :type processes: set
+
+        :param interrupted: Set by the thread interrupting the process; once set, a non-zero return code is that
+            of the interrupt and not a failure.
+        :type interrupted: threading.Event
+
+        :returns: The return code of the solver (None if it did not complete) and whether it timed out.
+        :rtype: tuple(int, bool)
+
+        :raises SimulationError: The solver returned a non-zero exit code.
+        """
+        if self.debug_level >= 1:
+            print(f'cmd: {solver_cmd}')
+
+        start = time.monotonic()
+        return_code = None
+        timed_out = False
+        try:
+            # The solver reads the domain and initial state from the input file written by compile()
+            env = dict(os.environ, GILLESPY3D_INPUT_FILE=self.input_file_name)
+            if variables_file is not None:
+                env['GILLESPY3D_VARIABLES_FILE'] = variables_file
+            with subprocess.Popen(solver_cmd, cwd=cwd, shell=True, env=env,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    start_new_session=True) as process:
+                if processes is not None:
+                    processes.add(process)
+                try:
+                    # start thread to read process stdout to stdout
+                    thread = threading.Thread(target=_read_from_stdout, args=(process.stdout,verbose))
+                    thread.start()
+                    if timeout is not None:
+                        return_code = process.wait(timeout=timeout)
+                    else:
+                        return_code = process.wait()
+                    thread.join()
+                except KeyboardInterrupt:
+                    # send signal to the process group
+                    os.killpg(process.pid, signal.SIGINT)
+                    print('Terminated by user after seconds: {:.2f}'.format(time.monotonic() - start))
+                except subprocess.TimeoutExpired as err:
+                    timed_out = True
+                    # send signal to the process group
+                    os.killpg(process.pid, signal.SIGINT)
+                finally:
+                    if processes is not None:
+                        processes.discard(process)
+
+        except OSError as err:
+            print(f"Error, execution of solver raised an exception: {err}")
+            print(f"cmd = {solver_cmd}")
+
+        if self.debug_level >= 1:  # output time
+            print('Elapsed seconds: {:.2f}'.format(time.monotonic() - start))
+
+        if interrupted is not None and interrupted.is_set():
+            return return_code, timed_out
+        if return_code is not None and return_code != 0:
+            print(f"solver_cmd = {solver_cmd}")
+            raise SimulationError(f"Solver execution failed, return code = {return_code}")
+        return return_code, timed_out
+
+    def __write_variables_file(self, variables):
+        """
+        Write the runtime variables of a run, see run().
+
+        :returns: Path of the file, to be removed after the run, or None if there are no variables.
+        :rtype: str
+        """
+        if not variables:
+            return None
+        variable_arrays = self.__get_variable_arrays(variables)
+        fd, variables_file = tempfile.mkstemp(prefix='gillespy3d_variables_', suffix='.bin', dir=self.build_dir)
+        os.close(fd)
+        write_input_file(variables_file, variable_arrays)
+        return variables_file
+
+    def __execute_concurrent(self, solver_cmd, results, seed, timeout, verbose, variables_file, max_workers):
+        """
+        Run one solver process per result, up to max_workers at a time, and wait for all of them.
+
+        :raises SimulationError: A solver returned a non-zero exit code.
+        """
+        processes = set()
+        interrupted = threading.Event()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            for run_ndx, result in enumerate(results):
+                run_cmd = solver_cmd
+                if seed is not None:
+                    run_cmd += " -s "+str(seed+run_ndx)
+                futures.append(executor.submit(
+                    self.__execute, run_cmd, result.result_dir, timeout, verbose, variables_file, processes,
+                    interrupted
+                ))
+            try:
+                wait(futures)
+            except KeyboardInterrupt:
+                # Only the main thread sees the interrupt: stop the queued runs and the running process groups.
+                # The runs it stops then end as in the serial case, without raising SimulationError.
+                interrupted.set()
+                for future in futures:
+                    future.cancel()
+                for process in list(processes):
+                    os.killpg(process.pid, signal.SIGINT)
+                wait(futures)
+                print("Terminated by user")
+        for result, future in zip(results, futures):
+            if not future.cancelled():
+                _, result.timeout = future.result()
 
     def run(self, number_of_trajectories=1, seed=None, timeout=None,
-                number_of_threads=None, debug=False, profile=False, verbose=True):
+                number_of_threads=None, debug=False, profile=False, verbose=True, batch=False, variables=None,
+                max_workers=None):
         """
         Run one simulation of the model.
 
@@ -521,7 +1014,8 @@ class Solver:
         :param timeout: maximum number of seconds the solver can run.
         :type timeout: int
 
-        :param number_of_threads: the number threads the solver will use.
+        :param number_of_threads: the number threads the solver will use for its particle loops, which are
+            split into small chunks that idle threads pick up as they go. If None, the engine uses every core.
         :type number_of_threads: int
 
         :param debug: start a gdbgui debugger (also compiles with debug symbols if compilation hasn't happened)
@@ -533,75 +1027,212 @@ class Solver:
         :param verbose: If true, prints addtional data to console
         :type verbose: bool
 
+        :param batch: If true, all trajectories are run by a single solver process, which initializes the
+            particles once and, for static domains, reuses the neighbor graph across trajectories. Each
+            trajectory still gets its own random number stream (seed + trajectory index) and result directory.
+            The timeout then applies to the whole batch.
+        :type batch: bool
+
+        :param variables: Values replacing those of the model for this run, without compiling again: parameter
+            values by name, the initial populations of a species (one count per voxel) by name, and the values of
+            boundary conditions under 'boundary_conditions', as a dict from their index in
+            model.listOfBoundaryConditions to the new value.
+        :type variables: dict
+
+        :param max_workers: If greater than 1, up to this many trajectories run at the same time, each in its own
+            solver process. Unless number_of_threads is given, max_workers is capped at the number of cores and
+            each process gets an equal share of them; otherwise max_workers * number_of_threads may not exceed the
+            cores. Results are still in trajectory order and
+            trajectory k is still seeded with seed + k. Ignored if batch is true.
+        :type max_workers: int
+
         :returns: A GillesPy3D Result object containing spatial and time series data from simulation.
         :rtype: gillespy3d.Result.Result 
 
         :raises SimulationError: Simulation execution failed.
         """
         from gillespy3d.core.result import Result # pylint: disable=import-outside-toplevel
+        if number_of_threads is not None and (not isinstance(number_of_threads, int) or number_of_threads < 1):
+            raise SimulationError("number_of_threads must be a positive integer or None.")
+        if max_workers is not None and (not isinstance(max_workers, int) or max_workers < 1):
+            raise SimulationError("max_workers must be a positive integer or None.")
+        concurrent = not batch and max_workers is not None and max_workers > 1 and number_of_trajectories > 1
+        if concurrent:
+            num_cores = os.cpu_count() or 1
+            if number_of_threads is None:
+                # More processes than cores would oversubscribe them; the other trajectories wait for a worker
+                max_workers = min(max_workers, num_cores)
+                number_of_threads = max(1, num_cores // max_workers)
+            elif max_workers * number_of_threads > num_cores:
+                raise SimulationError(
+                    f"max_workers * number_of_threads ({max_workers} * {number_of_threads}) exceeds the "
+                    f"{num_cores} available cores."
+                )
+        if number_of_trajectories < 1:
+            raise SimulationError("number_of_trajectories must be at least 1.")
         # Check if compiled, call compile() if not.
         if not self.is_compiled:
             self.compile(debug=debug, profile=profile)
 
-        # Execute the solver
-        for run_ndx in range(number_of_trajectories):
+        variables_file = self.__write_variables_file(variables)
+
+        results = []
+        for _ in range(number_of_trajectories):
             outfile = tempfile.mkdtemp(
                 prefix='gillespy3d_result_', dir=os.environ.get('GILLESPY3D_TMPDIR'))
-            result = Result(self.model, outfile)
+            results.append(Result(self.model, outfile))
             if self.debug_level >= 1:
                 print(f"Running simulation. Result dir: {outfile}")
-            solver_cmd = os.path.join(self.build_dir, self.executable_name)
 
-            if number_of_threads is not None:
-                solver_cmd += " -t " + str(number_of_threads)
+        solver_cmd = os.path.join(self.build_dir, self.executable_name)
+        if number_of_threads is not None:
+            solver_cmd += " -t " + str(number_of_threads)
 
-            if seed is not None:
-                solver_cmd += " -s "+str(seed+run_ndx)
+        # Execute the solver
+        try:
+            if batch:
+                if seed is not None:
+                    solver_cmd += " -s " + str(seed)
+                # One output directory per trajectory; trajectory k is seeded with seed + k
+                solver_cmd += "".join(f" -o {shlex.quote(result.result_dir)}" for result in results)
+                _, timed_out = self.__execute(solver_cmd, results[0].result_dir, timeout, verbose, variables_file)
+                for result in results:
+                    result.timeout = timed_out
+            elif concurrent:
+                self.__execute_concurrent(solver_cmd, results, seed, timeout, verbose, variables_file, max_workers)
+            else:
+                for run_ndx, result in enumerate(results):
+                    run_cmd = solver_cmd
+                    if seed is not None:
+                        run_cmd += " -s "+str(seed+run_ndx)
+                    _, result.timeout = self.__execute(run_cmd, result.result_dir, timeout, verbose, variables_file)
+        finally:
+            if variables_file is not None:
+                os.remove(variables_file)
+
+        for result in results:
+            result.success = True
+            result.read_stats()
+            if profile:
+                self.__read_profile_info(result)
 
-            if self.debug_level >= 1:
-                print(f'cmd: {solver_cmd}')
+        first_result = results[0]
+        for result in results[1:]:
+            first_result.append(result)
+        return first_result
 
-            start = time.monotonic()
-            return_code = None
-            try:
-                with subprocess.Popen(solver_cmd, cwd=outfile, shell=True,
-                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                        start_new_session=True) as process:
-                    try:
-                        # start thread to read process stdout to stdout
-                        thread = threading.Thread(target=_read_from_stdout, args=(process.stdout,verbose))
-                        thread.start()
-                        if timeout is not None:
-                            return_code = process.wait(timeout=timeout)
-                        else:
-                            return_code = process.wait()
-                        thread.join()
-                    except KeyboardInterrupt:
-                        # send signal to the process group
-                        os.killpg(process.pid, signal.SIGINT)
-                        print('Terminated by user after seconds: {:.2f}'.format(time.monotonic() - start))
-                    except subprocess.TimeoutExpired as err:
-                        result.timeout = True
-                        # send signal to the process group
-                        os.killpg(process.pid, signal.SIGINT)
+    def run_stream(self, seed=None, timeout=None, number_of_threads=None, debug=False, profile=False,
+                   verbose=False, variables=None, delete_steps=False, poll_interval=0.1):
+        """
+        Run one trajectory of the model, yielding each output step as soon as the solver has written it.
 
-            except OSError as err:
-                print(f"Error, execution of solver raised an exception: {err}")
-                print(f"cmd = {solver_cmd}")
+        The solver writes every output file under a temporary name and renames it once complete, so a step is
+        yielded only once its file is whole. Closing the generator early stops the solver.
 
-            if self.debug_level >= 1:  # output time
-                print('Elapsed seconds: {:.2f}'.format(time.monotonic() - start))
+        :param seed: the random number seed.
+        :type seed: int
 
-            if return_code is not None and return_code != 0:
-                print(f"solver_cmd = {solver_cmd}")
-                raise SimulationError(f"Solver execution failed, return code = {return_code}")
+        :param timeout: maximum number of seconds the solver can run.
+        :type timeout: int
 
-            result.success = True
-            if profile:
-                self.__read_profile_info(result)
-            if run_ndx == 0:                
-                first_result = result
-            elif number_of_trajectories > 1:
-                first_result.append(result)
+        :param number_of_threads: the number threads the solver will use for its particle loops, see run().
+        :type number_of_threads: int
 
-        return first_result
+        :param debug: compile with debug symbols if compilation hasn't happened.
+        :type debug: bool
+
+        :param profile: compile for profiling if compilation hasn't happened.
+        :type profile: bool
+
+        :param verbose: If true, prints the output of the solver to console.
+        :type verbose: bool
+
+        :param variables: Values replacing those of the model for this run, see run().
+        :type variables: dict
+
+        :param delete_steps: If true, the file of each step is deleted once it has been read, so that the disk
+            space used by long runs stays bounded.
+        :type delete_steps: bool
+
+        :param poll_interval: Seconds between checks for the next output file.
+        :type poll_interval: float
+
+        :returns: A generator of (t_ndx, points, data) tuples, where points and data are as returned by
+            Result.read_step. Its return value (the value of StopIteration, or of `yield from`) is the Result of the
+            run, holding the run statistics and, unless delete_steps is true, the output files.
+        :rtype: generator
+
+        :raises SimulationError: Simulation execution failed.
+        """
+        from gillespy3d.core.result import Result # pylint: disable=import-outside-toplevel
+        if number_of_threads is not None and (not isinstance(number_of_threads, int) or number_of_threads < 1):
+            raise SimulationError("number_of_threads must be a positive integer or None.")
+        if poll_interval <= 0:
+            raise SimulationError("poll_interval must be positive.")
+        if not self.is_compiled:
+            self.compile(debug=debug, profile=profile)
+
+        outfile = tempfile.mkdtemp(prefix='gillespy3d_result_', dir=os.environ.get('GILLESPY3D_TMPDIR'))
+        result = Result(self.model, outfile)
+        if self.debug_level >= 1:
+            print(f"Running simulation. Result dir: {outfile}")
+
+        solver_cmd = os.path.join(self.build_dir, self.executable_name)
+        if number_of_threads is not None:
+            solver_cmd += " -t " + str(number_of_threads)
+        if seed is not None:
+            solver_cmd += " -s " + str(seed)
+
+        variables_file = self.__write_variables_file(variables)
+        processes = set()
+        errors = []
+
+        def execute():
+            try:
+                _, result.timeout = self.__execute(
+                    solver_cmd, outfile, timeout, verbose, variables_file, processes
+                )
+            except Exception as err: # pylint: disable=broad-except
+                # Raised again by the generator, in the caller's thread
+                errors.append(err)
+
+        thread = threading.Thread(target=execute)
+        thread.start()
+        try:
+            t_ndx = 0
+            while True:
+                # Checked before looking for the file: a solver which has exited has renamed all of its files
+                finished = not thread.is_alive()
+                filename = None
+                for extension in ("vtu", "vtk"):
+                    candidate = os.path.join(outfile, f"output{t_ndx}.{extension}")
+                    if os.path.exists(candidate):
+                        filename = candidate
+                        break
+                if filename is None:
+                    if finished:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                points, data = result.read_step(t_ndx)
+                if delete_steps:
+                    os.remove(filename)
+                yield t_ndx, points, data
+                t_ndx += 1
+        finally:
+            # Stop a solver still running, e.g. when the generator is closed early
+            for process in list(processes):
+                try:
+                    os.killpg(process.pid, signal.SIGINT)
+                except ProcessLookupError:
+                    pass
+            thread.join()
+            if variables_file is not None:
+                os.remove(variables_file)
+
+        if errors:
+            raise errors[0]
+        result.success = True
+        result.read_stats()
+        return result
@@ -0,0 +1,144 @@
+/* Neighbor search scaling benchmark.
+ *
+ * Builds an ANN kd-tree and a cell list over uniformly random points and performs one fixed-radius
+ *   query per point, splitting the queries across 1 to N threads, once per NeighborSearchMethod.
+ * Index build times are reported separately, since both indices are rebuilt every step.
+ * The support radius is chosen so that each point has roughly `neighbors` points within range,
+ *   which is representative of an SDPD particle system.
+ *
+ * Usage: neighbor_search_benchmark [num_points=200000] [max_threads=hardware] [dimension=3] [neighbors=40]
+ */
+
+#include "neighbor_search.hpp"
+
+#include <algorithm>
+#include <atomic>
+#include <chrono>
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <random>
+#include <thread>
+#include <vector>
+
+namespace
+{
+    struct BenchmarkResult
+    {
+        double seconds;
+        long long total_neighbors;
+    };
+
+    BenchmarkResult run_searches(
+            GillesPy3D::NeighborSearchMethod method,
+            ANNkd_tree *tree,
+            const GillesPy3D::CellList *cells,
+            ANNpointArray points,
+            int num_points,
+            int dimension,
+            ANNdist sq_radius,
+            unsigned int num_threads)
+    {
+        // Queries are handed out in small chunks so that the comparison measures lock contention,
+        //   not load imbalance.
+        constexpr int chunk_size = 256;
+        std::atomic<int> next_chunk(0);
+        std::atomic<long long> total_neighbors(0);
+
+        auto worker = [&]() {
+            GillesPy3D::NeighborSearchBuffer buffer;
+            long long found = 0;
+            for (int start = next_chunk.fetch_add(chunk_size); start < num_points; start = next_chunk.fetch_add(chunk_size))
+            {
+                int end = std::min(start + chunk_size, num_points);
+                for (int i = start; i < end; ++i)
+                {
+                    found += buffer.search(method, tree, cells, points[i], dimension, sq_radius);
+                }
+            }
+            total_neighbors += found;
+        };
+
+        auto t0 = std::chrono::steady_clock::now();
+        std::vector<std::thread> threads;
+        for (unsigned int t = 1; t < num_threads; ++t)
+        {
+            threads.emplace_back(worker);
+        }
+        worker();
+        for (auto &thread : threads)
+        {
+            thread.join();
+        }
+        auto t1 = std::chrono::steady_clock::now();
+
+        return { std::chrono::duration<double>(t1 - t0).count(), total_neighbors.load() };
+    }
+}
+
+int main(int argc, char **argv)
+{
+    int num_points = argc > 1 ? std::atoi(argv[1]) : 200000;
+    unsigned int max_threads = argc > 2 ? std::atoi(argv[2]) : std::max(1u, std::thread::hardware_concurrency());
+    int dimension = argc > 3 ? std::atoi(argv[3]) : 3;
+    double neighbors = argc > 4 ? std::atof(argv[4]) : 40.0;
+    if (num_points <= 0 || max_threads == 0 || dimension < 1 || dimension > 3 || neighbors <= 0)
+    {
+        std::fprintf(stderr, "usage: %s [num_points] [max_threads] [dimension (1-3)] [neighbors]\n", argv[0]);
+        return 1;
+    }
+
+    // Points in the unit cube; pick h such that the expected neighbor count is `neighbors`.
+    const double unit_ball[] = { 2.0, M_PI, 4.0 / 3.0 * M_PI };
+    double h = std::pow(neighbors / (num_points * unit_ball[dimension - 1]), 1.0 / dimension);
+    ANNdist sq_radius = h * h;
+
+    std::mt19937_64 rng(42);
+    std::uniform_real_distribution<double> uniform(0.0, 1.0);
+    ANNpointArray points = annAllocPts(num_points, dimension);
+    for (int i = 0; i < num_points; ++i)
+    {
+        for (int d = 0; d < dimension; ++d)
+        {
+            points[i][d] = uniform(rng);
+        }
+    }
+
+    auto t0 = std::chrono::steady_clock::now();
+    ANNkd_tree *tree = new ANNkd_tree(points, num_points, dimension);
+    auto t1 = std::chrono::steady_clock::now();
+    GillesPy3D::CellList cells;
+    cells.build(points, num_points, dimension, h);
+    auto t2 = std::chrono::steady_clock::now();
+
+    std::printf("points=%d dimension=%d h=%e\n", num_points, dimension, h);
+    std::printf("build: kd-tree %.4fs, cell list %.4fs (%zu cells)\n",
+                std::chrono::duration<double>(t1 - t0).count(),
+                std::chrono::duration<double>(t2 - t1).count(), cells.num_cells());
+    std::printf("%-14s %8s %12s %10s %14s\n", "method", "threads", "seconds", "speedup", "avg neighbors");
+
+    const std::pair<GillesPy3D::NeighborSearchMethod, const char*> methods[] = {
+        { GillesPy3D::KDTREE_SERIAL, "KDTREE_SERIAL" },
+        { GillesPy3D::KDTREE, "KDTREE" },
+        { GillesPy3D::CELL_LIST, "CELL_LIST" },
+    };
+    double baseline = 0.0;
+    for (auto [method, name] : methods)
+    {
+        for (unsigned int num_threads = 1; num_threads <= max_threads; ++num_threads)
+        {
+            BenchmarkResult result = run_searches(method, tree, &cells, points, num_points, dimension, sq_radius, num_threads);
+            if (baseline == 0.0)
+            {
+                baseline = result.seconds;
+            }
+            std::printf("%-14s %8u %12.4f %10.2f %14.2f\n", name, num_threads, result.seconds,
+                        baseline / result.seconds, (double) result.total_neighbors / num_points);
+        }
+    }
+
+    delete tree;
+    annDeallocPts(points);
+    annClose();
+    return 0;
+}
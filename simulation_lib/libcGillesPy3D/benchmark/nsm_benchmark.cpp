@@ -0,0 +1,338 @@
+/* Next Subvolume Method benchmark.
+ *
+ * Runs the Michaelis-Menten model (examples/Michaelis_Menten.ipynb) on a cubic lattice of voxels with
+ *   GillesPy3D::NextSubvolumeMethod and with a port of the legacy nsm_core__take_step loop
+ *   (src/_old/simulate_rdme.cpp), and reports events per second for both.
+ * The legacy event queue is no longer part of the tree, so the legacy loop is timed with the same
+ *   IndexedMinHeap; the comparison therefore measures the per-event work the new method removes:
+ *   the linear destination search with a diffusion matrix lookup per neighbor, and a fresh random
+ *   time for the destination voxel of every diffusion event.
+ * The same model is also run with GillesPy3D::SpatialTauLeaping, whose final product count should be
+ *   close to that of the exact methods.
+ * Initial populations of the model are multiplied by `scale` and placed in random voxels; the
+ *   conserved totals are checked at the end of each run.
+ * By default the domain keeps the volume of the model, so concentrations grow with `scale` and the binding
+ *   S + E -> C speeds up with them: a leap then covers only a few events per voxel, and tau leaping is
+ *   slower than the exact methods. With `dilute` set to 1 the domain volume is multiplied by `scale` as
+ *   well, so concentrations and the rates per molecule stay those of the model; leaps then cover a number
+ *   of events per voxel that grows with `scale`, which is where tau leaping pays off (try scale=10000).
+ *
+ * Usage: nsm_benchmark [voxels_per_side=16] [scale=100] [end_time=5] [seed=1] [tau_tol=0.03] [dilute=0]
+ */
+
+#include "error.hpp"
+#include "neighbor_graph.hpp"
+#include "nsm.hpp"
+#include "spatial_tau.hpp"
+
+#include <chrono>
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <limits>
+#include <random>
+#include <vector>
+
+namespace
+{
+    constexpr std::size_t num_species = 4; // Substrate, Enzyme, Enzyme_Substrate_Complex, Product
+    constexpr std::size_t num_reactions = 3;
+    constexpr double diffusion_constant = 0.01;
+
+    double r1(const unsigned int *x, double, double vol, double*, int) { return 0.0017 * x[0] * x[1] / vol; }
+    double r2(const unsigned int *x, double, double, double*, int) { return 0.5 * x[2]; }
+    double r3(const unsigned int *x, double, double, double*, int) { return 0.1 * x[2]; }
+    const GillesPy3D::PropensityFun propensities[num_reactions] = { r1, r2, r3 };
+
+    // Stoichiometry, by reaction: r1: S + E -> C, r2: C -> S + E, r3: C -> E + P
+    const std::size_t irN[] = { 0, 1, 2,   0, 1, 2,   1, 2, 3 };
+    const int prN[] = { -1, -1, 1,   1, 1, -1,   1, -1, 1 };
+    const std::size_t jcN[] = { 0, 3, 6, 9 };
+    // Dependency graph: species S, E, C, P, then reactions r1, r2, r3
+    const std::size_t irG[] = { 0,   0,   1, 2,      0, 1, 2,   0, 1, 2,   0, 1, 2 };
+    const std::size_t jcG[] = { 0, 1, 2, 4, 4, 7, 10, 13 };
+
+    struct Lattice
+    {
+        GillesPy3D::NeighborGraph graph;
+        std::vector<double> volume;
+        std::vector<int> type;
+        double diffusion_matrix[num_species];
+    };
+
+    Lattice make_lattice(int side, double domain_volume)
+    {
+        Lattice lattice;
+        const std::size_t n = static_cast<std::size_t>(side) * side * side;
+        const double h = 1.0 / side;
+        // Diffusion rates are those of a unit cube; only the volumes seen by the reactions change
+        lattice.volume.assign(n, domain_volume * h * h * h);
+        lattice.type.assign(n, 1);
+        for (double &d : lattice.diffusion_matrix)
+        {
+            d = diffusion_constant;
+        }
+        lattice.graph.reserve(n, 6 * n);
+        auto index = [side](int i, int j, int k) { return static_cast<unsigned int>((k * side + j) * side + i); };
+        for (int k = 0; k < side; ++k)
+        {
+            for (int j = 0; j < side; ++j)
+            {
+                for (int i = 0; i < side; ++i)
+                {
+                    const int offsets[6][3] = { {-1, 0, 0}, {1, 0, 0}, {0, -1, 0}, {0, 1, 0}, {0, 0, -1}, {0, 0, 1} };
+                    for (const auto &o : offsets)
+                    {
+                        const int a = i + o[0], b = j + o[1], c = k + o[2];
+                        if (a >= 0 && a < side && b >= 0 && b < side && c >= 0 && c < side)
+                        {
+                            lattice.graph.add(index(a, b, c), h, 0.0, 1.0 / (h * h), 0.0);
+                        }
+                    }
+                    lattice.graph.end_row();
+                }
+            }
+        }
+        return lattice;
+    }
+
+    std::vector<unsigned int> initial_state(std::size_t num_voxels, int scale, std::mt19937_64 &rng)
+    {
+        const unsigned int totals[num_species] = { 301, 120, 0, 0 };
+        std::vector<unsigned int> state(num_voxels * num_species, 0);
+        std::uniform_int_distribution<std::size_t> voxel(0, num_voxels - 1);
+        for (std::size_t s = 0; s < num_species; ++s)
+        {
+            for (unsigned long m = 0; m < static_cast<unsigned long>(totals[s]) * scale; ++m)
+            {
+                state[num_species * voxel(rng) + s]++;
+            }
+        }
+        return state;
+    }
+
+    bool check_conservation(const std::vector<unsigned int> &state, int scale)
+    {
+        unsigned long substrate = 0, enzyme = 0;
+        for (std::size_t i = 0; i < state.size(); i += num_species)
+        {
+            substrate += state[i] + state[i + 2] + state[i + 3];
+            enzyme += state[i + 1] + state[i + 2];
+        }
+        return substrate == 301ul * scale && enzyme == 120ul * scale;
+    }
+
+    unsigned long total_product(const std::vector<unsigned int> &state)
+    {
+        unsigned long product = 0;
+        for (std::size_t i = 3; i < state.size(); i += num_species)
+        {
+            product += state[i];
+        }
+        return product;
+    }
+
+    /* Port of the legacy loop: per-voxel rate sums, a linear search for the diffusion destination that
+     *   multiplies every neighbor's D_i_j by its diffusion constant, and fresh times for both voxels.
+     */
+    class LegacyNSM
+    {
+    public:
+        LegacyNSM(const Lattice &lattice, std::vector<unsigned int> &state, std::mt19937_64 &rng)
+            : lattice(lattice), xx(state.data()), n(lattice.volume.size()),
+              rrate(n * num_reactions), srrate(n), Ddiag(n * num_species), sdrate(n)
+        {
+            for (std::size_t v = 0; v < n; ++v)
+            {
+                for (std::size_t j = 0; j < num_reactions; ++j)
+                {
+                    srrate[v] += (rrate[num_reactions * v + j] = propensities[j](x(v), 0.0, lattice.volume[v], nullptr, 1));
+                }
+                for (std::size_t s = 0; s < num_species; ++s)
+                {
+                    for (std::size_t e = lattice.graph.begin(v); e < lattice.graph.end(v); ++e)
+                    {
+                        Ddiag[num_species * v + s] += diff_const(s, lattice.graph.index[e]) * lattice.graph.D_i_j[e];
+                    }
+                    sdrate[v] += Ddiag[num_species * v + s] * x(v)[s];
+                }
+            }
+            std::vector<double> times(n);
+            for (std::size_t v = 0; v < n; ++v)
+            {
+                times[v] = next_time(v, 0.0, rng);
+            }
+            heap.build(times);
+        }
+
+        void advance(double end_time, std::mt19937_64 &rng)
+        {
+            while (heap.top_time() <= end_time)
+            {
+                const std::size_t subvol = heap.top();
+                const double tt = heap.top_time();
+                const double vol = lattice.volume[subvol];
+                const double totrate = srrate[subvol] + sdrate[subvol];
+                const double rand1 = uniform(rng);
+                std::size_t dest = n;
+
+                if (rand1 * totrate < srrate[subvol])
+                {
+                    const double rand_rval = rand1 * totrate;
+                    std::size_t re = 0;
+                    double cum = rrate[num_reactions * subvol];
+                    for (; re + 1 < num_reactions && rand_rval > cum; ++re, cum += rrate[num_reactions * subvol + re]);
+                    for (std::size_t i = jcN[re]; i < jcN[re + 1]; ++i)
+                    {
+                        x(subvol)[irN[i]] += prN[i];
+                        sdrate[subvol] += Ddiag[num_species * subvol + irN[i]] * prN[i];
+                    }
+                    double rdelta = 0.0;
+                    for (std::size_t i = jcG[num_species + re]; i < jcG[num_species + re + 1]; ++i)
+                    {
+                        const std::size_t j = irG[i];
+                        const double old = rrate[num_reactions * subvol + j];
+                        rdelta += (rrate[num_reactions * subvol + j] = propensities[j](x(subvol), tt, vol, nullptr, 1)) - old;
+                    }
+                    srrate[subvol] += rdelta;
+                    reaction_events++;
+                }
+                else
+                {
+                    const double diff_rand = rand1 * totrate - srrate[subvol];
+                    std::size_t spec = 0;
+                    double cum = Ddiag[num_species * subvol] * x(subvol)[0];
+                    for (; spec + 1 < num_species && diff_rand > cum; ++spec, cum += Ddiag[num_species * subvol + spec] * x(subvol)[spec]);
+                    while (x(subvol)[spec] == 0)
+                    {
+                        --spec;
+                    }
+
+                    const double rand2 = uniform(rng) * Ddiag[num_species * subvol + spec];
+                    double cum2 = 0.0;
+                    for (std::size_t e = lattice.graph.begin(subvol); e < lattice.graph.end(subvol); ++e)
+                    {
+                        cum2 += lattice.graph.D_i_j[e] * diff_const(spec, lattice.graph.index[e]);
+                        dest = lattice.graph.index[e];
+                        if (cum2 > rand2)
+                        {
+                            break;
+                        }
+                    }
+                    x(subvol)[spec]--;
+                    x(dest)[spec]++;
+
+                    double rdelta = 0.0, rrdelta = 0.0;
+                    for (std::size_t i = jcG[spec]; i < jcG[spec + 1]; ++i)
+                    {
+                        const std::size_t j = irG[i];
+                        double old = rrate[num_reactions * subvol + j];
+                        rdelta += (rrate[num_reactions * subvol + j] = propensities[j](x(subvol), tt, vol, nullptr, 1)) - old;
+                        old = rrate[num_reactions * dest + j];
+                        rrdelta += (rrate[num_reactions * dest + j] = propensities[j](x(dest), tt, vol, nullptr, 1)) - old;
+                    }
+                    srrate[subvol] += rdelta;
+                    srrate[dest] += rrdelta;
+                    sdrate[subvol] -= Ddiag[num_species * subvol + spec];
+                    sdrate[dest] += Ddiag[num_species * dest + spec];
+                    diffusion_events++;
+                }
+
+                heap.update(subvol, next_time(subvol, tt, rng));
+                if (dest != n)
+                {
+                    heap.update(dest, next_time(dest, tt, rng));
+                }
+            }
+        }
+
+        unsigned long reaction_events = 0;
+        unsigned long diffusion_events = 0;
+
+    private:
+        unsigned int *x(std::size_t v) { return xx + num_species * v; }
+        double diff_const(std::size_t s, std::size_t neighbor) const
+        {
+            return lattice.diffusion_matrix[s * 1 + (lattice.type[neighbor] - 1)];
+        }
+        double next_time(std::size_t v, double t, std::mt19937_64 &rng)
+        {
+            const double rate = srrate[v] + sdrate[v];
+            return rate > 0.0 ? t + exponential(rng) / rate : std::numeric_limits<double>::infinity();
+        }
+
+        const Lattice &lattice;
+        unsigned int *xx;
+        std::size_t n;
+        std::vector<double> rrate, srrate, Ddiag, sdrate;
+        GillesPy3D::IndexedMinHeap heap;
+        std::uniform_real_distribution<double> uniform;
+        std::exponential_distribution<double> exponential;
+    };
+
+    void report(const char *name, double seconds, unsigned long reactions, unsigned long diffusions,
+                const std::vector<unsigned int> &state, int scale)
+    {
+        const unsigned long events = reactions + diffusions;
+        std::printf("%-8s %10.3f s %12lu events (%lu reactions) %12.0f events/s  product %lu%s\n",
+                    name, seconds, events, reactions, events / seconds, total_product(state),
+                    check_conservation(state, scale) ? "" : "  CONSERVATION VIOLATED");
+    }
+}
+
+int main(int argc, char **argv)
+{
+    const int side = argc > 1 ? std::atoi(argv[1]) : 16;
+    const int scale = argc > 2 ? std::atoi(argv[2]) : 100;
+    const double end_time = argc > 3 ? std::atof(argv[3]) : 5.0;
+    const unsigned long long seed = argc > 4 ? std::strtoull(argv[4], nullptr, 10) : 1;
+    const double tau_tol = argc > 5 ? std::atof(argv[5]) : 0.03;
+    const bool dilute = argc > 6 && std::atoi(argv[6]) != 0;
+
+    const Lattice lattice = make_lattice(side, dilute ? scale : 1.0);
+    std::printf("Michaelis-Menten on %d^3 voxels, %d x initial populations%s, until t=%g\n",
+                side, scale, dilute ? " and volume" : "", end_time);
+
+    try
+    {
+        {
+            std::mt19937_64 rng(seed);
+            std::vector<unsigned int> state = initial_state(lattice.volume.size(), scale, rng);
+            const auto start = std::chrono::steady_clock::now();
+            LegacyNSM legacy(lattice, state, rng);
+            legacy.advance(end_time, rng);
+            const std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+            report("legacy", elapsed.count(), legacy.reaction_events, legacy.diffusion_events, state, scale);
+        }
+        {
+            std::mt19937_64 rng(seed);
+            std::vector<unsigned int> state = initial_state(lattice.volume.size(), scale, rng);
+            const auto start = std::chrono::steady_clock::now();
+            GillesPy3D::NextSubvolumeMethod nsm(num_species, num_reactions, irN, jcN, prN, irG, jcG, propensities);
+            nsm.initialize(lattice.graph, lattice.diffusion_matrix, 1, lattice.volume, lattice.type,
+                           nullptr, 0, state.data(), 0.0, rng);
+            nsm.advance(end_time, rng);
+            const std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+            report("nsm", elapsed.count(), nsm.num_reaction_events(), nsm.num_diffusion_events(), state, scale);
+        }
+        {
+            std::mt19937_64 rng(seed);
+            std::vector<unsigned int> state = initial_state(lattice.volume.size(), scale, rng);
+            const auto start = std::chrono::steady_clock::now();
+            GillesPy3D::SpatialTauLeaping tau(num_species, num_reactions, irN, jcN, prN, propensities, tau_tol);
+            tau.initialize(lattice.graph, lattice.diffusion_matrix, 1, lattice.volume, lattice.type,
+                           nullptr, 0, state.data(), 0.0);
+            tau.advance(end_time, rng);
+            const std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+            std::printf("%-8s %10.3f s %12lu leaps (%lu rejected, %lu exact events)  product %lu%s\n",
+                        "tau", elapsed.count(), tau.num_leaps(), tau.num_rejected_leaps(), tau.num_exact_events(),
+                        total_product(state), check_conservation(state, scale) ? "" : "  CONSERVATION VIOLATED");
+        }
+    }
+    catch (const GillesPy3D::GillesPyError &error)
+    {
+        std::fprintf(stderr, "%s\n", error.what());
+        return 1;
+    }
+    return 0;
+}
@@ -0,0 +1,147 @@
+/* ReactionState incremental propensity check.
+ *
+ * Simulates the updates the hybrid integrator makes to a small reaction network: discrete firings, applied
+ *   to the state and recorded with ReactionState::fire(), and changes of the continuous species between
+ *   firings. After each update, the propensities kept by update_ssa_propensity() must equal those computed
+ *   from scratch by ssa_propensity(). Halfway through, the continuous reaction becomes discrete and the
+ *   species modes are declared again, as Integrator::use_reactions() does after a change of partition.
+ * Reports the number of propensity evaluations of both, and exits with 1 on the first mismatch.
+ *
+ * Usage: reaction_state_check [steps=100000] [seed=1]
+ */
+
+#include "parameter_state.hpp"
+#include "reaction_state.hpp"
+
+#include <cstdio>
+#include <cstdlib>
+#include <random>
+#include <vector>
+
+namespace
+{
+    // Species A, B, C, D, E
+    constexpr std::size_t num_species = 5;
+    // Reaction r5 (E -> 0) starts continuous, so E is continuous, and r6 (E -> A) reads it
+    constexpr std::size_t continuous_reaction = 5;
+
+    std::size_t evaluations = 0;
+
+    double r0(double *x, double *k) { ++evaluations; return k[0] * x[0] * x[1]; }
+    double r1(double *x, double *k) { ++evaluations; return k[1] * x[2]; }
+    double r2(double *x, double *k) { ++evaluations; return k[2] * x[2]; }
+    double r3(double *x, double *k) { ++evaluations; return k[3] * x[3]; }
+    double r4(double *, double *k) { ++evaluations; return k[4]; }
+    double r5(double *x, double *k) { ++evaluations; return k[5] * x[4]; }
+    double r6(double *x, double *k) { ++evaluations; return k[6] * x[4]; }
+
+    GillesPy3D::ReactionVector reaction(std::vector<std::int32_t> reactants, std::vector<std::int32_t> products)
+    {
+        return { reactants, products };
+    }
+
+    // As Integrator::declare_species_modes(), without rate rules
+    void declare_species_modes(GillesPy3D::ReactionState &reactions)
+    {
+        for (std::size_t spec = 0; spec < num_species; ++spec)
+        {
+            bool discrete = true;
+            for (std::size_t rxn_id = 0; discrete && rxn_id < reactions.size(); ++rxn_id)
+            {
+                auto &[reactants_change, products_change] = reactions.change(rxn_id);
+                discrete = reactants_change[spec] == products_change[spec]
+                    || reactions.mode(rxn_id) == GillesPy3D::SimulationState::DISCRETE;
+            }
+            reactions.set_species_mode(spec, discrete ? GillesPy3D::SimulationState::DISCRETE
+                                                      : GillesPy3D::SimulationState::CONTINUOUS);
+        }
+    }
+}
+
+int main(int argc, char *argv[])
+{
+    const unsigned long steps = argc > 1 ? std::strtoul(argv[1], nullptr, 10) : 100000;
+    const unsigned long seed = argc > 2 ? std::strtoul(argv[2], nullptr, 10) : 1;
+
+    GillesPy3D::ParameterState parameters({ 0.001, 0.5, 0.1, 0.05, 2.0, 0.2, 0.01 });
+    GillesPy3D::ReactionState reactions(parameters);
+    reactions.add_reaction(r0, reaction({ 1, 1, 0, 0, 0 }, { 0, 0, 1, 0, 0 }));
+    reactions.add_reaction(r1, reaction({ 0, 0, 1, 0, 0 }, { 1, 1, 0, 0, 0 }));
+    reactions.add_reaction(r2, reaction({ 0, 0, 1, 0, 0 }, { 0, 0, 0, 1, 0 }));
+    reactions.add_reaction(r3, reaction({ 0, 0, 0, 1, 0 }, { 0, 0, 0, 0, 0 }));
+    reactions.add_reaction(r4, reaction({ 0, 0, 0, 0, 0 }, { 1, 0, 0, 0, 0 }));
+    reactions.add_reaction(r5, reaction({ 0, 0, 0, 0, 1 }, { 0, 0, 0, 0, 0 }),
+                           GillesPy3D::SimulationState::CONTINUOUS);
+    reactions.add_reaction(r6, reaction({ 0, 0, 0, 0, 1 }, { 1, 0, 0, 0, 0 }));
+    declare_species_modes(reactions);
+
+    std::vector<double> state = { 300.0, 200.0, 50.0, 20.0, 1000.0 };
+    std::vector<double> incremental(reactions.size(), 0.0);
+    std::vector<double> full(reactions.size(), 0.0);
+    std::mt19937_64 rng(seed);
+    std::uniform_int_distribution<std::size_t> pick_reaction(0, reactions.size() - 1);
+    std::uniform_real_distribution<double> uniform(0.0, 1.0);
+
+    std::size_t incremental_evaluations = 0;
+    std::size_t full_evaluations = 0;
+    for (unsigned long step = 0; step < steps; ++step)
+    {
+        if (step == steps / 2)
+        {
+            reactions.set_mode(continuous_reaction, GillesPy3D::SimulationState::DISCRETE);
+            declare_species_modes(reactions);
+        }
+
+        // A few firings of discrete reactions, as Integrator::fire() applies them
+        const int firings = static_cast<int>(uniform(rng) * 3);
+        for (int firing = 0; firing < firings; ++firing)
+        {
+            const std::size_t rxn_id = pick_reaction(rng);
+            if (reactions.mode(rxn_id) != GillesPy3D::SimulationState::DISCRETE)
+            {
+                continue;
+            }
+            auto &[reactants_change, products_change] = reactions.change(rxn_id);
+            bool feasible = true;
+            for (std::size_t spec = 0; spec < num_species; ++spec)
+            {
+                feasible &= state[spec] >= reactants_change[spec];
+            }
+            if (!feasible)
+            {
+                continue;
+            }
+            for (std::size_t spec = 0; spec < num_species; ++spec)
+            {
+                state[spec] += products_change[spec] - reactants_change[spec];
+            }
+            reactions.fire(rxn_id);
+        }
+        // The integrator moves the continuous species
+        if (reactions.mode(continuous_reaction) != GillesPy3D::SimulationState::DISCRETE)
+        {
+            state[4] *= 1.0 - 1e-4 * uniform(rng);
+        }
+
+        evaluations = 0;
+        reactions.update_ssa_propensity(state.data(), incremental.data());
+        incremental_evaluations += evaluations;
+        evaluations = 0;
+        reactions.ssa_propensity(state.data(), full.data());
+        full_evaluations += evaluations;
+
+        for (std::size_t rxn_id = 0; rxn_id < reactions.size(); ++rxn_id)
+        {
+            if (incremental[rxn_id] != full[rxn_id])
+            {
+                std::printf("step %lu: reaction %zu has incremental propensity %.17g, full %.17g\n",
+                            step, rxn_id, incremental[rxn_id], full[rxn_id]);
+                return 1;
+            }
+        }
+    }
+
+    std::printf("%lu steps: incremental and full propensities agree\n", steps);
+    std::printf("propensity evaluations: incremental %zu, full %zu\n", incremental_evaluations, full_evaluations);
+    return 0;
+}
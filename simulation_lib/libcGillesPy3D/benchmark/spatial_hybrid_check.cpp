@@ -0,0 +1,90 @@
+/* SpatialHybrid deterministic rate check.
+ *
+ * Dimerization 2A -> 0 with A continuous, in voxels of different volumes and without diffusion, so that
+ *   SpatialHybrid only integrates the ODE channel. Its stochastic propensity k A (A - 1) / vol and its
+ *   deterministic rate k a^2 (a = A / vol) are given as the generated code defines them, so the populations
+ *   follow dA/dt = -2 k A^2 / vol, whose solution is A(t) = A0 / (1 + 2 k A0 t / vol).
+ * The populations are small enough that integrating the stochastic propensity instead would be off by
+ *   several percent. Exits with 1 if a population differs from the solution by more than the tolerance.
+ *
+ * Usage: spatial_hybrid_check [steps=50] [dt=0.1]
+ */
+
+#include "neighbor_graph.hpp"
+#include "spatial_hybrid.hpp"
+
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <random>
+#include <vector>
+
+namespace
+{
+    constexpr double k = 0.05;
+    constexpr double tolerance = 1e-5;
+
+    double ssa_dimerization(const double *x, double, double vol, const double *, int)
+    {
+        return k * x[0] * (x[0] - 1) / vol;
+    }
+
+    double ode_dimerization(const double *x, double, double, const double *, int)
+    {
+        return k * x[0] * x[0];
+    }
+
+    const GillesPy3D::ChemRxnFun ssa_propensities[] = { ssa_dimerization };
+    const GillesPy3D::ChemRxnFun ode_propensities[] = { ode_dimerization };
+}
+
+int main(int argc, char *argv[])
+{
+    const unsigned long steps = argc > 1 ? std::strtoul(argv[1], nullptr, 10) : 50;
+    const double dt = argc > 2 ? std::strtod(argv[2], nullptr) : 0.1;
+
+    // 2A -> 0
+    const std::size_t irN[] = { 0 };
+    const std::size_t jcN[] = { 0, 1 };
+    const int prN[] = { -2 };
+    GillesPy3D::HybridSpeciesMode continuous;
+    continuous.mode = GillesPy3D::SimulationState::CONTINUOUS;
+    GillesPy3D::SpatialHybrid hybrid(1, 1, irN, jcN, prN, ssa_propensities, ode_propensities, { continuous },
+                                     GillesPy3D::IntegratorConfiguration{ 1e-9, 1e-12, 0.0 });
+
+    const std::vector<double> volume = { 0.5, 1.0, 4.0 };
+    const std::vector<double> initial = { 20.0, 50.0, 200.0 };
+    GillesPy3D::NeighborGraph graph;
+    for (std::size_t voxel = 0; voxel < volume.size(); ++voxel)
+    {
+        graph.end_row();
+    }
+    const std::vector<int> type(volume.size(), 1);
+    const double diffusion_matrix[] = { 0.0 };
+    std::vector<double> state = initial;
+    hybrid.initialize(graph, diffusion_matrix, 1, volume, type, nullptr, 0, state.data(), 0.0);
+
+    std::mt19937_64 rng(1);
+    double max_error = 0.0;
+    for (unsigned long step = 1; step <= steps; ++step)
+    {
+        const double t = step * dt;
+        hybrid.advance(t, rng);
+        for (std::size_t voxel = 0; voxel < volume.size(); ++voxel)
+        {
+            const double expected = initial[voxel] / (1.0 + 2.0 * k * initial[voxel] * t / volume[voxel]);
+            const double error = std::fabs(state[voxel] - expected) / expected;
+            if (!(error <= tolerance))
+            {
+                std::printf("t=%g, voxel %zu (vol %g): population %.10g, ODE solution %.10g\n",
+                            t, voxel, volume[voxel], state[voxel], expected);
+                return 1;
+            }
+            max_error = std::fmax(max_error, error);
+        }
+    }
+
+    std::printf("%lu steps: continuous dimerization follows the ODE rate (max relative error %.3g, %lu stochastic "
+                "events)\n", steps, max_error, hybrid.num_stochastic_events());
+    return hybrid.num_stochastic_events() == 0 ? 0 : 1;
+}
@@ -0,0 +1,166 @@
+/* Sparse stoichiometry check.
+ *
+ * The reaction fluxes of ParticleStore::pairwise_force() and pairwise_force_symmetric() walk the stoichiometry
+ *   in compressed sparse column form, one column per reaction. This compares the Q they produce with the
+ *   product of the dense stoichiometric matrix and the reaction rates, which the SDPD update used before,
+ *   for random stoichiometries (including reactions that change no species) on particles without
+ *   neighbors, so that Q only holds the reaction fluxes.
+ * Both add the rates of the reactions in the same order, so Q must be identical, not only close.
+ * Exits with 1 on the first difference.
+ *
+ * Usage: stoichiometry_check [trials=200] [particles=1000] [seed=1]
+ */
+
+#include "neighbor_graph.hpp"
+#include "particle_store.hpp"
+
+#include <cstdio>
+#include <cstdlib>
+#include <random>
+#include <vector>
+
+namespace
+{
+    constexpr std::size_t num_species = 6;
+    constexpr std::size_t num_reactions = 8;
+    constexpr std::size_t num_data_fn = 1;
+
+    // Rates of various orders, reading the volume, time, data function and type like generated ones
+    double f0(const double *x, double, double vol, const double *, int) { return 0.5 * x[0] * x[1] / vol; }
+    double f1(const double *x, double, double, const double *, int) { return 0.1 * x[2]; }
+    double f2(const double *, double, double vol, const double *, int) { return 3.0 * vol; }
+    double f3(const double *x, double t, double, const double *, int) { return x[3] * x[3] * (1.0 + t); }
+    double f4(const double *x, double, double, const double *data, int) { return data[0] * x[4]; }
+    double f5(const double *x, double, double, const double *, int type) { return type == 2 ? x[5] : 0.0; }
+    double f6(const double *x, double, double vol, const double *, int) { return x[0] * x[2] * x[4] / (vol * vol); }
+    double f7(const double *x, double, double, const double *, int) { return 0.25 / (1.0 + x[1]); }
+    const GillesPy3D::ChemRxnFun rates[num_reactions] = { f0, f1, f2, f3, f4, f5, f6, f7 };
+
+    struct Stoichiometry
+    {
+        std::vector<std::size_t> irN;
+        std::vector<std::size_t> jcN;
+        std::vector<int> prN;
+        // dense[num_species * rxn + s]
+        std::vector<int> dense;
+    };
+
+    Stoichiometry random_stoichiometry(std::mt19937_64 &rng)
+    {
+        std::uniform_real_distribution<double> uniform(0.0, 1.0);
+        std::uniform_int_distribution<int> coefficient(-2, 2);
+        Stoichiometry stoich;
+        stoich.dense.assign(num_species * num_reactions, 0);
+        stoich.jcN.push_back(0);
+        for (std::size_t rxn = 0; rxn < num_reactions; ++rxn)
+        {
+            for (std::size_t s = 0; s < num_species; ++s)
+            {
+                const int change = uniform(rng) < 0.3 ? coefficient(rng) : 0;
+                if (change != 0)
+                {
+                    stoich.irN.push_back(s);
+                    stoich.prN.push_back(change);
+                    stoich.dense[num_species * rxn + s] = change;
+                }
+            }
+            stoich.jcN.push_back(stoich.irN.size());
+        }
+        return stoich;
+    }
+
+    bool compare(const char *kernel, unsigned long trial, const std::vector<std::vector<double>> &Q,
+                 const std::vector<std::vector<double>> &expected)
+    {
+        for (std::size_t s = 0; s < num_species; ++s)
+        {
+            for (std::size_t i = 0; i < expected[s].size(); ++i)
+            {
+                if (Q[s][i] != expected[s][i])
+                {
+                    std::printf("trial %lu, %s: Q[%zu][%zu] is %.17g, dense product %.17g\n",
+                                trial, kernel, s, i, Q[s][i], expected[s][i]);
+                    return false;
+                }
+            }
+        }
+        return true;
+    }
+}
+
+int main(int argc, char *argv[])
+{
+    const unsigned long trials = argc > 1 ? std::strtoul(argv[1], nullptr, 10) : 200;
+    const std::size_t num_particles = argc > 2 ? std::strtoul(argv[2], nullptr, 10) : 1000;
+    const unsigned long seed = argc > 3 ? std::strtoul(argv[3], nullptr, 10) : 1;
+
+    std::mt19937_64 rng(seed);
+    std::uniform_real_distribution<double> uniform(0.0, 1.0);
+    GillesPy3D::NeighborGraph graph;
+    for (std::size_t i = 0; i < num_particles; ++i)
+    {
+        graph.end_row();
+    }
+    GillesPy3D::SDPDParameters params{};
+    params.h = 1.0;
+    params.rho0 = 1.0;
+    const std::vector<double> diffusion_matrix(2 * num_species, 0.0);
+
+    std::size_t nonzeros = 0;
+    for (unsigned long trial = 0; trial < trials; ++trial)
+    {
+        const Stoichiometry stoich = random_stoichiometry(rng);
+        nonzeros += stoich.irN.size();
+        const GillesPy3D::ChemistryParameters chem{
+            num_reactions, rates, stoich.irN.data(), stoich.jcN.data(), stoich.prN.data(), 0.5 * trial
+        };
+
+        GillesPy3D::ParticleStore store;
+        store.resize(num_particles, num_species, num_data_fn, false);
+        for (std::size_t i = 0; i < num_particles; ++i)
+        {
+            store.mass[i] = 0.5 + uniform(rng);
+            store.rho[i] = 0.5 + uniform(rng);
+            store.type[i] = uniform(rng) < 0.5 ? 1 : 2;
+            store.data_fn[i] = uniform(rng);
+            for (std::size_t s = 0; s < num_species; ++s)
+            {
+                store.C[s][i] = 10.0 * uniform(rng);
+            }
+        }
+
+        // Dense product, as the SDPD update computed it before
+        std::vector<std::vector<double>> expected(num_species, std::vector<double>(num_particles, 0.0));
+        double x[num_species];
+        for (std::size_t i = 0; i < num_particles; ++i)
+        {
+            for (std::size_t s = 0; s < num_species; ++s)
+            {
+                x[s] = store.C[s][i];
+            }
+            const double vol = store.mass[i] / store.rho[i];
+            for (std::size_t rxn = 0; rxn < num_reactions; ++rxn)
+            {
+                const double flux = rates[rxn](x, chem.t, vol, &store.data_fn[i], store.type[i]);
+                for (std::size_t s = 0; s < num_species; ++s)
+                {
+                    expected[s][i] += stoich.dense[num_species * rxn + s] * flux;
+                }
+            }
+        }
+
+        store.pairwise_force(graph, params, diffusion_matrix.data(), chem, 0, num_particles);
+        GillesPy3D::ForceAccumulator sums;
+        sums.reset(num_particles, num_species, false);
+        store.pairwise_force_symmetric(graph, params, diffusion_matrix.data(), chem, 0, num_particles, sums);
+        if (!compare("pairwise_force", trial, store.Q, expected)
+            || !compare("pairwise_force_symmetric", trial, sums.Q, expected))
+        {
+            return 1;
+        }
+    }
+
+    std::printf("%lu trials of %zu particles: sparse and dense Q identical (%zu of %zu stoichiometry entries "
+                "non-zero)\n", trials, num_particles, nonzeros, trials * num_species * num_reactions);
+    return 0;
+}
@@ -0,0 +1,37 @@
+#pragma once
+
+#include <cstddef>
+
+namespace GillesPy3D
+{
+    /* ArrayView
+     * Non-owning description of a contiguous array of engine state.
+     *
+     * Returned by the Simulation state accessors so that the Python bindings can expose the memory
+     *   through the buffer protocol without copying it. The view is only valid while the array it
+     *   points into is neither destroyed nor resized.
+     */
+    struct ArrayView
+    {
+        void *data = nullptr;
+        std::size_t size = 0;
+        std::size_t itemsize = 0;
+        // Buffer protocol format character of the elements: 'd' (double) or 'i' (int)
+        char format = 'd';
+
+        template <typename T>
+        static ArrayView of(T *data, std::size_t size);
+    };
+
+    template <>
+    inline ArrayView ArrayView::of<double>(double *data, std::size_t size)
+    {
+        return ArrayView{data, size, sizeof(double), 'd'};
+    }
+
+    template <>
+    inline ArrayView ArrayView::of<int>(int *data, std::size_t size)
+    {
+        return ArrayView{data, size, sizeof(int), 'i'};
+    }
+}
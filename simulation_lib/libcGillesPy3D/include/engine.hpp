@@ -0,0 +1,33 @@
+#pragma once
+
+#include <cstddef>
+#include <string>
+#include <vector>
+
+namespace GillesPy3D
+{
+    struct ParticleSystem;
+
+    /* EngineArguments
+     * Command line of a compiled solver, as written by Solver.run():
+     *   -t <threads>    threads for the particle loops; 0 (the default) uses every core
+     *   -s <seed>       random seed of the first trajectory, trajectory k being seeded with seed + k;
+     *                   drawn from std::random_device if not given
+     *   -o <directory>  output directory of one trajectory, repeated (in trajectory order) for a batch;
+     *                   one trajectory in the working directory if not given
+     */
+    struct EngineArguments
+    {
+        std::size_t num_threads = 0;
+        unsigned long long seed = 0;
+        std::vector<std::string> output_directories;
+
+        /// @throws GillesPyError An option is unknown or its value is missing or malformed.
+        static EngineArguments parse(int argc, char *argv[]);
+    };
+
+    /// @brief Entry point of a compiled solver: run every trajectory requested on the command line with
+    ///   Simulation::run_trajectories().
+    /// @returns The exit status of the solver: 0, or 1 if the arguments are invalid or the simulation failed.
+    int run_engine(ParticleSystem *system, int argc, char *argv[]);
+}
@@ -0,0 +1,90 @@
+#pragma once
+
+#include <cstddef>
+#include <cstdint>
+#include <string>
+#include <type_traits>
+#include <unordered_map>
+#include <vector>
+
+namespace GillesPy3D
+{
+    /* InputFile
+     * Named arrays of the per-particle and per-voxel input of a simulation, read from the binary file written
+     *   by the Python solver, so that the size of the domain never changes the generated source.
+     *
+     * Layout (native byte order, every field 8-byte aligned):
+     *   "GPY3DIN\0", uint32 version, uint32 number of arrays, then for each array:
+     *   uint32 name length, char type code, 3 bytes of padding, uint64 count, the name (padded to 8 bytes)
+     *   and count values (padded to 8 bytes).
+     * Type codes: 'd' double, 'i' int32, 'I' uint32, 'Q' uint64 (size_t).
+     */
+    class InputFile
+    {
+    public:
+        static constexpr std::uint32_t version = 1;
+        /// Environment variable holding the path of the input file of a solver run.
+        static constexpr const char *path_variable = "GILLESPY3D_INPUT_FILE";
+        /// Environment variable holding the path of an optional file of runtime variables, whose arrays replace
+        ///   those of the same name in the input file (e.g. the parameters of one point of a sweep).
+        static constexpr const char *variables_variable = "GILLESPY3D_VARIABLES_FILE";
+
+        explicit InputFile(const std::string &path);
+        /// @brief Read the file named by the environment variable `path_variable`.
+        static InputFile from_environment();
+        /// @brief The input file of this run, with its variables applied, read on first use. Generated code
+        ///   may call it from any static initializer.
+        static InputFile &instance();
+
+        /// @brief Replace arrays with those of `variables`, which must exist with the same type and size.
+        void override(InputFile &&variables);
+
+        bool contains(const std::string &name) const;
+        /// @brief Number of values of an array.
+        std::size_t size(const std::string &name) const;
+
+        /// @brief Values of an array, which live as long as the file object.
+        /// @throws GillesPyError The array does not exist or has another type.
+        template <typename T>
+        T *data(const std::string &name);
+
+    private:
+        struct Array
+        {
+            char type;
+            std::size_t count;
+            std::vector<std::uint64_t> storage;
+        };
+
+        template <typename T>
+        static constexpr char type_code();
+        Array &find(const std::string &name, char type);
+        const Array &find(const std::string &name) const;
+
+        std::string m_path;
+        std::unordered_map<std::string, Array> m_arrays;
+    };
+
+    // By size rather than by type, so that size_t matches 'Q' whether or not it is the same type as uint64_t
+    template <typename T>
+    constexpr char InputFile::type_code()
+    {
+        if constexpr (std::is_same_v<T, double>)
+            return 'd';
+        else if constexpr (std::is_integral_v<T> && std::is_signed_v<T> && sizeof(T) == 4)
+            return 'i';
+        else if constexpr (std::is_integral_v<T> && std::is_unsigned_v<T> && sizeof(T) == 4)
+            return 'I';
+        else if constexpr (std::is_integral_v<T> && std::is_unsigned_v<T> && sizeof(T) == 8)
+            return 'Q';
+        else
+            static_assert(sizeof(T) == 0, "InputFile: unsupported array type");
+    }
+
+    template <typename T>
+    T *InputFile::data(const std::string &name)
+    {
+        Array &array = find(name, type_code<T>());
+        return array.count > 0 ? reinterpret_cast<T*>(array.storage.data()) : nullptr;
+    }
+}
@@ -71,18 +71,19 @@ namespace GillesPy3D
         // In `rootfn`, this means that gout[i] is the "output" of reaction active_reaction_ids[i].
         // This is used to map the internal reaction number to the actual reaction id.
         std::vector<unsigned int> active_reaction_ids;
+        // Stochastic propensities of the last evaluation, updated incrementally by ReactionState
         std::vector<double> propensities;
 
-        IntegratorData(const ParameterState &parameter_state, const SpeciesState &species_state, const ReactionState &reaction_state);
+        IntegratorData(const ParameterState &parameter_state, const SpeciesState &species_state, ReactionState &reaction_state);
 
         const ParameterState &parameters() { return m_parameter_state; }
         const SpeciesState &species() { return m_species_state; }
-        const ReactionState &reactions() { return m_reaction_state; }
+        ReactionState &reactions() { return m_reaction_state; }
 
     private:
         const ParameterState &m_parameter_state;
         const SpeciesState &m_species_state;
-        const ReactionState &m_reaction_state;
+        ReactionState &m_reaction_state;
     };
 
     /* :IntegrationResults:
@@ -155,6 +156,8 @@ namespace GillesPy3D
          * Loads any new changes to the solution vector without changing previous output.
          * Any new values assigned to the public N_Vector y will be recognized by the integrator.
          * The current time value remains the same. To change this, modify `t`.
+         * Species changed directly, rather than through fire(), must also be passed to
+         *   data.reactions().mark_dirty(), or the propensities reading them are not recomputed.
          */
         void refresh_state();
 
@@ -172,8 +175,19 @@ namespace GillesPy3D
 
         /// @brief Make reactions available to root-finder during integration.
         /// The root-finder itself is not activated until enable_root_finder() is called.
+        /// Also declares the species modes to the ReactionState, see declare_species_modes().
         void use_reactions();
 
+        /// @brief Declare to the ReactionState which species are discrete: those without rate rules which
+        /// only discrete reactions change. Propensities reading only discrete species are then recomputed
+        /// after the firings that change them, not on every evaluation of the right-hand side.
+        /// Must be called again whenever the mode of a reaction changes.
+        void declare_species_modes();
+
+        /// @brief Apply `count` firings of a discrete reaction to the species of `y`, draw a new offset for it
+        /// and record the firing in the ReactionState. Call refresh_state() once every firing is applied.
+        void fire(unsigned int reaction_id, unsigned int count = 1);
+
         /// @brief Installs a CVODE root-finder onto the integrator.
         /// Any events or reactions provided by previous calls to use_events() or use_reactions()
         /// will cause the integrator to return early, which the integrate() method will indicate.
@@ -214,7 +228,7 @@ namespace GillesPy3D
         IntegrationResults integrate(double *t, std::set<int> &event_roots, std::set<unsigned int> &reaction_roots, int num_det_rxns, int num_rate_rules);
         IntegratorData data;
 
-        Integrator(const GillesPy3D::ParameterState &parameter_state, const SpeciesState &species_state, const ReactionState &reaction_state, URNGenerator urn, double reltol, double abstol);
+        Integrator(const GillesPy3D::ParameterState &parameter_state, const SpeciesState &species_state, ReactionState &reaction_state, URNGenerator urn, double reltol, double abstol);
         ~Integrator();
         N_Vector init_model_vector(const SUNContext &context);
         void reset_model_vector();
@@ -0,0 +1,70 @@
+#pragma once
+
+#include <cstddef>
+#include <vector>
+
+namespace GillesPy3D
+{
+    /// @brief SPH weight functions available to SmoothingKernel.
+    /// All kernels have compact support of radius h (R = r / h <= 1).
+    enum KernelFunction : unsigned int
+    {
+        // Lucy quartic, (1 + 3R)(1 - R)^3; Drawert et al. 2019, Eq 14.
+        LUCY = 0,
+        // Wendland C2, (1 + 4R)(1 - R)^4; (1 + 3R)(1 - R)^3 in 1D.
+        WENDLAND_C2 = 1,
+        // Wendland C4, (1 + 6R + 35/3 R^2)(1 - R)^6; (1 + 5R + 8R^2)(1 - R)^5 in 1D.
+        WENDLAND_C4 = 2,
+        // M4 cubic B-spline, rescaled to a support of h.
+        CUBIC_SPLINE = 3,
+    };
+
+    /* SmoothingKernel
+     * Weight function W(r) and its derivative dW/dr for a fixed kernel, dimension and h.
+     *
+     * The normalization and other constants are computed once by init(), so evaluating a pair
+     *   is a handful of multiplications.
+     * With a nonzero table size, W and dW/dr are sampled at evenly spaced R and evaluated by
+     *   linear interpolation instead.
+     */
+    class SmoothingKernel
+    {
+    public:
+        SmoothingKernel();
+
+        /// @brief Set up the kernel; must be called before evaluate().
+        /// @param function Weight function to use.
+        /// @param dimension Number of spatial dimensions (1, 2 or 3), which sets the normalization.
+        /// @param h Support radius.
+        /// @param table_size Number of intervals of the lookup table over R in [0, 1]; 0 evaluates exactly.
+        void init(KernelFunction function, int dimension, double h, std::size_t table_size = 0);
+
+        /// @brief W(r) and dW/dr(r); both are zero for r >= h.
+        void evaluate(double r, double &W, double &dWdr) const;
+
+        double W(double r) const;
+        double dWdr(double r) const;
+
+        KernelFunction function() const { return m_function; }
+        int dimension() const { return m_dimension; }
+        double h() const { return m_h; }
+        std::size_t table_size() const { return m_table_size; }
+
+    private:
+        // Exact values as functions of R = r / h, without table lookup.
+        void evaluate_exact(double R, double &W, double &dWdr) const;
+
+        KernelFunction m_function;
+        int m_dimension;
+        double m_h;
+        double m_inv_h;
+        // Normalization of W, and of dW/dr = m_dWdr_alpha * dW/dR
+        double m_alpha;
+        double m_dWdr_alpha;
+
+        std::size_t m_table_size;
+        double m_table_scale;
+        std::vector<double> m_W_table;
+        std::vector<double> m_dWdr_table;
+    };
+}
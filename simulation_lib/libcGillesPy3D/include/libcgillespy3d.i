@@ -11,6 +11,14 @@ namespace std {
     *((void**)&$1) = PyLong_AsVoidPtr($input);
 }
 
+%typemap(in) void(*)(double*, double*, double*) {
+    *((void**)&$1) = PyLong_AsVoidPtr($input);
+}
+
+%typemap(in) void(*)(std::size_t, double*, double*, double*) {
+    *((void**)&$1) = PyLong_AsVoidPtr($input);
+}
+
 %module libcgillespy3d
 %{
 #include "model.hpp"
@@ -29,6 +37,113 @@ namespace std {
 %include "species.hpp"
 %include "timespan.hpp"
 %include "error.hpp"
+%include "simulation_state.hpp"
 %include "model.hpp"
 %include "model_context.hpp"
+
+// Wrapped as an opaque pointer: compiled solvers build their Simulation from a system in C++
+namespace GillesPy3D {
+    class ParticleSystem;
+}
+
+// Simulation state accessors return views of engine memory. The typemap hands them to Python as writable
+// memoryviews (buffer protocol, no copy), which do not own the memory; the wrappers below turn those into
+// NumPy arrays whose base holds a reference to the Simulation.
+namespace GillesPy3D {
+    struct ArrayView;
+}
+%typemap(out) GillesPy3D::ArrayView {
+    const GillesPy3D::ArrayView &view = $1;
+    static char empty_view = 0;
+    PyObject *bytes = PyMemoryView_FromMemory(
+        view.data != nullptr ? static_cast<char*>(view.data) : &empty_view,
+        static_cast<Py_ssize_t>(view.size * view.itemsize), PyBUF_WRITE);
+    if (bytes == nullptr) SWIG_fail;
+    const char format[2] = {view.format, '\0'};
+    $result = PyObject_CallMethod(bytes, "cast", "s", format);
+    Py_DECREF(bytes);
+    if ($result == nullptr) SWIG_fail;
+}
+%rename(_get_species) GillesPy3D::Simulation::get_species;
+%rename(_get_property) GillesPy3D::Simulation::get_property;
+%rename(_get_position) GillesPy3D::Simulation::get_position;
 %include "simulation.hpp"
+
+%pythoncode %{
+import numpy
+
+class _StateView:
+    # Array interface of a view of engine memory, which keeps the Simulation owning that memory alive:
+    #   NumPy arrays made from it hold it as their base
+    def __init__(self, view, owner):
+        self.owner = owner
+        self.__array_interface__ = numpy.asarray(view).__array_interface__
+
+def _state_array(view, owner, copy):
+    if copy:
+        return numpy.array(view)
+    return numpy.asarray(_StateView(view, owner))
+%}
+
+%extend GillesPy3D::Simulation {
+%pythoncode %{
+    def get_species(self, species_name, copy=False):
+        """
+        Concentration of a continuous species in every particle.
+
+        Unless `copy` is set, the array is a view of the engine state: it reflects later steps of the
+        simulation, writing to it changes the state, and it must not be used once particles are added
+        or removed. The view keeps the simulation alive.
+
+        :param species_name: Name of the species.
+        :type species_name: str
+
+        :param copy: Return a copy of the state instead of a view.
+        :type copy: bool
+
+        :returns: Array of length number of particles.
+        :rtype: numpy.ndarray
+        """
+        return _state_array(self._get_species(species_name), self, copy)
+
+    def get_property(self, property_name, copy=False):
+        """
+        Property of every particle: one of 'rho', 'mass', 'type' or, for fluid domains, 'nu' and 'v'.
+
+        Scalar properties are views of the engine state unless `copy` is set (see get_species).
+        The velocity is stored per component, so 'v' is returned as an (n, 3) copy.
+
+        :param property_name: Name of the property.
+        :type property_name: str
+
+        :param copy: Return a copy of the state instead of a view.
+        :type copy: bool
+
+        :returns: Array of length number of particles, or (number of particles, 3) for 'v'.
+        :rtype: numpy.ndarray
+        """
+        if property_name == "v":
+            return numpy.column_stack([self._get_property("v", d) for d in range(3)])
+        return _state_array(self._get_property(property_name), self, copy)
+
+    def get_position(self, axis=None, copy=False):
+        """
+        Particle positions.
+
+        Positions are stored per axis, so a single axis is returned as a view of the engine state unless
+        `copy` is set (see get_species), while all axes are returned as an (n, 3) copy.
+
+        :param axis: Axis (0, 1 or 2) to return, or None for all of them.
+        :type axis: int
+
+        :param copy: Return a copy of the state instead of a view.
+        :type copy: bool
+
+        :returns: Array of length number of particles, or (number of particles, 3) if `axis` is None.
+        :rtype: numpy.ndarray
+        """
+        if axis is None:
+            return numpy.column_stack([self._get_position(d) for d in range(3)])
+        return _state_array(self._get_position(axis), self, copy)
+%}
+}
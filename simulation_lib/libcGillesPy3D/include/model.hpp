@@ -9,6 +9,7 @@
 #include "data_function.hpp"
 #include "boundary_condition.hpp"
 #include "domain.hpp"
+#include "simulation_state.hpp"
 #include <memory>
 #include <string>
 #include <vector>
@@ -16,15 +17,6 @@
 namespace GillesPy3D
 {
 
-
-   enum SimulationState : unsigned int
-    {
-        CONTINUOUS = 0,
-        DISCRETE = 1,
-        DYNAMIC = 2
-    };
-
-
     class Model
     {
     private:
@@ -22,6 +22,10 @@ namespace GillesPy3D
     template <typename T>
     using GroupContinuousFunction = void (*)(T* state, T* parameters, T* out);
 
+    /// Propensity of one reaction in `num_voxels` voxels, whose states are contiguous (species-minor).
+    template <typename T>
+    using VoxelPropensityFunction = void (*)(std::size_t num_voxels, T* states, T* parameters, T* out);
+
     class ReactionContext;
 
     class CPropensityFunction
@@ -34,6 +38,32 @@ namespace GillesPy3D
         double (*propensity_function)(double*, double*);
     };
 
+    /* CGroupPropensityFunction
+     * Propensities of every reaction of the model, written to out[reaction_id] in one call.
+     */
+    class CGroupPropensityFunction
+    {
+    public:
+        friend class ReactionContext;
+        explicit CGroupPropensityFunction(void (*propensity_function)(double*, double*, double*));
+
+    private:
+        GroupPropensityFunction<double> propensity_function;
+    };
+
+    /* CVoxelPropensityFunction
+     * Propensity of one reaction in a batch of voxels, written to out[voxel] in one call.
+     */
+    class CVoxelPropensityFunction
+    {
+    public:
+        friend class ReactionContext;
+        explicit CVoxelPropensityFunction(void (*propensity_function)(std::size_t, double*, double*, double*));
+
+    private:
+        VoxelPropensityFunction<double> propensity_function;
+    };
+
     class ReactionContext
     {
     public:
@@ -44,14 +74,46 @@ namespace GillesPy3D
         void set_ode_propensity_function(std::size_t reaction_id, const CPropensityFunction &propensity_function);
         void set_ssa_propensity_function(std::size_t reaction_id, const CPropensityFunction &propensity_function);
 
+        /// @brief Evaluate the propensities of all reactions with a single function, in place of the
+        ///   per-reaction functions.
+        void set_group_propensity_function(const CGroupPropensityFunction &propensity_function);
+        void set_ode_group_propensity_function(const CGroupPropensityFunction &propensity_function);
+        void set_ssa_group_propensity_function(const CGroupPropensityFunction &propensity_function);
+
+        /// @brief Evaluate the stochastic propensity of a reaction in many voxels with a single function.
+        void set_voxel_propensity_function(std::size_t reaction_id, const CVoxelPropensityFunction &propensity_function);
+
+        std::size_t num_reactions() const;
+
+        /// @brief Propensity of every reaction, into out[num_reactions]; reactions without a propensity
+        ///   function have a propensity of zero.
+        void get_ode_propensities(double *state, double *parameters, double *out) const;
+        void get_ssa_propensities(double *state, double *parameters, double *out) const;
+
+        /// @brief Stochastic propensity of a reaction in `num_voxels` voxels, into out[num_voxels].
+        /// @param states Populations of the voxels, num_species per voxel.
+        void get_voxel_propensities(std::size_t reaction_id, std::size_t num_voxels,
+                                    double *states, double *parameters, double *out) const;
+
         double get_propensity_sum(double *state, double *parameters);
 
     private:
         void set_ssa_propensity_function(std::size_t reaction_id, double (*propensity_function)(double*, double*));
         void set_ode_propensity_function(std::size_t reaction_id, double (*propensity_function)(double*, double*));
+        void check_reaction_id(std::size_t reaction_id) const;
+        static void get_propensities(const std::vector<UniquePropensityFunction<double>> &table,
+                                     GroupPropensityFunction<double> group,
+                                     double *state, double *parameters, double *out);
+
+        std::size_t num_species;
         std::unordered_map<std::string, std::size_t> reaction_id_map;
-        std::unordered_map<std::size_t, double(*)(double*, double*)> ssa_propensity_map;
-        std::unordered_map<std::size_t, double(*)(double*, double*)> ode_propensity_map;
+        // Dense tables indexed by reaction id; nullptr where no function was set
+        std::vector<UniquePropensityFunction<double>> ssa_propensities;
+        std::vector<UniquePropensityFunction<double>> ode_propensities;
+        std::vector<VoxelPropensityFunction<double>> voxel_propensities;
+        GroupPropensityFunction<double> ssa_group_propensity = nullptr;
+        GroupPropensityFunction<double> ode_group_propensity = nullptr;
+        std::vector<double> propensity_buffer;
     };
 
     class SpeciesContext
@@ -0,0 +1,50 @@
+#pragma once
+
+#include <cstddef>
+#include <vector>
+
+namespace GillesPy3D
+{
+    /* NeighborGraph
+     * System-wide neighbor lists packed in compressed sparse row (CSR) form.
+     *
+     * The neighbors of particle i are the entries [offsets[i], offsets[i + 1]) of the per-pair arrays,
+     *   where index[e] is the position of the neighbor in ParticleSystem::particles.
+     * Rows are appended in particle order (start_row / add / end_row).
+     * clear() keeps the allocated storage, so rebuilding the graph every step does not touch the allocator
+     *   once it has reached its working size.
+     *
+     * Threaded builds fill one graph per contiguous block of particles and join them with assign().
+     */
+    class NeighborGraph
+    {
+    public:
+        std::vector<std::size_t> offsets;
+        std::vector<unsigned int> index;
+        std::vector<double> dist;
+        std::vector<double> dWdr;
+        std::vector<double> D_i_j;
+        std::vector<double> W;
+
+        NeighborGraph();
+
+        /// @brief Number of rows (particles) in the graph.
+        std::size_t size() const { return offsets.size() - 1; }
+        /// @brief Total number of stored pairs.
+        std::size_t num_edges() const { return index.size(); }
+        std::size_t begin(std::size_t row) const { return offsets[row]; }
+        std::size_t end(std::size_t row) const { return offsets[row + 1]; }
+        std::size_t degree(std::size_t row) const { return offsets[row + 1] - offsets[row]; }
+
+        /// @brief Remove all rows, keeping capacity.
+        void clear();
+        void reserve(std::size_t num_rows, std::size_t num_edges);
+
+        void add(unsigned int neighbor, double dist, double dWdr, double D_i_j, double W);
+        /// @brief Close the current row; entries added since the previous end_row() belong to it.
+        void end_row();
+
+        /// @brief Replace the contents with the concatenation of `blocks`, in order.
+        void assign(const std::vector<NeighborGraph> &blocks);
+    };
+}
@@ -0,0 +1,114 @@
+#pragma once
+
+#include <vector>
+
+#include "ANN/ANN.h" // ANN KD Tree
+
+namespace GillesPy3D
+{
+    /// @brief Selects the backend used by Particle::find_neighbors().
+    enum NeighborSearchMethod : unsigned int
+    {
+        // ANN kd-tree, queries serialized behind a global lock (count pass, then search pass).
+        KDTREE_SERIAL = 0,
+        // ANN kd-tree, queries run concurrently against the read-only tree.
+        KDTREE = 1,
+        // Uniform grid with cells of width >= h, rebuilt in O(N) by counting sort.
+        CELL_LIST = 2,
+    };
+
+    class CellList;
+
+    /* NeighborSearchBuffer
+     * Scratch space for fixed-radius neighbor queries.
+     *
+     * A buffer is owned by exactly one thread (see Particle::find_neighbors, which keeps one
+     *   thread_local buffer per worker), so no locking is needed to reuse its storage.
+     * After a search, indices[0, count) and distances[0, count) hold the point indices
+     *   and squared distances of every point within the search radius.
+     * The storage only ever grows, so in steady state a search performs no allocations.
+     */
+    struct NeighborSearchBuffer
+    {
+    public:
+        std::vector<ANNidx> indices;
+        std::vector<ANNdist> distances;
+        int count = 0;
+
+        explicit NeighborSearchBuffer(std::size_t initial_capacity = 64);
+
+        /// @brief Fixed-radius search using the requested backend.
+        /// @param method Backend to use for the query.
+        /// @param tree kd-tree built over the particle positions (KDTREE, KDTREE_SERIAL).
+        /// @param cells Cell list built over the particle positions (CELL_LIST).
+        /// @param x Coordinates of the query point (at least `dimension` values).
+        /// @param dimension Number of spatial dimensions of the points.
+        /// @param sq_radius Squared search radius.
+        /// @returns Number of points found, also stored in `count`.
+        /// The index structure must not be modified while searches are in progress.
+        int search(NeighborSearchMethod method, ANNkd_tree *tree, const CellList *cells,
+                   const double *x, int dimension, ANNdist sq_radius);
+
+        /// @brief Lock-free fixed-radius search.
+        /// Relies on the per-thread search state of ANN's fixed-radius search, so any number of
+        ///   threads may call this concurrently on the same tree.
+        int kdtree_search(ANNkd_tree *tree, const double *x, int dimension, ANNdist sq_radius);
+
+        /// @brief Fixed-radius search serialized behind a global lock.
+        /// Kept as the reference implementation for benchmarking and debugging.
+        int kdtree_search_serial(ANNkd_tree *tree, const double *x, int dimension, ANNdist sq_radius);
+
+        /// @brief Fixed-radius search over a uniform grid.
+        /// Unlike the kd-tree searches, results are not sorted by distance.
+        int cell_list_search(const CellList &cells, const double *x, ANNdist sq_radius);
+
+    private:
+        ANNcoord m_query[3];
+
+        void set_query(const double *x, int dimension);
+        void reserve(std::size_t capacity);
+    };
+
+    /* CellList
+     * Uniform-grid spatial index for fixed-radius searches.
+     *
+     * The bounding box of the points is divided into cubic cells at least `cell_size` wide,
+     *   and the points are stored sorted by cell (x varies fastest) alongside a copy of their coordinates.
+     * A query with radius r <= cell_size therefore only has to scan 3^dimension neighboring cells,
+     *   and each row of cells along x is one contiguous range of the sorted arrays.
+     *
+     * Cells are widened if the grid would otherwise hold far more cells than points
+     *   (e.g. a few particles spread over a large domain), which keeps memory bounded by O(N).
+     */
+    class CellList
+    {
+    public:
+        /// @brief (Re)build the grid; previously allocated storage is reused.
+        /// @param points Point coordinates, indexed the same way as the particles.
+        /// @param num_points Number of points.
+        /// @param dimension Number of spatial dimensions (1-3).
+        /// @param cell_size Minimum cell width, normally the support radius h.
+        void build(ANNpointArray points, int num_points, int dimension, double cell_size);
+
+        bool empty() const { return m_point_index.empty(); }
+        int dimension() const { return m_dimension; }
+        double cell_size() const { return m_cell_size; }
+        std::size_t num_cells() const { return m_cell_start.empty() ? 0 : m_cell_start.size() - 1; }
+
+    private:
+        friend struct NeighborSearchBuffer;
+
+        int m_dimension = 0;
+        double m_cell_size = 0.0;
+        double m_origin[3] = { 0.0, 0.0, 0.0 };
+        int m_num_cells[3] = { 1, 1, 1 };
+        // Points in cell c are m_point_index[m_cell_start[c], m_cell_start[c + 1]).
+        std::vector<int> m_cell_start;
+        std::vector<ANNidx> m_point_index;
+        // Coordinates in cell order, m_dimension values per point.
+        std::vector<ANNcoord> m_sorted_x;
+        std::vector<int> m_cell_of_point;
+
+        int cell_coordinate(double x, int axis) const;
+    };
+}
@@ -0,0 +1,171 @@
+#pragma once
+
+#include <cstddef>
+#include <random>
+#include <vector>
+
+#include "neighbor_graph.hpp"
+#include "propensities.hpp"
+
+namespace GillesPy3D
+{
+    /* IndexedMinHeap
+     * Binary min-heap of event times with one entry per key (voxel).
+     *
+     * Each key's position in the heap is tracked, so the time of any key can be changed in O(log n)
+     *   without searching for it; this is what makes a step of the Next Subvolume Method O(log n).
+     */
+    class IndexedMinHeap
+    {
+    public:
+        /// @brief Replace the contents with keys 0..times.size()-1 at the given times.
+        void build(const std::vector<double> &times);
+
+        std::size_t size() const { return m_heap.size(); }
+        /// @brief Key with the earliest time.
+        std::size_t top() const { return m_heap.front(); }
+        double top_time() const { return m_time[m_heap.front()]; }
+        double time(std::size_t key) const { return m_time[key]; }
+
+        void update(std::size_t key, double time);
+
+    private:
+        void sift_up(std::size_t position);
+        void sift_down(std::size_t position);
+        void place(std::size_t position, std::size_t key);
+
+        // Keys in heap order
+        std::vector<std::size_t> m_heap;
+        // Position of each key in m_heap
+        std::vector<std::size_t> m_position;
+        // Event time of each key
+        std::vector<double> m_time;
+    };
+
+    /// @brief Method used to simulate the discrete species (reaction-diffusion master equation).
+    enum RDMEMethod : unsigned int
+    {
+        // Exact: NextSubvolumeMethod
+        RDME_NSM = 0,
+        // Approximate: SpatialTauLeaping
+        RDME_TAU_LEAPING = 1,
+        // Deterministic where populations are high, stochastic elsewhere: SpatialHybrid
+        RDME_HYBRID = 2,
+    };
+
+    /* DiffusionRates
+     * Jump rates of every species from every voxel to each of its neighbors.
+     *
+     * The rates only depend on the neighbor graph, so they are computed once per graph: for each species and
+     *   voxel, the cumulative rates to its neighbors, whose total (the diagonal of the diffusion operator)
+     *   is the rate at which one molecule leaves the voxel.
+     */
+    struct DiffusionRates
+    {
+        // Cumulative rates to the neighbors of each voxel, per species: [num_edges * s + e]
+        std::vector<double> cdf;
+        // Rate per molecule of each species out of each voxel, num_species per voxel
+        std::vector<double> rate;
+        std::size_t num_species = 0;
+
+        /// @param diffusion_matrix Diffusion constant of species s into a voxel of type k: [num_types * s + k - 1].
+        void compute(const NeighborGraph &graph, const double *diffusion_matrix, std::size_t num_types,
+                     const std::vector<int> &type, std::size_t num_species);
+
+        /// @brief Edge of `graph` a molecule of species s leaving `voxel` moves along, for u uniform in [0, 1).
+        std::size_t edge(const NeighborGraph &graph, std::size_t voxel, std::size_t s, double u) const;
+    };
+
+    /* NextSubvolumeMethod
+     * Exact stochastic simulation of the reaction-diffusion master equation (Elf and Ehrenberg, 2004).
+     *
+     * Every voxel holds the sum of its reaction propensities and of its diffusion propensities, and the
+     *   time of its next event is kept in an IndexedMinHeap. Executing an event only recomputes the
+     *   reactions listed by the dependency graph for the species that changed, in the one or two voxels
+     *   involved, and reschedules those voxels.
+     *
+     * Diffusion rates are fixed by the neighbor graph, so for each voxel and species the cumulative rates to
+     *   its neighbors are computed once by initialize(); the total (the diagonal of the diffusion operator)
+     *   gives the species' diffusion propensity per molecule, and a destination is found by bisection.
+     *
+     * The state is species-minor: state[num_species * voxel + s] is the population of species s in voxel.
+     */
+    class NextSubvolumeMethod
+    {
+    public:
+        /// @param irN, jcN, prN Stoichiometry in compressed sparse column form: column r lists the species
+        ///   (irN) changed by reaction r and by how much (prN).
+        /// @param irG, jcG Dependency graph in compressed sparse column form: column s < num_species lists the
+        ///   reactions whose propensity depends on species s, column num_species + r those that must be
+        ///   recomputed after reaction r fires.
+        /// @param propensities Propensity function of each reaction.
+        NextSubvolumeMethod(std::size_t num_species, std::size_t num_reactions,
+                            const std::size_t *irN, const std::size_t *jcN, const int *prN,
+                            const std::size_t *irG, const std::size_t *jcG,
+                            const PropensityFun *propensities);
+
+        /// @brief Compute all propensities and event times, starting at time `t`.
+        /// @param graph Neighbors of each voxel, with the diffusion coefficients D_i_j; must outlive the method.
+        /// @param diffusion_matrix Diffusion constant of species s into a voxel of type k: [num_types * s + k - 1].
+        /// @param volume, type Volume and type of each voxel.
+        /// @param data Data function values, num_data_fn per voxel; may be null if there are none.
+        /// @param state Populations, modified in place by advance(); must outlive the method.
+        void initialize(const NeighborGraph &graph, const double *diffusion_matrix, std::size_t num_types,
+                        const std::vector<double> &volume, const std::vector<int> &type,
+                        double *data, std::size_t num_data_fn, unsigned int *state,
+                        double t, std::mt19937_64 &rng);
+
+        /// @brief Execute every event that occurs up to `end_time`.
+        void advance(double end_time, std::mt19937_64 &rng);
+
+        double time() const { return m_time; }
+        std::size_t num_voxels() const { return m_volume.size(); }
+        unsigned long num_reaction_events() const { return m_reaction_events; }
+        unsigned long num_diffusion_events() const { return m_diffusion_events; }
+
+    private:
+        double propensity(std::size_t reaction, std::size_t voxel, double t) const;
+        // Recompute the reactions in column `column` of the dependency graph; returns the change of their sum.
+        double update_reactions(std::size_t column, std::size_t voxel, double t);
+        // Execute the reaction (diffusion) event `u` in [0, reaction (diffusion) sum) of a voxel.
+        void execute_reaction(std::size_t voxel, double u, double t);
+        void execute_diffusion(std::size_t voxel, double u, double t, std::mt19937_64 &rng);
+        // Recompute the sums of a voxel from its rates, discarding accumulated rounding errors.
+        void refresh_sums(std::size_t voxel);
+        double total_rate(std::size_t voxel) const { return m_reaction_sum[voxel] + m_diffusion_sum[voxel]; }
+        // Time of the next event of a voxel whose rate is `rate`, drawn afresh at time t
+        double next_time(double rate, double t, std::mt19937_64 &rng);
+
+        // Model
+        std::size_t m_num_species;
+        std::size_t m_num_reactions;
+        const std::size_t *m_irN;
+        const std::size_t *m_jcN;
+        const int *m_prN;
+        const std::size_t *m_irG;
+        const std::size_t *m_jcG;
+        const PropensityFun *m_propensities;
+
+        // Voxels
+        const NeighborGraph *m_graph = nullptr;
+        std::vector<double> m_volume;
+        std::vector<int> m_type;
+        double *m_data = nullptr;
+        std::size_t m_num_data_fn = 0;
+        unsigned int *m_state = nullptr;
+
+        // Reaction propensities, num_reactions per voxel, and their sum in each voxel
+        std::vector<double> m_reaction_rate;
+        std::vector<double> m_reaction_sum;
+        DiffusionRates m_diffusion;
+        // Diffusion propensity of each voxel, sum over s of m_diffusion_rate * state
+        std::vector<double> m_diffusion_sum;
+
+        IndexedMinHeap m_heap;
+        std::exponential_distribution<double> m_exponential;
+        std::uniform_real_distribution<double> m_uniform;
+        double m_time = 0.0;
+        unsigned long m_reaction_events = 0;
+        unsigned long m_diffusion_events = 0;
+    };
+}
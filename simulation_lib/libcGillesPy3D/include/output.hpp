@@ -25,5 +25,8 @@ namespace GillesPy3D{
     void output_csv(ParticleSystem*system, int current_step);
     void output_vtk__sync_step(ParticleSystem*system, int current_step);
     void output_vtk__async_step(ParticleSystem *system);
+    void output_vtu__async_step(ParticleSystem *system);
+    // Write the buffered step in system->output_format
+    void output__async_step(ParticleSystem *system);
 }
 #endif // output_h
@@ -0,0 +1,135 @@
+#pragma once
+
+#include <condition_variable>
+#include <cstddef>
+#include <deque>
+#include <exception>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <vector>
+
+namespace GillesPy3D
+{
+    struct ParticleSystem;
+
+    /// @brief File format of the per-step output files.
+    enum OutputFormat : unsigned int
+    {
+        // Legacy ASCII VTK (output<N>.vtk)
+        OUTPUT_VTK_ASCII = 0,
+        // VTK XML UnstructuredGrid with raw appended arrays (output<N>.vtu), indexed by output.pvd
+        OUTPUT_VTU_BINARY = 1,
+    };
+
+    /* OutputSnapshot
+     * Copy of the particle state written for one output step.
+     *
+     * Vector fields are interleaved (x[3 * i + k]); species are species-major (C[s][i]).
+     * The storage is reused between captures, so once a snapshot has reached the size of the system
+     *   capturing into it does not allocate.
+     */
+    struct OutputSnapshot
+    {
+        unsigned int step = 0;
+        double time = 0.0;
+        std::vector<double> x;
+        std::vector<double> v;
+        std::vector<int> id;
+        std::vector<int> type;
+        std::vector<double> rho;
+        std::vector<double> mass;
+        std::vector<double> bvf_phi;
+        std::vector<double> nu;
+        // Concentrations of the continuous species
+        std::vector<std::vector<double>> C;
+        // Populations of the discrete species
+        std::vector<std::vector<unsigned int>> D;
+
+        std::size_t size() const { return id.size(); }
+        void resize(std::size_t num_particles, std::size_t num_chem_species, std::size_t num_stoch_species);
+
+        /// @brief Copy the state of `system`, from its particle_store (which must be loaded), and the
+        ///   populations of its discrete species from system.rdme, if any.
+        void capture(const ParticleSystem &system, unsigned int step);
+    };
+
+    /// @brief Names of the species arrays, C[name] and D[name], in the output files.
+    struct OutputSpeciesNames
+    {
+        std::vector<std::string> chem;
+        std::vector<std::string> stoch;
+    };
+
+    void write_vtk(const OutputSnapshot &snapshot, const OutputSpeciesNames &names, const std::string &filename);
+    void write_vtu(const OutputSnapshot &snapshot, const OutputSpeciesNames &names, const std::string &filename);
+    /// @brief ParaView collection listing `files` with their simulation `times`.
+    void write_pvd(const std::vector<std::string> &files, const std::vector<double> &times, const std::string &filename);
+
+    /* OutputWriter
+     * Writes output snapshots on a dedicated thread.
+     *
+     * The writer owns a fixed pool of `num_buffers` snapshots. The compute loop acquire()s a free snapshot,
+     *   fills it and submit()s it; the writer thread writes submitted snapshots in order and returns them
+     *   to the pool. The compute loop therefore only blocks in acquire() when the writer has fallen
+     *   `num_buffers` snapshots behind, and the time spent blocked is reported by wait_seconds().
+     *
+     * Errors raised while writing are rethrown by the next acquire() or by finish().
+     */
+    class OutputWriter
+    {
+    public:
+        OutputWriter() = default;
+        OutputWriter(const OutputWriter&) = delete;
+        OutputWriter &operator=(const OutputWriter&) = delete;
+        ~OutputWriter();
+
+        /// @brief Start the writer thread.
+        /// @param format Format of the per-step files.
+        /// @param directory Directory the files are written to; empty for the working directory.
+        /// @param names Names of the species arrays.
+        /// @param num_buffers Number of snapshots that may be in flight (at least 2).
+        void start(OutputFormat format, const std::string &directory, const OutputSpeciesNames &names,
+                   std::size_t num_buffers = 2);
+
+        /// @brief Free snapshot to fill; blocks while every snapshot is waiting to be written.
+        OutputSnapshot &acquire();
+        /// @brief Queue the snapshot returned by the last acquire() for writing.
+        void submit();
+        /// @brief Write everything that was submitted and stop the writer thread.
+        void finish();
+
+        bool running() const { return m_thread.joinable(); }
+        /// @brief Total time the compute loop spent blocked in acquire().
+        double wait_seconds() const { return m_wait_seconds; }
+        /// @brief Number of snapshots written so far.
+        unsigned long num_written() const;
+
+    private:
+        void run();
+        void write(const OutputSnapshot &snapshot);
+        void rethrow_error();
+
+        OutputFormat m_format = OUTPUT_VTK_ASCII;
+        std::string m_directory;
+        OutputSpeciesNames m_names;
+
+        std::vector<std::unique_ptr<OutputSnapshot>> m_buffers;
+        std::vector<OutputSnapshot*> m_free;
+        std::deque<OutputSnapshot*> m_queue;
+        OutputSnapshot *m_current = nullptr;
+        bool m_stop = false;
+        std::exception_ptr m_error;
+        mutable std::mutex m_mutex;
+        std::condition_variable m_changed;
+        std::thread m_thread;
+
+        // Files written so far and their simulation times; only touched by the writer thread
+        std::vector<std::string> m_files;
+        std::vector<double> m_times;
+
+        double m_wait_seconds = 0.0;
+        unsigned long m_num_written = 0;
+    };
+}
@@ -1,6 +1,7 @@
 #pragma once
 
 #include "sundials/sundials_types.h"
+#include <cstdint>
 #include <memory>
 #include <vector>
 
@@ -17,7 +18,7 @@ namespace GillesPy3D
 
     private:
         std::size_t m_parameter_count;
-        std::unique_ptr<sunrealtype*> m_parameter_values;
+        std::unique_ptr<sunrealtype[]> m_parameter_values;
     };
 
 }
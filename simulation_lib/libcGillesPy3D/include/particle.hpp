@@ -22,9 +22,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 #include "species_state.hpp"
 #include "reaction_state.hpp"
+#include "sundials/sundials_nvector.h"
 #include <vector>
 
 #include "ANN/ANN.h" // ANN KD Tree
+#include "neighbor_graph.hpp"
 
 extern int debug_flag;
 
@@ -32,7 +34,6 @@ namespace GillesPy3D{
 
     struct Particle;
     struct ParticleSystem;
-    struct NeighborNode;
     struct EventNode;
 
     struct Particle{
@@ -40,11 +41,8 @@ namespace GillesPy3D{
                     double zl=0, int type=0, double nu=0.01, double mass=1, double c=0,
                     double rho=1, int solidTag=0);
         ParticleSystem *sys;
-        std::vector<NeighborNode> neighbors;
         unsigned int id;
         int type;
-        double old_x[3];
-        double old_v[3];
         double old_rho;
         double x[3];
         double v[3];
@@ -59,37 +57,32 @@ namespace GillesPy3D{
         double F[3];
         double Frho;
         double Fbp[3];
-        // Data Function
-        //double * data_fn; //TODO
-        // chem_rxn_system
-        SpeciesState species_state;
-        ReactionState reaction_state;
-        N_Vector Y_state;  // Integrator State
-        N_Vector Y_save;   // Saved Integrator State
-        realtype current_time;
-
-        //double *C; // concentration of chem species // ARE THESE USED STILL??
-        //double *Q; // flux of chem species
+        // Position when our Verlet list (row of system->verlet_graph) was built
+        double verlet_x[3];
+        // Data Function values at the particle, system->num_data_fn of them
+        double *data_fn;
+        // Chemical species, system->num_chem_species of each; loaded into system->particle_store,
+        //   which holds them while the simulation runs
+        double *C; // concentration of chem species
+        double *Q; // flux of chem species
         // below here for simulation
 
-        double save_integrator_state();
-        double restore_integrator_state();
         void integrate_forward(double tau_step_size); // "run" function
         double calculate_max_tau_step_size();
 
 
-        void check_particle_nan();
-
         double particle_dist(Particle *p2);
         double particle_dist_sqrd(Particle *p2);
-        int add_to_neighbor_list(Particle *neighbor, ParticleSystem *system, double r2);
-
-        // KD TREE FUNCTIONS
-        void get_k_cleanup(ANNidxArray nn_idx, ANNdistArray dists);
-        void search_cleanup(ANNpoint queryPt, ANNidxArray nn_idx, ANNdistArray dists);
-        int get_k__approx(ParticleSystem *system);
-        int get_k__exact(ANNpoint queryPt, ANNdist dist, ANNkd_tree *tree);
-        void find_neighbors(ParticleSystem *system, bool use_exact_k=true);
+        int add_to_neighbor_list(Particle *neighbor, ParticleSystem *system, double r2, NeighborGraph &graph);
+
+        // NEIGHBOR FUNCTIONS
+        // Each appends this particle's row to `graph` (and `candidates`, the Verlet list, when searching),
+        //   so particles must be processed in order. Safe to call concurrently into different graphs.
+        void find_neighbors(ParticleSystem *system, NeighborGraph &graph, NeighborGraph &candidates);
+        // Recompute the neighbor row from our row of system->verlet_graph, without searching.
+        void refresh_neighbors(ParticleSystem *system, NeighborGraph &graph);
+        // find_neighbors() if `rebuild` (see ParticleSystem::rebuild_neighbor_search), otherwise refresh_neighbors().
+        void update_neighbors(ParticleSystem *system, bool rebuild, NeighborGraph &graph, NeighborGraph &candidates);
 
         bool operator<(const Particle& p2){
             return x[0] > p2.x[0];
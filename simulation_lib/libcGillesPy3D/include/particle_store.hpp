@@ -0,0 +1,159 @@
+#pragma once
+
+#include <cstddef>
+#include <vector>
+
+#include "neighbor_graph.hpp"
+#include "propensities.hpp"
+
+namespace GillesPy3D
+{
+    struct Particle;
+
+    /// @brief SDPD constants read by the ParticleStore kernels.
+    struct SDPDParameters
+    {
+        int dimension;
+        double h;
+        double dt;
+        double rho0;
+        double c0;
+        double P0;
+        double gravity[3];
+    };
+
+    /// @brief Deterministic chemical reactions read by the ParticleStore kernels.
+    struct ChemistryParameters
+    {
+        std::size_t num_reactions;
+        // Rate of each reaction in a particle: f(C, t, volume, data_fn, type), with the concentrations
+        //   and data function values of that particle
+        const ChemRxnFun *rhs_functions;
+        // Stoichiometry in compressed sparse column form: column rxn lists the species (irN) changed by
+        //   reaction rxn and by how much (prN)
+        const std::size_t *irN;
+        const std::size_t *jcN;
+        const int *prN;
+        double t;
+    };
+
+    /* ForceAccumulator
+     * Force and flux sums written by ParticleStore::pairwise_force_symmetric().
+     *
+     * Each pair is evaluated once and contributes to both of its particles, so a thread may write to
+     *   particles outside of its range; every thread therefore accumulates into its own buffer,
+     *   and the buffers are summed into the store by ParticleStore::add_forces().
+     */
+    class ForceAccumulator
+    {
+    public:
+        std::vector<double> F[3];
+        std::vector<double> Fbp[3];
+        std::vector<double> Frho;
+        std::vector<std::vector<double>> Q;
+
+        /// @brief Size for the given store and zero all sums.
+        void reset(std::size_t num_particles, std::size_t num_chem_species, bool fluid);
+    };
+
+    /* ParticleStore
+     * Structure-of-arrays copy of the particle state used by the SDPD hot loops.
+     *
+     * Every field is one contiguous array indexed by particle (vector fields are split by component,
+     *   e.g. x[1][i] is the y-coordinate of particle i), so a pass only streams the fields it uses.
+     * Chemical species are stored species-major: C[s][i] is the concentration of species s in particle i.
+     *
+     * Fluid-only fields (v, vt, F, Fbp, Frho, nu) are only allocated when the store is resized with `fluid`;
+     *   static-domain simulations leave them empty and the kernels skip the mechanics.
+     *
+     * Kernels operate on a particle range [begin, end) and only write to particles in that range,
+     *   so disjoint ranges may be processed concurrently.
+     */
+    class ParticleStore
+    {
+    public:
+        std::vector<double> x[3];
+        std::vector<double> rho;
+        std::vector<double> old_rho;
+        std::vector<double> mass;
+        std::vector<int> type;
+        std::vector<int> solid_tag;
+        // Boundary volume fraction, set by boundary_volume_fraction()
+        std::vector<double> bvf_phi;
+
+        // Fluid-only fields
+        std::vector<double> v[3];
+        std::vector<double> vt[3];
+        std::vector<double> F[3];
+        std::vector<double> Fbp[3];
+        std::vector<double> Frho;
+        std::vector<double> nu;
+
+        // Chemical species concentrations and fluxes
+        std::vector<std::vector<double>> C;
+        std::vector<std::vector<double>> Q;
+        // Data function values, particle-major: data_fn[num_data_fn * i + k]
+        std::vector<double> data_fn;
+
+        std::size_t size() const { return m_size; }
+        std::size_t num_chem_species() const { return C.size(); }
+        std::size_t num_data_fn() const { return m_num_data_fn; }
+        bool has_fluid_fields() const { return m_fluid; }
+
+        void resize(std::size_t num_particles, std::size_t num_chem_species, std::size_t num_data_fn, bool fluid);
+
+        /// @brief Copy particle state into the store, resizing it to match.
+        void load(const std::vector<Particle> &particles, std::size_t num_chem_species, std::size_t num_data_fn,
+                  bool fluid);
+        /// @brief Copy the state back into the particles.
+        void store(std::vector<Particle> &particles) const;
+
+        /// @brief Predictor half of the time step (take_step1): half-step update of v, vt, x, rho and C,
+        ///   then reset F to gravity and clear Fbp, Frho and Q.
+        void predictor_step(const SDPDParameters &params, bool update_chem, std::size_t begin, std::size_t end);
+
+        /// @brief Pressure, viscous, background pressure and transport forces, density variation,
+        ///   and the diffusion and reaction fluxes of every chemical species.
+        /// @param diffusion_matrix Per-type diffusion coefficients, `num_chem_species * (type - 1) + s`; may be
+        ///   null if there are no chemical species.
+        void pairwise_force(const NeighborGraph &graph, const SDPDParameters &params,
+                            const double *diffusion_matrix, const ChemistryParameters &chem,
+                            std::size_t begin, std::size_t end);
+
+        /// @brief Same as pairwise_force(), evaluating each pair once (Newton's third law).
+        /// Only pairs (i, j) with i in [begin, end) and j > i are visited; the contributions to both particles
+        ///   are added to `out`, which must have been reset() for this store. The reaction fluxes of the
+        ///   particles in [begin, end) are added to `out` as well.
+        void pairwise_force_symmetric(const NeighborGraph &graph, const SDPDParameters &params,
+                                      const double *diffusion_matrix, const ChemistryParameters &chem,
+                                      std::size_t begin, std::size_t end, ForceAccumulator &out) const;
+
+        /// @brief Add accumulated sums to F, Fbp, Frho and Q for particles in [begin, end).
+        void add_forces(const ForceAccumulator &sums, std::size_t begin, std::size_t end);
+
+        /// @brief Shepard filter of the density, from old_rho.
+        void filter_density(const NeighborGraph &graph, std::size_t begin, std::size_t end);
+
+        /// @brief Corrector half of the time step (take_step2): half-step update of v, rho and C.
+        void corrector_step(const SDPDParameters &params, std::size_t begin, std::size_t end);
+
+        /// @brief Boundary volume fraction and wall normal of the fluid particles, then the bounce-back of those
+        ///   with bvf_phi >= 0.5 (computeBoundaryVolumeFraction and applyBoundaryVolumeFraction).
+        /// Only reads the positions, masses, densities and solid tags of the neighbors.
+        void boundary_volume_fraction(const NeighborGraph &graph, const SDPDParameters &params,
+                                      std::size_t begin, std::size_t end);
+
+        /// @brief First particle in [begin, end) whose position, density or (fluid) velocity is NaN or infinite.
+        /// @returns The index of that particle, or `end` if they are all finite.
+        std::size_t find_non_finite(std::size_t begin, std::size_t end) const;
+
+    private:
+        // Add the reaction fluxes of particle i to out[s][i]; `state` (num_chem_species values) is scratch
+        void reaction_flux(const ChemistryParameters &chem, std::size_t i, double *state,
+                           std::vector<std::vector<double>> &out) const;
+
+        std::size_t m_size = 0;
+        std::size_t m_num_data_fn = 0;
+        bool m_fluid = false;
+    };
+}
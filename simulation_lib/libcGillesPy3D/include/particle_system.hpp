@@ -26,10 +26,20 @@ See the file LICENSE.txt for details.
 #ifndef particlesystem_hpp
 #define particlesystem_hpp
 
+#include <memory>
+#include <string>
 #include <vector>
 
 #include "ANN/ANN.h" // ANN KD Tree
+#include "neighbor_search.hpp"
+#include "neighbor_graph.hpp"
+#include "particle_store.hpp"
+#include "kernel.hpp"
+#include "output_writer.hpp"
+#include "thread_pool.hpp"
 #include "propensities.hpp"
+#include "nsm.hpp"
+#include "simulation_state.hpp"
 
 extern int debug_flag ;
 
@@ -51,20 +61,8 @@ namespace GillesPy3D {
 
     struct Particle;
     struct ParticleSystem;
-    struct NeighborNode;
     struct EventNode;
-
-    struct NeighborNode{
-        Particle *data;
-        double dist;
-        double dWdr;
-        double D_i_j;
-        NeighborNode(Particle *data, double dist, double dWdr, double D_i_j);
-
-        bool operator<(const NeighborNode& n2){
-            return dist > n2.dist;
-        }
-    };
+    class RDMESimulation;
 
     struct ParticleSystem{
         ParticleSystem(size_t num_types, size_t num_chem_species, size_t num_chem_rxns,
@@ -86,14 +84,133 @@ namespace GillesPy3D {
 
         bool static_domain;
         size_t num_types;
+        size_t num_chem_species;
+        size_t num_chem_rxns;
+        size_t num_stoch_species;
+        size_t num_stoch_rxns;
+        size_t num_data_fn;
+        char boundary_conditions[3];
+        // Number of BoundaryConditions applied by boundary_condition_function
+        size_t num_boundary_conditions;
+        // The generated applyBoundaryConditions(), applied to every particle after the predictor and corrector
+        void (*boundary_condition_function)(Particle *, ParticleSystem *);
+        const char * const *species_names;
+        // Deterministic rate of each chemical reaction in a particle, added to Q times its stoichiometry; also the
+        //   rate of the continuous channels when rdme_method is RDME_HYBRID
+        ChemRxnFun *chem_rxn_rhs_functions;
+        PropensityFun *stoch_rxn_propensity_functions;
+        // Propensity (in molecules) of each stochastic reaction on real-valued populations, used by the
+        //   stochastic channels when rdme_method is RDME_HYBRID
+        ChemRxnFun *hybrid_propensity_functions;
+        OutputFormat output_format;
+        // Snapshots that may wait for the output writer before the simulation blocks
+        std::size_t output_buffers;
+        OutputSpeciesNames output_species_names;
+        OutputWriter output_writer;
+        // Capture the current state and queue it for output_writer, starting the writer on first use.
+        //   output_writer.finish() flushes the remaining output at the end of the simulation.
+        void output_step(unsigned int step);
+        // Directory output and run statistics are written to; empty for the working directory
+        std::string output_directory;
+        // Position in the output schedule, advanced by next_output_function
+        unsigned int output_index;
+        // The generated get_next_output(): the step of the next output, from the tspan of the model
+        unsigned int (*next_output_function)(ParticleSystem *);
+
+        // Several trajectories may be run in one process: save_initial_state() records the state before the
+        //   first one (as a copy of particle_store) and begin_trajectory() restores it. A static domain keeps its
+        //   neighbor graph (and kernel quantities) between trajectories, as its particles never move.
+        ParticleStore initial_store;
+        void save_initial_state();
+        // Restore the initial state, reseed urn and rdme and send output to `directory`.
+        void begin_trajectory(unsigned long long seed, const std::string &directory);
+        // Set once the neighbor graph of a static domain has been built
+        bool static_neighbors_ready;
 
         double* gravity;
+        // Messages printed by the engine, as the debug_level of the solver
+        int debug_level;
 
         void add_particle(Particle *me);
+        std::size_t index_of(const Particle *p) const;
+        // Rebuild the index used by neighbor_search from the current particle positions.
+        void build_neighbor_search();
+        // Rebuild the index only if the Verlet lists are stale; returns true if it was rebuilt.
+        bool rebuild_neighbor_search();
+        // Largest distance any particle has moved since the Verlet lists were built.
+        double max_verlet_displacement() const;
+        // Recompute neighbor_graph for all particles, searching again if `rebuild`.
+        void update_neighbor_graph(bool rebuild);
+        // Same, with the rows built by `pool` in chunks of particle_chunk_size (see neighbor_blocks).
+        void update_neighbor_graph(ThreadPool &pool, bool rebuild);
+        // Rows for particles [first, last) only, into separate graphs; neighbor_graph
+        //   (and verlet_graph, if `rebuild`) are then the assign() of the blocks in order.
+        void update_neighbor_rows(bool rebuild, std::size_t first, std::size_t last,
+                                  NeighborGraph &graph, NeighborGraph &candidates);
+        void write_run_stats(const char *filename) const;
 
         ANNkd_tree *kdTree;
         ANNpointArray kdTree_pts;
         bool kdTree_initialized;
+        NeighborSearchMethod neighbor_search;
+        CellList cell_list;
+        // Neighbors are searched within h + neighbor_skin and the search is repeated only once
+        // some particle has moved more than neighbor_skin / 2. Zero searches every step.
+        double neighbor_skin;
+        unsigned long neighbor_rebuilds;
+        // Pairs within h, with kernel quantities, for every particle
+        NeighborGraph neighbor_graph;
+        // Candidate pairs within h + neighbor_skin (only used when neighbor_skin > 0)
+        NeighborGraph verlet_graph;
+        // Structure-of-arrays state for the SDPD kernels; fluid fields are omitted for static domains
+        ParticleStore particle_store;
+        // SPH weight function; initialized from kernel_function, dimension and h by build_neighbor_search()
+        KernelFunction kernel_function;
+        // Lookup table intervals for W and dWdr, 0 to evaluate the kernel exactly
+        std::size_t kernel_table_size;
+        SmoothingKernel kernel;
+        SDPDParameters sdpd_parameters() const;
+        // Evaluate each pair once and add equal and opposite contributions to both particles
+        bool half_neighbor_list;
+        // One per thread when half_neighbor_list is set
+        std::vector<ForceAccumulator> force_accumulators;
+        // Per-type diffusion coefficients of the chemical species, num_chem_species * (type - 1) + s
+        const double *subdomain_diffusion_matrix;
+        // Stoichiometry of the chemical reactions in compressed sparse column form, as for NextSubvolumeMethod:
+        //   column rxn lists the species (stoich_irN) changed by reaction rxn and by how much (stoich_prN)
+        const std::size_t *stoich_irN;
+        const std::size_t *stoich_jcN;
+        const int *stoich_prN;
+        // Simulation of the stochastic species: exact (NextSubvolumeMethod), SpatialTauLeaping with tau_tol,
+        //   or SpatialHybrid with hybrid_species
+        RDMEMethod rdme_method;
+        double tau_tol;
+        // Partitioning of each stochastic species when rdme_method is RDME_HYBRID
+        std::vector<HybridSpeciesMode> hybrid_species;
+        // Stochastic species, advanced after each SDPD step; set by initialize_rdme() if the model has any
+        std::unique_ptr<RDMESimulation> rdme;
+        ChemistryParameters chemistry_parameters() const;
+        // Pairwise forces and fluxes of particle_store over neighbor_graph, and the reaction fluxes.
+        void pairwise_forces(ThreadPool &pool);
+
+        // Particles per unit of work in the threaded loops; small enough that threads which draw
+        //   particles with many neighbors (near walls, dense regions) are balanced by the others.
+        std::size_t particle_chunk_size;
+        // Rows of neighbor_graph / verlet_graph built by each chunk, joined in chunk order
+        std::vector<NeighborGraph> neighbor_blocks;
+        std::vector<NeighborGraph> verlet_blocks;
+        // (Re)load particle_store from `particles` unless it already holds them with the right fields.
+        void sync_particle_store();
+        // Apply the boundary conditions to particle_store: they are generated for a Particle, so the store is
+        //   copied to the particles and back around them. Nothing is copied if there are none.
+        void apply_boundary_conditions(ThreadPool &pool);
+        // Stop the simulation (GillesPyError) if a position, density or velocity of particle_store is NaN or
+        //   infinite, reporting the first such particle.
+        void check_finite_state(ThreadPool &pool) const;
+        // Advance particle_store by one time step: predictor, boundary conditions, neighbors, forces and
+        //   reaction fluxes, Shepard filter, corrector, boundary volume fraction, boundary conditions;
+        //   then the stochastic species (rdme) over the same step.
+        void take_step(ThreadPool &pool);
     };
 
 
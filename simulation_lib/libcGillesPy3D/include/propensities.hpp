@@ -36,11 +36,14 @@ namespace GillesPy3D{
     //typedef double (*PropensityFun)(const int *, double, double, const double *, int, int, int *, const size_t *, const size_t *, const double *);
     // double rfun(const int *x, double t, const double vol, const double *data, int sd)
     typedef double (*PropensityFun)(const unsigned int *, double, double, double*, int);
-    typedef double (*ChemRxnFun)(double*, double, double, double*, int);
+    // double rfun(const double *x, double t, const double vol, const double *data_fn, int sd)
+    typedef double (*ChemRxnFun)(const double*, double, double, const double*, int);
 
     /* Declaration of allocation and deallocation of propensity list. */
     PropensityFun *ALLOC_propensities(void);
     ChemRxnFun *ALLOC_ChemRxnFun(void);
+    // Generated only for rdme_method='hybrid'
+    ChemRxnFun *ALLOC_hybrid_propensities(void);
     void FREE_propensities(PropensityFun* ptr);
     void applyBoundaryConditions(Particle* me, ParticleSystem* system);
 }
@@ -15,19 +15,79 @@ namespace GillesPy3D
         const std::vector<std::int32_t> products_change;
     };
 
+    /* ReactionState
+     * Propensities and stoichiometry of the reactions of a model.
+     *
+     * Besides evaluating every propensity (ssa_propensity), the reactions keep a dependency graph: which
+     *   propensities read each species, and which propensities change when a reaction fires. Species changed
+     *   outside the integrator (discrete firings) are marked dirty, with fire() or mark_dirty(), and
+     *   update_ssa_propensity() then only recomputes the propensities that read a dirty species or a species
+     *   which is not discrete, whose value changes on every step of the integrator.
+     */
     class ReactionState
     {
     public:
         explicit ReactionState(const ParameterState &parameters);
+
+        /// @brief Add a reaction whose propensity reads exactly its reactants (mass action).
+        /// @returns The id of the reaction.
+        std::size_t add_reaction(UniquePropensityFunction<sunrealtype> propensity, const ReactionVector &change,
+                                 SimulationState mode = SimulationState::DISCRETE);
+        /// @param dependencies Ids of the species read by the propensity.
+        std::size_t add_reaction(UniquePropensityFunction<sunrealtype> propensity, const ReactionVector &change,
+                                 const std::vector<std::size_t> &dependencies,
+                                 SimulationState mode = SimulationState::DISCRETE);
+
         std::size_t size() const;
         void ssa_propensity(sunrealtype *y, sunrealtype *propensities) const;
         SimulationState mode(std::size_t reaction_id) const;
-        const ReactionVector &change(std::size_t reaction_id);
+        void set_mode(std::size_t reaction_id, SimulationState mode);
+        const ReactionVector &change(std::size_t reaction_id) const;
+
+        /// @brief Declare whether a species only changes through discrete events. Species are not discrete
+        ///   until declared so, which makes update_ssa_propensity() recompute every propensity reading them.
+        void set_species_mode(std::size_t species_id, SimulationState mode);
+
+        /// @brief Reactions whose propensity may change when `reaction_id` fires (including itself, if so).
+        const std::vector<std::size_t> &dependents(std::size_t reaction_id);
+
+        /// @brief Record that the population of a species changed outside the integrator.
+        void mark_dirty(std::size_t species_id);
+        /// @brief Record that a reaction fired: every species it changes is dirty.
+        void fire(std::size_t reaction_id);
+        /// @brief Make the next update_ssa_propensity() recompute every propensity.
+        void invalidate();
+
+        /// @brief Bring up to date `propensities`, the result of the previous call (or of ssa_propensity),
+        ///   recomputing only the propensities reading dirty or non-discrete species.
+        void update_ssa_propensity(sunrealtype *y, sunrealtype *propensities);
 
     private:
+        // Rebuild m_species_dependents, m_reaction_dependents and m_volatile_reactions
+        void build_dependency_graph();
+        void evaluate(std::size_t reaction_id, sunrealtype *y, sunrealtype *propensities) const;
+
         const ParameterState &m_parameters;
-        const std::vector<SimulationState> m_reaction_state;
-        const std::vector<UniquePropensityFunction<sunrealtype>> m_propensity_impl;
+        std::vector<SimulationState> m_reaction_state;
+        std::vector<UniquePropensityFunction<sunrealtype>> m_propensity_impl;
+        std::vector<ReactionVector> m_changes;
+        // Species read by the propensity of each reaction
+        std::vector<std::vector<std::size_t>> m_dependencies;
+        std::vector<char> m_species_discrete;
+
+        // Dependency graph
+        bool m_graph_valid = false;
+        std::vector<std::vector<std::size_t>> m_species_dependents;
+        std::vector<std::vector<std::size_t>> m_reaction_dependents;
+        // Reactions reading a species which is not discrete
+        std::vector<std::size_t> m_volatile_reactions;
+
+        // Dirty species since the last update
+        bool m_all_dirty = true;
+        std::vector<char> m_dirty;
+        std::vector<std::size_t> m_dirty_species;
+        std::vector<char> m_stale;
+        std::vector<std::size_t> m_stale_reactions;
     };
 
 }
@@ -26,32 +26,74 @@ See the file LICENSE.txt for details.
 #ifndef simulate_rdme_h
 #define simulate_rdme_h
 
-namespace GillesPy3D{
-
-void initialize_rdme(ParticleSystem *system, size_t *irN, size_t *jcN,int *prN,
-                     size_t *irG,size_t *jcG, unsigned int*u0);
-void simulate_rdme(ParticleSystem*system, unsigned int step);
-void destroy_rdme(ParticleSystem*system);
-
-
-/******************************************************************/
+#include <cstddef>
+#include <memory>
+#include <random>
+#include <vector>
 
-void nsm_core__create(ParticleSystem*system, size_t *irN, size_t *jcN,int *prN,
-                      size_t *irG, size_t *jcG);
-void nsm_core__destroy(ParticleSystem*system);
+#include "nsm.hpp"
+#include "spatial_hybrid.hpp"
+#include "spatial_tau.hpp"
 
-void nsm_core__initialize_chem_populations(ParticleSystem*system, unsigned int*u0);
-
-void nsm_core__initialize_rxn_propensities(ParticleSystem*system);
-void nsm_core__initialize_diff_propensities(ParticleSystem*system);
-bool nsm_core__initialize_heap(ParticleSystem*system);
-
-
-//void nsm_core__build_diffusion_matrix(ParticleSystem*system);
-//void nsm_core__destroy_diffusion_matrix(ParticleSystem*system);
+namespace GillesPy3D{
 
-void nsm_core__take_step(ParticleSystem*system, double current_time,
-                         double step_size);
+    struct ParticleSystem;
+
+    /* RDMESimulation
+     * Stochastic species of a ParticleSystem: the reaction-diffusion master equation with the particles as
+     *   voxels, advanced over each time step after the SDPD step (see ParticleSystem::take_step).
+     *
+     * The volume of a voxel is mass / rho, its type and data function values are those of the particle,
+     *   and its neighbors and diffusion coefficients D_i_j are the particle's row of neighbor_graph. The method
+     *   is initialized from them at the first step of a trajectory and, since the graph changes as the particles
+     *   move, again at every step of a moving domain.
+     *
+     * The method is chosen by system.rdme_method: NextSubvolumeMethod, SpatialTauLeaping with system.tau_tol, or
+     *   SpatialHybrid with system.hybrid_species. SpatialHybrid evaluates system.hybrid_propensity_functions for
+     *   its stochastic channels and the deterministic rates system.chem_rxn_rhs_functions (generated for every
+     *   reaction of the model, in the same order) for its continuous ones, and its real-valued populations are
+     *   reported rounded.
+     *
+     * Populations are species-minor, num_stoch_species per voxel, as in the input_u0 they start from.
+     */
+    class RDMESimulation
+    {
+    public:
+        /// @param irN, jcN, prN, irG, jcG Stoichiometry and dependency graph, as for NextSubvolumeMethod.
+        /// @param u0 Initial populations; must outlive the simulation.
+        RDMESimulation(const ParticleSystem &system, const std::size_t *irN, const std::size_t *jcN, const int *prN,
+                       const std::size_t *irG, const std::size_t *jcG, const unsigned int *u0);
+
+        /// @brief Start a trajectory at time 0 from the initial populations, with a new random number stream.
+        void reset(unsigned long long seed);
+        /// @brief Simulate from the end of the previous step until `end_time`.
+        void advance(ParticleSystem &system, double end_time);
+
+        std::size_t num_species() const { return m_num_species; }
+        unsigned int population(std::size_t voxel, std::size_t s) const;
+
+    private:
+        void initialize(ParticleSystem &system);
+
+        std::size_t m_num_species;
+        const unsigned int *m_u0;
+        // Populations, loaded from m_u0 at the first step of a trajectory
+        std::vector<unsigned int> m_state;
+        // Populations of SpatialHybrid, which are real-valued where a species is continuous
+        std::vector<double> m_hybrid_state;
+        std::vector<double> m_volume;
+        // The method in use; the others are null
+        std::unique_ptr<NextSubvolumeMethod> m_nsm;
+        std::unique_ptr<SpatialTauLeaping> m_tau;
+        std::unique_ptr<SpatialHybrid> m_hybrid;
+        double m_time = 0.0;
+        bool m_initialized = false;
+        std::mt19937_64 m_rng;
+    };
+
+    /// @brief Create system->rdme; called by the generated code once the system is configured.
+    void initialize_rdme(ParticleSystem *system, const size_t *irN, const size_t *jcN, const int *prN,
+                         const size_t *irG, const size_t *jcG, const unsigned int *u0);
 }
 
 #endif /* simulate_rdme_h */
@@ -4,8 +4,10 @@
 #include <memory>
 #include <string>
 #include <tuple>
+#include "array_view.hpp"
 #include "model_context.hpp"
 #include "particle_system.hpp"
+#include "thread_pool.hpp"
 
 namespace GillesPy3D
 {
@@ -15,17 +17,40 @@ namespace GillesPy3D
     public:
         // explicit Simulation(Model &model);
         explicit Simulation(ModelContext &context);
+        Simulation(ModelContext &context, ParticleSystem &system, std::size_t num_threads = 1);
+        /// @brief Simulation of a compiled solver's system, which has no model context (see run_engine()).
+        explicit Simulation(ParticleSystem &system, std::size_t num_threads = 1);
+
+        /// @brief Number of threads used by run_until(), including the calling thread; 0 uses every core.
+        void set_num_threads(std::size_t num_threads);
+        std::size_t get_num_threads() const;
 
         void run_until(double t);
-        double *get_species(const std::string &species_name);
-        double *get_property(const std::string &property_name);
-        double *get_position();
+        /// @brief Run one trajectory per output directory, all sharing this process and the system's domain.
+        /// Trajectory k starts from the initial state with its random number stream seeded with `seed + k`,
+        ///   and writes its output files and run statistics to output_directories[k].
+        void run_trajectories(unsigned long long seed, const std::vector<std::string> &output_directories);
+
+        // State accessors: views of the particle state, one element per particle, which alias engine memory.
+        //   A view stays valid until the particles are added or removed, or the simulation is destroyed.
+        /// @brief Concentrations of a continuous (chemical) species.
+        ArrayView get_species(const std::string &species_name);
+        /// @brief One of "rho", "mass", "type" or, for fluid domains, "nu" and "v" (the given component).
+        ArrayView get_property(const std::string &property_name, unsigned int component = 0);
+        /// @brief Coordinate `axis` (0, 1 or 2) of the particle positions.
+        ArrayView get_position(unsigned int axis);
+        std::size_t get_num_particles();
 
         void output_vtk(const std::string &output_directory);
         void reset();
 
     private:
-        ModelContext &context;
+        // particle_store of the system, loaded from its particles if needed
+        ParticleStore &particle_state();
+
+        ModelContext *context = nullptr;
+        ParticleSystem *system = nullptr;
+        std::unique_ptr<ThreadPool> thread_pool;
     };
 
 }
@@ -0,0 +1,24 @@
+#pragma once
+
+namespace GillesPy3D
+{
+    enum SimulationState : unsigned int
+    {
+        CONTINUOUS = 0,
+        DISCRETE = 1,
+        DYNAMIC = 2
+    };
+
+    /// @brief How a species is partitioned by SpatialHybrid; the fields of the TauHybrid HybridSpecies.
+    struct HybridSpeciesMode
+    {
+        // CONTINUOUS or DISCRETE everywhere, or DYNAMIC to partition every voxel separately
+        SimulationState mode = SimulationState::DYNAMIC;
+        // If nonzero, a dynamic species is continuous in the voxels where its expected population
+        //   exceeds switch_min, and switch_tol is ignored
+        unsigned int switch_min = 0;
+        // Otherwise it is continuous where the coefficient of variation of its population (averaged over
+        //   the last steps) is below switch_tol
+        double switch_tol = 0.03;
+    };
+}
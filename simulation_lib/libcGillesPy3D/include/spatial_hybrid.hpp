@@ -0,0 +1,135 @@
+#pragma once
+
+#include <cstddef>
+#include <random>
+#include <utility>
+#include <vector>
+
+#include "integrator.hpp"
+#include "neighbor_graph.hpp"
+#include "nsm.hpp"
+#include "propensities.hpp"
+#include "simulation_state.hpp"
+
+namespace GillesPy3D
+{
+    /* SpatialHybrid
+     * Reaction-diffusion with every species simulated deterministically in the voxels where it is abundant
+     *   and stochastically in those where it is not.
+     *
+     * Before each step, every (voxel, species) pair of a dynamic species is partitioned with the
+     *   coefficient of variation test of the TauHybrid solver, using the reactions and diffusion jumps that
+     *   change it in that voxel. A reaction is continuous in a voxel if every species it changes is, and the
+     *   diffusion of a species between two voxels is continuous if the species is continuous in both.
+     *
+     * Each step is split: the continuous channels are first integrated over the step with CVODE (BDF with
+     *   SPGMR, as in Integrator) over the populations of all voxels, discrete populations having a zero
+     *   derivative; the stochastic channels are then simulated exactly (direct method) over the same step,
+     *   with the continuous populations they touch updated by their events. The splitting error is first
+     *   order in the step length, and a stochastic event never restarts the integrator.
+     *
+     * Populations are doubles, species-minor: state[num_species * voxel + s]. A population that becomes
+     *   discrete is rounded to the nearest integer.
+     */
+    class SpatialHybrid
+    {
+    public:
+        /// @param irN, jcN, prN Stoichiometry in compressed sparse column form, as for NextSubvolumeMethod.
+        /// @param ssa_propensities Stochastic propensity of each reaction, in molecules, evaluated on the populations
+        ///   of a voxel.
+        /// @param ode_propensities Deterministic rate of each reaction per unit volume, evaluated on the
+        ///   concentrations of a voxel (the `det` functions of the chemical reactions).
+        SpatialHybrid(std::size_t num_species, std::size_t num_reactions,
+                      const std::size_t *irN, const std::size_t *jcN, const int *prN,
+                      const ChemRxnFun *ssa_propensities, const ChemRxnFun *ode_propensities,
+                      const std::vector<HybridSpeciesMode> &species_modes, IntegratorConfiguration config);
+        ~SpatialHybrid();
+        SpatialHybrid(const SpatialHybrid&) = delete;
+        SpatialHybrid &operator=(const SpatialHybrid&) = delete;
+
+        /// @brief Start at time `t`; the voxel arguments are the same as those of NextSubvolumeMethod.
+        /// @param state Populations, modified in place by advance(); must outlive the method.
+        void initialize(const NeighborGraph &graph, const double *diffusion_matrix, std::size_t num_types,
+                        const std::vector<double> &volume, const std::vector<int> &type,
+                        double *data, std::size_t num_data_fn, double *state, double t);
+
+        /// @brief Partition the species, then simulate one step, until `end_time`.
+        void advance(double end_time, std::mt19937_64 &rng);
+
+        double time() const { return m_time; }
+        bool is_continuous(std::size_t voxel, std::size_t s) const { return m_continuous[m_num_species * voxel + s]; }
+        /// @brief Number of (voxel, species) pairs currently simulated deterministically.
+        std::size_t num_continuous() const;
+        unsigned long num_stochastic_events() const { return m_stochastic_events; }
+        /// @brief Changes of partition of a (voxel, species) pair, in either direction.
+        unsigned long num_switches() const { return m_switches; }
+
+    private:
+        static int rhs(sunrealtype t, N_Vector y, N_Vector ydot, void *user_data);
+
+        double ssa_propensity(std::size_t reaction, std::size_t voxel, double *x, double t) const;
+        // Deterministic rate of a reaction in a voxel, in molecules, from the concentrations `c` of the voxel
+        double ode_propensity(std::size_t reaction, std::size_t voxel, const double *c, double t) const;
+        // Rate of one molecule of species s jumping along edge e, out of `voxel`
+        double edge_rate(std::size_t voxel, std::size_t e, std::size_t s) const;
+        bool diffusion_continuous(std::size_t voxel, std::size_t neighbor, std::size_t s) const;
+        // Choose the mode of every (voxel, species) pair
+        void partition();
+        // Derivative of the populations due to the continuous channels
+        void derivative(double t, double *y, double *dydt);
+        // Total propensity of the stochastic channels of a voxel
+        double stochastic_rate(std::size_t voxel, double t);
+        // Execute one stochastic event at time t, in proportion to m_voxel_rate (whose sum is `total`);
+        //   returns the voxels whose populations changed
+        std::pair<std::size_t, std::size_t> execute_event(double t, double total, std::mt19937_64 &rng);
+        // Events of the stochastic channels from m_time until end_time
+        void simulate_stochastic(double end_time, std::mt19937_64 &rng);
+        void check(int retcode, const char *call) const;
+
+        // Model
+        std::size_t m_num_species;
+        std::size_t m_num_reactions;
+        const std::size_t *m_irN;
+        const std::size_t *m_jcN;
+        const int *m_prN;
+        const ChemRxnFun *m_ssa_propensities;
+        const ChemRxnFun *m_ode_propensities;
+        std::vector<HybridSpeciesMode> m_species_modes;
+        IntegratorConfiguration m_config;
+        // Concentrations of the voxel whose deterministic rates derivative() evaluates
+        std::vector<double> m_concentration;
+
+        // Voxels
+        const NeighborGraph *m_graph = nullptr;
+        std::vector<double> m_volume;
+        std::vector<int> m_type;
+        double *m_data = nullptr;
+        std::size_t m_num_data_fn = 0;
+        double *m_state = nullptr;
+        DiffusionRates m_diffusion;
+
+        // Partition: mode of each (voxel, species) pair and of each (voxel, reaction)
+        std::vector<char> m_continuous;
+        std::vector<char> m_reaction_continuous;
+        // Last coefficients of variation of each pair, history_length per pair
+        std::vector<double> m_cv_history;
+        // Expected population of each pair and its variance, per unit time
+        std::vector<double> m_mean;
+        std::vector<double> m_variance;
+        unsigned long m_steps = 0;
+
+        // Integration of the populations of all voxels
+        IntegratorContext m_context;
+        N_Vector m_y = nullptr;
+        void *m_cvode_mem = nullptr;
+        SUNLinearSolver m_solver = nullptr;
+        // Stochastic propensity of each voxel
+        std::vector<double> m_voxel_rate;
+
+        std::exponential_distribution<double> m_exponential;
+        std::uniform_real_distribution<double> m_uniform;
+        double m_time = 0.0;
+        unsigned long m_stochastic_events = 0;
+        unsigned long m_switches = 0;
+    };
+}
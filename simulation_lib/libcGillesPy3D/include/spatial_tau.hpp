@@ -0,0 +1,106 @@
+#pragma once
+
+#include <cstddef>
+#include <random>
+#include <vector>
+
+#include "neighbor_graph.hpp"
+#include "nsm.hpp"
+#include "propensities.hpp"
+
+namespace GillesPy3D
+{
+    /* SpatialTauLeaping
+     * Approximate simulation of the reaction-diffusion master equation by tau-leaping.
+     *
+     * Each leap fires every reaction and every diffusion jump of a voxel a Poisson number of times, using
+     *   the propensities at the start of the leap; the molecules of a species leaving a voxel are spread
+     *   over its neighbors according to their jump rates. The leap length is the largest that keeps the
+     *   expected relative change of every species in every leaping voxel below tau_tol (Cao, Gillespie and
+     *   Petzold, 2006; the selection of src/tau.cpp applied per voxel, with diffusion as a first order
+     *   channel). A leap that would make a population negative is rejected and retried with half the length.
+     *
+     * A reaction or diffusion channel that can fire and consumes a species with fewer than critical_threshold
+     *   molecules in its voxel is critical: it does not leap, but the critical channels of a voxel are
+     *   simulated exactly (direct SSA) over the leap, so low populations keep their exact dynamics. Molecules
+     *   moving into any voxel arrive at the end of the leap, so, like the critical reactions of src/tau.cpp,
+     *   the critical channels of a voxel limit the leap to the expected time of their next event.
+     *
+     * The model and voxel arguments are the same as those of NextSubvolumeMethod.
+     */
+    class SpatialTauLeaping
+    {
+    public:
+        SpatialTauLeaping(std::size_t num_species, std::size_t num_reactions,
+                          const std::size_t *irN, const std::size_t *jcN, const int *prN,
+                          const PropensityFun *propensities, double tau_tol, unsigned int critical_threshold = 10);
+
+        void initialize(const NeighborGraph &graph, const double *diffusion_matrix, std::size_t num_types,
+                        const std::vector<double> &volume, const std::vector<int> &type,
+                        double *data, std::size_t num_data_fn, unsigned int *state, double t);
+
+        /// @brief Leap until `end_time`.
+        void advance(double end_time, std::mt19937_64 &rng);
+
+        double time() const { return m_time; }
+        double tau_tol() const { return m_tau_tol; }
+        unsigned long num_leaps() const { return m_leaps; }
+        unsigned long num_rejected_leaps() const { return m_rejected_leaps; }
+        /// @brief Events of critical channels, simulated exactly.
+        unsigned long num_exact_events() const { return m_exact_events; }
+
+    private:
+        double propensity(std::size_t reaction, std::size_t voxel, double t) const;
+        // Propensities of the voxels and which of their channels are critical
+        void compute_rates(double t);
+        // Largest leap allowed by tau_tol and the critical channels (infinite if nothing constrains it)
+        double select_tau() const;
+        // g_i of Cao, Gillespie and Petzold (eq. 27) for species s at population x
+        double g(std::size_t s, double x) const;
+        // Fire the non-critical channels of a voxel over tau; all changes go to m_delta
+        void leap_voxel(std::size_t voxel, double tau, std::mt19937_64 &rng);
+        // Exact events of the critical channels of a voxel over [t, t + tau]; its own state changes in place,
+        //   molecules sent to neighbors go to m_delta
+        void simulate_voxel(std::size_t voxel, double t, double tau, std::mt19937_64 &rng);
+        // Spread `count` molecules of species s leaving `voxel` over its neighbors, into m_delta
+        void move_molecules(std::size_t voxel, std::size_t s, unsigned long count, std::mt19937_64 &rng);
+
+        // Model
+        std::size_t m_num_species;
+        std::size_t m_num_reactions;
+        const std::size_t *m_irN;
+        const std::size_t *m_jcN;
+        const int *m_prN;
+        const PropensityFun *m_propensities;
+        double m_tau_tol;
+        unsigned int m_critical_threshold;
+        // Highest order of the reactions consuming each species, and whether that reaction consumes 2 or 3 of it
+        std::vector<int> m_highest_order;
+        std::vector<int> m_highest_order_count;
+
+        // Voxels
+        const NeighborGraph *m_graph = nullptr;
+        std::vector<double> m_volume;
+        std::vector<int> m_type;
+        double *m_data = nullptr;
+        std::size_t m_num_data_fn = 0;
+        unsigned int *m_state = nullptr;
+        DiffusionRates m_diffusion;
+
+        // Per leap
+        std::vector<double> m_reaction_rate;
+        // Critical channels, num_reactions (num_species) per voxel, and voxels with any critical channel
+        std::vector<char> m_reaction_critical;
+        std::vector<char> m_diffusion_critical;
+        std::vector<char> m_critical;
+        std::vector<long long> m_delta;
+        std::vector<unsigned int> m_saved_state;
+
+        std::exponential_distribution<double> m_exponential;
+        std::uniform_real_distribution<double> m_uniform;
+        double m_time = 0.0;
+        unsigned long m_leaps = 0;
+        unsigned long m_rejected_leaps = 0;
+        unsigned long m_exact_events = 0;
+    };
+}
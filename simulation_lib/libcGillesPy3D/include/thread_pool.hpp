@@ -0,0 +1,64 @@
+#pragma once
+
+#include <atomic>
+#include <condition_variable>
+#include <cstddef>
+#include <exception>
+#include <functional>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+namespace GillesPy3D
+{
+    /* ThreadPool
+     * Fixed set of worker threads for data-parallel loops over particles.
+     *
+     * parallel_for() splits a range into chunks which threads claim one at a time from a shared counter,
+     *   so a thread that draws cheap particles simply takes more chunks (dynamic scheduling).
+     * The calling thread works on the loop as well; a pool of size 1 starts no threads at all.
+     * Loops are not reentrant: a body must not call parallel_for() on the same pool.
+     */
+    class ThreadPool
+    {
+    public:
+        /// @brief Body of a loop: processes [begin, end), which is chunk `chunk`, on thread `thread` (< size()).
+        using ChunkFunction = std::function<void(std::size_t begin, std::size_t end, std::size_t chunk, std::size_t thread)>;
+
+        /// @param num_threads Total number of threads, including the caller; 0 uses the hardware concurrency.
+        explicit ThreadPool(std::size_t num_threads = 0);
+        ThreadPool(const ThreadPool&) = delete;
+        ThreadPool &operator=(const ThreadPool&) = delete;
+        ~ThreadPool();
+
+        std::size_t size() const { return m_workers.size() + 1; }
+
+        /// @brief Number of chunks parallel_for() uses for `count` items with the given chunk size.
+        static std::size_t num_chunks(std::size_t count, std::size_t chunk_size);
+
+        /// @brief Run `body` over [begin, end) in chunks of `chunk_size` items and wait for all of them.
+        /// The first exception thrown by a chunk is rethrown once every thread has stopped.
+        void parallel_for(std::size_t begin, std::size_t end, std::size_t chunk_size, const ChunkFunction &body);
+
+    private:
+        void worker(std::size_t thread);
+        void run_chunks(std::size_t thread);
+
+        std::vector<std::thread> m_workers;
+        std::mutex m_mutex;
+        std::condition_variable m_start;
+        std::condition_variable m_done;
+        bool m_stop = false;
+        // Incremented for every loop, so that workers wake up exactly once per loop
+        unsigned long m_generation = 0;
+        std::size_t m_active = 0;
+
+        // Current loop
+        const ChunkFunction *m_body = nullptr;
+        std::size_t m_begin = 0;
+        std::size_t m_end = 0;
+        std::size_t m_chunk_size = 1;
+        std::atomic<std::size_t> m_next_chunk{0};
+        std::exception_ptr m_error;
+    };
+}
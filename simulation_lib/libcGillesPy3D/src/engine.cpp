@@ -0,0 +1,90 @@
+#include "engine.hpp"
+#include "error.hpp"
+#include "particle_system.hpp"
+#include "simulation.hpp"
+
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <exception>
+#include <random>
+
+namespace
+{
+    // Value of the option at argv[i], which must be followed by one
+    const char *option_value(int argc, char *argv[], int i)
+    {
+        if (i + 1 >= argc)
+        {
+            throw GillesPy3D::GillesPyError((std::string("Missing value for option ") + argv[i]).c_str());
+        }
+        return argv[i + 1];
+    }
+
+    unsigned long long parse_integer(const char *option, const char *value)
+    {
+        char *end = nullptr;
+        unsigned long long result = std::strtoull(value, &end, 10);
+        if (*value == '\0' || *value == '-' || *end != '\0')
+        {
+            throw GillesPy3D::GillesPyError(
+                (std::string("Invalid value '") + value + "' for option " + option).c_str());
+        }
+        return result;
+    }
+}
+
+GillesPy3D::EngineArguments GillesPy3D::EngineArguments::parse(int argc, char *argv[])
+{
+    EngineArguments arguments;
+    bool has_seed = false;
+    for (int i = 1; i < argc; i += 2)
+    {
+        const char *option = argv[i];
+        const char *value = option_value(argc, argv, i);
+        if (std::strcmp(option, "-t") == 0)
+        {
+            arguments.num_threads = parse_integer(option, value);
+        }
+        else if (std::strcmp(option, "-s") == 0)
+        {
+            arguments.seed = parse_integer(option, value);
+            has_seed = true;
+        }
+        else if (std::strcmp(option, "-o") == 0)
+        {
+            arguments.output_directories.emplace_back(value);
+        }
+        else
+        {
+            throw GillesPyError((std::string("Unknown option ") + option).c_str());
+        }
+    }
+
+    if (!has_seed)
+    {
+        std::random_device device;
+        arguments.seed = (static_cast<unsigned long long>(device()) << 32) | device();
+    }
+    if (arguments.output_directories.empty())
+    {
+        arguments.output_directories.emplace_back();
+    }
+    return arguments;
+}
+
+int GillesPy3D::run_engine(ParticleSystem *system, int argc, char *argv[])
+{
+    try
+    {
+        EngineArguments arguments = EngineArguments::parse(argc, argv);
+        Simulation simulation(*system, arguments.num_threads);
+        simulation.run_trajectories(arguments.seed, arguments.output_directories);
+    }
+    catch (const std::exception &error)
+    {
+        std::fprintf(stderr, "Error: %s\n", error.what());
+        return 1;
+    }
+    return 0;
+}
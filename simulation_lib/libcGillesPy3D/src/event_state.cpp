@@ -1,5 +1,7 @@
 #include "event_state.hpp"
 
+#include <cstring>
+
 GillesPy3D::EventStatus::EventStatus(int event_id, bool use_trigger_state, bool use_persist)
     : m_use_trigger_state(use_trigger_state),
       m_use_persist(use_persist) {}
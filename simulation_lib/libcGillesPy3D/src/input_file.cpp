@@ -0,0 +1,165 @@
+#include "input_file.hpp"
+#include "error.hpp"
+
+#include <cstdlib>
+#include <cstring>
+#include <fstream>
+
+namespace
+{
+    constexpr char magic[8] = {'G', 'P', 'Y', '3', 'D', 'I', 'N', '\0'};
+
+    std::size_t padded(std::size_t bytes)
+    {
+        return (bytes + 7) / 8 * 8;
+    }
+
+    std::size_t type_size(char type)
+    {
+        switch (type)
+        {
+        case 'd':
+        case 'Q':
+            return 8;
+        case 'i':
+        case 'I':
+            return 4;
+        default:
+            return 0;
+        }
+    }
+}
+
+GillesPy3D::InputFile::InputFile(const std::string &path)
+    : m_path(path)
+{
+    std::ifstream file(path, std::ios::binary);
+    if (!file)
+    {
+        std::string msg = "Can't read input file '" + path + "'";
+        throw GillesPyError(msg.c_str());
+    }
+
+    auto read = [&](void *out, std::size_t bytes)
+    {
+        if (!file.read(static_cast<char*>(out), static_cast<std::streamsize>(bytes)))
+        {
+            std::string msg = "Input file '" + path + "' is truncated";
+            throw GillesPyError(msg.c_str());
+        }
+    };
+
+    char header[8];
+    std::uint32_t file_version;
+    std::uint32_t num_arrays;
+    read(header, sizeof(header));
+    read(&file_version, sizeof(file_version));
+    read(&num_arrays, sizeof(num_arrays));
+    if (std::memcmp(header, magic, sizeof(magic)) != 0 || file_version != version)
+    {
+        std::string msg = "'" + path + "' is not a version " + std::to_string(version) + " input file";
+        throw GillesPyError(msg.c_str());
+    }
+
+    for (std::uint32_t array_i = 0; array_i < num_arrays; ++array_i)
+    {
+        std::uint32_t name_length;
+        char type_and_padding[4];
+        std::uint64_t count;
+        read(&name_length, sizeof(name_length));
+        read(type_and_padding, sizeof(type_and_padding));
+        read(&count, sizeof(count));
+
+        std::string name(padded(name_length), '\0');
+        read(name.data(), name.size());
+        name.resize(name_length);
+
+        Array array;
+        array.type = type_and_padding[0];
+        array.count = count;
+        std::size_t bytes = type_size(array.type) * count;
+        if (bytes == 0 && count > 0)
+        {
+            std::string msg = "Input file array '" + name + "' has unknown type '" + array.type + "'";
+            throw GillesPyError(msg.c_str());
+        }
+        array.storage.resize(padded(bytes) / 8);
+        read(array.storage.data(), padded(bytes));
+        m_arrays[name] = std::move(array);
+    }
+}
+
+GillesPy3D::InputFile GillesPy3D::InputFile::from_environment()
+{
+    const char *path = std::getenv(path_variable);
+    if (path == nullptr || path[0] == '\0')
+    {
+        std::string msg = std::string("No input file: ") + path_variable + " is not set";
+        throw GillesPyError(msg.c_str());
+    }
+    return InputFile(path);
+}
+
+GillesPy3D::InputFile &GillesPy3D::InputFile::instance()
+{
+    static InputFile input = []()
+    {
+        InputFile file = from_environment();
+        const char *variables = std::getenv(variables_variable);
+        if (variables != nullptr && variables[0] != '\0')
+        {
+            file.override(InputFile(variables));
+        }
+        return file;
+    }();
+    return input;
+}
+
+void GillesPy3D::InputFile::override(GillesPy3D::InputFile &&variables)
+{
+    for (auto &[name, array] : variables.m_arrays)
+    {
+        const Array &current = find(name);
+        if (current.type != array.type || current.count != array.count)
+        {
+            std::string msg = "Variable '" + name + "' of '" + variables.m_path + "' has " +
+                              std::to_string(array.count) + " values of type '" + array.type + "', expected " +
+                              std::to_string(current.count) + " of type '" + current.type + "'";
+            throw GillesPyError(msg.c_str());
+        }
+        m_arrays[name] = std::move(array);
+    }
+}
+
+bool GillesPy3D::InputFile::contains(const std::string &name) const
+{
+    return m_arrays.find(name) != m_arrays.end();
+}
+
+std::size_t GillesPy3D::InputFile::size(const std::string &name) const
+{
+    return find(name).count;
+}
+
+const GillesPy3D::InputFile::Array &GillesPy3D::InputFile::find(const std::string &name) const
+{
+    auto array = m_arrays.find(name);
+    if (array == m_arrays.end())
+    {
+        std::string msg = "Input file '" + m_path + "' has no array '" + name + "'";
+        throw GillesPyError(msg.c_str());
+    }
+    return array->second;
+}
+
+GillesPy3D::InputFile::Array &GillesPy3D::InputFile::find(const std::string &name, char type)
+{
+    Array &array = const_cast<Array&>(static_cast<const InputFile*>(this)->find(name));
+    if (array.type != type)
+    {
+        std::string msg = "Input file array '" + name + "' has type '" + array.type +
+                          "', not '" + type + "'";
+        throw GillesPyError(msg.c_str());
+    }
+    return array;
+}
@@ -19,29 +19,34 @@
 #include "integrator.hpp"
 #include "model.hpp"
 
+#include <algorithm>
+
 static bool validate(GillesPy3D::Integrator *integrator, int retcode);
 
 GillesPy3D::IntegratorData::IntegratorData(
     const GillesPy3D::ParameterState &parameter_state,
     const GillesPy3D::SpeciesState &species_state,
-    const GillesPy3D::ReactionState &reaction_state)
+    GillesPy3D::ReactionState &reaction_state)
     : m_parameter_state(parameter_state),
       m_species_state(species_state),
       m_reaction_state(reaction_state)
 {
-    propensities.reserve(m_reaction_state.size());
+    propensities.assign(m_reaction_state.size(), 0.0);
+    m_reaction_state.invalidate();
 }
 
 
 GillesPy3D::Integrator::Integrator(
     const GillesPy3D::ParameterState &parameter_state,
     const GillesPy3D::SpeciesState &species_state,
-    const GillesPy3D::ReactionState &reaction_state,
+    GillesPy3D::ReactionState &reaction_state,
     const URNGenerator urn,
     double reltol, double abstol)
-    : t(0.0f),
-      data(parameter_state, species_state, reaction_state),
-      urn(urn)
+    : num_species(species_state.size()),
+      num_reactions(reaction_state.size()),
+      urn(urn),
+      t(0.0f),
+      data(parameter_state, species_state, reaction_state)
 {
     y0 = init_model_vector(*context);
     reset_model_vector();
@@ -65,6 +70,7 @@ GillesPy3D::Integrator::Integrator(
     solver = SUNLinSol_SPGMR(y, 0, 0, *context);
     validate(this, CVodeSetUserData(cvode_mem, &data));
     validate(this, CVodeSetLinearSolver(cvode_mem, solver, NULL));
+    declare_species_modes();
 }
 
 double GillesPy3D::Integrator::save_state()
@@ -87,6 +93,7 @@ double GillesPy3D::Integrator::restore_state()
         NV_Ith_S(y, mem_i) = NV_Ith_S(y_save, mem_i);
     }
     t = t_save;
+    data.reactions().invalidate();
     if (!validate(this, CVodeReInit(cvode_mem, t, y)))
     {
         return 0;
@@ -109,6 +116,7 @@ void GillesPy3D::Integrator::reinitialize()
     }
     t = 0;
     t_save = 0;
+    data.reactions().invalidate();
     validate(this, CVodeReInit(cvode_mem, t, y));
 }
 
@@ -125,12 +133,12 @@ GillesPy3D::IntegrationResults GillesPy3D::Integrator::integrate_constant(double
     // this function assumes no deterministic species or 
     realtype *Y = N_VGetArrayPointer(y);
     const GillesPy3D::SpeciesState &species = data.species();
-    const GillesPy3D::ReactionState &reactions = data.reactions();
+    GillesPy3D::ReactionState &reactions = data.reactions();
     std::vector<double> &propensities = data.propensities;
     unsigned int num_species = species.size();
     unsigned int num_reactions = reactions.size();
     realtype propensity;
-    reactions.ssa_propensity(Y, propensities.data());
+    reactions.update_ssa_propensity(Y, propensities.data());
 
     double tau = *t - this->t;
     for (int rxn_i = 0; rxn_i < num_reactions; ++rxn_i){
@@ -252,6 +260,37 @@ void GillesPy3D::Integrator::use_reactions()
             data.active_reaction_ids.push_back(rxn_id);
         }
     }
+    declare_species_modes();
+}
+
+void GillesPy3D::Integrator::declare_species_modes()
+{
+    const GillesPy3D::SpeciesState &species = data.species();
+    GillesPy3D::ReactionState &reactions = data.reactions();
+    for (std::size_t spec = 0; spec < species.size(); ++spec)
+    {
+        bool discrete = species.diff_equation(spec).rate_rules.empty();
+        for (std::size_t rxn_id = 0; discrete && rxn_id < reactions.size(); ++rxn_id)
+        {
+            auto &[reactants_change, products_change] = reactions.change(rxn_id);
+            discrete = reactants_change[spec] == products_change[spec]
+                || reactions.mode(rxn_id) == GillesPy3D::SimulationState::DISCRETE;
+        }
+        reactions.set_species_mode(spec, discrete ? GillesPy3D::SimulationState::DISCRETE
+                                                  : GillesPy3D::SimulationState::CONTINUOUS);
+    }
+}
+
+void GillesPy3D::Integrator::fire(unsigned int reaction_id, unsigned int count)
+{
+    auto &[reactants_change, products_change] = data.reactions().change(reaction_id);
+    realtype *species = get_species_state();
+    for (int spec = 0; spec < num_species; ++spec)
+    {
+        species[spec] += static_cast<realtype>(products_change[spec] - reactants_change[spec]) * count;
+    }
+    get_reaction_state()[reaction_id] = log(urn.next());
+    data.reactions().fire(reaction_id);
 }
 
 bool GillesPy3D::Integrator::enable_root_finder()
@@ -350,14 +389,17 @@ int GillesPy3D::rhs(realtype t, N_Vector y, N_Vector ydot, void *user_data)
     // Extract simulation data
     GillesPy3D::IntegratorData *data = static_cast<GillesPy3D::IntegratorData*>(user_data);
     const GillesPy3D::SpeciesState &species = data->species();
-    const GillesPy3D::ReactionState &reactions = data->reactions();
+    GillesPy3D::ReactionState &reactions = data->reactions();
     std::vector<double> &propensities = data->propensities;
 
     // Differentiate different regions of the input/output vectors.
     // First half is for concentrations, second half is for reaction offsets.
+    // Only the propensities reading continuous species, or species changed by a firing since the last
+    // evaluation, are recomputed; the others keep their value in `propensities`.
     sunrealtype *dydt_offsets = &dydt[species.size()];
     species.integrate(t, Y, dydt);
-    reactions.ssa_propensity(Y, dydt_offsets);
+    reactions.update_ssa_propensity(Y, propensities.data());
+    std::copy(propensities.begin(), propensities.end(), dydt_offsets);
 
     return 0;
 };
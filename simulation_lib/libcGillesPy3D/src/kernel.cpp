@@ -0,0 +1,148 @@
+#include "kernel.hpp"
+#include "error.hpp"
+
+#include <cmath>
+
+namespace
+{
+    // Normalization of each kernel in 1D, 2D and 3D, in units of h^-dimension.
+    const double kernel_normalization[4][3] = {
+        { 5.0 / 4.0, 5.0 / M_PI, 105.0 / (16.0 * M_PI) },       // LUCY
+        { 5.0 / 4.0, 7.0 / M_PI, 21.0 / (2.0 * M_PI) },         // WENDLAND_C2
+        { 3.0 / 2.0, 9.0 / M_PI, 495.0 / (32.0 * M_PI) },       // WENDLAND_C4
+        { 4.0 / 3.0, 40.0 / (7.0 * M_PI), 8.0 / M_PI },         // CUBIC_SPLINE
+    };
+}
+
+GillesPy3D::SmoothingKernel::SmoothingKernel()
+    : m_function(LUCY), m_dimension(0), m_h(0.0), m_inv_h(0.0), m_alpha(0.0), m_dWdr_alpha(0.0),
+      m_table_size(0), m_table_scale(0.0)
+{
+}
+
+void GillesPy3D::SmoothingKernel::init(KernelFunction function, int dimension, double h, std::size_t table_size)
+{
+    if (function > CUBIC_SPLINE)
+    {
+        throw GillesPyError("SmoothingKernel: unknown kernel function");
+    }
+    if (dimension < 1 || dimension > 3)
+    {
+        throw GillesPyError("SmoothingKernel: dimension must be 1, 2 or 3");
+    }
+    if (!(h > 0.0))
+    {
+        throw GillesPyError("SmoothingKernel: h must be positive");
+    }
+
+    m_function = function;
+    m_dimension = dimension;
+    m_h = h;
+    m_inv_h = 1.0 / h;
+    m_alpha = kernel_normalization[function][dimension - 1] * std::pow(m_inv_h, dimension);
+    m_dWdr_alpha = m_alpha * m_inv_h;
+
+    m_table_size = table_size;
+    m_W_table.clear();
+    m_dWdr_table.clear();
+    if (table_size > 0)
+    {
+        m_table_scale = static_cast<double>(table_size);
+        m_W_table.resize(table_size + 1);
+        m_dWdr_table.resize(table_size + 1);
+        for (std::size_t k = 0; k <= table_size; ++k)
+        {
+            evaluate_exact(k / m_table_scale, m_W_table[k], m_dWdr_table[k]);
+        }
+    }
+}
+
+void GillesPy3D::SmoothingKernel::evaluate_exact(double R, double &W, double &dWdr) const
+{
+    const double q = 1.0 - R;
+    double w = 0.0;
+    double dwdR = 0.0;
+    switch (m_function)
+    {
+    case LUCY:
+        w = (1.0 + 3.0 * R) * q * q * q;
+        dwdR = -12.0 * R * q * q;
+        break;
+    case WENDLAND_C2:
+        if (m_dimension == 1)
+        {
+            w = (1.0 + 3.0 * R) * q * q * q;
+            dwdR = -12.0 * R * q * q;
+        }
+        else
+        {
+            w = (1.0 + 4.0 * R) * q * q * q * q;
+            dwdR = -20.0 * R * q * q * q;
+        }
+        break;
+    case WENDLAND_C4:
+        if (m_dimension == 1)
+        {
+            const double q4 = q * q * q * q;
+            w = (1.0 + 5.0 * R + 8.0 * R * R) * q4 * q;
+            dwdR = -14.0 * R * (1.0 + 4.0 * R) * q4;
+        }
+        else
+        {
+            const double q5 = q * q * q * q * q;
+            w = (1.0 + 6.0 * R + 35.0 / 3.0 * R * R) * q5 * q;
+            dwdR = -56.0 / 3.0 * R * (1.0 + 5.0 * R) * q5;
+        }
+        break;
+    case CUBIC_SPLINE:
+        if (R <= 0.5)
+        {
+            w = 1.0 + 6.0 * R * R * (R - 1.0);
+            dwdR = 6.0 * R * (3.0 * R - 2.0);
+        }
+        else
+        {
+            w = 2.0 * q * q * q;
+            dwdR = -6.0 * q * q;
+        }
+        break;
+    }
+    W = m_alpha * w;
+    dWdr = m_dWdr_alpha * dwdR;
+}
+
+void GillesPy3D::SmoothingKernel::evaluate(double r, double &W, double &dWdr) const
+{
+    const double R = r * m_inv_h;
+    if (R >= 1.0)
+    {
+        W = 0.0;
+        dWdr = 0.0;
+        return;
+    }
+    if (m_table_size == 0)
+    {
+        evaluate_exact(R, W, dWdr);
+        return;
+    }
+
+    const double position = R * m_table_scale;
+    const std::size_t k = static_cast<std::size_t>(position);
+    const double t = position - k;
+    W = m_W_table[k] + t * (m_W_table[k + 1] - m_W_table[k]);
+    dWdr = m_dWdr_table[k] + t * (m_dWdr_table[k + 1] - m_dWdr_table[k]);
+}
+
+double GillesPy3D::SmoothingKernel::W(double r) const
+{
+    double W, dWdr;
+    evaluate(r, W, dWdr);
+    return W;
+}
+
+double GillesPy3D::SmoothingKernel::dWdr(double r) const
+{
+    double W, dWdr;
+    evaluate(r, W, dWdr);
+    return dWdr;
+}
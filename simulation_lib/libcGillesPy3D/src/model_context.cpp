@@ -1,4 +1,6 @@
 #include "model_context.hpp"
+#include "error.hpp"
+#include <numeric>
 
 GillesPy3D::ModelContext::ModelContext(GillesPy3D::Model &model)
     : species_context(model),
@@ -9,11 +11,8 @@ GillesPy3D::ModelContext::ModelContext(GillesPy3D::Model &model)
 
 double GillesPy3D::ReactionContext::get_propensity_sum(double *state, double *parameters)
 {
-    double result = 0.0f;
-    for (auto const &[reaction_id, propensity] : ode_propensity_map) {
-        result += propensity(state, parameters);
-    }
-    return result;
+    get_ode_propensities(state, parameters, propensity_buffer.data());
+    return std::accumulate(propensity_buffer.begin(), propensity_buffer.end(), 0.0);
 }
 
 GillesPy3D::CPropensityFunction::CPropensityFunction(double (*propensity_function)(double*, double*))
@@ -22,6 +21,18 @@ GillesPy3D::CPropensityFunction::CPropensityFunction(double (*propensity_functio
     
 }
 
+GillesPy3D::CGroupPropensityFunction::CGroupPropensityFunction(void (*propensity_function)(double*, double*, double*))
+    : propensity_function(propensity_function)
+{
+
+}
+
+GillesPy3D::CVoxelPropensityFunction::CVoxelPropensityFunction(void (*propensity_function)(std::size_t, double*, double*, double*))
+    : propensity_function(propensity_function)
+{
+
+}
+
 GillesPy3D::SpeciesContext &GillesPy3D::ModelContext::species()
 {
     return species_context;
@@ -33,6 +44,11 @@ GillesPy3D::ReactionContext &GillesPy3D::ModelContext::reactions()
 }
 
 GillesPy3D::ReactionContext::ReactionContext(GillesPy3D::Model &model)
+    : num_species(model.get_species().size()),
+      ssa_propensities(model.get_reactions().size(), nullptr),
+      ode_propensities(model.get_reactions().size(), nullptr),
+      voxel_propensities(model.get_reactions().size(), nullptr),
+      propensity_buffer(model.get_reactions().size(), 0.0)
 {
     for (std::size_t reaction_id = 0; reaction_id < model.get_reactions().size(); ++reaction_id) {
         const GillesPy3D::Reaction &reaction = model.get_reactions().at(reaction_id);
@@ -68,12 +84,95 @@ void GillesPy3D::ReactionContext::set_ssa_propensity_function(std::size_t reacti
 
 void GillesPy3D::ReactionContext::set_ssa_propensity_function(std::size_t reaction_id, double (*propensity_function)(double*, double*))
 {
-    ssa_propensity_map[reaction_id] = propensity_function;
+    check_reaction_id(reaction_id);
+    ssa_propensities[reaction_id] = propensity_function;
 }
 
 void GillesPy3D::ReactionContext::set_ode_propensity_function(std::size_t reaction_id, double (*propensity_function)(double*, double*))
 {
-    ode_propensity_map[reaction_id] = propensity_function;
+    check_reaction_id(reaction_id);
+    ode_propensities[reaction_id] = propensity_function;
+}
+
+void GillesPy3D::ReactionContext::set_group_propensity_function(const GillesPy3D::CGroupPropensityFunction &propensity_function)
+{
+    set_ssa_group_propensity_function(propensity_function);
+    set_ode_group_propensity_function(propensity_function);
+}
+
+void GillesPy3D::ReactionContext::set_ode_group_propensity_function(const GillesPy3D::CGroupPropensityFunction &propensity_function)
+{
+    ode_group_propensity = propensity_function.propensity_function;
+}
+
+void GillesPy3D::ReactionContext::set_ssa_group_propensity_function(const GillesPy3D::CGroupPropensityFunction &propensity_function)
+{
+    ssa_group_propensity = propensity_function.propensity_function;
+}
+
+void GillesPy3D::ReactionContext::set_voxel_propensity_function(std::size_t reaction_id, const GillesPy3D::CVoxelPropensityFunction &propensity_function)
+{
+    check_reaction_id(reaction_id);
+    voxel_propensities[reaction_id] = propensity_function.propensity_function;
+}
+
+std::size_t GillesPy3D::ReactionContext::num_reactions() const
+{
+    return ssa_propensities.size();
+}
+
+void GillesPy3D::ReactionContext::get_ode_propensities(double *state, double *parameters, double *out) const
+{
+    get_propensities(ode_propensities, ode_group_propensity, state, parameters, out);
+}
+
+void GillesPy3D::ReactionContext::get_ssa_propensities(double *state, double *parameters, double *out) const
+{
+    get_propensities(ssa_propensities, ssa_group_propensity, state, parameters, out);
+}
+
+void GillesPy3D::ReactionContext::get_voxel_propensities(std::size_t reaction_id, std::size_t num_voxels,
+                                                         double *states, double *parameters, double *out) const
+{
+    check_reaction_id(reaction_id);
+    if (voxel_propensities[reaction_id] != nullptr)
+    {
+        voxel_propensities[reaction_id](num_voxels, states, parameters, out);
+        return;
+    }
+
+    // No batched function: one call per voxel
+    UniquePropensityFunction<double> propensity = ssa_propensities[reaction_id];
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        out[voxel] = propensity != nullptr ? propensity(states + num_species * voxel, parameters) : 0.0;
+    }
+}
+
+void GillesPy3D::ReactionContext::get_propensities(const std::vector<UniquePropensityFunction<double>> &table,
+                                                   GroupPropensityFunction<double> group,
+                                                   double *state, double *parameters, double *out)
+{
+    if (group != nullptr)
+    {
+        group(state, parameters, out);
+        return;
+    }
+
+    for (std::size_t reaction_id = 0; reaction_id < table.size(); ++reaction_id)
+    {
+        out[reaction_id] = table[reaction_id] != nullptr ? table[reaction_id](state, parameters) : 0.0;
+    }
+}
+
+void GillesPy3D::ReactionContext::check_reaction_id(std::size_t reaction_id) const
+{
+    if (reaction_id >= num_reactions())
+    {
+        std::string msg = "ReactionContext: reaction id " + std::to_string(reaction_id) +
+                          " out of range for a model of " + std::to_string(num_reactions()) + " reactions";
+        throw GillesPyError(msg.c_str());
+    }
 }
 
 GillesPy3D::SpeciesContext::SpeciesContext(GillesPy3D::Model &model)
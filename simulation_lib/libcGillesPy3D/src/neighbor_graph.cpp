@@ -0,0 +1,77 @@
+#include "neighbor_graph.hpp"
+
+#include <algorithm>
+
+GillesPy3D::NeighborGraph::NeighborGraph()
+    : offsets(1, 0)
+{
+}
+
+void GillesPy3D::NeighborGraph::clear()
+{
+    offsets.resize(1);
+    index.clear();
+    dist.clear();
+    dWdr.clear();
+    D_i_j.clear();
+    W.clear();
+}
+
+void GillesPy3D::NeighborGraph::reserve(std::size_t num_rows, std::size_t num_edges)
+{
+    offsets.reserve(num_rows + 1);
+    index.reserve(num_edges);
+    dist.reserve(num_edges);
+    dWdr.reserve(num_edges);
+    D_i_j.reserve(num_edges);
+    W.reserve(num_edges);
+}
+
+void GillesPy3D::NeighborGraph::add(unsigned int neighbor, double dist, double dWdr, double D_i_j, double W)
+{
+    this->index.push_back(neighbor);
+    this->dist.push_back(dist);
+    this->dWdr.push_back(dWdr);
+    this->D_i_j.push_back(D_i_j);
+    this->W.push_back(W);
+}
+
+void GillesPy3D::NeighborGraph::end_row()
+{
+    offsets.push_back(index.size());
+}
+
+void GillesPy3D::NeighborGraph::assign(const std::vector<NeighborGraph> &blocks)
+{
+    std::size_t num_rows = 0;
+    std::size_t num_edges = 0;
+    for (const NeighborGraph &block : blocks)
+    {
+        num_rows += block.size();
+        num_edges += block.num_edges();
+    }
+
+    offsets.resize(num_rows + 1);
+    index.resize(num_edges);
+    dist.resize(num_edges);
+    dWdr.resize(num_edges);
+    D_i_j.resize(num_edges);
+    W.resize(num_edges);
+
+    std::size_t row = 0;
+    std::size_t edge = 0;
+    offsets[0] = 0;
+    for (const NeighborGraph &block : blocks)
+    {
+        for (std::size_t i = 1; i < block.offsets.size(); ++i)
+        {
+            offsets[++row] = edge + block.offsets[i];
+        }
+        std::copy(block.index.begin(), block.index.end(), index.begin() + edge);
+        std::copy(block.dist.begin(), block.dist.end(), dist.begin() + edge);
+        std::copy(block.dWdr.begin(), block.dWdr.end(), dWdr.begin() + edge);
+        std::copy(block.D_i_j.begin(), block.D_i_j.end(), D_i_j.begin() + edge);
+        std::copy(block.W.begin(), block.W.end(), W.begin() + edge);
+        edge += block.num_edges();
+    }
+}
@@ -0,0 +1,248 @@
+#include "neighbor_search.hpp"
+#include "error.hpp"
+
+#include <algorithm>
+#include <cmath>
+#include <mutex>
+
+namespace
+{
+    // Guards ANN queries in KDTREE_SERIAL mode.
+    std::mutex serial_search_mutex;
+
+    // Upper bound on the number of grid cells per point before cells are widened.
+    constexpr double max_cells_per_point = 8.0;
+}
+
+GillesPy3D::NeighborSearchBuffer::NeighborSearchBuffer(std::size_t initial_capacity)
+    : indices(initial_capacity), distances(initial_capacity)
+{
+    m_query[0] = m_query[1] = m_query[2] = 0.0;
+}
+
+void GillesPy3D::NeighborSearchBuffer::set_query(const double *x, int dimension)
+{
+    for (int i = 0; i < dimension; ++i)
+    {
+        m_query[i] = x[i];
+    }
+}
+
+void GillesPy3D::NeighborSearchBuffer::reserve(std::size_t capacity)
+{
+    if (indices.size() < capacity)
+    {
+        // Leave some headroom so that slowly growing neighborhoods don't resize every step.
+        capacity += capacity / 2;
+        indices.resize(capacity);
+        distances.resize(capacity);
+    }
+}
+
+int GillesPy3D::NeighborSearchBuffer::search(
+        NeighborSearchMethod method,
+        ANNkd_tree *tree,
+        const CellList *cells,
+        const double *x,
+        int dimension,
+        ANNdist sq_radius)
+{
+    switch (method)
+    {
+    case KDTREE:
+        return kdtree_search(tree, x, dimension, sq_radius);
+    case KDTREE_SERIAL:
+        return kdtree_search_serial(tree, x, dimension, sq_radius);
+    case CELL_LIST:
+        if (cells == nullptr || cells->dimension() != dimension)
+        {
+            throw GillesPyError("CELL_LIST neighbor search requires a cell list built for this dimension");
+        }
+        return cell_list_search(*cells, x, sq_radius);
+    default:
+        throw GillesPyError("Unknown neighbor search method");
+    }
+}
+
+int GillesPy3D::NeighborSearchBuffer::kdtree_search(ANNkd_tree *tree, const double *x, int dimension, ANNdist sq_radius)
+{
+    set_query(x, dimension);
+
+    // Search with the current capacity as k; annkFRSearch reports the true number of points in range,
+    //   so a second pass is only needed when a neighborhood outgrows the buffer.
+    int k = static_cast<int>(indices.size());
+    int found = tree->annkFRSearch(m_query, sq_radius, k, indices.data(), distances.data());
+    if (found > k)
+    {
+        reserve(found);
+        k = static_cast<int>(indices.size());
+        found = tree->annkFRSearch(m_query, sq_radius, k, indices.data(), distances.data());
+    }
+
+    count = found;
+    return count;
+}
+
+int GillesPy3D::NeighborSearchBuffer::kdtree_search_serial(ANNkd_tree *tree, const double *x, int dimension, ANNdist sq_radius)
+{
+    set_query(x, dimension);
+
+    std::lock_guard<std::mutex> lock(serial_search_mutex);
+    int k = tree->annkFRSearch(m_query, sq_radius, 0);
+    reserve(k);
+    tree->annkFRSearch(m_query, sq_radius, k, indices.data(), distances.data());
+
+    count = k;
+    return count;
+}
+
+int GillesPy3D::NeighborSearchBuffer::cell_list_search(const CellList &cells, const double *x, ANNdist sq_radius)
+{
+    const int dimension = cells.m_dimension;
+    const int reach = static_cast<int>(std::ceil(std::sqrt(sq_radius) / cells.m_cell_size));
+
+    int lo[3] = { 0, 0, 0 };
+    int hi[3] = { 0, 0, 0 };
+    for (int axis = 0; axis < dimension; ++axis)
+    {
+        int c = cells.cell_coordinate(x[axis], axis);
+        lo[axis] = std::max(c - reach, 0);
+        hi[axis] = std::min(c + reach, cells.m_num_cells[axis] - 1);
+        if (lo[axis] > hi[axis])
+        {
+            count = 0;
+            return count;
+        }
+    }
+
+    count = 0;
+    const int nx = cells.m_num_cells[0];
+    const int ny = cells.m_num_cells[1];
+    for (int cz = lo[2]; cz <= hi[2]; ++cz)
+    {
+        for (int cy = lo[1]; cy <= hi[1]; ++cy)
+        {
+            // Cells lo[0]..hi[0] of this row are stored back to back.
+            int row = (cz * ny + cy) * nx;
+            int begin = cells.m_cell_start[row + lo[0]];
+            int end = cells.m_cell_start[row + hi[0] + 1];
+            for (int p = begin; p < end; ++p)
+            {
+                const ANNcoord *px = &cells.m_sorted_x[static_cast<std::size_t>(p) * dimension];
+                ANNdist r2 = 0.0;
+                for (int axis = 0; axis < dimension; ++axis)
+                {
+                    ANNcoord t = x[axis] - px[axis];
+                    r2 += t * t;
+                }
+                // Same convention as ANN: points at distance zero (including the query itself) are skipped.
+                if (r2 <= sq_radius && (ANN_ALLOW_SELF_MATCH || r2 != 0))
+                {
+                    if (static_cast<std::size_t>(count) == indices.size())
+                    {
+                        reserve(count + 1);
+                    }
+                    indices[count] = cells.m_point_index[p];
+                    distances[count] = r2;
+                    ++count;
+                }
+            }
+        }
+    }
+
+    return count;
+}
+
+int GillesPy3D::CellList::cell_coordinate(double x, int axis) const
+{
+    return static_cast<int>(std::floor((x - m_origin[axis]) / m_cell_size));
+}
+
+void GillesPy3D::CellList::build(ANNpointArray points, int num_points, int dimension, double cell_size)
+{
+    if (dimension < 1 || dimension > 3)
+    {
+        throw GillesPyError("CellList: dimension must be 1, 2 or 3");
+    }
+    if (!(cell_size > 0.0))
+    {
+        throw GillesPyError("CellList: cell size must be positive");
+    }
+    m_dimension = dimension;
+
+    double lower[3] = { 0.0, 0.0, 0.0 };
+    double upper[3] = { 0.0, 0.0, 0.0 };
+    if (num_points > 0)
+    {
+        for (int axis = 0; axis < dimension; ++axis)
+        {
+            lower[axis] = upper[axis] = points[0][axis];
+        }
+    }
+    for (int i = 1; i < num_points; ++i)
+    {
+        for (int axis = 0; axis < dimension; ++axis)
+        {
+            lower[axis] = std::min(lower[axis], points[i][axis]);
+            upper[axis] = std::max(upper[axis], points[i][axis]);
+        }
+    }
+
+    // Widen the cells until the grid size is proportional to the number of points.
+    const double max_cells = max_cells_per_point * std::max(num_points, 1);
+    m_cell_size = cell_size;
+    double total_cells;
+    while (true)
+    {
+        total_cells = 1.0;
+        for (int axis = 0; axis < dimension; ++axis)
+        {
+            total_cells *= std::floor((upper[axis] - lower[axis]) / m_cell_size) + 1.0;
+        }
+        if (total_cells <= max_cells)
+        {
+            break;
+        }
+        m_cell_size *= std::max(std::pow(total_cells / max_cells, 1.0 / dimension), 1.01);
+    }
+
+    for (int axis = 0; axis < 3; ++axis)
+    {
+        m_origin[axis] = lower[axis];
+        m_num_cells[axis] = axis < dimension
+            ? static_cast<int>(std::floor((upper[axis] - lower[axis]) / m_cell_size)) + 1
+            : 1;
+    }
+
+    // Counting sort of the points by cell.
+    m_cell_start.assign(static_cast<std::size_t>(total_cells) + 1, 0);
+    m_cell_of_point.resize(num_points);
+    for (int i = 0; i < num_points; ++i)
+    {
+        int cell = 0;
+        for (int axis = dimension - 1; axis >= 0; --axis)
+        {
+            int c = std::min(cell_coordinate(points[i][axis], axis), m_num_cells[axis] - 1);
+            cell = cell * m_num_cells[axis] + c;
+        }
+        m_cell_of_point[i] = cell;
+        ++m_cell_start[cell + 1];
+    }
+    for (std::size_t cell = 1; cell < m_cell_start.size(); ++cell)
+    {
+        m_cell_start[cell] += m_cell_start[cell - 1];
+    }
+
+    m_point_index.resize(num_points);
+    m_sorted_x.resize(static_cast<std::size_t>(num_points) * dimension);
+    std::vector<int> next(m_cell_start.begin(), m_cell_start.end() - 1);
+    for (int i = 0; i < num_points; ++i)
+    {
+        int slot = next[m_cell_of_point[i]]++;
+        m_point_index[slot] = i;
+        for (int axis = 0; axis < dimension; ++axis)
+        {
+            m_sorted_x[static_cast<std::size_t>(slot) * dimension + axis] = points[i][axis];
+        }
+    }
+}
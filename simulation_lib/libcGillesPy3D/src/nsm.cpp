@@ -0,0 +1,359 @@
+#include "nsm.hpp"
+#include "error.hpp"
+
+#include <algorithm>
+#include <limits>
+#include <string>
+
+namespace
+{
+    constexpr double never = std::numeric_limits<double>::infinity();
+}
+
+void GillesPy3D::IndexedMinHeap::build(const std::vector<double> &times)
+{
+    const std::size_t n = times.size();
+    m_time = times;
+    m_heap.resize(n);
+    m_position.resize(n);
+    for (std::size_t key = 0; key < n; ++key)
+    {
+        m_heap[key] = key;
+        m_position[key] = key;
+    }
+    for (std::size_t position = n / 2; position-- > 0;)
+    {
+        sift_down(position);
+    }
+}
+
+void GillesPy3D::IndexedMinHeap::update(std::size_t key, double time)
+{
+    const double old_time = m_time[key];
+    m_time[key] = time;
+    if (time < old_time)
+    {
+        sift_up(m_position[key]);
+    }
+    else
+    {
+        sift_down(m_position[key]);
+    }
+}
+
+void GillesPy3D::IndexedMinHeap::place(std::size_t position, std::size_t key)
+{
+    m_heap[position] = key;
+    m_position[key] = position;
+}
+
+void GillesPy3D::IndexedMinHeap::sift_up(std::size_t position)
+{
+    const std::size_t key = m_heap[position];
+    const double time = m_time[key];
+    while (position > 0)
+    {
+        const std::size_t parent = (position - 1) / 2;
+        if (!(time < m_time[m_heap[parent]]))
+        {
+            break;
+        }
+        place(position, m_heap[parent]);
+        position = parent;
+    }
+    place(position, key);
+}
+
+void GillesPy3D::IndexedMinHeap::sift_down(std::size_t position)
+{
+    const std::size_t n = m_heap.size();
+    const std::size_t key = m_heap[position];
+    const double time = m_time[key];
+    while (true)
+    {
+        std::size_t child = 2 * position + 1;
+        if (child >= n)
+        {
+            break;
+        }
+        if (child + 1 < n && m_time[m_heap[child + 1]] < m_time[m_heap[child]])
+        {
+            ++child;
+        }
+        if (!(m_time[m_heap[child]] < time))
+        {
+            break;
+        }
+        place(position, m_heap[child]);
+        position = child;
+    }
+    place(position, key);
+}
+
+void GillesPy3D::DiffusionRates::compute(const NeighborGraph &graph, const double *diffusion_matrix,
+                                         std::size_t num_types, const std::vector<int> &type,
+                                         std::size_t num_species)
+{
+    const std::size_t num_voxels = graph.size();
+    const std::size_t num_edges = graph.num_edges();
+    this->num_species = num_species;
+    cdf.assign(num_edges * num_species, 0.0);
+    rate.assign(num_voxels * num_species, 0.0);
+    for (std::size_t s = 0; s < num_species; ++s)
+    {
+        double *species_cdf = cdf.data() + num_edges * s;
+        for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+        {
+            double cumulative = 0.0;
+            for (std::size_t e = graph.begin(voxel); e < graph.end(voxel); ++e)
+            {
+                const int neighbor_type = type[graph.index[e]];
+                if (neighbor_type >= 1 && static_cast<std::size_t>(neighbor_type) <= num_types)
+                {
+                    cumulative += diffusion_matrix[num_types * s + neighbor_type - 1] * graph.D_i_j[e];
+                }
+                species_cdf[e] = cumulative;
+            }
+            rate[num_species * voxel + s] = cumulative;
+        }
+    }
+}
+
+std::size_t GillesPy3D::DiffusionRates::edge(const NeighborGraph &graph, std::size_t voxel, std::size_t s,
+                                             double u) const
+{
+    const double *species_cdf = cdf.data() + graph.num_edges() * s;
+    const std::size_t begin = graph.begin(voxel);
+    const std::size_t end = graph.end(voxel);
+    // Bisection of the cumulative rates
+    std::size_t e = std::upper_bound(species_cdf + begin, species_cdf + end, u * rate[num_species * voxel + s]) - species_cdf;
+    return e == end ? end - 1 : e;
+}
+
+GillesPy3D::NextSubvolumeMethod::NextSubvolumeMethod(
+        std::size_t num_species, std::size_t num_reactions,
+        const std::size_t *irN, const std::size_t *jcN, const int *prN,
+        const std::size_t *irG, const std::size_t *jcG,
+        const PropensityFun *propensities)
+    : m_num_species(num_species), m_num_reactions(num_reactions),
+      m_irN(irN), m_jcN(jcN), m_prN(prN), m_irG(irG), m_jcG(jcG), m_propensities(propensities)
+{
+}
+
+void GillesPy3D::NextSubvolumeMethod::initialize(
+        const NeighborGraph &graph, const double *diffusion_matrix, std::size_t num_types,
+        const std::vector<double> &volume, const std::vector<int> &type,
+        double *data, std::size_t num_data_fn, unsigned int *state,
+        double t, std::mt19937_64 &rng)
+{
+    const std::size_t num_voxels = volume.size();
+    if (type.size() != num_voxels || graph.size() != num_voxels)
+    {
+        throw GillesPyError("NextSubvolumeMethod: volume, type and neighbor graph sizes differ");
+    }
+    m_graph = &graph;
+    m_volume = volume;
+    m_type = type;
+    m_data = data;
+    m_num_data_fn = num_data_fn;
+    m_state = state;
+    m_time = t;
+
+    // Reaction propensities
+    m_reaction_rate.assign(num_voxels * m_num_reactions, 0.0);
+    m_reaction_sum.assign(num_voxels, 0.0);
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        for (std::size_t r = 0; r < m_num_reactions; ++r)
+        {
+            const double rate = propensity(r, voxel, t);
+            m_reaction_rate[m_num_reactions * voxel + r] = rate;
+            m_reaction_sum[voxel] += rate;
+        }
+    }
+
+    // Diffusion rates only depend on the graph, so they are computed once here
+    m_diffusion.compute(graph, diffusion_matrix, num_types, m_type, m_num_species);
+    m_diffusion_sum.assign(num_voxels, 0.0);
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        for (std::size_t s = 0; s < m_num_species; ++s)
+        {
+            m_diffusion_sum[voxel] += m_diffusion.rate[m_num_species * voxel + s] * m_state[m_num_species * voxel + s];
+        }
+    }
+
+    std::vector<double> times(num_voxels);
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        times[voxel] = next_time(total_rate(voxel), t, rng);
+    }
+    m_heap.build(times);
+}
+
+double GillesPy3D::NextSubvolumeMethod::propensity(std::size_t reaction, std::size_t voxel, double t) const
+{
+    double *data = m_data != nullptr ? m_data + m_num_data_fn * voxel : nullptr;
+    return m_propensities[reaction](m_state + m_num_species * voxel, t, m_volume[voxel], data, m_type[voxel]);
+}
+
+double GillesPy3D::NextSubvolumeMethod::update_reactions(std::size_t column, std::size_t voxel, double t)
+{
+    double *rates = m_reaction_rate.data() + m_num_reactions * voxel;
+    double delta = 0.0;
+    for (std::size_t k = m_jcG[column]; k < m_jcG[column + 1]; ++k)
+    {
+        const std::size_t r = m_irG[k];
+        const double rate = propensity(r, voxel, t);
+        delta += rate - rates[r];
+        rates[r] = rate;
+    }
+    return delta;
+}
+
+double GillesPy3D::NextSubvolumeMethod::next_time(double rate, double t, std::mt19937_64 &rng)
+{
+    return rate > 0.0 ? t + m_exponential(rng) / rate : never;
+}
+
+void GillesPy3D::NextSubvolumeMethod::execute_reaction(std::size_t voxel, double u, double t)
+{
+    const double *rates = m_reaction_rate.data() + m_num_reactions * voxel;
+    std::size_t reaction = 0;
+    double cumulative = rates[0];
+    while (u >= cumulative && reaction + 1 < m_num_reactions)
+    {
+        cumulative += rates[++reaction];
+    }
+    // Rounding in the running sums can leave `u` just past the last channel; fall back to one that can fire
+    while (rates[reaction] <= 0.0)
+    {
+        if (reaction == 0)
+        {
+            // The sum had drifted away from zero: nothing can fire
+            refresh_sums(voxel);
+            return;
+        }
+        --reaction;
+    }
+
+    unsigned int *x = m_state + m_num_species * voxel;
+    for (std::size_t k = m_jcN[reaction]; k < m_jcN[reaction + 1]; ++k)
+    {
+        const std::size_t s = m_irN[k];
+        if (m_prN[k] < 0 && x[s] < static_cast<unsigned int>(-m_prN[k]))
+        {
+            throw GillesPyError(("NextSubvolumeMethod: reaction " + std::to_string(reaction) + " in voxel " +
+                                 std::to_string(voxel) + " would make species " + std::to_string(s) +
+                                 " negative").c_str());
+        }
+    }
+    for (std::size_t k = m_jcN[reaction]; k < m_jcN[reaction + 1]; ++k)
+    {
+        const std::size_t s = m_irN[k];
+        x[s] += m_prN[k];
+        m_diffusion_sum[voxel] += m_diffusion.rate[m_num_species * voxel + s] * m_prN[k];
+    }
+    m_reaction_sum[voxel] += update_reactions(m_num_species + reaction, voxel, t);
+    ++m_reaction_events;
+}
+
+void GillesPy3D::NextSubvolumeMethod::execute_diffusion(std::size_t voxel, double u, double t,
+                                                                std::mt19937_64 &rng)
+{
+    const double *rate = m_diffusion.rate.data() + m_num_species * voxel;
+    unsigned int *x = m_state + m_num_species * voxel;
+
+    // Species: cumulative sum of rate * population
+    std::size_t s = 0;
+    double cumulative = rate[0] * x[0];
+    while (u >= cumulative && s + 1 < m_num_species)
+    {
+        ++s;
+        cumulative += rate[s] * x[s];
+    }
+    while (x[s] == 0 || rate[s] <= 0.0)
+    {
+        if (s == 0)
+        {
+            refresh_sums(voxel);
+            return;
+        }
+        --s;
+    }
+
+    const std::size_t destination = m_graph->index[m_diffusion.edge(*m_graph, voxel, s, m_uniform(rng))];
+
+    const double old_rate = total_rate(destination);
+    x[s]--;
+    m_state[m_num_species * destination + s]++;
+    m_diffusion_sum[voxel] -= rate[s];
+    m_diffusion_sum[destination] += m_diffusion.rate[m_num_species * destination + s];
+    if (m_num_reactions > 0)
+    {
+        m_reaction_sum[voxel] += update_reactions(s, voxel, t);
+        m_reaction_sum[destination] += update_reactions(s, destination, t);
+    }
+    ++m_diffusion_events;
+
+    // The destination's pending event stays valid with its clock rescaled to the new rate (Gibson and Bruck)
+    const double new_rate = total_rate(destination);
+    const double old_time = m_heap.time(destination);
+    double time;
+    if (new_rate <= 0.0)
+    {
+        time = never;
+    }
+    else if (old_rate > 0.0 && old_time != never)
+    {
+        time = t + (old_time - t) * (old_rate / new_rate);
+    }
+    else
+    {
+        time = next_time(new_rate, t, rng);
+    }
+    m_heap.update(destination, time);
+}
+
+void GillesPy3D::NextSubvolumeMethod::refresh_sums(std::size_t voxel)
+{
+    const double *rates = m_reaction_rate.data() + m_num_reactions * voxel;
+    const double *rate = m_diffusion.rate.data() + m_num_species * voxel;
+    const unsigned int *x = m_state + m_num_species * voxel;
+    m_reaction_sum[voxel] = 0.0;
+    for (std::size_t r = 0; r < m_num_reactions; ++r)
+    {
+        m_reaction_sum[voxel] += rates[r];
+    }
+    m_diffusion_sum[voxel] = 0.0;
+    for (std::size_t s = 0; s < m_num_species; ++s)
+    {
+        m_diffusion_sum[voxel] += rate[s] * x[s];
+    }
+}
+
+void GillesPy3D::NextSubvolumeMethod::advance(double end_time, std::mt19937_64 &rng)
+{
+    if (m_graph == nullptr)
+    {
+        throw GillesPyError("NextSubvolumeMethod: advance() called before initialize()");
+    }
+    while (m_heap.size() > 0 && m_heap.top_time() <= end_time)
+    {
+        const std::size_t voxel = m_heap.top();
+        const double t = m_heap.top_time();
+        m_time = t;
+
+        const double u = m_uniform(rng) * total_rate(voxel);
+        if (u < m_reaction_sum[voxel])
+        {
+            execute_reaction(voxel, u, t);
+        }
+        else
+        {
+            execute_diffusion(voxel, u - m_reaction_sum[voxel], t, rng);
+        }
+        m_heap.update(voxel, next_time(total_rate(voxel), t, rng));
+    }
+    m_time = end_time;
+}
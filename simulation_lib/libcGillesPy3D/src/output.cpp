@@ -19,9 +19,14 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <string>
+#include <vector>
 
+#include "error.hpp"
 #include "output.hpp"
+#include "particle.hpp"
 #include "particle_system.hpp"
+#include "output_writer.hpp"
 
 namespace GillesPy3D{
     void output_csv(ParticleSystem*system, int current_step){
@@ -40,67 +45,19 @@ namespace GillesPy3D{
     }
 
 
-    Particle *output_buffer;
-    long unsigned int output_buffer_size = 0;
-    int output_buffer_current_step;
-    int output_buffer_current_num_particles;
-    unsigned int* output_buffer_xx;
-    long unsigned int output_buffer_xx_size = 0;
-    double* output_buffer_chem;
-    long unsigned int output_buffer_chem_size = 0;
+    // Step captured by output_vtk__sync_step() and written by the *__async_step() functions
+    OutputSnapshot output_snapshot;
+    std::vector<std::string> output_pvd_files;
+    std::vector<double> output_pvd_times;
 
     void output_vtk__sync_step(ParticleSystem*system, int current_step){
-        output_buffer_current_step = current_step;
-        if(output_buffer_size == 0){
-            output_buffer_size = system->particles.size();
-            output_buffer = (Particle*) malloc(sizeof(Particle)*output_buffer_size);
-        }else if(output_buffer_size < system->particles.size()){
-            output_buffer = (Particle*) realloc(output_buffer, sizeof(Particle)*output_buffer_size);
-        }
-        if(system->num_chem_species > 0){
-            if(output_buffer_chem_size==0){
-                output_buffer_chem_size = system->particles.size() * system->num_chem_species;
-                output_buffer_chem = (double*) malloc(sizeof(double)*output_buffer_chem_size);
-            }else if(output_buffer_chem_size < system->particles.size() * system->num_chem_species){
-                output_buffer_chem_size = system->particles.size() * system->num_chem_species;
-                output_buffer_chem = (double*) realloc(output_buffer_chem, sizeof(double)*output_buffer_chem_size) ;
-            }
-        }
-        int ncnt=0;
-        Particle* p;
-        for(long unsigned int i = 0; i < system->particles.size(); i++){
-            p = &system->particles[i] ;
-            memcpy( (void *) &output_buffer[ncnt++], (void *) p, sizeof(Particle) );
-            if(system->num_chem_species > 0){
-                memcpy( (void *) &output_buffer_chem[p->id*system->num_chem_species], (void*) (p->C), sizeof(double)*system->num_chem_species );
-            }
-        }
-        output_buffer_current_num_particles = ncnt;
-        if(system->num_stoch_species > 0){
-            // make a copy of the RDME state vector xx
-            if(output_buffer_xx_size==0){
-                output_buffer_xx_size = output_buffer_current_num_particles*system->num_stoch_species;
-                output_buffer_xx = (unsigned int*) malloc(sizeof(unsigned int)*output_buffer_xx_size);
-            }else if(output_buffer_xx_size < output_buffer_current_num_particles*system->num_stoch_species){
-                output_buffer_xx_size = output_buffer_current_num_particles*system->num_stoch_species;
-                output_buffer_xx = (unsigned int*) realloc(output_buffer_xx, sizeof(unsigned int)*output_buffer_xx_size);
-
-            }
-            ncnt=0;
-            for(long unsigned int i = 0; i < system->particles.size(); i++){
-                p = &system->particles[i] ;
-                memcpy( (void *) &output_buffer_xx[ncnt], (void *) p->xx, sizeof(unsigned int)*system->num_stoch_species );
-                ncnt += system->num_stoch_species;
-            }
-        }
+        output_snapshot.capture(*system, current_step);
     }
     void output_vtk__async_step(ParticleSystem*system){
         FILE*fp;
-        int i;
         char filename[256];
-        int np = output_buffer_current_num_particles;
         static unsigned int output_index = 0;
-        if(output_buffer_current_step == 0){
+        if(output_snapshot.step == 0){
             sprintf(filename, "output0_boundingBox.vtk");
             if(debug_flag){printf("Writing file '%s'\n", filename);}
             if((fp = fopen(filename,"w+"))==NULL){
@@ -121,103 +78,37 @@ namespace GillesPy3D{
         }
         sprintf(filename,"output%u.vtk", output_index++);
         if(debug_flag){printf("Writing file '%s'\n", filename);}
-        if((fp = fopen(filename,"w+"))==NULL){
-            perror("Can't write output vtk file");exit(1);
-        }
-        fprintf(fp, "# vtk DataFile Version 4.1\n");
-        fprintf(fp, "Generated by GillesPy3D\n");
-        fprintf(fp, "ASCII\n");
-        fprintf(fp, "DATASET POLYDATA\n");
-        fprintf(fp, "POINTS %i float\n",np);
-        for(i=0;i<np;i++){
-            //fprintf(fp, "%lf %lf %lf ",output_buffer[i].x[0],output_buffer[i].x[1],output_buffer[i].x[2]);
-            fprintf(fp, "%.10e %.10e %.10e ",output_buffer[i].x[0],output_buffer[i].x[1],output_buffer[i].x[2]);
-            if((i+1)%3==0){ fprintf(fp,"\n"); }
-        }
-        fprintf(fp,"\n");
-        fprintf(fp, "VERTICES %i %i\n",np,2*np);
-        for(i=0;i<np;i++){
-            fprintf(fp,"1 %i\n",i);
-        }
-        fprintf(fp,"\n");
-        fprintf(fp,"POINT_DATA %i\n", np);
-        int num_fields = 7;
-        if(system->initialized){
-            num_fields += system->num_stoch_species;
-        }
-        if(system->num_chem_species > 0){
-            num_fields += system->num_chem_species;
-        }
-        fprintf(fp,"FIELD FieldData %i\n",num_fields);//
-        fprintf(fp,"id 1 %i int\n", np);
-        for(i=0;i<np;i++){
-            fprintf(fp, "%u ",output_buffer[i].id);
-            if((i+1)%9==0){ fprintf(fp,"\n"); }
-        }
-        fprintf(fp,"\n");
-        fprintf(fp,"type 1 %i int\n", np);
-        for(i=0;i<np;i++){
-            fprintf(fp, "%u ",output_buffer[i].type);
-            if((i+1)%9==0){ fprintf(fp,"\n"); }
-        }
-        fprintf(fp,"\n");
-        fprintf(fp,"v 3 %i double\n",np);
-        for(i=0;i<np;i++){
-            fprintf(fp, "%lf %lf %lf ",output_buffer[i].v[0],output_buffer[i].v[1],output_buffer[i].v[2]);
-            if((i+1)%3==0){ fprintf(fp,"\n"); }
-        }
-        fprintf(fp,"\n");
-        fprintf(fp,"rho 1 %i double\n", np);
-        for(i=0;i<np;i++){
-            fprintf(fp, "%lf ",output_buffer[i].rho);
-            if((i+1)%9==0){ fprintf(fp,"\n"); }
-        }
-        fprintf(fp,"\n");
-        fprintf(fp,"mass 1 %i double\n", np);
-        for(i=0;i<np;i++){
-            fprintf(fp, "%lf ",output_buffer[i].mass);
-            if((i+1)%9==0){ fprintf(fp,"\n"); }
-        }
-        fprintf(fp,"\n");
-        fprintf(fp,"bvf_phi 1 %i double\n", np);
-        for(i=0;i<np;i++){
-            fprintf(fp, "%lf ",output_buffer[i].bvf_phi);
-            if((i+1)%9==0){ fprintf(fp,"\n"); }
-        }
-        fprintf(fp,"\n");
-        fprintf(fp,"nu 1 %i double\n", np);
-        for(i=0;i<np;i++){
-            fprintf(fp, "%lf ",output_buffer[i].nu);
-            if((i+1)%9==0){ fprintf(fp,"\n"); }
-        }
-        fprintf(fp,"\n");
-        // loop here to check for continous species
-        // c - concentration or continous? clarify at meeting
-        if(system->num_chem_species > 0){
-            long unsigned int s;
-            for(s=0;s<system->num_chem_species;s++){
-                fprintf(fp,"C[%s] 1 %i double\n", system->species_names[s], np);
-                for(i=0;i<np;i++){
-                    fprintf(fp, "%lf ",output_buffer_chem[i*system->num_chem_species+s] );
-                    if((i+1)%9==0){ fprintf(fp,"\n"); }
-                }
-                fprintf(fp,"\n");
-            }
-        }
-        // d - discrete
-        if(system->num_stoch_species > 0){
-            long unsigned int s;
-            for(s=0;s<system->num_stoch_species;s++){
-                fprintf(fp,"D[%s] 1 %i int\n", system->species_names[s], np);
-                for(i=0;i<np;i++){
-                    fprintf(fp, "%u ",output_buffer_xx[i*system->num_stoch_species+s] );
-                    if((i+1)%9==0){ fprintf(fp,"\n"); }
-                }
-                fprintf(fp,"\n");
-            }
+        try{
+            write_vtk(output_snapshot, system->output_species_names, filename);
+        }catch(const GillesPyError &error){
+            fprintf(stderr, "%s\n", error.what());exit(1);
         }
+    }
 
-        fclose(fp);
+    void output_vtu__async_step(ParticleSystem*system){
+        char filename[256];
+        static unsigned int output_index = 0;
+        sprintf(filename,"output%u.vtu", output_index++);
+        if(debug_flag){printf("Writing file '%s'\n", filename);}
+        output_pvd_files.push_back(filename);
+        output_pvd_times.push_back(output_snapshot.time);
+        try{
+            write_vtu(output_snapshot, system->output_species_names, filename);
+            write_pvd(output_pvd_files, output_pvd_times, "output.pvd");
+        }catch(const GillesPyError &error){
+            fprintf(stderr, "%s\n", error.what());exit(1);
+        }
+    }
 
+    void output__async_step(ParticleSystem*system){
+        switch(system->output_format){
+            case OUTPUT_VTU_BINARY:
+                output_vtu__async_step(system);
+                break;
+            case OUTPUT_VTK_ASCII:
+            default:
+                output_vtk__async_step(system);
+                break;
+        }
     }
 }
@@ -0,0 +1,515 @@
+#include "output_writer.hpp"
+#include "error.hpp"
+#include "particle.hpp"
+#include "particle_system.hpp"
+#include "simulate_rdme.hpp"
+
+#include <algorithm>
+#include <chrono>
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <filesystem>
+
+namespace
+{
+    // RAII wrapper so that the writers close their file on every path.
+    class OutputFile
+    {
+    public:
+        OutputFile(const std::string &filename, const char *mode)
+            : m_fp(std::fopen(filename.c_str(), mode)), m_filename(filename)
+        {
+            if (m_fp == nullptr)
+            {
+                throw GillesPy3D::GillesPyError(("Can't write output file '" + filename + "'").c_str());
+            }
+        }
+        ~OutputFile()
+        {
+            if (m_fp != nullptr)
+            {
+                std::fclose(m_fp);
+            }
+        }
+        void close()
+        {
+            bool failed = std::ferror(m_fp) != 0;
+            failed |= std::fclose(m_fp) != 0;
+            m_fp = nullptr;
+            if (failed)
+            {
+                throw GillesPy3D::GillesPyError(("Error writing output file '" + m_filename + "'").c_str());
+            }
+        }
+        FILE *get() const { return m_fp; }
+
+    private:
+        FILE *m_fp;
+        std::string m_filename;
+    };
+
+    // Write a file under a temporary name, then rename it, so that a reader polling the output directory
+    //   (Solver.run_stream) never sees a partial file.
+    template <typename Writer>
+    void write_atomically(const std::string &filename, Writer write)
+    {
+        const std::string partial = filename + ".part";
+        write(partial);
+        std::error_code error;
+        std::filesystem::rename(partial, filename, error);
+        if (error)
+        {
+            throw GillesPy3D::GillesPyError(("Can't write output file '" + filename + "': " + error.message()).c_str());
+        }
+    }
+
+    const char *byte_order()
+    {
+        std::uint16_t one = 1;
+        unsigned char first;
+        std::memcpy(&first, &one, 1);
+        return first ? "LittleEndian" : "BigEndian";
+    }
+
+    template <typename T>
+    void write_ascii_values(FILE *fp, const char *format, const std::vector<T> &values, std::size_t per_line)
+    {
+        for (std::size_t i = 0; i < values.size(); ++i)
+        {
+            std::fprintf(fp, format, values[i]);
+            if ((i + 1) % per_line == 0)
+            {
+                std::fputc('\n', fp);
+            }
+        }
+        std::fputc('\n', fp);
+    }
+
+    struct AppendedArray
+    {
+        const char *vtk_type;
+        std::string name;
+        int num_components;
+        const void *data;
+        std::uint64_t nbytes;
+    };
+
+    template <typename T>
+    AppendedArray appended_array(const char *vtk_type, const std::string &name, int num_components,
+                                 const std::vector<T> &values)
+    {
+        return { vtk_type, name, num_components, values.data(), sizeof(T) * values.size() };
+    }
+
+    void write_data_array_header(FILE *fp, const AppendedArray &array, std::uint64_t offset)
+    {
+        std::fprintf(fp, "        <DataArray type=\"%s\"", array.vtk_type);
+        if (!array.name.empty())
+        {
+            std::fprintf(fp, " Name=\"%s\"", array.name.c_str());
+        }
+        std::fprintf(fp, " NumberOfComponents=\"%i\" format=\"appended\" offset=\"%llu\"/>\n",
+                     array.num_components, static_cast<unsigned long long>(offset));
+    }
+}
+
+void GillesPy3D::OutputSnapshot::resize(std::size_t num_particles, std::size_t num_chem_species, std::size_t num_stoch_species)
+{
+    x.resize(3 * num_particles);
+    v.resize(3 * num_particles);
+    id.resize(num_particles);
+    type.resize(num_particles);
+    rho.resize(num_particles);
+    mass.resize(num_particles);
+    bvf_phi.resize(num_particles);
+    nu.resize(num_particles);
+    C.resize(num_chem_species);
+    for (std::vector<double> &species : C)
+    {
+        species.resize(num_particles);
+    }
+    D.resize(num_stoch_species);
+    for (std::vector<unsigned int> &species : D)
+    {
+        species.resize(num_particles);
+    }
+}
+
+void GillesPy3D::OutputSnapshot::capture(const ParticleSystem &system, unsigned int step)
+{
+    // The state is advanced in system.particle_store, which take_step() only copies back to the particles
+    //   when it needs them; the particles only provide what the store does not hold.
+    const ParticleStore &store = system.particle_store;
+    const std::size_t n = store.size();
+    if (n != system.particles.size())
+    {
+        throw GillesPyError("OutputSnapshot::capture: particle_store is not loaded");
+    }
+    const RDMESimulation *rdme = system.rdme.get();
+    resize(n, store.num_chem_species(), rdme != nullptr ? rdme->num_species() : 0);
+
+    this->step = step;
+    time = step * system.dt;
+    for (std::size_t i = 0; i < n; ++i)
+    {
+        const Particle &p = system.particles[i];
+        for (int k = 0; k < 3; ++k)
+        {
+            x[3 * i + k] = store.x[k][i];
+            // Static domains do not move: the store omits v and nu, which keep their initial values
+            v[3 * i + k] = store.has_fluid_fields() ? store.v[k][i] : p.v[k];
+        }
+        id[i] = p.id;
+        type[i] = store.type[i];
+        rho[i] = store.rho[i];
+        mass[i] = store.mass[i];
+        bvf_phi[i] = store.bvf_phi[i];
+        nu[i] = store.has_fluid_fields() ? store.nu[i] : p.nu;
+    }
+    for (std::size_t s = 0; s < store.num_chem_species(); ++s)
+    {
+        C[s].assign(store.C[s].begin(), store.C[s].end());
+    }
+    for (std::size_t s = 0; s < D.size(); ++s)
+    {
+        for (std::size_t i = 0; i < n; ++i)
+        {
+            D[s][i] = rdme->population(i, s);
+        }
+    }
+}
+
+void GillesPy3D::write_vtk(const OutputSnapshot &snapshot, const OutputSpeciesNames &names, const std::string &filename)
+{
+    OutputFile file(filename, "w+");
+    FILE *fp = file.get();
+    const int np = static_cast<int>(snapshot.size());
+
+    std::fprintf(fp, "# vtk DataFile Version 4.1\n");
+    std::fprintf(fp, "Generated by GillesPy3D\n");
+    std::fprintf(fp, "ASCII\n");
+    std::fprintf(fp, "DATASET POLYDATA\n");
+    std::fprintf(fp, "POINTS %i float\n", np);
+    write_ascii_values(fp, "%.10e ", snapshot.x, 9);
+    std::fprintf(fp, "VERTICES %i %i\n", np, 2 * np);
+    for (int i = 0; i < np; ++i)
+    {
+        std::fprintf(fp, "1 %i\n", i);
+    }
+    std::fprintf(fp, "\n");
+    std::fprintf(fp, "POINT_DATA %i\n", np);
+    std::fprintf(fp, "FIELD FieldData %zu\n", 7 + snapshot.C.size() + snapshot.D.size());
+    std::fprintf(fp, "id 1 %i int\n", np);
+    write_ascii_values(fp, "%i ", snapshot.id, 9);
+    std::fprintf(fp, "type 1 %i int\n", np);
+    write_ascii_values(fp, "%i ", snapshot.type, 9);
+    std::fprintf(fp, "v 3 %i double\n", np);
+    write_ascii_values(fp, "%lf ", snapshot.v, 9);
+    std::fprintf(fp, "rho 1 %i double\n", np);
+    write_ascii_values(fp, "%lf ", snapshot.rho, 9);
+    std::fprintf(fp, "mass 1 %i double\n", np);
+    write_ascii_values(fp, "%lf ", snapshot.mass, 9);
+    std::fprintf(fp, "bvf_phi 1 %i double\n", np);
+    write_ascii_values(fp, "%lf ", snapshot.bvf_phi, 9);
+    std::fprintf(fp, "nu 1 %i double\n", np);
+    write_ascii_values(fp, "%lf ", snapshot.nu, 9);
+    for (std::size_t s = 0; s < snapshot.C.size(); ++s)
+    {
+        std::fprintf(fp, "C[%s] 1 %i double\n", names.chem.at(s).c_str(), np);
+        write_ascii_values(fp, "%lf ", snapshot.C[s], 9);
+    }
+    for (std::size_t s = 0; s < snapshot.D.size(); ++s)
+    {
+        std::fprintf(fp, "D[%s] 1 %i int\n", names.stoch.at(s).c_str(), np);
+        write_ascii_values(fp, "%u ", snapshot.D[s], 9);
+    }
+    file.close();
+}
+
+void GillesPy3D::write_vtu(const OutputSnapshot &snapshot, const OutputSpeciesNames &names, const std::string &filename)
+{
+    const std::size_t np = snapshot.size();
+    std::vector<std::int64_t> connectivity(np);
+    std::vector<std::int64_t> offsets(np);
+    std::vector<std::uint8_t> cell_types(np, 1); // VTK_VERTEX
+    for (std::size_t i = 0; i < np; ++i)
+    {
+        connectivity[i] = i;
+        offsets[i] = i + 1;
+    }
+
+    const AppendedArray points = appended_array("Float64", "", 3, snapshot.x);
+    const std::vector<AppendedArray> cells = {
+        appended_array("Int64", "connectivity", 1, connectivity),
+        appended_array("Int64", "offsets", 1, offsets),
+        appended_array("UInt8", "types", 1, cell_types),
+    };
+    std::vector<AppendedArray> point_data = {
+        appended_array("Int32", "id", 1, snapshot.id),
+        appended_array("Int32", "type", 1, snapshot.type),
+        appended_array("Float64", "v", 3, snapshot.v),
+        appended_array("Float64", "rho", 1, snapshot.rho),
+        appended_array("Float64", "mass", 1, snapshot.mass),
+        appended_array("Float64", "bvf_phi", 1, snapshot.bvf_phi),
+        appended_array("Float64", "nu", 1, snapshot.nu),
+    };
+    for (std::size_t s = 0; s < snapshot.C.size(); ++s)
+    {
+        point_data.push_back(appended_array("Float64", "C[" + names.chem.at(s) + "]", 1, snapshot.C[s]));
+    }
+    for (std::size_t s = 0; s < snapshot.D.size(); ++s)
+    {
+        point_data.push_back(appended_array("UInt32", "D[" + names.stoch.at(s) + "]", 1, snapshot.D[s]));
+    }
+
+    OutputFile file(filename, "wb");
+    FILE *fp = file.get();
+    std::uint64_t offset = 0;
+    auto header = [&](const AppendedArray &array)
+    {
+        write_data_array_header(fp, array, offset);
+        offset += sizeof(std::uint64_t) + array.nbytes;
+    };
+    std::fprintf(fp, "<?xml version=\"1.0\"?>\n");
+    std::fprintf(fp, "<VTKFile type=\"UnstructuredGrid\" version=\"1.0\" byte_order=\"%s\" header_type=\"UInt64\">\n",
+                 byte_order());
+    std::fprintf(fp, "  <UnstructuredGrid>\n");
+    std::fprintf(fp, "    <Piece NumberOfPoints=\"%zu\" NumberOfCells=\"%zu\">\n", np, np);
+    std::fprintf(fp, "      <Points>\n");
+    header(points);
+    std::fprintf(fp, "      </Points>\n");
+    std::fprintf(fp, "      <Cells>\n");
+    for (const AppendedArray &array : cells)
+    {
+        header(array);
+    }
+    std::fprintf(fp, "      </Cells>\n");
+    std::fprintf(fp, "      <PointData>\n");
+    for (const AppendedArray &array : point_data)
+    {
+        header(array);
+    }
+    std::fprintf(fp, "      </PointData>\n");
+    std::fprintf(fp, "    </Piece>\n");
+    std::fprintf(fp, "  </UnstructuredGrid>\n");
+    std::fprintf(fp, "  <AppendedData encoding=\"raw\">\n");
+    std::fprintf(fp, "   _");
+    // Same order as the offsets above
+    auto data = [&](const AppendedArray &array)
+    {
+        std::fwrite(&array.nbytes, sizeof(std::uint64_t), 1, fp);
+        std::fwrite(array.data, 1, array.nbytes, fp);
+    };
+    data(points);
+    for (const AppendedArray &array : cells)
+    {
+        data(array);
+    }
+    for (const AppendedArray &array : point_data)
+    {
+        data(array);
+    }
+    std::fprintf(fp, "\n  </AppendedData>\n");
+    std::fprintf(fp, "</VTKFile>\n");
+    file.close();
+}
+
+void GillesPy3D::write_pvd(const std::vector<std::string> &files, const std::vector<double> &times, const std::string &filename)
+{
+    OutputFile file(filename, "w+");
+    FILE *fp = file.get();
+    std::fprintf(fp, "<?xml version=\"1.0\"?>\n");
+    std::fprintf(fp, "<VTKFile type=\"Collection\" version=\"0.1\" byte_order=\"%s\">\n", byte_order());
+    std::fprintf(fp, "  <Collection>\n");
+    for (std::size_t i = 0; i < files.size(); ++i)
+    {
+        std::fprintf(fp, "    <DataSet timestep=\"%.17g\" part=\"0\" file=\"%s\"/>\n", times[i], files[i].c_str());
+    }
+    std::fprintf(fp, "  </Collection>\n");
+    std::fprintf(fp, "</VTKFile>\n");
+    file.close();
+}
+
+GillesPy3D::OutputWriter::~OutputWriter()
+{
+    try
+    {
+        finish();
+    }
+    catch (...)
+    {
+        // Errors are reported by an explicit finish(); a destructor must not throw.
+    }
+}
+
+void GillesPy3D::OutputWriter::start(OutputFormat format, const std::string &directory,
+                                     const OutputSpeciesNames &names, std::size_t num_buffers)
+{
+    if (running())
+    {
+        throw GillesPyError("OutputWriter: already started");
+    }
+    m_format = format;
+    m_directory = directory;
+    if (!m_directory.empty() && m_directory.back() != '/')
+    {
+        m_directory += '/';
+    }
+    m_names = names;
+
+    m_buffers.clear();
+    m_free.clear();
+    m_queue.clear();
+    m_current = nullptr;
+    for (std::size_t i = 0; i < std::max<std::size_t>(num_buffers, 2); ++i)
+    {
+        m_buffers.push_back(std::make_unique<OutputSnapshot>());
+        m_free.push_back(m_buffers.back().get());
+    }
+    m_files.clear();
+    m_times.clear();
+    m_stop = false;
+    m_error = nullptr;
+    m_wait_seconds = 0.0;
+    m_num_written = 0;
+    m_thread = std::thread(&OutputWriter::run, this);
+}
+
+GillesPy3D::OutputSnapshot &GillesPy3D::OutputWriter::acquire()
+{
+    if (!running())
+    {
+        throw GillesPyError("OutputWriter: acquire() called before start()");
+    }
+    if (m_current != nullptr)
+    {
+        return *m_current;
+    }
+
+    std::unique_lock<std::mutex> lock(m_mutex);
+    if (m_free.empty() && m_error == nullptr)
+    {
+        auto wait_start = std::chrono::steady_clock::now();
+        m_changed.wait(lock, [this]() { return !m_free.empty() || m_error != nullptr; });
+        m_wait_seconds += std::chrono::duration<double>(std::chrono::steady_clock::now() - wait_start).count();
+    }
+    rethrow_error();
+    m_current = m_free.back();
+    m_free.pop_back();
+    return *m_current;
+}
+
+void GillesPy3D::OutputWriter::submit()
+{
+    if (m_current == nullptr)
+    {
+        throw GillesPyError("OutputWriter: submit() without a snapshot from acquire()");
+    }
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        m_queue.push_back(m_current);
+        m_current = nullptr;
+    }
+    m_changed.notify_all();
+}
+
+void GillesPy3D::OutputWriter::finish()
+{
+    if (!running())
+    {
+        return;
+    }
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        m_stop = true;
+    }
+    m_changed.notify_all();
+    m_thread.join();
+
+    std::lock_guard<std::mutex> lock(m_mutex);
+    rethrow_error();
+}
+
+unsigned long GillesPy3D::OutputWriter::num_written() const
+{
+    std::lock_guard<std::mutex> lock(m_mutex);
+    return m_num_written;
+}
+
+void GillesPy3D::OutputWriter::rethrow_error()
+{
+    if (m_error != nullptr)
+    {
+        std::exception_ptr error = m_error;
+        m_error = nullptr;
+        std::rethrow_exception(error);
+    }
+}
+
+void GillesPy3D::OutputWriter::run()
+{
+    std::unique_lock<std::mutex> lock(m_mutex);
+    while (true)
+    {
+        m_changed.wait(lock, [this]() { return !m_queue.empty() || m_stop; });
+        if (m_queue.empty())
+        {
+            return; // stopped, and everything submitted has been written
+        }
+        OutputSnapshot *snapshot = m_queue.front();
+        m_queue.pop_front();
+
+        lock.unlock();
+        std::exception_ptr error;
+        try
+        {
+            write(*snapshot);
+        }
+        catch (...)
+        {
+            error = std::current_exception();
+        }
+        lock.lock();
+
+        if (error == nullptr)
+        {
+            ++m_num_written;
+        }
+        else if (m_error == nullptr)
+        {
+            m_error = error;
+        }
+        m_free.push_back(snapshot);
+        m_changed.notify_all();
+    }
+}
+
+void GillesPy3D::OutputWriter::write(const OutputSnapshot &snapshot)
+{
+    // Files are numbered by output index, as read by Result.read_step
+    const std::string index = std::to_string(m_files.size());
+    if (m_format == OUTPUT_VTU_BINARY)
+    {
+        m_files.push_back("output" + index + ".vtu");
+        m_times.push_back(snapshot.time);
+        write_atomically(m_directory + m_files.back(), [&](const std::string &filename)
+        {
+            write_vtu(snapshot, m_names, filename);
+        });
+        // Rewritten every step so that the collection can be opened while the simulation runs
+        write_atomically(m_directory + "output.pvd", [&](const std::string &filename)
+        {
+            write_pvd(m_files, m_times, filename);
+        });
+    }
+    else
+    {
+        m_files.push_back("output" + index + ".vtk");
+        m_times.push_back(snapshot.time);
+        write_atomically(m_directory + m_files.back(), [&](const std::string &filename)
+        {
+            write_vtk(snapshot, m_names, filename);
+        });
+    }
+}
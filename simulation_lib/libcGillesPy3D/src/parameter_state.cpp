@@ -0,0 +1,25 @@
+#include "parameter_state.hpp"
+
+#include <algorithm>
+
+GillesPy3D::ParameterState::ParameterState(const std::vector<double> &initial_parameters)
+    : m_parameter_count(initial_parameters.size()),
+      m_parameter_values(std::make_unique<sunrealtype[]>(initial_parameters.size()))
+{
+    std::copy(initial_parameters.begin(), initial_parameters.end(), m_parameter_values.get());
+}
+
+std::size_t GillesPy3D::ParameterState::size()
+{
+    return m_parameter_count;
+}
+
+sunrealtype GillesPy3D::ParameterState::parameter(std::uint32_t parameter_id)
+{
+    return m_parameter_values[parameter_id];
+}
+
+sunrealtype *GillesPy3D::ParameterState::data() const
+{
+    return m_parameter_values.get();
+}
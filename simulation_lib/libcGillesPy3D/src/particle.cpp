@@ -27,21 +27,21 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #include <vector>
 #include <queue>
 #include <memory>
-#include <thread>
-#include <mutex>
+#include <algorithm>
 
 // Include ANN KD Tree
 #include "ANN/ANN.h"
+#include "error.hpp"
 #include "particle.hpp"
 #include "particle_system.hpp"
+#include "propensities.hpp"
+#include "simulate_rdme.hpp"
 
 namespace GillesPy3D{
-    
-    std::mutex mtx ;
 
     ParticleSystem::ParticleSystem(size_t num_types, size_t num_chem_species, size_t num_chem_rxns,
                          size_t num_stoch_species, size_t num_stoch_rxns,size_t num_data_fn):
-                            num_types(num_types), num_chem_species(num_chem_species),
+                            urn(0), num_types(num_types), num_chem_species(num_chem_species),
                             num_chem_rxns(num_chem_rxns), num_stoch_species(num_stoch_species),
                             num_stoch_rxns(num_stoch_rxns), num_data_fn(num_data_fn){
         boundary_conditions[0] = 'n';
@@ -49,7 +49,33 @@ namespace GillesPy3D{
         boundary_conditions[2] = 'n';
         static_domain = 0;
         gravity = (double*) calloc(3,sizeof(double));
+        kdTree = nullptr;
         kdTree_initialized = false;
+        neighbor_search = KDTREE;
+        neighbor_skin = 0.0;
+        neighbor_rebuilds = 0;
+        half_neighbor_list = false;
+        kernel_function = LUCY;
+        kernel_table_size = 0;
+        output_format = OUTPUT_VTK_ASCII;
+        output_buffers = 2;
+        particle_chunk_size = 256;
+        output_index = 0;
+        static_neighbors_ready = false;
+        rdme_method = RDME_NSM;
+        tau_tol = 0.03;
+        num_boundary_conditions = 0;
+        boundary_condition_function = nullptr;
+        next_output_function = nullptr;
+        debug_level = 0;
+        species_names = nullptr;
+        subdomain_diffusion_matrix = nullptr;
+        chem_rxn_rhs_functions = nullptr;
+        stoch_rxn_propensity_functions = nullptr;
+        hybrid_propensity_functions = nullptr;
+        stoich_irN = nullptr;
+        stoich_jcN = nullptr;
+        stoich_prN = nullptr;
     }
 
     void ParticleSystem::add_particle(Particle *me){
@@ -60,6 +86,310 @@ namespace GillesPy3D{
         particles.clear() ;
     }
 
+    std::size_t ParticleSystem::index_of(const Particle *p) const {
+        return p - particles.data();
+    }
+
+    void ParticleSystem::build_neighbor_search(){
+        if(!kdTree_initialized) {
+            // h and the dimension are fixed by the time the first search index is built
+            kernel.init(kernel_function, dimension, h, kernel_table_size);
+        }
+        if(kdTree_initialized) {
+            if(static_domain) {
+                return;} // do not rebuild for static domains
+            annDeallocPts(kdTree_pts);
+            delete kdTree;
+            kdTree = nullptr;
+        }
+        int nPts = particles.size();
+        kdTree_pts = annAllocPts(nPts, dimension);
+        for(int i = 0; i < nPts; i++) {
+            for(int j = 0; j < dimension; j++) {
+                kdTree_pts[i][j] = particles[i].x[j];
+            }
+        }
+        if(neighbor_search == CELL_LIST) {
+            cell_list.build(kdTree_pts, nPts, dimension, h);
+        }else{
+            kdTree = new ANNkd_tree(kdTree_pts, nPts, dimension);
+        }
+        kdTree_initialized = true;
+    }
+
+    double ParticleSystem::max_verlet_displacement() const {
+        double max_r2 = 0.0;
+        for(const Particle &p : particles) {
+            double r2 = 0.0;
+            for(int j = 0; j < dimension; j++) {
+                double dx = p.x[j] - p.verlet_x[j];
+                r2 += dx * dx;
+            }
+            max_r2 = std::max(max_r2, r2);
+        }
+        return sqrt(max_r2);
+    }
+
+    bool ParticleSystem::rebuild_neighbor_search(){
+        // The first step of a trajectory always searches: Verlet lists may be left over from a previous one
+        if(kdTree_initialized && neighbor_skin > 0.0 && current_step > 0
+                && max_verlet_displacement() <= 0.5 * neighbor_skin) {
+            return false;
+        }
+        // The search index of a static domain is only built once; later searches reuse it
+        if(!(kdTree_initialized && static_domain)) {
+            neighbor_rebuilds++;
+        }
+        build_neighbor_search();
+        return true;
+    }
+
+    void ParticleSystem::update_neighbor_rows(bool rebuild, std::size_t first, std::size_t last,
+                                              NeighborGraph &graph, NeighborGraph &candidates){
+        graph.clear();
+        if(rebuild) {
+            candidates.clear();
+        }
+        for(std::size_t i = first; i < last; i++) {
+            particles[i].update_neighbors(this, rebuild, graph, candidates);
+        }
+    }
+
+    void ParticleSystem::update_neighbor_graph(bool rebuild){
+        if(rebuild) {
+            verlet_graph.clear();
+        }
+        neighbor_graph.clear();
+        for(Particle &p : particles) {
+            p.update_neighbors(this, rebuild, neighbor_graph, verlet_graph);
+        }
+    }
+
+    SDPDParameters ParticleSystem::sdpd_parameters() const {
+        SDPDParameters params;
+        params.dimension = dimension;
+        params.h = h;
+        params.dt = dt;
+        params.rho0 = rho0;
+        params.c0 = c0;
+        params.P0 = P0;
+        for(int i = 0; i < 3; i++) {
+            params.gravity[i] = gravity[i];
+        }
+        return params;
+    }
+
+    ChemistryParameters ParticleSystem::chemistry_parameters() const {
+        ChemistryParameters chem;
+        chem.num_reactions = chem_rxn_rhs_functions != nullptr && stoich_jcN != nullptr ? num_chem_rxns : 0;
+        chem.rhs_functions = chem_rxn_rhs_functions;
+        chem.irN = stoich_irN;
+        chem.jcN = stoich_jcN;
+        chem.prN = stoich_prN;
+        chem.t = current_step * dt;
+        return chem;
+    }
+
+    void ParticleSystem::pairwise_forces(ThreadPool &pool) {
+        SDPDParameters params = sdpd_parameters();
+        ChemistryParameters chem = chemistry_parameters();
+        const double *diffusion = subdomain_diffusion_matrix;
+        std::size_t n = particle_store.size();
+        if(!half_neighbor_list) {
+            pool.parallel_for(0, n, particle_chunk_size,
+                [&](std::size_t first, std::size_t last, std::size_t, std::size_t) {
+                    particle_store.pairwise_force(neighbor_graph, params, diffusion, chem, first, last);
+                });
+            return;
+        }
+
+        // A pair writes to both of its particles, so each thread accumulates into its own buffer;
+        //   the reduction afterwards only touches the store.
+        force_accumulators.resize(pool.size());
+        pool.parallel_for(0, force_accumulators.size(), 1,
+            [&](std::size_t first, std::size_t, std::size_t, std::size_t) {
+                force_accumulators[first].reset(n, particle_store.num_chem_species(), particle_store.has_fluid_fields());
+            });
+        pool.parallel_for(0, n, particle_chunk_size,
+            [&](std::size_t first, std::size_t last, std::size_t, std::size_t thread) {
+                particle_store.pairwise_force_symmetric(neighbor_graph, params, diffusion, chem, first, last,
+                                                        force_accumulators[thread]);
+            });
+        pool.parallel_for(0, n, particle_chunk_size,
+            [&](std::size_t first, std::size_t last, std::size_t, std::size_t) {
+                for(const ForceAccumulator &sums : force_accumulators) {
+                    particle_store.add_forces(sums, first, last);
+                }
+            });
+    }
+
+    void ParticleSystem::update_neighbor_graph(ThreadPool &pool, bool rebuild){
+        std::size_t num_chunks = ThreadPool::num_chunks(particles.size(), particle_chunk_size);
+        neighbor_blocks.resize(num_chunks);
+        verlet_blocks.resize(num_chunks);
+        pool.parallel_for(0, particles.size(), particle_chunk_size,
+            [&](std::size_t first, std::size_t last, std::size_t chunk, std::size_t) {
+                update_neighbor_rows(rebuild, first, last, neighbor_blocks[chunk], verlet_blocks[chunk]);
+            });
+        neighbor_graph.assign(neighbor_blocks);
+        if(rebuild) {
+            verlet_graph.assign(verlet_blocks);
+        }
+    }
+
+    void ParticleSystem::sync_particle_store(){
+        bool fluid = !static_domain;
+        if(particle_store.size() != particles.size() || particle_store.has_fluid_fields() != fluid) {
+            particle_store.load(particles, num_chem_species, num_data_fn, fluid);
+        }
+    }
+
+    void ParticleSystem::apply_boundary_conditions(ThreadPool &pool){
+        if(num_boundary_conditions == 0) {
+            return;
+        }
+        if(boundary_condition_function == nullptr) {
+            throw GillesPyError("ParticleSystem: num_boundary_conditions is set but boundary_condition_function is not");
+        }
+        particle_store.store(particles);
+        pool.parallel_for(0, particles.size(), particle_chunk_size,
+            [&](std::size_t first, std::size_t last, std::size_t, std::size_t) {
+                for(std::size_t i = first; i < last; i++) {
+                    boundary_condition_function(&particles[i], this);
+                }
+            });
+        particle_store.load(particles, num_chem_species, num_data_fn, !static_domain);
+    }
+
+    void ParticleSystem::take_step(ThreadPool &pool){
+        SDPDParameters params = sdpd_parameters();
+        std::size_t n = particles.size();
+        bool fluid = !static_domain;
+        sync_particle_store();
+        auto for_each_chunk = [&](auto &&body) {
+            pool.parallel_for(0, n, particle_chunk_size,
+                [&](std::size_t first, std::size_t last, std::size_t, std::size_t) { body(first, last); });
+        };
+
+        // Predictor: half step of v, vt, x, rho and C, then clear the forces
+        for_each_chunk([&](std::size_t first, std::size_t last) {
+            particle_store.predictor_step(params, current_step > 0, first, last);
+        });
+        apply_boundary_conditions(pool);
+
+        // Neighbors at the predicted positions (only once for static domains)
+        if(!static_domain || !static_neighbors_ready) {
+            particle_store.store(particles);
+            bool rebuild = rebuild_neighbor_search();
+            update_neighbor_graph(pool, rebuild);
+            static_neighbors_ready = static_domain;
+        }
+
+        pairwise_forces(pool);
+
+        // Corrector, with the Shepard density filter every 20 steps
+        if(fluid && current_step % 20 == 0) {
+            for_each_chunk([&](std::size_t first, std::size_t last) {
+                particle_store.filter_density(neighbor_graph, first, last);
+            });
+        }
+        for_each_chunk([&](std::size_t first, std::size_t last) {
+            particle_store.corrector_step(params, first, last);
+        });
+
+        // Boundary volume fraction and bounce-back off the walls, once every density is final
+        if(fluid) {
+            for_each_chunk([&](std::size_t first, std::size_t last) {
+                particle_store.boundary_volume_fraction(neighbor_graph, params, first, last);
+            });
+        }
+        apply_boundary_conditions(pool);
+        check_finite_state(pool);
+        current_step++;
+
+        if(rdme) {
+            rdme->advance(*this, current_step * dt);
+        }
+    }
+
+    void ParticleSystem::check_finite_state(ThreadPool &pool) const{
+        std::size_t n = particles.size();
+        std::vector<std::size_t> first_bad(ThreadPool::num_chunks(n, particle_chunk_size), n);
+        pool.parallel_for(0, n, particle_chunk_size,
+            [&](std::size_t first, std::size_t last, std::size_t chunk, std::size_t) {
+                std::size_t i = particle_store.find_non_finite(first, last);
+                first_bad[chunk] = i < last ? i : n;
+            });
+        std::size_t i = first_bad.empty() ? n : *std::min_element(first_bad.begin(), first_bad.end());
+        if(i == n) {
+            return;
+        }
+
+        const ParticleStore &ps = particle_store;
+        char buffer[256];
+        std::string message = "nan/inf detected";
+        snprintf(buffer, sizeof(buffer), " in particle id=%u at step %u (dt=%e)\n", particles[i].id, current_step, dt);
+        message += buffer;
+        if(i < neighbor_graph.size()) {
+            snprintf(buffer, sizeof(buffer), "number of neighbors: %zu\n", neighbor_graph.degree(i));
+            message += buffer;
+        }
+        snprintf(buffer, sizeof(buffer), "x=(%e, %e, %e) rho=%e\n", ps.x[0][i], ps.x[1][i], ps.x[2][i], ps.rho[i]);
+        message += buffer;
+        if(ps.has_fluid_fields()) {
+            snprintf(buffer, sizeof(buffer), "v=(%e, %e, %e) vt=(%e, %e, %e)\n",
+                     ps.v[0][i], ps.v[1][i], ps.v[2][i], ps.vt[0][i], ps.vt[1][i], ps.vt[2][i]);
+            message += buffer;
+            snprintf(buffer, sizeof(buffer), "F=(%e, %e, %e) Fbp=(%e, %e, %e)\n",
+                     ps.F[0][i], ps.F[1][i], ps.F[2][i], ps.Fbp[0][i], ps.Fbp[1][i], ps.Fbp[2][i]);
+            message += buffer;
+        }
+        throw GillesPyError(message.c_str());
+    }
+
+    void ParticleSystem::save_initial_state(){
+        sync_particle_store();
+        initial_store = particle_store;
+    }
+
+    void ParticleSystem::begin_trajectory(unsigned long long seed, const std::string &directory){
+        if(output_writer.running()) {
+            output_writer.finish();
+        }
+        particle_store = initial_store;
+        particle_store.store(particles);
+        current_step = 0;
+        output_index = 0;
+        urn = URNGenerator(seed);
+        if(rdme) {
+            rdme->reset(seed);
+        }
+        output_directory = directory;
+    }
+
+    void ParticleSystem::output_step(unsigned int step) {
+        if(!output_writer.running()) {
+            output_writer.start(output_format, output_directory, output_species_names, output_buffers);
+        }
+        sync_particle_store();
+        OutputSnapshot &snapshot = output_writer.acquire();
+        snapshot.capture(*this, step);
+        output_writer.submit();
+    }
+
+    void ParticleSystem::write_run_stats(const char *filename) const {
+        FILE *fp = fopen(filename, "w");
+        if(fp == NULL) {
+            printf("Error: could not open '%s' for writing\n", filename);
+            return;
+        }
+        fprintf(fp, "neighbor_rebuilds %lu\n", neighbor_rebuilds);
+        // Time the simulation was blocked because the output writer was output_buffers snapshots behind
+        fprintf(fp, "output_snapshots %lu\n", output_writer.num_written());
+        fprintf(fp, "output_wait_seconds %.6f\n", output_writer.wait_seconds());
+        fclose(fp);
+    }
+
     Particle::Particle(ParticleSystem *sys, unsigned int id, 
                         double xl, double yl, double zl, int type, double nu, 
                         double mass, double c, double rho, int solidTag) : 
@@ -70,62 +400,16 @@ namespace GillesPy3D{
         x[1] = yl ;
         x[2] = zl ;
     	v[0] = v[1] = v[2] = 0.0;
+        verlet_x[0] = xl ;
+        verlet_x[1] = yl ;
+        verlet_x[2] = zl ;
     	Q = (double*) calloc(sys->num_chem_species, sizeof(double));
     	C = (double*) calloc(sys->num_chem_species, sizeof(double));
     	data_fn = (double*) calloc(sys->num_data_fn, sizeof(double));
     }
 
-    NeighborNode::NeighborNode(Particle *data, double dist, double dWdr, double D_i_j):data(data), dist(dist), dWdr(dWdr), D_i_j(D_i_j){}
     //EventNode::EventNode(Particle *data, double tt):data(data), tt(tt){}
 
-    void Particle::check_particle_nan(){
-        if(
-            std::isnan(x[0]) || !std::isfinite(x[0]) ||
-            std::isnan(x[1]) || !std::isfinite(x[1]) ||
-            std::isnan(x[2]) || !std::isfinite(x[2]) ||
-            std::isnan(v[0]) || !std::isfinite(v[0]) ||
-            std::isnan(v[1]) || !std::isfinite(v[1]) ||
-            std::isnan(v[2]) || !std::isfinite(v[2]) ||
-            std::isnan(rho)  || !std::isfinite(rho) ){
-            printf("ERROR: nan/inf detected!!!\n");
-            printf("number of neighbors: %li\n", neighbors.size()) ;
-            printf("id=%i\n",id);
-            printf("x[0]=%e\n",x[0]);
-            printf("x[1]=%e\n",x[1]);
-            printf("x[2]=%e\n",x[2]);
-            printf("v[0]=%e\n",v[0]);
-            printf("v[1]=%e\n",v[1]);
-            printf("v[2]=%e\n",v[2]);
-            printf("vt[0]=%e\n",vt[0]);
-            printf("vt[1]=%e\n",vt[1]);
-            printf("vt[2]=%e\n",vt[2]);
-            printf("F[0]=%e\n",F[0]);
-            printf("F[1]=%e\n",F[1]);
-            printf("F[2]=%e\n",F[2]);
-            printf("Fbp[0]=%e\n",Fbp[0]);
-            printf("Fbp[1]=%e\n",Fbp[1]);
-            printf("Fbp[2]=%e\n",Fbp[2]);
-            printf("old_x[0]=%e\n",old_x[0]);
-            printf("old_x[1]=%e\n",old_x[1]);
-            printf("old_x[2]=%e\n",old_x[2]);
-            printf("old_v[0]=%e\n",old_v[0]);
-            printf("old_v[1]=%e\n",old_v[1]);
-            printf("old_v[2]=%e\n",old_v[2]);
-            printf("sys->dimension: %i\n", sys->dimension) ;
-            printf("sys->current_step=%i\n",sys->current_step);
-            printf("sys->dt=%e\n",sys->dt);
-            exit(1);
-
-        }
-        old_x[0] =  x[0];
-        old_x[1] =  x[1];
-        old_x[2] =  x[2];
-        old_v[0] =  v[0];
-        old_v[1] =  v[1];
-        old_v[2] =  v[2];
-        old_rho =  rho;
-    }
-
     double Particle::particle_dist(Particle *p2){
         double a = x[0] - p2->x[0];
         double b = x[1] - p2->x[1];
@@ -140,7 +424,7 @@ namespace GillesPy3D{
         return ( a*a + b*b + c*c);
     }
 
-    int Particle::add_to_neighbor_list(Particle *neighbor, ParticleSystem *system, double r2){
+    int Particle::add_to_neighbor_list(Particle *neighbor, ParticleSystem *system, double r2, NeighborGraph &graph){
      //    double a = x[0] - neighbor.x[0];
     	// double b = x[1] - neighbor.x[1];
     	// double c = x[2] - neighbor.x[2];
@@ -154,30 +438,14 @@ namespace GillesPy3D{
 
     	if(r > system->h){ return 0; } // do not add, out side support radius
 
-    	// calculate dWdr
+    	// calculate W and dWdr
     	double h = system->h;
-    	double R = r / h;
-        // Alpha varies between 1D, 2D, and 3D Simulations, values from Drawert et. al. Eq 14
-        double alpha = 0.0; //intitialized to some value to avoid warning
-        if (system->dimension == 3){
-            alpha = 105 / (16 * M_PI * h * h * h) ; // 3D
-        }else if (system->dimension == 2){ 
-            alpha = 5 / (M_PI * h * h) ; // 2D
-        }else if (system->dimension == 1){
-            alpha = 5 / 4 * h ; //1D
-        }
-        
-    	//double alpha = 105 / (16 * M_PI * h * h * h); // 3D
-    	double dWdr = alpha * (-12 * r / (h * h)) * ((1 - R)* (1 - R));
-    	// calculate D_i_j
+    	double W, dWdr;
+    	system->kernel.evaluate(r, W, dWdr);
 
-    	// Eq (13-14), Drawert et al 2019
-    	double ih = 1.0 / h;
-    	double ihsq = ih * ih;
-    	double dhr = h - r;
-    	double wfd = -25.066903536973515383e0 * dhr * dhr * ihsq * ihsq * ihsq * ih; //3D
-    	// Eq 28 of Drawert et al 2019, Tartakovsky et. al., 2007, JCP
-    	double D_i_j = -2.0*(mass*neighbor->mass)/(mass+neighbor->mass)*(rho+neighbor->rho)/(rho*neighbor->rho) * r2 * wfd / (r2+0.01*h*h);
+    	// calculate D_i_j
+    	// Eq 28 of Drawert et al 2019, Tartakovsky et. al., 2007, JCP; r2 * (dWdr / r) reduces to r * dWdr
+    	double D_i_j = -2.0*(mass*neighbor->mass)/(mass+neighbor->mass)*(rho+neighbor->rho)/(rho*neighbor->rho) * r * dWdr / (r2+0.01*h*h);
 
     	if(std::isnan(D_i_j)){
     	    printf("Got NaN calculating D_i_j for me=%i, neighbor=%i\n",id, neighbor->id);
@@ -186,7 +454,6 @@ namespace GillesPy3D{
     	    printf("r2_old=%e ",r2);
     	    printf("r=%e ",r);
     	    printf("h=%e ",h);
-    	    printf("alpha=%e ",alpha);
     	    printf("dWdr=%e ",dWdr);
     	    printf("mass=%e ",mass);
     	    printf("rho=%e ",rho);
@@ -197,94 +464,63 @@ namespace GillesPy3D{
 
     	    exit(1);
     	}
-    	neighbors.emplace_back(neighbor, r, dWdr, D_i_j) ;
+    	graph.add(system->index_of(neighbor), r, dWdr, D_i_j, W);
 
     	return 1;
     }
 
-    void Particle::get_k_cleanup(ANNidxArray nn_idx, ANNdistArray dists) {
-        delete [] nn_idx;
-        delete [] dists;
-    }
-
-    void Particle::search_cleanup(ANNpoint queryPt, ANNidxArray nn_idx, ANNdistArray dists) {
-        //printf("***TOP OF SEARCH CLEANUP***\n") ;
-        get_k_cleanup(nn_idx, dists);
-        annDeallocPt(queryPt);
-        //printf("***BOTTOM OF SEARCH CLEANUP***\n") ;
-    }
+    void Particle::find_neighbors(ParticleSystem *system, NeighborGraph &graph, NeighborGraph &candidates){
+        // One scratch buffer per thread: reused across particles and steps, never shared.
+        thread_local NeighborSearchBuffer search;
 
-    int Particle::get_k__approx(ParticleSystem *system) {
-        return system->kdTree->nPoints();
-    }
+        // Fixed radius nearest neighbor search, squared radius
+        double radius = system->h + system->neighbor_skin;
+        ANNdist dist = radius * radius;
+        int k = search.search(system->neighbor_search, system->kdTree, &system->cell_list, x, system->dimension, dist);
 
-    int Particle::get_k__exact(ANNpoint queryPt, ANNdist dist, ANNkd_tree *tree) {
-        //printf("***TOP OF GET_K__EXACT***\n") ;
-        //printf("USING DIST %f...", dist) ;
-        for(int i = 0; i < 3; i++){
+        bool use_verlet = system->neighbor_skin > 0.0;
+        for(int j = 0; j < 3; j++) {
+            verlet_x[j] = x[j];
         }
-        mtx.lock();
-        int k = tree->annkFRSearch(queryPt, dist, 0);
-        mtx.unlock(); 
-        //printf("Found %i neighbors!\n", k) ;
-        return k;
-    }
-
-    void Particle::find_neighbors(ParticleSystem *system, bool use_exact_k){
-    	//clean out previous neighbors
-    	//printf("find_neighbors.empty_linked_list\n");
-    	//TODO: empty_neighbor_list(neighbors);
-    	// search for points forward: (assumes the list is sorted ascending)
-    	//printf("find_neighbors.search forward\n");
-
-        // ANN KD Tree k fixed radius nearest neighbor search
-        ANNpoint queryPt = annAllocPt(system->dimension);
-        for(int i = 0; i < system->dimension; i++) {
-            queryPt[i] = x[i];
-        }
-        // Squared radius
-        ANNdist dist = system->h * system->h;
-        // Number of neighbors to search for
-        int k;
-        if(use_exact_k) {
-            k = get_k__exact(queryPt, dist, system->kdTree);
-        }else{
-            k = get_k__approx(system);
-        }
-        // Holds indicies that identify the neighbor in system.kdTree_pts
-        ANNidxArray nn_idx = new ANNidx[k];
-        // Holds squared distances to the neighbor (r2)
-        ANNdistArray dists = new ANNdist[k];
-        // Search for k nearest neighbors in the fixed squared radius dist from queryPt
-        /*
-        printf("Searching for Neighbors...\n") ;
-        printf("Point at (%f, %f, %f), dist %f, finding %i neighbors out of %i indices and %i dists\n",
-                    queryPt[0], queryPt[1], queryPt[2], dist, k, sizeof(nn_idx), sizeof(dists)) ;
-        printf("CURRENT SIZE OF PARTICLES: %i\n", system->particles.size()) ;
-        printf("NPOINTS IN KDTREE: %i\n", system->kdTree->nPoints()) ;
-        printf("SEARCH RETURNED %i\n", system->kdTree->annkFRSearch(queryPt, dist, k, nn_idx, dists));
-        printf("Neighbor search complete!\n") ;
-        */
-        mtx.lock();
-        system->kdTree->annkFRSearch(queryPt, dist, k, nn_idx, dists);
-        mtx.unlock();
-        neighbors.clear() ;
-        for(int i = 0; i < k && nn_idx[i] != ANN_NULL_IDX; i++) {
-            //printf("Adding neighbor %i to list.  Index of neighbor: %i with dist: %f\n", i, nn_idx[i], dists[i]) ;
-            Particle *neighbor = &system->particles[nn_idx[i]];
-            add_to_neighbor_list(neighbor, system, dists[i]);
-            //printf("ADDED %i with dist %f!\n", nn_idx[i], dists[i]) ;
-            if(debug_flag > 2) {
+        for(int i = 0; i < k; i++) {
+            Particle *neighbor = &system->particles[search.indices[i]];
+            if(use_verlet) {
+                candidates.add(search.indices[i], sqrt(search.distances[i]), 0.0, 0.0, 0.0);
+            }
+            add_to_neighbor_list(neighbor, system, search.distances[i], graph);
+            if(system->debug_level > 2) {
                 printf("find_neighbors(%i) forward found %i dist: %e    dx: %e   dy: %e   dz: %e\n",
-                    id, neighbor->id, sqrt(dists[i]),
+                    id, neighbor->id, sqrt(search.distances[i]),
                     x[0] - neighbor->x[0],
                     x[1] - neighbor->x[1],
                     x[2] - neighbor->x[2]);
                 }
             }
-        // Cleanup after the search
-        search_cleanup(queryPt, nn_idx, dists);
+        graph.end_row();
+        if(use_verlet) {
+            candidates.end_row();
+        }
+        }
+
+    void Particle::refresh_neighbors(ParticleSystem *system, NeighborGraph &graph){
+        // Kernel quantities change as particles move, so they are recomputed for every
+        // candidate; add_to_neighbor_list() drops candidates that are currently beyond h.
+        const NeighborGraph &candidates = system->verlet_graph;
+        std::size_t row = system->index_of(this);
+        for(std::size_t e = candidates.begin(row); e < candidates.end(row); e++) {
+            Particle *neighbor = &system->particles[candidates.index[e]];
+            add_to_neighbor_list(neighbor, system, particle_dist_sqrd(neighbor), graph);
+        }
+        graph.end_row();
+    }
+
+    void Particle::update_neighbors(ParticleSystem *system, bool rebuild, NeighborGraph &graph, NeighborGraph &candidates){
+        if(rebuild || system->neighbor_skin <= 0.0) {
+            find_neighbors(system, graph, candidates);
+        }else{
+            refresh_neighbors(system, graph);
         }
+    }
 
         // Brute force neighbor look-up
         //  for(Particle n : system.x_index){
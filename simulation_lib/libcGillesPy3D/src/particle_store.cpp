@@ -0,0 +1,630 @@
+#include "particle_store.hpp"
+#include "particle.hpp"
+
+#include <cmath>
+
+void GillesPy3D::ParticleStore::resize(std::size_t num_particles, std::size_t num_chem_species, std::size_t num_data_fn,
+                                       bool fluid)
+{
+    m_size = num_particles;
+    m_num_data_fn = num_data_fn;
+    m_fluid = fluid;
+    const std::size_t fluid_size = fluid ? num_particles : 0;
+
+    for (int d = 0; d < 3; ++d)
+    {
+        x[d].resize(num_particles);
+        v[d].resize(fluid_size);
+        vt[d].resize(fluid_size);
+        F[d].resize(fluid_size);
+        Fbp[d].resize(fluid_size);
+    }
+    rho.resize(num_particles);
+    old_rho.resize(num_particles);
+    mass.resize(num_particles);
+    type.resize(num_particles);
+    solid_tag.resize(num_particles);
+    bvf_phi.resize(num_particles);
+    Frho.resize(fluid_size);
+    nu.resize(fluid_size);
+
+    C.resize(num_chem_species);
+    Q.resize(num_chem_species);
+    for (std::size_t s = 0; s < num_chem_species; ++s)
+    {
+        C[s].resize(num_particles, 0.0);
+        Q[s].resize(num_particles, 0.0);
+    }
+    data_fn.resize(num_data_fn * num_particles, 0.0);
+}
+
+void GillesPy3D::ParticleStore::load(const std::vector<Particle> &particles, std::size_t num_chem_species,
+                                     std::size_t num_data_fn, bool fluid)
+{
+    resize(particles.size(), num_chem_species, num_data_fn, fluid);
+    for (std::size_t i = 0; i < m_size; ++i)
+    {
+        const Particle &p = particles[i];
+        for (int d = 0; d < 3; ++d)
+        {
+            x[d][i] = p.x[d];
+        }
+        rho[i] = p.rho;
+        old_rho[i] = p.old_rho;
+        mass[i] = p.mass;
+        type[i] = p.type;
+        solid_tag[i] = p.solidTag;
+        bvf_phi[i] = p.bvf_phi;
+        for (std::size_t s = 0; s < num_chem_species; ++s)
+        {
+            C[s][i] = p.C[s];
+        }
+        for (std::size_t k = 0; k < num_data_fn; ++k)
+        {
+            data_fn[num_data_fn * i + k] = p.data_fn[k];
+        }
+        if (m_fluid)
+        {
+            for (int d = 0; d < 3; ++d)
+            {
+                v[d][i] = p.v[d];
+                vt[d][i] = p.vt[d];
+                F[d][i] = p.F[d];
+                Fbp[d][i] = p.Fbp[d];
+            }
+            Frho[i] = p.Frho;
+            nu[i] = p.nu;
+        }
+    }
+}
+
+void GillesPy3D::ParticleStore::store(std::vector<Particle> &particles) const
+{
+    for (std::size_t i = 0; i < m_size && i < particles.size(); ++i)
+    {
+        Particle &p = particles[i];
+        for (int d = 0; d < 3; ++d)
+        {
+            p.x[d] = x[d][i];
+        }
+        p.rho = rho[i];
+        p.old_rho = old_rho[i];
+        p.bvf_phi = bvf_phi[i];
+        for (std::size_t s = 0; s < C.size(); ++s)
+        {
+            p.C[s] = C[s][i];
+        }
+        if (m_fluid)
+        {
+            for (int d = 0; d < 3; ++d)
+            {
+                p.v[d] = v[d][i];
+                p.vt[d] = vt[d][i];
+                p.F[d] = F[d][i];
+                p.Fbp[d] = Fbp[d][i];
+            }
+            p.Frho = Frho[i];
+            p.nu = nu[i];
+        }
+    }
+}
+
+void GillesPy3D::ParticleStore::predictor_step(const SDPDParameters &params, bool update_chem, std::size_t begin, std::size_t end)
+{
+    const double half_dt = 0.5 * params.dt;
+    if (m_fluid)
+    {
+        for (int d = 0; d < 3; ++d)
+        {
+            double *xd = x[d].data();
+            double *vd = v[d].data();
+            double *vtd = vt[d].data();
+            const double *Fd = F[d].data();
+            const double *Fbpd = Fbp[d].data();
+            const int *solid = solid_tag.data();
+            for (std::size_t i = begin; i < end; ++i)
+            {
+                if (solid[i] == 0)
+                {
+                    // Update velocity using forces, transport velocity using background pressure force,
+                    // then position using the transport velocity
+                    vd[i] += half_dt * Fd[i];
+                    vtd[i] = vd[i] + half_dt * Fbpd[i];
+                    xd[i] += params.dt * vtd[i];
+                }
+            }
+        }
+        for (std::size_t i = begin; i < end; ++i)
+        {
+            if (solid_tag[i] == 0)
+            {
+                rho[i] += half_dt * Frho[i];
+            }
+        }
+    }
+
+    for (std::size_t s = 0; s < C.size(); ++s)
+    {
+        double *Cs = C[s].data();
+        double *Qs = Q[s].data();
+        if (update_chem)
+        {
+            for (std::size_t i = begin; i < end; ++i)
+            {
+                Cs[i] += Qs[i] * half_dt;
+            }
+        }
+        for (std::size_t i = begin; i < end; ++i)
+        {
+            Qs[i] = 0.0;
+        }
+    }
+
+    if (m_fluid)
+    {
+        for (int d = 0; d < 3; ++d)
+        {
+            for (std::size_t i = begin; i < end; ++i)
+            {
+                F[d][i] = params.gravity[d];
+                Fbp[d][i] = 0.0;
+            }
+        }
+        for (std::size_t i = begin; i < end; ++i)
+        {
+            Frho[i] = 0.0;
+        }
+    }
+
+    // Save the current density for the Shepard filter
+    for (std::size_t i = begin; i < end; ++i)
+    {
+        old_rho[i] = rho[i];
+    }
+}
+
+void GillesPy3D::ParticleStore::pairwise_force(
+        const NeighborGraph &graph,
+        const SDPDParameters &params,
+        const double *diffusion_matrix,
+        const ChemistryParameters &chem,
+        std::size_t begin,
+        std::size_t end)
+{
+    const int dimension = params.dimension;
+    const double h = params.h;
+    const double rho0 = params.rho0;
+    const double P0 = params.P0;
+    const double c0 = params.c0;
+    const std::size_t num_species = C.size();
+    std::vector<double> state(num_species);
+
+    for (std::size_t i = begin; i < end; ++i)
+    {
+        const double rho_i = rho[i];
+        const double mass_i = mass[i];
+        const double Pi = P0 * (rho_i / rho0 - 1.0);
+        const double vol2_i = (mass_i / rho_i) * (mass_i / rho_i);
+
+        double Fi[3] = { 0.0, 0.0, 0.0 };
+        double Fbpi[3] = { 0.0, 0.0, 0.0 };
+        double Frhoi = 0.0;
+
+        for (std::size_t n = graph.begin(i); n < graph.end(i); ++n)
+        {
+            const double r = graph.dist[n];
+            if (r > h || r == 0.0)
+                continue; // outside kernel support, or singular
+            const std::size_t j = graph.index[n];
+            const double dWdr = graph.dWdr[n];
+            const double rho_j = rho[j];
+            const double mass_j = mass[j];
+            const double ir = 1.0 / (r + 0.001 * h);
+
+            double dx[3] = { 0.0, 0.0, 0.0 };
+            for (int d = 0; d < dimension; ++d)
+            {
+                dx[d] = x[d][i] - x[d][j];
+            }
+
+            if (m_fluid)
+            {
+                double dv[3] = { 0.0, 0.0, 0.0 };
+                double dv_dx = 0.0;
+                for (int d = 0; d < dimension; ++d)
+                {
+                    dv[d] = v[d][i] - v[d][j];
+                    dv_dx += dv[d] * dx[d];
+                }
+
+                // Pressure of particle j, and sign-checked pressure gradient
+                const double Pj = P0 * (rho_j / rho0 - 1.0);
+                double pressure_gradient = Pi / (rho_i * rho_i) + Pj / (rho_j * rho_j);
+                if (pressure_gradient < 0) pressure_gradient = -Pi / (rho_i * rho_i) + Pj / (rho_j * rho_j);
+
+                const double vol2_j = (mass_j / rho_j) * (mass_j / rho_j);
+                const double fp = -1.0 * mass_j * pressure_gradient * dWdr * ir;
+                const double fv = mass_j * (2.0 * (nu[i] * nu[j]) / (nu[i] + nu[j])) * ir * dWdr / (rho_i * rho_j);
+                const double fbp = -10.0 * P0 * (1.0 / mass_i) * (vol2_i + vol2_j) * dWdr * ir;
+
+                // Transport force: A_k = 0.5 * (rho v_k (vt - v) . dx) summed over both particles
+                double a_i = 0.0;
+                double a_j = 0.0;
+                for (int d = 0; d < 3; ++d)
+                {
+                    a_i += (vt[d][i] - v[d][i]) * dx[d];
+                    a_j += (vt[d][j] - v[d][j]) * dx[d];
+                }
+                const double ft_scale = (1.0 / mass_i) * (vol2_i + vol2_j) * dWdr * ir;
+                for (int d = 0; d < dimension; ++d)
+                {
+                    const double transport = 0.5 * (rho_i * v[d][i] * a_i + rho_j * v[d][j] * a_j);
+                    Fi[d] += fp * dx[d] + fv * dv[d] + ft_scale * transport;
+                    Fbpi[d] += fbp * dx[d];
+                }
+
+                // Density variation
+                Frhoi += rho_i * (mass_j / rho_j) * dv_dx * ir * dWdr
+                       - 0.0 * h * rho_i * c0 * mass_j * 2.0 * (rho_j / rho_i - 1.0) * (r * r / (r * r + 0.01 * h * h)) * ir * dWdr / rho_j
+                       + (mass_j / rho_j) * (rho_i * a_i + rho_j * a_j) * ir * dWdr;
+            }
+
+            // Chemical species diffusion flux (Tartakovsky et. al., 2007, JCP)
+            if (num_species > 0)
+            {
+                const double wfd = ir * dWdr;
+                const double dQc_base = 2.0 * ((mass_i * mass_j) / (mass_i + mass_j)) * ((rho_i + rho_j) / (rho_i * rho_j))
+                                      * (r * r) * wfd / ((r * r) + 0.01 * h * h);
+                // Note: types start at 1
+                const double *diffusion = diffusion_matrix + num_species * (type[i] - 1);
+                for (std::size_t s = 0; s < num_species; ++s)
+                {
+                    Q[s][i] += diffusion[s] * (C[s][i] - C[s][j]) * dQc_base;
+                }
+            }
+        }
+
+        if (m_fluid)
+        {
+            for (int d = 0; d < dimension; ++d)
+            {
+                F[d][i] += Fi[d];
+                Fbp[d][i] += Fbpi[d];
+            }
+            Frho[i] += Frhoi;
+        }
+
+        reaction_flux(chem, i, state.data(), Q);
+    }
+}
+
+void GillesPy3D::ParticleStore::reaction_flux(
+        const ChemistryParameters &chem,
+        std::size_t i,
+        double *state,
+        std::vector<std::vector<double>> &out) const
+{
+    if (chem.num_reactions == 0)
+        return;
+
+    // The rate functions take the concentrations of one particle, contiguous
+    for (std::size_t s = 0; s < C.size(); ++s)
+    {
+        state[s] = C[s][i];
+    }
+    const double vol = mass[i] / rho[i];
+    const double *data = m_num_data_fn > 0 ? &data_fn[m_num_data_fn * i] : nullptr;
+    for (std::size_t rxn = 0; rxn < chem.num_reactions; ++rxn)
+    {
+        // Only the species changed by the reaction: the non-zeros of its column of the stoichiometry
+        if (chem.jcN[rxn] == chem.jcN[rxn + 1])
+            continue;
+        const double flux = chem.rhs_functions[rxn](state, chem.t, vol, data, type[i]);
+        for (std::size_t k = chem.jcN[rxn]; k < chem.jcN[rxn + 1]; ++k)
+        {
+            out[chem.irN[k]][i] += chem.prN[k] * flux;
+        }
+    }
+}
+
+void GillesPy3D::ForceAccumulator::reset(std::size_t num_particles, std::size_t num_chem_species, bool fluid)
+{
+    const std::size_t fluid_size = fluid ? num_particles : 0;
+    for (int d = 0; d < 3; ++d)
+    {
+        F[d].assign(fluid_size, 0.0);
+        Fbp[d].assign(fluid_size, 0.0);
+    }
+    Frho.assign(fluid_size, 0.0);
+    Q.resize(num_chem_species);
+    for (std::size_t s = 0; s < num_chem_species; ++s)
+    {
+        Q[s].assign(num_particles, 0.0);
+    }
+}
+
+void GillesPy3D::ParticleStore::pairwise_force_symmetric(
+        const NeighborGraph &graph,
+        const SDPDParameters &params,
+        const double *diffusion_matrix,
+        const ChemistryParameters &chem,
+        std::size_t begin,
+        std::size_t end,
+        ForceAccumulator &out) const
+{
+    const int dimension = params.dimension;
+    const double h = params.h;
+    const double rho0 = params.rho0;
+    const double P0 = params.P0;
+    const std::size_t num_species = C.size();
+    std::vector<double> state(num_species);
+
+    for (std::size_t i = begin; i < end; ++i)
+    {
+        const double rho_i = rho[i];
+        const double mass_i = mass[i];
+        const double Pi_rho2 = P0 * (rho_i / rho0 - 1.0) / (rho_i * rho_i);
+        const double vol2_i = (mass_i / rho_i) * (mass_i / rho_i);
+
+        for (std::size_t n = graph.begin(i); n < graph.end(i); ++n)
+        {
+            const std::size_t j = graph.index[n];
+            const double r = graph.dist[n];
+            if (j <= i || r > h || r == 0.0)
+                continue; // visited from the other side, outside kernel support, or singular
+            const double dWdr = graph.dWdr[n];
+            const double rho_j = rho[j];
+            const double mass_j = mass[j];
+            const double ir_dWdr = dWdr / (r + 0.001 * h);
+
+            // dx and dv are from j to i; the j side sees them negated
+            double dx[3] = { 0.0, 0.0, 0.0 };
+            for (int d = 0; d < dimension; ++d)
+            {
+                dx[d] = x[d][i] - x[d][j];
+            }
+
+            if (m_fluid)
+            {
+                double dv[3] = { 0.0, 0.0, 0.0 };
+                double dv_dx = 0.0;
+                for (int d = 0; d < dimension; ++d)
+                {
+                    dv[d] = v[d][i] - v[d][j];
+                    dv_dx += dv[d] * dx[d];
+                }
+
+                // Sign-checked pressure gradient, from each side
+                const double Pj_rho2 = P0 * (rho_j / rho0 - 1.0) / (rho_j * rho_j);
+                double pressure_gradient_i = Pi_rho2 + Pj_rho2;
+                double pressure_gradient_j = pressure_gradient_i;
+                if (pressure_gradient_i < 0)
+                {
+                    pressure_gradient_i = -Pi_rho2 + Pj_rho2;
+                    pressure_gradient_j = -Pj_rho2 + Pi_rho2;
+                }
+
+                const double vol2 = vol2_i + (mass_j / rho_j) * (mass_j / rho_j);
+                const double nu_ij = 2.0 * (nu[i] * nu[j]) / (nu[i] + nu[j]) * ir_dWdr / (rho_i * rho_j);
+                const double fp_i = -1.0 * mass_j * pressure_gradient_i * ir_dWdr;
+                const double fp_j = -1.0 * mass_i * pressure_gradient_j * ir_dWdr;
+                const double fv_i = mass_j * nu_ij;
+                const double fv_j = mass_i * nu_ij;
+                const double fbp = -10.0 * P0 * vol2 * ir_dWdr;
+                const double ft = vol2 * ir_dWdr;
+
+                double a_i = 0.0;
+                double a_j = 0.0;
+                for (int d = 0; d < 3; ++d)
+                {
+                    a_i += (vt[d][i] - v[d][i]) * dx[d];
+                    a_j += (vt[d][j] - v[d][j]) * dx[d];
+                }
+                for (int d = 0; d < dimension; ++d)
+                {
+                    // The transport tensor term is the same from both sides, up to the 1/mass factor and sign
+                    const double transport = ft * 0.5 * (rho_i * v[d][i] * a_i + rho_j * v[d][j] * a_j);
+                    out.F[d][i] += fp_i * dx[d] + fv_i * dv[d] + transport / mass_i;
+                    out.F[d][j] -= fp_j * dx[d] + fv_j * dv[d] + transport / mass_j;
+                    out.Fbp[d][i] += fbp / mass_i * dx[d];
+                    out.Fbp[d][j] -= fbp / mass_j * dx[d];
+                }
+
+                // Density variation (the artificial density diffusion term of pairwise_force is disabled)
+                const double transport_rho = (rho_i * a_i + rho_j * a_j) * ir_dWdr;
+                out.Frho[i] += rho_i * (mass_j / rho_j) * dv_dx * ir_dWdr + (mass_j / rho_j) * transport_rho;
+                out.Frho[j] += rho_j * (mass_i / rho_i) * dv_dx * ir_dWdr - (mass_i / rho_i) * transport_rho;
+            }
+
+            // Chemical species diffusion flux (Tartakovsky et. al., 2007, JCP)
+            if (num_species > 0)
+            {
+                const double dQc_base = 2.0 * ((mass_i * mass_j) / (mass_i + mass_j)) * ((rho_i + rho_j) / (rho_i * rho_j))
+                                      * (r * r) * ir_dWdr / ((r * r) + 0.01 * h * h);
+                // Note: types start at 1
+                const double *diffusion_i = diffusion_matrix + num_species * (type[i] - 1);
+                const double *diffusion_j = diffusion_matrix + num_species * (type[j] - 1);
+                for (std::size_t s = 0; s < num_species; ++s)
+                {
+                    const double dC = (C[s][i] - C[s][j]) * dQc_base;
+                    out.Q[s][i] += diffusion_i[s] * dC;
+                    out.Q[s][j] -= diffusion_j[s] * dC;
+                }
+            }
+        }
+
+        reaction_flux(chem, i, state.data(), out.Q);
+    }
+}
+
+void GillesPy3D::ParticleStore::add_forces(const ForceAccumulator &sums, std::size_t begin, std::size_t end)
+{
+    if (m_fluid)
+    {
+        for (int d = 0; d < 3; ++d)
+        {
+            for (std::size_t i = begin; i < end; ++i)
+            {
+                F[d][i] += sums.F[d][i];
+                Fbp[d][i] += sums.Fbp[d][i];
+            }
+        }
+        for (std::size_t i = begin; i < end; ++i)
+        {
+            Frho[i] += sums.Frho[i];
+        }
+    }
+    for (std::size_t s = 0; s < Q.size(); ++s)
+    {
+        for (std::size_t i = begin; i < end; ++i)
+        {
+            Q[s][i] += sums.Q[s][i];
+        }
+    }
+}
+
+void GillesPy3D::ParticleStore::filter_density(const NeighborGraph &graph, std::size_t begin, std::size_t end)
+{
+    for (std::size_t i = begin; i < end; ++i)
+    {
+        double num = 0.0;
+        double den = 0.0;
+        for (std::size_t n = graph.begin(i); n < graph.end(i); ++n)
+        {
+            if (graph.dist[n] == 0.0)
+                continue;
+            const double Wij = graph.W[n];
+            num += old_rho[graph.index[n]] * Wij;
+            den += Wij;
+        }
+        rho[i] = num / den;
+    }
+}
+
+void GillesPy3D::ParticleStore::corrector_step(const SDPDParameters &params, std::size_t begin, std::size_t end)
+{
+    const double half_dt = 0.5 * params.dt;
+    if (m_fluid)
+    {
+        for (int d = 0; d < 3; ++d)
+        {
+            double *vd = v[d].data();
+            const double *Fd = F[d].data();
+            const int *solid = solid_tag.data();
+            for (std::size_t i = begin; i < end; ++i)
+            {
+                if (solid[i] == 0)
+                {
+                    vd[i] += half_dt * Fd[i];
+                }
+            }
+        }
+        for (std::size_t i = begin; i < end; ++i)
+        {
+            if (solid_tag[i] == 0)
+            {
+                rho[i] += half_dt * Frho[i];
+            }
+        }
+    }
+
+    for (std::size_t s = 0; s < C.size(); ++s)
+    {
+        double *Cs = C[s].data();
+        const double *Qs = Q[s].data();
+        for (std::size_t i = begin; i < end; ++i)
+        {
+            Cs[i] += Qs[i] * half_dt;
+        }
+    }
+}
+
+void GillesPy3D::ParticleStore::boundary_volume_fraction(
+        const NeighborGraph &graph,
+        const SDPDParameters &params,
+        std::size_t begin,
+        std::size_t end)
+{
+    if (!m_fluid)
+        return;
+    const int dimension = params.dimension;
+    const double h = params.h;
+
+    for (std::size_t i = begin; i < end; ++i)
+    {
+        if (solid_tag[i] != 0)
+            continue;
+
+        // Volume of solid (vos) and total volume (vtot) around particle i, and the numerator of
+        //   the normal vector pointing out of the nearby solid wall
+        double vos = 0.0;
+        double vtot = 0.0;
+        double nw[3] = { 0.0, 0.0, 0.0 };
+        for (std::size_t n = graph.begin(i); n < graph.end(i); ++n)
+        {
+            const double r = graph.dist[n];
+            if (r > h || r == 0.0)
+                continue;
+            const std::size_t j = graph.index[n];
+            const double vol2_j = (mass[j] / rho[j]) * (mass[j] / rho[j]);
+            vtot += vol2_j * graph.W[n];
+            if (solid_tag[j] != 0)
+            {
+                vos += vol2_j * graph.W[n];
+                for (int d = 0; d < dimension; ++d)
+                {
+                    nw[d] += vol2_j * (x[d][i] - x[d][j]) * graph.dWdr[n] / (r + 0.001 * h);
+                }
+            }
+        }
+
+        double normal[3];
+        double norm_nw = 0.0;
+        for (int d = 0; d < 3; ++d)
+        {
+            nw[d] /= vtot;
+            norm_nw += nw[d] * nw[d];
+        }
+        norm_nw = std::sqrt(norm_nw);
+        for (int d = 0; d < 3; ++d)
+        {
+            normal[d] = -nw[d] / norm_nw;
+        }
+        for (int d = 0; d < dimension; ++d)
+        {
+            vt[d][i] = 0.0;
+        }
+        bvf_phi[i] = std::fabs(vos / vtot);
+
+        // Bounce-back condition for fluid particles
+        if (bvf_phi[i] >= 0.5)
+        {
+            double v_dot_normal = 0.0;
+            for (int d = 0; d < 3; ++d)
+            {
+                v_dot_normal += v[d][i] * normal[d];
+            }
+            for (int d = 0; d < dimension; ++d)
+            {
+                v[d][i] = -v[d][i] + 2.0 * std::fmax(0.0, v_dot_normal) * normal[d];
+            }
+        }
+    }
+}
+
+std::size_t GillesPy3D::ParticleStore::find_non_finite(std::size_t begin, std::size_t end) const
+{
+    for (std::size_t i = begin; i < end; ++i)
+    {
+        bool finite = std::isfinite(rho[i]);
+        for (int d = 0; d < 3; ++d)
+        {
+            finite = finite && std::isfinite(x[d][i]) && (!m_fluid || std::isfinite(v[d][i]));
+        }
+        if (!finite)
+        {
+            return i;
+        }
+    }
+    return end;
+}
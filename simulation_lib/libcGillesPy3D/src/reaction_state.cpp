@@ -1,8 +1,47 @@
 #include "reaction_state.hpp"
+#include "error.hpp"
+
+#include <algorithm>
 
 GillesPy3D::ReactionState::ReactionState(const GillesPy3D::ParameterState &parameters)
     : m_parameters(parameters) {}
 
+std::size_t GillesPy3D::ReactionState::add_reaction(GillesPy3D::UniquePropensityFunction<sunrealtype> propensity,
+                                                    const GillesPy3D::ReactionVector &change,
+                                                    GillesPy3D::SimulationState mode)
+{
+    std::vector<std::size_t> reactants;
+    for (std::size_t spec = 0; spec < change.reactants_change.size(); ++spec)
+    {
+        if (change.reactants_change[spec] > 0)
+        {
+            reactants.push_back(spec);
+        }
+    }
+    return add_reaction(propensity, change, reactants, mode);
+}
+
+std::size_t GillesPy3D::ReactionState::add_reaction(GillesPy3D::UniquePropensityFunction<sunrealtype> propensity,
+                                                    const GillesPy3D::ReactionVector &change,
+                                                    const std::vector<std::size_t> &dependencies,
+                                                    GillesPy3D::SimulationState mode)
+{
+    if (change.reactants_change.size() != change.products_change.size())
+    {
+        std::string msg = "ReactionState::add_reaction: reactants change has " +
+                          std::to_string(change.reactants_change.size()) + " species, products change has " +
+                          std::to_string(change.products_change.size());
+        throw GillesPyError(msg.c_str());
+    }
+
+    m_propensity_impl.push_back(propensity);
+    m_changes.push_back(change);
+    m_dependencies.push_back(dependencies);
+    m_reaction_state.push_back(mode);
+    m_graph_valid = false;
+    return m_propensity_impl.size() - 1;
+}
+
 std::size_t GillesPy3D::ReactionState::size() const
 {
     return m_propensity_impl.size();
@@ -13,20 +52,200 @@ GillesPy3D::SimulationState GillesPy3D::ReactionState::mode(std::size_t reaction
     return m_reaction_state.at(reaction_id);
 }
 
+void GillesPy3D::ReactionState::set_mode(std::size_t reaction_id, GillesPy3D::SimulationState mode)
+{
+    m_reaction_state.at(reaction_id) = mode;
+    if (m_graph_valid && !m_stale[reaction_id])
+    {
+        m_stale[reaction_id] = 1;
+        m_stale_reactions.push_back(reaction_id);
+    }
+}
+
+const GillesPy3D::ReactionVector &GillesPy3D::ReactionState::change(std::size_t reaction_id) const
+{
+    return m_changes.at(reaction_id);
+}
+
+void GillesPy3D::ReactionState::set_species_mode(std::size_t species_id, GillesPy3D::SimulationState mode)
+{
+    if (species_id >= m_species_discrete.size())
+    {
+        m_species_discrete.resize(species_id + 1, 0);
+    }
+    m_species_discrete[species_id] = mode == SimulationState::DISCRETE;
+    m_graph_valid = false;
+}
+
+const std::vector<std::size_t> &GillesPy3D::ReactionState::dependents(std::size_t reaction_id)
+{
+    if (!m_graph_valid)
+    {
+        build_dependency_graph();
+    }
+    return m_reaction_dependents.at(reaction_id);
+}
+
+void GillesPy3D::ReactionState::mark_dirty(std::size_t species_id)
+{
+    if (!m_graph_valid)
+    {
+        // Everything is recomputed once the graph is rebuilt
+        return;
+    }
+    if (species_id < m_dirty.size() && !m_dirty[species_id])
+    {
+        m_dirty[species_id] = 1;
+        m_dirty_species.push_back(species_id);
+    }
+}
+
+void GillesPy3D::ReactionState::fire(std::size_t reaction_id)
+{
+    const ReactionVector &rxn_change = m_changes.at(reaction_id);
+    for (std::size_t spec = 0; spec < rxn_change.reactants_change.size(); ++spec)
+    {
+        if (rxn_change.products_change[spec] != rxn_change.reactants_change[spec])
+        {
+            mark_dirty(spec);
+        }
+    }
+}
+
+void GillesPy3D::ReactionState::invalidate()
+{
+    m_all_dirty = true;
+}
+
+void GillesPy3D::ReactionState::evaluate(std::size_t reaction_id, sunrealtype *y, sunrealtype *propensities) const
+{
+    switch (m_reaction_state[reaction_id]) {
+    case SimulationState::DISCRETE:
+        propensities[reaction_id] = m_propensity_impl[reaction_id](y, m_parameters.data());
+        break;
+
+    case SimulationState::CONTINUOUS:
+    default:
+        propensities[reaction_id] = 0;
+        break;
+    }
+}
+
 void GillesPy3D::ReactionState::ssa_propensity(sunrealtype *y, sunrealtype *propensities) const
 {
-    for (unsigned int rxn_i = 0; rxn_i < size(); ++rxn_i)
+    for (std::size_t rxn_i = 0; rxn_i < size(); ++rxn_i)
+    {
+        // Process stochastic reaction state by updating the root offset for each reaction.
+        evaluate(rxn_i, y, propensities);
+    }
+}
+
+void GillesPy3D::ReactionState::update_ssa_propensity(sunrealtype *y, sunrealtype *propensities)
+{
+    if (!m_graph_valid)
     {
-        switch (m_reaction_state[rxn_i]) {
-        case SimulationState::DISCRETE:
-            // Process stochastic reaction state by updating the root offset for each reaction.
-            propensities[rxn_i] = m_propensity_impl.at(rxn_i)(y, m_parameters.data());
-            break;
+        build_dependency_graph();
+    }
 
-        case SimulationState::CONTINUOUS:
-        default:
-            propensities[rxn_i] = 0;
-            break;
+    if (m_all_dirty)
+    {
+        ssa_propensity(y, propensities);
+        for (std::size_t spec : m_dirty_species)
+        {
+            m_dirty[spec] = 0;
+        }
+        for (std::size_t rxn_i : m_stale_reactions)
+        {
+            m_stale[rxn_i] = 0;
         }
+        m_dirty_species.clear();
+        m_stale_reactions.clear();
+        m_all_dirty = false;
+        return;
     }
+
+    for (std::size_t spec : m_dirty_species)
+    {
+        m_dirty[spec] = 0;
+        for (std::size_t rxn_i : m_species_dependents[spec])
+        {
+            if (!m_stale[rxn_i])
+            {
+                m_stale[rxn_i] = 1;
+                m_stale_reactions.push_back(rxn_i);
+            }
+        }
+    }
+    m_dirty_species.clear();
+
+    for (std::size_t rxn_i : m_volatile_reactions)
+    {
+        evaluate(rxn_i, y, propensities);
+    }
+    for (std::size_t rxn_i : m_stale_reactions)
+    {
+        m_stale[rxn_i] = 0;
+        evaluate(rxn_i, y, propensities);
+    }
+    m_stale_reactions.clear();
+}
+
+void GillesPy3D::ReactionState::build_dependency_graph()
+{
+    std::size_t num_species = m_species_discrete.size();
+    for (std::size_t rxn_i = 0; rxn_i < size(); ++rxn_i)
+    {
+        num_species = std::max(num_species, m_changes[rxn_i].reactants_change.size());
+        for (std::size_t spec : m_dependencies[rxn_i])
+        {
+            num_species = std::max(num_species, spec + 1);
+        }
+    }
+    m_species_discrete.resize(num_species, 0);
+
+    m_species_dependents.assign(num_species, {});
+    m_volatile_reactions.clear();
+    for (std::size_t rxn_i = 0; rxn_i < size(); ++rxn_i)
+    {
+        bool is_volatile = false;
+        for (std::size_t spec : m_dependencies[rxn_i])
+        {
+            m_species_dependents[spec].push_back(rxn_i);
+            is_volatile |= !m_species_discrete[spec];
+        }
+        if (is_volatile)
+        {
+            m_volatile_reactions.push_back(rxn_i);
+        }
+    }
+    for (std::vector<std::size_t> &dependents : m_species_dependents)
+    {
+        std::sort(dependents.begin(), dependents.end());
+        dependents.erase(std::unique(dependents.begin(), dependents.end()), dependents.end());
+    }
+
+    // A reaction affects the propensities reading any species it changes
+    m_reaction_dependents.assign(size(), {});
+    for (std::size_t rxn_i = 0; rxn_i < size(); ++rxn_i)
+    {
+        const ReactionVector &rxn_change = m_changes[rxn_i];
+        std::vector<std::size_t> &dependents = m_reaction_dependents[rxn_i];
+        for (std::size_t spec = 0; spec < rxn_change.reactants_change.size(); ++spec)
+        {
+            if (rxn_change.products_change[spec] != rxn_change.reactants_change[spec])
+            {
+                dependents.insert(dependents.end(),
+                                  m_species_dependents[spec].begin(), m_species_dependents[spec].end());
+            }
+        }
+        std::sort(dependents.begin(), dependents.end());
+        dependents.erase(std::unique(dependents.begin(), dependents.end()), dependents.end());
+    }
+
+    m_dirty.assign(num_species, 0);
+    m_dirty_species.clear();
+    m_stale.assign(size(), 0);
+    m_stale_reactions.clear();
+    m_all_dirty = true;
+    m_graph_valid = true;
 }
@@ -23,6 +23,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #include <stdio.h>
 #include <stdlib.h>
 
+#include "particle.hpp"
 #include "particle_system.hpp"
 
 namespace GillesPy3D{
@@ -30,7 +31,8 @@ namespace GillesPy3D{
     void pairwiseForce(Particle* me, ParticleSystem* system)
     {
         // F, Frho and Fbp are output
-        std::vector<NeighborNode> neighbors = me->neighbors;
+        const NeighborGraph &graph = system->neighbor_graph;
+        std::size_t row = system->index_of(me);
         //printf("pairwiseForce(id=%i)\n",me->id);
         //fflush(stdout);
 
@@ -71,11 +73,11 @@ namespace GillesPy3D{
         //fflush(stdout);
 
         // Compute force from each neighbor
-        for (auto n = neighbors.begin(); n != neighbors.end(); n = ++n) {
-            pt_j = n->data;
+        for (std::size_t n = graph.begin(row); n < graph.end(row); n++) {
+            pt_j = &system->particles[graph.index[n]];
 
             //r = particle_dist(me, pt_j);
-            r = n->dist;
+            r = graph.dist[n];
             R = r / h;
             //printf("pairwiseForce(id=%i) pt_j->id=%i r=%e R=%e\n",me->id,pt_j->id,r,R);
             //fflush(stdout);
@@ -86,7 +88,7 @@ namespace GillesPy3D{
             // Compute weight function and weight function derivative
             // dWdr = (5/(pi*(h^2))) * (-12*r/(h^2)) * (1 - r/h)^2;
             //dWdr = alpha * (-12 * r / (h * h)) * pow(1 - R, 2);
-            dWdr = n->dWdr;
+            dWdr = graph.dWdr[n];
             // Spatial deriviatives
             dv_dx = 0.0;
             for (i = 0; i < system->dimension; i++) {
@@ -172,10 +174,11 @@ namespace GillesPy3D{
         double vol = (me->mass / me->rho);
         double cur_time = system->current_step * system->dt;
         for(rxn=0; rxn < system->num_chem_rxns; rxn++){
+            // Only the species changed by the reaction: the non-zeros of its column of the stoichiometry
+            if(system->stoich_jcN[rxn] == system->stoich_jcN[rxn + 1]) continue;
             double flux = (*system->chem_rxn_rhs_functions[rxn])(me->C, cur_time, vol , me->data_fn, me->type);
-            for(s=0; s< system->num_chem_species; s++){
-                int k = system->num_chem_rxns * rxn + s;
-                me->Q[s] += system->stoichiometric_matrix[k] * flux;
+            for(std::size_t k = system->stoich_jcN[rxn]; k < system->stoich_jcN[rxn + 1]; k++){
+                me->Q[system->stoich_irN[k]] += system->stoich_prN[k] * flux;
             }
         }
 
@@ -184,32 +187,23 @@ namespace GillesPy3D{
 
     void filterDensity(Particle* me, ParticleSystem* system)
     {
-      std::vector<NeighborNode> neighbors = me->neighbors;
+      const NeighborGraph &graph = system->neighbor_graph;
+      std::size_t row = system->index_of(me);
       Particle* pt_j;
-      double r, R, Wij, alpha, num, den;
+      double r, R, Wij, num, den;
       double h = system->h;
-      if(system->dimension==3){
-          alpha = 105/(16*M_PI*h*h*h); //3D
-      }else if(system->dimension==2){
-          alpha = 5/(M_PI*h*h); //2D
-      }else if(system->dimension==1){
-          alpha = 5 / 4 * h ; //1D
-      }else{
-          printf("Not 1D, 2D, or 3D\n");exit(1);
-      }
       num = 0.0;
       den = 0.0;
 
-      for(auto n=neighbors.begin(); n!=neighbors.end(); n = ++n){
-          pt_j = n->data;
-          r = n->dist;
+      for(std::size_t n = graph.begin(row); n < graph.end(row); n++){
+          pt_j = &system->particles[graph.index[n]];
+          r = graph.dist[n];
           R = r/h;
           if(R > 1.0) continue;
           if(r == 0.0) continue;
 
-          // Compute weight function
-          //Wij = (5/(M_PI*pow(h,2))) * (1+3*r/h) * pow((1-r/h),3) ;
-          Wij = alpha*( (1+3*R) * pow( 1-R,3));
+          // Weight function, evaluated when the neighbor graph was built
+          Wij = graph.W[n];
 
           //Compute numerator of Shepard filter
           num += pt_j->old_rho * Wij;
@@ -226,20 +220,12 @@ namespace GillesPy3D{
 
     void computeBoundaryVolumeFraction(Particle* me, ParticleSystem* system)
     {
-        std::vector<NeighborNode> neighbors = me->neighbors;
+        const NeighborGraph &graph = system->neighbor_graph;
+        std::size_t row = system->index_of(me);
         Particle* pt_j;
-        double r, R, Wij, dWdr, alpha, vos, vtot, nw[3], dx[3], norm_nw;
+        double r, R, Wij, dWdr, vos, vtot, nw[3], dx[3], norm_nw;
         int i;
         double h = system->h;
-        if(system->dimension==3){
-            alpha = 105/(16*M_PI*h*h*h); //3D
-        }else if(system->dimension==2){
-            alpha = 5/(M_PI*h*h); //2D
-        }else if(system->dimension==1){
-            alpha = 5 / 4 * h ; //1D
-        }else{
-            printf("Not 1D, 2D, or 3D\n");exit(1);
-        }
 
         for (i = 0; i < 3; i++) {
             nw[i] = 0.0;
@@ -253,9 +239,9 @@ namespace GillesPy3D{
         me->bvf_phi = 0.0;
         vos = 0.0;
         vtot = 0.0;
-        for (auto n = neighbors.begin(); n != neighbors.end(); ++n) {
-            pt_j = n->data;
-            r = n->dist;
+        for (std::size_t n = graph.begin(row); n < graph.end(row); n++) {
+            pt_j = &system->particles[graph.index[n]];
+            r = graph.dist[n];
             R = r / h;
             if (R > 1.0)
                 continue;
@@ -263,9 +249,9 @@ namespace GillesPy3D{
                 continue;
             // Compute weight function and weight function derivative
             // Wij = (5/(M_PI*pow(h,2))) * (1+3*r/h) * pow((1-r/h),3) ;
-            Wij = alpha * ((1 + 3 * R) * pow(1 - R, 3));
+            Wij = graph.W[n];
             //dWdr = alpha * (-12 * r / (h * h)) * pow(1 - R, 2);
-            dWdr = n->dWdr;
+            dWdr = graph.dWdr[n];
 
             for (i = 0; i < system->dimension; i++) {
                 dx[i] = (me->x[i] - pt_j->x[i]);
@@ -0,0 +1,125 @@
+#include <algorithm>
+#include <cmath>
+
+#include "simulate_rdme.hpp"
+#include "error.hpp"
+#include "particle_system.hpp"
+
+GillesPy3D::RDMESimulation::RDMESimulation(
+        const ParticleSystem &system,
+        const std::size_t *irN, const std::size_t *jcN, const int *prN,
+        const std::size_t *irG, const std::size_t *jcG, const unsigned int *u0)
+    : m_num_species(system.num_stoch_species), m_u0(u0), m_rng(std::random_device()())
+{
+    switch (system.rdme_method)
+    {
+    case RDME_NSM:
+        m_nsm = std::make_unique<NextSubvolumeMethod>(system.num_stoch_species, system.num_stoch_rxns,
+                                                      irN, jcN, prN, irG, jcG, system.stoch_rxn_propensity_functions);
+        break;
+    case RDME_TAU_LEAPING:
+        m_tau = std::make_unique<SpatialTauLeaping>(system.num_stoch_species, system.num_stoch_rxns,
+                                                    irN, jcN, prN, system.stoch_rxn_propensity_functions,
+                                                    system.tau_tol);
+        break;
+    case RDME_HYBRID:
+        if (system.hybrid_propensity_functions == nullptr || system.chem_rxn_rhs_functions == nullptr)
+        {
+            throw GillesPyError("RDMESimulation: rdme_method is RDME_HYBRID but hybrid_propensity_functions or "
+                                "chem_rxn_rhs_functions is not set");
+        }
+        // Tolerances of the TauHybrid solver
+        m_hybrid = std::make_unique<SpatialHybrid>(system.num_stoch_species, system.num_stoch_rxns, irN, jcN, prN,
+                                                   system.hybrid_propensity_functions,
+                                                   system.chem_rxn_rhs_functions,
+                                                   system.hybrid_species, IntegratorConfiguration{1e-3, 1e-6, 0.0});
+        break;
+    default:
+        throw GillesPyError("RDMESimulation: unknown rdme_method");
+    }
+}
+
+void GillesPy3D::RDMESimulation::reset(unsigned long long seed)
+{
+    m_state.clear();
+    m_hybrid_state.clear();
+    m_time = 0.0;
+    m_initialized = false;
+    m_rng.seed(seed);
+}
+
+unsigned int GillesPy3D::RDMESimulation::population(std::size_t voxel, std::size_t s) const
+{
+    const std::size_t i = m_num_species * voxel + s;
+    if (!m_hybrid_state.empty())
+    {
+        return static_cast<unsigned int>(std::lround(std::max(m_hybrid_state[i], 0.0)));
+    }
+    const unsigned int *state = m_state.empty() ? m_u0 : m_state.data();
+    return state[i];
+}
+
+void GillesPy3D::RDMESimulation::initialize(ParticleSystem &system)
+{
+    ParticleStore &store = system.particle_store;
+    const std::size_t num_voxels = store.size();
+    if (m_hybrid && m_hybrid_state.empty())
+    {
+        m_hybrid_state.assign(m_u0, m_u0 + m_num_species * num_voxels);
+    }
+    else if (!m_hybrid && m_state.empty())
+    {
+        m_state.assign(m_u0, m_u0 + m_num_species * num_voxels);
+    }
+    m_volume.resize(num_voxels);
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        m_volume[voxel] = store.mass[voxel] / store.rho[voxel];
+    }
+    double *data = store.num_data_fn() > 0 ? store.data_fn.data() : nullptr;
+
+    if (m_nsm)
+    {
+        m_nsm->initialize(system.neighbor_graph, system.subdomain_diffusion_matrix, system.num_types,
+                          m_volume, store.type, data, store.num_data_fn(), m_state.data(), m_time, m_rng);
+    }
+    else if (m_tau)
+    {
+        m_tau->initialize(system.neighbor_graph, system.subdomain_diffusion_matrix, system.num_types,
+                          m_volume, store.type, data, store.num_data_fn(), m_state.data(), m_time);
+    }
+    else
+    {
+        m_hybrid->initialize(system.neighbor_graph, system.subdomain_diffusion_matrix, system.num_types,
+                             m_volume, store.type, data, store.num_data_fn(), m_hybrid_state.data(), m_time);
+    }
+    m_initialized = true;
+}
+
+void GillesPy3D::RDMESimulation::advance(ParticleSystem &system, double end_time)
+{
+    // Volumes, neighbors and their diffusion coefficients change with the particles of a moving domain
+    if (!m_initialized || !system.static_domain)
+    {
+        initialize(system);
+    }
+    if (m_nsm)
+    {
+        m_nsm->advance(end_time, m_rng);
+    }
+    else if (m_tau)
+    {
+        m_tau->advance(end_time, m_rng);
+    }
+    else
+    {
+        m_hybrid->advance(end_time, m_rng);
+    }
+    m_time = end_time;
+}
+
+void GillesPy3D::initialize_rdme(ParticleSystem *system, const size_t *irN, const size_t *jcN, const int *prN,
+                                 const size_t *irG, const size_t *jcG, const unsigned int *u0)
+{
+    system->rdme = std::make_unique<RDMESimulation>(*system, irN, jcN, prN, irG, jcG, u0);
+}
@@ -1,4 +1,6 @@
 #include "simulation.hpp"
+#include "error.hpp"
+#include "propensities.hpp"
 #include <iostream>
 
 
@@ -22,7 +24,7 @@
 
 
 GillesPy3D::Simulation::Simulation(GillesPy3D::ModelContext &context)
-    : context(context)
+    : context(&context), thread_pool(std::make_unique<ThreadPool>(1))
 {
     double test_state[2] = {1.23, 4.56};
     double test_parameters[1] = {2.5};
@@ -30,38 +32,156 @@ GillesPy3D::Simulation::Simulation(GillesPy3D::ModelContext &context)
 }
 
 
+GillesPy3D::Simulation::Simulation(GillesPy3D::ModelContext &context, GillesPy3D::ParticleSystem &system, std::size_t num_threads)
+    : context(&context), system(&system), thread_pool(std::make_unique<ThreadPool>(num_threads))
+{
+}
+
+GillesPy3D::Simulation::Simulation(GillesPy3D::ParticleSystem &system, std::size_t num_threads)
+    : system(&system), thread_pool(std::make_unique<ThreadPool>(num_threads))
+{
+}
+
+void GillesPy3D::Simulation::set_num_threads(std::size_t num_threads)
+{
+    thread_pool = std::make_unique<ThreadPool>(num_threads);
+}
+
+std::size_t GillesPy3D::Simulation::get_num_threads() const
+{
+    return thread_pool->size();
+}
+
+
 void GillesPy3D::Simulation::reset(){
     // set t=0, re-set initial conditions
 }
 
 void GillesPy3D::Simulation::run_until(double t)
 {
-    // TODO
-    // while current_time < t
-        // foreach particle
-            // find neighbors (1st step, all steps if non-static)
-            // find max tau
-        // foreach particle
-            // integrate forward by tau
+    if (system == nullptr)
+    {
+        throw GillesPyError("Simulation::run_until: no particle system to simulate");
+    }
 
+    // Each step runs its particle loops on the thread pool, and includes the deterministic reactions and
+    //   the boundary conditions (see ParticleSystem::take_step)
+    while (system->current_step < system->nt && system->current_step * system->dt < t)
+    {
+        system->take_step(*thread_pool);
+    }
 }
 
-double *GillesPy3D::Simulation::get_species(const std::string &species_name)
+void GillesPy3D::Simulation::run_trajectories(unsigned long long seed, const std::vector<std::string> &output_directories)
 {
-    // TODO
-    return new double[32];
+    if (system == nullptr)
+    {
+        throw GillesPyError("Simulation::run_trajectories: no particle system to simulate");
+    }
+    if (system->next_output_function == nullptr)
+    {
+        throw GillesPyError("Simulation::run_trajectories: the particle system has no next_output_function");
+    }
+
+    system->save_initial_state();
+    for (std::size_t trajectory = 0; trajectory < output_directories.size(); ++trajectory)
+    {
+        const std::string &directory = output_directories[trajectory];
+        system->begin_trajectory(seed + trajectory, directory);
+
+        // One output per time point of the tspan: next_output_function returns them in order, from step 0
+        unsigned int next_output_step = system->next_output_function(system);
+        while (system->current_step < system->nt)
+        {
+            if (system->current_step >= next_output_step)
+            {
+                system->output_step(system->current_step);
+                next_output_step = system->next_output_function(system);
+            }
+            system->take_step(*thread_pool);
+        }
+        // The last time point, at step nt, is reached after the last step
+        if (system->current_step >= next_output_step)
+        {
+            system->output_step(system->current_step);
+        }
+        system->output_writer.finish();
+        system->write_run_stats((directory.empty() ? std::string("stats.txt") : directory + "/stats.txt").c_str());
+    }
 }
 
-double *GillesPy3D::Simulation::get_property(const std::string &property_name)
+GillesPy3D::ParticleStore &GillesPy3D::Simulation::particle_state()
 {
-    // TODO
-    return new double[32];
+    if (system == nullptr)
+    {
+        throw GillesPyError("Simulation: no particle system to read the state of");
+    }
+    system->sync_particle_store();
+    return system->particle_store;
 }
 
-double *GillesPy3D::Simulation::get_position()
+std::size_t GillesPy3D::Simulation::get_num_particles()
 {
-    // TODO
-    return new double[32];
+    return particle_state().size();
+}
+
+GillesPy3D::ArrayView GillesPy3D::Simulation::get_species(const std::string &species_name)
+{
+    ParticleStore &state = particle_state();
+    const std::vector<std::string> &names = system->output_species_names.chem;
+    for (std::size_t s = 0; s < names.size() && s < state.num_chem_species(); ++s)
+    {
+        if (names[s] == species_name)
+        {
+            return ArrayView::of(state.C[s].data(), state.size());
+        }
+    }
+    throw GillesPyError(("Simulation::get_species: no continuous species named '" + species_name + "'").c_str());
+}
+
+GillesPy3D::ArrayView GillesPy3D::Simulation::get_property(const std::string &property_name, unsigned int component)
+{
+    ParticleStore &state = particle_state();
+    const std::size_t n = state.size();
+    if (property_name == "rho")
+    {
+        return ArrayView::of(state.rho.data(), n);
+    }
+    if (property_name == "mass")
+    {
+        return ArrayView::of(state.mass.data(), n);
+    }
+    if (property_name == "type")
+    {
+        return ArrayView::of(state.type.data(), n);
+    }
+    if (property_name == "nu" || property_name == "v")
+    {
+        if (!state.has_fluid_fields())
+        {
+            throw GillesPyError(("Simulation::get_property: '" + property_name + "' is only stored for fluid domains").c_str());
+        }
+        if (property_name == "nu")
+        {
+            return ArrayView::of(state.nu.data(), n);
+        }
+        if (component > 2)
+        {
+            throw GillesPyError("Simulation::get_property: velocity component must be 0, 1 or 2");
+        }
+        return ArrayView::of(state.v[component].data(), n);
+    }
+    throw GillesPyError(("Simulation::get_property: unknown property '" + property_name + "'").c_str());
+}
+
+GillesPy3D::ArrayView GillesPy3D::Simulation::get_position(unsigned int axis)
+{
+    ParticleStore &state = particle_state();
+    if (axis > 2)
+    {
+        throw GillesPyError("Simulation::get_position: axis must be 0, 1 or 2");
+    }
+    return ArrayView::of(state.x[axis].data(), state.size());
 }
 
 void GillesPy3D::Simulation::output_vtk(const std::string &output_directory)
@@ -0,0 +1,428 @@
+#include "spatial_hybrid.hpp"
+#include "error.hpp"
+
+#include <algorithm>
+#include <cmath>
+#include <string>
+
+namespace
+{
+    // Steps the coefficients of variation are averaged over, as in TauHybrid's partition_species()
+    constexpr std::size_t history_length = 12;
+}
+
+GillesPy3D::SpatialHybrid::SpatialHybrid(
+        std::size_t num_species, std::size_t num_reactions,
+        const std::size_t *irN, const std::size_t *jcN, const int *prN,
+        const ChemRxnFun *ssa_propensities, const ChemRxnFun *ode_propensities,
+        const std::vector<HybridSpeciesMode> &species_modes, IntegratorConfiguration config)
+    : m_num_species(num_species), m_num_reactions(num_reactions),
+      m_irN(irN), m_jcN(jcN), m_prN(prN),
+      m_ssa_propensities(ssa_propensities), m_ode_propensities(ode_propensities),
+      m_species_modes(species_modes), m_config(config), m_concentration(num_species, 0.0)
+{
+    if (m_species_modes.size() != num_species)
+    {
+        throw GillesPyError("SpatialHybrid: one mode is needed per species");
+    }
+}
+
+GillesPy3D::SpatialHybrid::~SpatialHybrid()
+{
+    CVodeFree(&m_cvode_mem);
+    if (m_solver != nullptr)
+    {
+        SUNLinSolFree(m_solver);
+    }
+    if (m_y != nullptr)
+    {
+        N_VDestroy_Serial(m_y);
+    }
+}
+
+void GillesPy3D::SpatialHybrid::initialize(
+        const NeighborGraph &graph, const double *diffusion_matrix, std::size_t num_types,
+        const std::vector<double> &volume, const std::vector<int> &type,
+        double *data, std::size_t num_data_fn, double *state, double t)
+{
+    const std::size_t num_voxels = volume.size();
+    if (type.size() != num_voxels || graph.size() != num_voxels)
+    {
+        throw GillesPyError("SpatialHybrid: volume, type and neighbor graph sizes differ");
+    }
+    m_graph = &graph;
+    m_volume = volume;
+    m_type = type;
+    m_data = data;
+    m_num_data_fn = num_data_fn;
+    m_state = state;
+    m_time = t;
+    m_diffusion.compute(graph, diffusion_matrix, num_types, m_type, m_num_species);
+
+    // Dynamic species start discrete; the first advance() partitions them
+    m_continuous.resize(num_voxels * m_num_species);
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        for (std::size_t s = 0; s < m_num_species; ++s)
+        {
+            m_continuous[m_num_species * voxel + s] = m_species_modes[s].mode == SimulationState::CONTINUOUS;
+        }
+    }
+    m_reaction_continuous.assign(num_voxels * m_num_reactions, 0);
+    m_cv_history.assign(num_voxels * m_num_species * history_length, 0.0);
+    m_mean.assign(num_voxels * m_num_species, 0.0);
+    m_variance.assign(num_voxels * m_num_species, 0.0);
+    m_voxel_rate.assign(num_voxels, 0.0);
+    m_steps = 0;
+
+    const std::size_t size = num_voxels * m_num_species;
+    CVodeFree(&m_cvode_mem);
+    if (m_solver != nullptr)
+    {
+        SUNLinSolFree(m_solver);
+    }
+    if (m_y != nullptr)
+    {
+        N_VDestroy_Serial(m_y);
+    }
+    m_y = N_VNew_Serial(static_cast<sunindextype>(size), *m_context);
+    std::copy(m_state, m_state + size, N_VGetArrayPointer(m_y));
+
+    m_cvode_mem = CVodeCreate(CV_BDF, *m_context);
+    check(CVodeInit(m_cvode_mem, rhs, m_time, m_y), "CVodeInit");
+    check(CVodeSStolerances(m_cvode_mem, m_config.rel_tol, m_config.abs_tol), "CVodeSStolerances");
+    if (m_config.max_step > 0.0)
+    {
+        check(CVodeSetMaxStep(m_cvode_mem, m_config.max_step), "CVodeSetMaxStep");
+    }
+    check(CVodeSetUserData(m_cvode_mem, this), "CVodeSetUserData");
+    m_solver = SUNLinSol_SPGMR(m_y, SUN_PREC_NONE, 0, *m_context);
+    check(CVodeSetLinearSolver(m_cvode_mem, m_solver, nullptr), "CVodeSetLinearSolver");
+}
+
+std::size_t GillesPy3D::SpatialHybrid::num_continuous() const
+{
+    return static_cast<std::size_t>(std::count(m_continuous.begin(), m_continuous.end(), 1));
+}
+
+double GillesPy3D::SpatialHybrid::ssa_propensity(std::size_t reaction, std::size_t voxel, double *x, double t) const
+{
+    double *data = m_data != nullptr ? m_data + m_num_data_fn * voxel : nullptr;
+    // Continuous populations may dip slightly below zero during integration
+    return std::max(m_ssa_propensities[reaction](x, t, m_volume[voxel], data, m_type[voxel]), 0.0);
+}
+
+double GillesPy3D::SpatialHybrid::ode_propensity(std::size_t reaction, std::size_t voxel, const double *c, double t) const
+{
+    double *data = m_data != nullptr ? m_data + m_num_data_fn * voxel : nullptr;
+    // The deterministic rate is per unit volume
+    return m_volume[voxel] * m_ode_propensities[reaction](c, t, m_volume[voxel], data, m_type[voxel]);
+}
+
+double GillesPy3D::SpatialHybrid::edge_rate(std::size_t voxel, std::size_t e, std::size_t s) const
+{
+    const double *cdf = m_diffusion.cdf.data() + m_graph->num_edges() * s;
+    return e == m_graph->begin(voxel) ? cdf[e] : cdf[e] - cdf[e - 1];
+}
+
+bool GillesPy3D::SpatialHybrid::diffusion_continuous(std::size_t voxel, std::size_t neighbor, std::size_t s) const
+{
+    return m_continuous[m_num_species * voxel + s] && m_continuous[m_num_species * neighbor + s];
+}
+
+void GillesPy3D::SpatialHybrid::partition()
+{
+    const std::size_t num_voxels = m_volume.size();
+    std::copy(m_state, m_state + num_voxels * m_num_species, m_mean.begin());
+    std::fill(m_variance.begin(), m_variance.end(), 0.0);
+
+    // Expected change and variance of every population per unit time (as in TauHybrid's partition_species()),
+    //   from the reactions in its voxel and the diffusion jumps out of and into it
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        double *x = m_state + m_num_species * voxel;
+        for (std::size_t r = 0; r < m_num_reactions; ++r)
+        {
+            const double firings = ssa_propensity(r, voxel, x, m_time);
+            for (std::size_t k = m_jcN[r]; k < m_jcN[r + 1]; ++k)
+            {
+                m_mean[m_num_species * voxel + m_irN[k]] += m_prN[k] * firings;
+                m_variance[m_num_species * voxel + m_irN[k]] += static_cast<double>(m_prN[k]) * m_prN[k] * firings;
+            }
+        }
+        for (std::size_t s = 0; s < m_num_species; ++s)
+        {
+            for (std::size_t e = m_graph->begin(voxel); e < m_graph->end(voxel) && x[s] > 0.0; ++e)
+            {
+                const double jumps = edge_rate(voxel, e, s) * x[s];
+                const std::size_t neighbor = m_num_species * m_graph->index[e] + s;
+                m_mean[m_num_species * voxel + s] -= jumps;
+                m_variance[m_num_species * voxel + s] += jumps;
+                m_mean[neighbor] += jumps;
+                m_variance[neighbor] += jumps;
+            }
+        }
+    }
+
+    // Select the mode of the dynamic pairs from their time-averaged coefficient of variation
+    const std::size_t slot = m_steps % history_length;
+    const std::size_t history_size = std::min<std::size_t>(m_steps + 1, history_length);
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        for (std::size_t s = 0; s < m_num_species; ++s)
+        {
+            const HybridSpeciesMode &mode = m_species_modes[s];
+            if (mode.mode != SimulationState::DYNAMIC)
+            {
+                continue;
+            }
+            const std::size_t pair = m_num_species * voxel + s;
+            double *history = m_cv_history.data() + history_length * pair;
+            history[slot] = m_mean[pair] > 0.0 && m_variance[pair] > 0.0
+                ? std::sqrt(m_variance[pair]) / m_mean[pair] : 1.0;
+            double cv_sum = 0.0;
+            for (std::size_t i = 0; i < history_size; ++i)
+            {
+                cv_sum += history[i];
+            }
+            const bool continuous = mode.switch_min == 0
+                ? cv_sum / history_size < mode.switch_tol
+                : m_mean[pair] > mode.switch_min;
+            if (continuous != static_cast<bool>(m_continuous[pair]))
+            {
+                m_continuous[pair] = continuous;
+                ++m_switches;
+                if (!continuous)
+                {
+                    m_state[pair] = std::max(std::round(m_state[pair]), 0.0);
+                }
+            }
+        }
+    }
+    ++m_steps;
+
+    // A reaction is continuous where every species it changes is
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        for (std::size_t r = 0; r < m_num_reactions; ++r)
+        {
+            bool continuous = true;
+            for (std::size_t k = m_jcN[r]; k < m_jcN[r + 1] && continuous; ++k)
+            {
+                continuous = m_continuous[m_num_species * voxel + m_irN[k]];
+            }
+            m_reaction_continuous[m_num_reactions * voxel + r] = continuous;
+        }
+    }
+}
+
+void GillesPy3D::SpatialHybrid::derivative(double t, double *y, double *dydt)
+{
+    const std::size_t num_voxels = m_volume.size();
+    std::fill(dydt, dydt + num_voxels * m_num_species, 0.0);
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        double *x = y + m_num_species * voxel;
+        double *dx = dydt + m_num_species * voxel;
+        const char *reaction_continuous = m_reaction_continuous.data() + m_num_reactions * voxel;
+        if (std::find(reaction_continuous, reaction_continuous + m_num_reactions, 1)
+            != reaction_continuous + m_num_reactions)
+        {
+            for (std::size_t s = 0; s < m_num_species; ++s)
+            {
+                m_concentration[s] = x[s] / m_volume[voxel];
+            }
+        }
+        for (std::size_t r = 0; r < m_num_reactions; ++r)
+        {
+            if (!reaction_continuous[r])
+            {
+                continue;
+            }
+            const double rate = ode_propensity(r, voxel, m_concentration.data(), t);
+            for (std::size_t k = m_jcN[r]; k < m_jcN[r + 1]; ++k)
+            {
+                dx[m_irN[k]] += m_prN[k] * rate;
+            }
+        }
+        for (std::size_t s = 0; s < m_num_species; ++s)
+        {
+            if (!m_continuous[m_num_species * voxel + s])
+            {
+                continue;
+            }
+            for (std::size_t e = m_graph->begin(voxel); e < m_graph->end(voxel); ++e)
+            {
+                if (diffusion_continuous(voxel, m_graph->index[e], s))
+                {
+                    const double flux = edge_rate(voxel, e, s) * x[s];
+                    dx[s] -= flux;
+                    dydt[m_num_species * m_graph->index[e] + s] += flux;
+                }
+            }
+        }
+    }
+}
+
+double GillesPy3D::SpatialHybrid::stochastic_rate(std::size_t voxel, double t)
+{
+    double *x = m_state + m_num_species * voxel;
+    const char *reaction_continuous = m_reaction_continuous.data() + m_num_reactions * voxel;
+    double rate = 0.0;
+    for (std::size_t r = 0; r < m_num_reactions; ++r)
+    {
+        rate += reaction_continuous[r] ? 0.0 : ssa_propensity(r, voxel, x, t);
+    }
+    for (std::size_t s = 0; s < m_num_species; ++s)
+    {
+        if (!(x[s] > 0.0))
+        {
+            continue;
+        }
+        if (!m_continuous[m_num_species * voxel + s])
+        {
+            rate += m_diffusion.rate[m_num_species * voxel + s] * x[s];
+            continue;
+        }
+        for (std::size_t e = m_graph->begin(voxel); e < m_graph->end(voxel); ++e)
+        {
+            rate += diffusion_continuous(voxel, m_graph->index[e], s) ? 0.0 : edge_rate(voxel, e, s) * x[s];
+        }
+    }
+    return rate;
+}
+
+std::pair<std::size_t, std::size_t> GillesPy3D::SpatialHybrid::execute_event(double t, double total,
+                                                                             std::mt19937_64 &rng)
+{
+    const std::size_t num_voxels = m_volume.size();
+    double u = m_uniform(rng) * total;
+    std::size_t voxel = 0;
+    while (u >= m_voxel_rate[voxel] && voxel + 1 < num_voxels)
+    {
+        u -= m_voxel_rate[voxel++];
+    }
+    double *x = m_state + m_num_species * voxel;
+    const char *reaction_continuous = m_reaction_continuous.data() + m_num_reactions * voxel;
+    for (std::size_t r = 0; r < m_num_reactions; ++r)
+    {
+        const double rate = reaction_continuous[r] ? 0.0 : ssa_propensity(r, voxel, x, t);
+        if (u < rate)
+        {
+            for (std::size_t k = m_jcN[r]; k < m_jcN[r + 1]; ++k)
+            {
+                x[m_irN[k]] += m_prN[k];
+            }
+            ++m_stochastic_events;
+            return { voxel, voxel };
+        }
+        u -= rate;
+    }
+    // Otherwise a diffusion jump; if rounding leaves u past the last channel, the last one with a nonzero rate fires
+    std::size_t edge = m_graph->num_edges();
+    std::size_t species = 0;
+    bool found = false;
+    for (std::size_t s = 0; s < m_num_species && !found; ++s)
+    {
+        for (std::size_t e = m_graph->begin(voxel); e < m_graph->end(voxel) && x[s] > 0.0 && !found; ++e)
+        {
+            const double rate = diffusion_continuous(voxel, m_graph->index[e], s) ? 0.0 : edge_rate(voxel, e, s) * x[s];
+            if (rate > 0.0)
+            {
+                edge = e;
+                species = s;
+                found = u < rate;
+                u -= rate;
+            }
+        }
+    }
+    if (edge == m_graph->num_edges())
+    {
+        return { voxel, voxel };
+    }
+    const std::size_t neighbor = m_graph->index[edge];
+    x[species] -= 1.0;
+    m_state[m_num_species * neighbor + species] += 1.0;
+    ++m_stochastic_events;
+    return { voxel, neighbor };
+}
+
+void GillesPy3D::SpatialHybrid::simulate_stochastic(double end_time, std::mt19937_64 &rng)
+{
+    const std::size_t num_voxels = m_volume.size();
+    double total = 0.0;
+    for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+    {
+        total += (m_voxel_rate[voxel] = stochastic_rate(voxel, m_time));
+    }
+
+    double t = m_time;
+    std::size_t events = 0;
+    while (total > 0.0)
+    {
+        t += m_exponential(rng) / total;
+        if (t >= end_time)
+        {
+            break;
+        }
+        // Only the one or two voxels of the event change their rate
+        const auto [voxel, neighbor] = execute_event(t, total, rng);
+        const double old_rate = m_voxel_rate[voxel] + (neighbor != voxel ? m_voxel_rate[neighbor] : 0.0);
+        m_voxel_rate[voxel] = stochastic_rate(voxel, t);
+        m_voxel_rate[neighbor] = stochastic_rate(neighbor, t);
+        total += m_voxel_rate[voxel] + (neighbor != voxel ? m_voxel_rate[neighbor] : 0.0) - old_rate;
+        // Discard the rounding errors accumulated by the updates
+        if (++events == num_voxels)
+        {
+            events = 0;
+            total = 0.0;
+            for (double rate : m_voxel_rate)
+            {
+                total += rate;
+            }
+        }
+    }
+}
+
+void GillesPy3D::SpatialHybrid::advance(double end_time, std::mt19937_64 &rng)
+{
+    if (m_graph == nullptr)
+    {
+        throw GillesPyError("SpatialHybrid: advance() called before initialize()");
+    }
+    if (!(end_time > m_time))
+    {
+        return;
+    }
+    partition();
+
+    if (num_continuous() > 0)
+    {
+        const std::size_t size = m_volume.size() * m_num_species;
+        double *y = N_VGetArrayPointer(m_y);
+        std::copy(m_state, m_state + size, y);
+        check(CVodeReInit(m_cvode_mem, m_time, m_y), "CVodeReInit");
+        check(CVodeSetStopTime(m_cvode_mem, end_time), "CVodeSetStopTime");
+        sunrealtype t = m_time;
+        check(CVode(m_cvode_mem, end_time, m_y, &t, CV_NORMAL), "CVode");
+        std::copy(y, y + size, m_state);
+    }
+    simulate_stochastic(end_time, rng);
+    m_time = end_time;
+}
+
+void GillesPy3D::SpatialHybrid::check(int retcode, const char *call) const
+{
+    if (retcode < 0)
+    {
+        const std::string message = std::string("SpatialHybrid: ") + call + " failed with error code "
+                                  + std::to_string(retcode);
+        throw GillesPyError(message.c_str());
+    }
+}
+
+int GillesPy3D::SpatialHybrid::rhs(sunrealtype t, N_Vector y, N_Vector ydot, void *user_data)
+{
+    static_cast<SpatialHybrid*>(user_data)->derivative(t, N_VGetArrayPointer(y), N_VGetArrayPointer(ydot));
+    return 0;
+}
@@ -0,0 +1,410 @@
+#include "spatial_tau.hpp"
+#include "error.hpp"
+
+#include <algorithm>
+#include <cmath>
+#include <limits>
+
+namespace
+{
+    constexpr double never = std::numeric_limits<double>::infinity();
+    // Leaps shorter than this are not attempted: the step is considered to have failed
+    constexpr double min_tau = 1e-10;
+}
+
+GillesPy3D::SpatialTauLeaping::SpatialTauLeaping(
+        std::size_t num_species, std::size_t num_reactions,
+        const std::size_t *irN, const std::size_t *jcN, const int *prN,
+        const PropensityFun *propensities, double tau_tol, unsigned int critical_threshold)
+    : m_num_species(num_species), m_num_reactions(num_reactions),
+      m_irN(irN), m_jcN(jcN), m_prN(prN), m_propensities(propensities),
+      m_tau_tol(tau_tol), m_critical_threshold(critical_threshold),
+      m_highest_order(num_species, 0), m_highest_order_count(num_species, 0)
+{
+    if (!(tau_tol > 0.0 && tau_tol < 1.0))
+    {
+        throw GillesPyError("SpatialTauLeaping: tau_tol must be between 0 and 1");
+    }
+
+    // Only net changes are known, so a reaction's reactants are the species it consumes
+    for (std::size_t r = 0; r < num_reactions; ++r)
+    {
+        int order = 0;
+        for (std::size_t k = jcN[r]; k < jcN[r + 1]; ++k)
+        {
+            if (prN[k] < 0)
+            {
+                order -= prN[k];
+            }
+        }
+        for (std::size_t k = jcN[r]; k < jcN[r + 1]; ++k)
+        {
+            const std::size_t s = irN[k];
+            if (prN[k] < 0 && (order > m_highest_order[s] ||
+                               (order == m_highest_order[s] && -prN[k] > m_highest_order_count[s])))
+            {
+                m_highest_order[s] = order;
+                m_highest_order_count[s] = -prN[k];
+            }
+        }
+    }
+}
+
+void GillesPy3D::SpatialTauLeaping::initialize(
+        const NeighborGraph &graph, const double *diffusion_matrix, std::size_t num_types,
+        const std::vector<double> &volume, const std::vector<int> &type,
+        double *data, std::size_t num_data_fn, unsigned int *state, double t)
+{
+    const std::size_t num_voxels = volume.size();
+    if (type.size() != num_voxels || graph.size() != num_voxels)
+    {
+        throw GillesPyError("SpatialTauLeaping: volume, type and neighbor graph sizes differ");
+    }
+    m_graph = &graph;
+    m_volume = volume;
+    m_type = type;
+    m_data = data;
+    m_num_data_fn = num_data_fn;
+    m_state = state;
+    m_time = t;
+    m_diffusion.compute(graph, diffusion_matrix, num_types, m_type, m_num_species);
+
+    m_reaction_rate.assign(num_voxels * m_num_reactions, 0.0);
+    m_reaction_critical.assign(num_voxels * m_num_reactions, 0);
+    m_diffusion_critical.assign(num_voxels * m_num_species, 0);
+    m_critical.assign(num_voxels, 0);
+    m_delta.assign(num_voxels * m_num_species, 0);
+    m_saved_state.assign(num_voxels * m_num_species, 0);
+}
+
+double GillesPy3D::SpatialTauLeaping::propensity(std::size_t reaction, std::size_t voxel, double t) const
+{
+    double *data = m_data != nullptr ? m_data + m_num_data_fn * voxel : nullptr;
+    return m_propensities[reaction](m_state + m_num_species * voxel, t, m_volume[voxel], data, m_type[voxel]);
+}
+
+void GillesPy3D::SpatialTauLeaping::compute_rates(double t)
+{
+    for (std::size_t voxel = 0; voxel < m_volume.size(); ++voxel)
+    {
+        const unsigned int *x = m_state + m_num_species * voxel;
+        double *rates = m_reaction_rate.data() + m_num_reactions * voxel;
+        char *reaction_critical = m_reaction_critical.data() + m_num_reactions * voxel;
+        char *diffusion_critical = m_diffusion_critical.data() + m_num_species * voxel;
+        bool critical = false;
+        for (std::size_t r = 0; r < m_num_reactions; ++r)
+        {
+            rates[r] = propensity(r, voxel, t);
+            reaction_critical[r] = 0;
+            for (std::size_t k = m_jcN[r]; k < m_jcN[r + 1] && rates[r] > 0.0; ++k)
+            {
+                if (m_prN[k] < 0 && x[m_irN[k]] < static_cast<unsigned long>(-m_prN[k]) * m_critical_threshold)
+                {
+                    reaction_critical[r] = 1;
+                }
+            }
+            critical = critical || reaction_critical[r];
+        }
+        // Diffusion consumes one molecule
+        for (std::size_t s = 0; s < m_num_species; ++s)
+        {
+            diffusion_critical[s] = x[s] > 0 && x[s] < m_critical_threshold &&
+                                    m_diffusion.rate[m_num_species * voxel + s] > 0.0;
+            critical = critical || diffusion_critical[s];
+        }
+        m_critical[voxel] = critical;
+    }
+}
+
+double GillesPy3D::SpatialTauLeaping::g(std::size_t s, double x) const
+{
+    const int order = m_highest_order[s];
+    const int count = m_highest_order_count[s];
+    const double x1 = std::max(x - 1.0, 1.0);
+    const double x2 = std::max(x - 2.0, 1.0);
+    if (order <= 1)
+    {
+        return 1.0;
+    }
+    if (order == 2)
+    {
+        return count == 2 ? 2.0 + 1.0 / x1 : 2.0;
+    }
+    if (count == 2)
+    {
+        return 1.5 * (2.0 + 1.0 / x1);
+    }
+    if (count == 3)
+    {
+        return 3.0 + 1.0 / x1 + 2.0 / x2;
+    }
+    return static_cast<double>(order);
+}
+
+double GillesPy3D::SpatialTauLeaping::select_tau() const
+{
+    double tau = never;
+    std::vector<double> mu(m_num_species);
+    std::vector<double> sigma(m_num_species);
+    for (std::size_t voxel = 0; voxel < m_volume.size(); ++voxel)
+    {
+        const unsigned int *x = m_state + m_num_species * voxel;
+        const double *rates = m_reaction_rate.data() + m_num_reactions * voxel;
+        const double *diffusion_rate = m_diffusion.rate.data() + m_num_species * voxel;
+        const char *reaction_critical = m_reaction_critical.data() + m_num_reactions * voxel;
+        const char *diffusion_critical = m_diffusion_critical.data() + m_num_species * voxel;
+
+        // Mean and variance of the consumption of each species by the leaping channels
+        //   (Cao, Gillespie and Petzold, eq. 32a), and the rate of the critical channels
+        double critical_rate = 0.0;
+        for (std::size_t s = 0; s < m_num_species; ++s)
+        {
+            if (diffusion_critical[s])
+            {
+                critical_rate += diffusion_rate[s] * x[s];
+                mu[s] = sigma[s] = 0.0;
+            }
+            else
+            {
+                mu[s] = sigma[s] = diffusion_rate[s] * x[s];
+            }
+        }
+        for (std::size_t r = 0; r < m_num_reactions; ++r)
+        {
+            if (reaction_critical[r])
+            {
+                critical_rate += rates[r];
+                continue;
+            }
+            for (std::size_t k = m_jcN[r]; k < m_jcN[r + 1]; ++k)
+            {
+                if (m_prN[k] < 0)
+                {
+                    mu[m_irN[k]] -= m_prN[k] * rates[r];
+                    sigma[m_irN[k]] += static_cast<double>(m_prN[k]) * m_prN[k] * rates[r];
+                }
+            }
+        }
+        // At most about one critical event per voxel and leap, as molecules it sends out arrive late
+        if (critical_rate > 0.0)
+        {
+            tau = std::min(tau, 1.0 / critical_rate);
+        }
+        // eq. 33
+        for (std::size_t s = 0; s < m_num_species; ++s)
+        {
+            if (mu[s] > 0.0)
+            {
+                const double max_change = std::max(m_tau_tol / g(s, x[s]) * x[s], 1.0);
+                tau = std::min(tau, std::min(max_change / mu[s], max_change * max_change / sigma[s]));
+            }
+        }
+    }
+    return tau;
+}
+
+void GillesPy3D::SpatialTauLeaping::move_molecules(std::size_t voxel, std::size_t s, unsigned long count,
+                                                   std::mt19937_64 &rng)
+{
+    // Multinomial over the neighbors, as a chain of binomials
+    const double *cdf = m_diffusion.cdf.data() + m_graph->num_edges() * s;
+    const double total = m_diffusion.rate[m_num_species * voxel + s];
+    double previous = 0.0;
+    for (std::size_t e = m_graph->begin(voxel); e < m_graph->end(voxel) && count > 0; ++e)
+    {
+        const double remaining = total - previous;
+        const double p = remaining > 0.0 ? std::min((cdf[e] - previous) / remaining, 1.0) : 1.0;
+        previous = cdf[e];
+        const unsigned long moved = e + 1 == m_graph->end(voxel)
+            ? count : std::binomial_distribution<unsigned long>(count, p)(rng);
+        m_delta[m_num_species * m_graph->index[e] + s] += moved;
+        count -= moved;
+    }
+}
+
+void GillesPy3D::SpatialTauLeaping::leap_voxel(std::size_t voxel, double tau, std::mt19937_64 &rng)
+{
+    const unsigned int *x = m_state + m_num_species * voxel;
+    const double *rates = m_reaction_rate.data() + m_num_reactions * voxel;
+    const char *reaction_critical = m_reaction_critical.data() + m_num_reactions * voxel;
+    const char *diffusion_critical = m_diffusion_critical.data() + m_num_species * voxel;
+    long long *delta = m_delta.data() + m_num_species * voxel;
+    for (std::size_t r = 0; r < m_num_reactions; ++r)
+    {
+        if (rates[r] > 0.0 && !reaction_critical[r])
+        {
+            const long long firings = std::poisson_distribution<long long>(rates[r] * tau)(rng);
+            for (std::size_t k = m_jcN[r]; k < m_jcN[r + 1]; ++k)
+            {
+                delta[m_irN[k]] += firings * m_prN[k];
+            }
+        }
+    }
+    for (std::size_t s = 0; s < m_num_species; ++s)
+    {
+        const double rate = m_diffusion.rate[m_num_species * voxel + s] * x[s];
+        if (rate > 0.0 && !diffusion_critical[s])
+        {
+            const unsigned long jumps = std::poisson_distribution<unsigned long>(rate * tau)(rng);
+            delta[s] -= static_cast<long long>(jumps);
+            move_molecules(voxel, s, jumps, rng);
+        }
+    }
+}
+
+void GillesPy3D::SpatialTauLeaping::simulate_voxel(std::size_t voxel, double t, double tau, std::mt19937_64 &rng)
+{
+    unsigned int *x = m_state + m_num_species * voxel;
+    double *rates = m_reaction_rate.data() + m_num_reactions * voxel;
+    const double *diffusion_rate = m_diffusion.rate.data() + m_num_species * voxel;
+    const char *reaction_critical = m_reaction_critical.data() + m_num_reactions * voxel;
+    const char *diffusion_critical = m_diffusion_critical.data() + m_num_species * voxel;
+    const double end_time = t + tau;
+    while (true)
+    {
+        double reaction_sum = 0.0;
+        for (std::size_t r = 0; r < m_num_reactions; ++r)
+        {
+            reaction_sum += reaction_critical[r] ? rates[r] : 0.0;
+        }
+        double diffusion_sum = 0.0;
+        for (std::size_t s = 0; s < m_num_species; ++s)
+        {
+            diffusion_sum += diffusion_critical[s] ? diffusion_rate[s] * x[s] : 0.0;
+        }
+        const double total = reaction_sum + diffusion_sum;
+        if (!(total > 0.0))
+        {
+            return;
+        }
+        t += m_exponential(rng) / total;
+        if (t > end_time)
+        {
+            return;
+        }
+
+        // Only the critical channels are selected; if rounding leaves u past the last one, that one is taken
+        double u = m_uniform(rng) * total;
+        if (u < reaction_sum || !(diffusion_sum > 0.0))
+        {
+            std::size_t reaction = m_num_reactions;
+            for (std::size_t r = 0; r < m_num_reactions; ++r)
+            {
+                if (!reaction_critical[r] || !(rates[r] > 0.0))
+                {
+                    continue;
+                }
+                reaction = r;
+                if (u < rates[r])
+                {
+                    break;
+                }
+                u -= rates[r];
+            }
+            bool feasible = true;
+            for (std::size_t k = m_jcN[reaction]; k < m_jcN[reaction + 1]; ++k)
+            {
+                feasible = feasible && (m_prN[k] >= 0 || x[m_irN[k]] >= static_cast<unsigned int>(-m_prN[k]));
+            }
+            if (!feasible)
+            {
+                // A (custom) propensity positive without the reactants: the event does nothing
+                continue;
+            }
+            for (std::size_t k = m_jcN[reaction]; k < m_jcN[reaction + 1]; ++k)
+            {
+                x[m_irN[k]] += m_prN[k];
+            }
+        }
+        else
+        {
+            u -= reaction_sum;
+            std::size_t s = m_num_species;
+            for (std::size_t species = 0; species < m_num_species; ++species)
+            {
+                const double rate = diffusion_rate[species] * x[species];
+                if (!diffusion_critical[species] || !(rate > 0.0))
+                {
+                    continue;
+                }
+                s = species;
+                if (u < rate)
+                {
+                    break;
+                }
+                u -= rate;
+            }
+            x[s]--;
+            m_delta[m_num_species * m_graph->index[m_diffusion.edge(*m_graph, voxel, s, m_uniform(rng))] + s]++;
+        }
+        ++m_exact_events;
+        for (std::size_t r = 0; r < m_num_reactions; ++r)
+        {
+            if (reaction_critical[r])
+            {
+                rates[r] = propensity(r, voxel, t);
+            }
+        }
+    }
+}
+
+void GillesPy3D::SpatialTauLeaping::advance(double end_time, std::mt19937_64 &rng)
+{
+    if (m_graph == nullptr)
+    {
+        throw GillesPyError("SpatialTauLeaping: advance() called before initialize()");
+    }
+    const std::size_t num_voxels = m_volume.size();
+    const std::size_t state_size = num_voxels * m_num_species;
+    while (m_time < end_time)
+    {
+        compute_rates(m_time);
+        double tau = std::min(select_tau(), end_time - m_time);
+        std::copy(m_state, m_state + state_size, m_saved_state.begin());
+
+        while (true)
+        {
+            std::fill(m_delta.begin(), m_delta.end(), 0);
+            const unsigned long exact_events = m_exact_events;
+            // Leap first: the leaping channels use the populations at the start of the leap
+            for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+            {
+                leap_voxel(voxel, tau, rng);
+            }
+            for (std::size_t voxel = 0; voxel < num_voxels; ++voxel)
+            {
+                if (m_critical[voxel])
+                {
+                    simulate_voxel(voxel, m_time, tau, rng);
+                }
+            }
+
+            bool negative = false;
+            for (std::size_t i = 0; i < state_size && !negative; ++i)
+            {
+                negative = static_cast<long long>(m_state[i]) + m_delta[i] < 0;
+            }
+            if (!negative)
+            {
+                for (std::size_t i = 0; i < state_size; ++i)
+                {
+                    m_state[i] = static_cast<unsigned int>(static_cast<long long>(m_state[i]) + m_delta[i]);
+                }
+                break;
+            }
+
+            // Reject: undo the exact events of the critical voxels and try a shorter leap
+            std::copy(m_saved_state.begin(), m_saved_state.end(), m_state);
+            m_exact_events = exact_events;
+            ++m_rejected_leaps;
+            tau /= 2.0;
+            if (tau < min_tau)
+            {
+                throw GillesPyError("SpatialTauLeaping: no leap keeps the populations non-negative");
+            }
+            compute_rates(m_time);
+        }
+        m_time = std::min(m_time + tau, end_time);
+        ++m_leaps;
+    }
+}
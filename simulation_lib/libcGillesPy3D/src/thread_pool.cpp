@@ -0,0 +1,130 @@
+#include "thread_pool.hpp"
+
+#include <algorithm>
+
+GillesPy3D::ThreadPool::ThreadPool(std::size_t num_threads)
+{
+    if (num_threads == 0)
+    {
+        num_threads = std::max(std::thread::hardware_concurrency(), 1u);
+    }
+    for (std::size_t thread = 1; thread < num_threads; ++thread)
+    {
+        m_workers.emplace_back(&ThreadPool::worker, this, thread);
+    }
+}
+
+GillesPy3D::ThreadPool::~ThreadPool()
+{
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        m_stop = true;
+    }
+    m_start.notify_all();
+    for (std::thread &worker : m_workers)
+    {
+        worker.join();
+    }
+}
+
+std::size_t GillesPy3D::ThreadPool::num_chunks(std::size_t count, std::size_t chunk_size)
+{
+    chunk_size = std::max<std::size_t>(chunk_size, 1);
+    return (count + chunk_size - 1) / chunk_size;
+}
+
+void GillesPy3D::ThreadPool::parallel_for(std::size_t begin, std::size_t end, std::size_t chunk_size, const ChunkFunction &body)
+{
+    if (end <= begin)
+    {
+        return;
+    }
+    chunk_size = std::max<std::size_t>(chunk_size, 1);
+    if (m_workers.empty() || end - begin <= chunk_size)
+    {
+        // Nothing to share; run inline with the same chunk numbering.
+        for (std::size_t chunk = 0, first = begin; first < end; ++chunk, first += chunk_size)
+        {
+            body(first, std::min(first + chunk_size, end), chunk, 0);
+        }
+        return;
+    }
+
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        m_body = &body;
+        m_begin = begin;
+        m_end = end;
+        m_chunk_size = chunk_size;
+        m_next_chunk.store(0, std::memory_order_relaxed);
+        m_error = nullptr;
+        m_active = m_workers.size();
+        ++m_generation;
+    }
+    m_start.notify_all();
+
+    run_chunks(0);
+
+    std::unique_lock<std::mutex> lock(m_mutex);
+    m_done.wait(lock, [this]() { return m_active == 0; });
+    m_body = nullptr;
+    if (m_error != nullptr)
+    {
+        std::exception_ptr error = m_error;
+        m_error = nullptr;
+        std::rethrow_exception(error);
+    }
+}
+
+void GillesPy3D::ThreadPool::worker(std::size_t thread)
+{
+    unsigned long generation = 0;
+    while (true)
+    {
+        {
+            std::unique_lock<std::mutex> lock(m_mutex);
+            m_start.wait(lock, [&]() { return m_stop || m_generation != generation; });
+            if (m_stop)
+            {
+                return;
+            }
+            generation = m_generation;
+        }
+
+        run_chunks(thread);
+
+        std::lock_guard<std::mutex> lock(m_mutex);
+        if (--m_active == 0)
+        {
+            m_done.notify_one();
+        }
+    }
+}
+
+void GillesPy3D::ThreadPool::run_chunks(std::size_t thread)
+{
+    const std::size_t count = m_end - m_begin;
+    while (true)
+    {
+        const std::size_t chunk = m_next_chunk.fetch_add(1, std::memory_order_relaxed);
+        const std::size_t first = chunk * m_chunk_size;
+        if (first >= count)
+        {
+            return;
+        }
+        try
+        {
+            (*m_body)(m_begin + first, m_begin + std::min(first + m_chunk_size, count), chunk, thread);
+        }
+        catch (...)
+        {
+            std::lock_guard<std::mutex> lock(m_mutex);
+            if (m_error == nullptr)
+            {
+                m_error = std::current_exception();
+            }
+            // Stop handing out chunks; the loop is abandoned.
+            m_next_chunk.store(count, std::memory_order_relaxed);
+        }
+    }
+}
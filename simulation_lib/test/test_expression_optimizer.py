@@ -0,0 +1,77 @@
+# GillesPy3D is a Python 3 package for simulation of
+# spatial/non-spatial deterministic/stochastic reaction-diffusion-advection problems
+# Copyright (C) 2023 GillesPy3D developers.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU GENERAL PUBLIC LICENSE Version 3 as
+# published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU GENERAL PUBLIC LICENSE Version 3 for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from gillespy3d import Reaction, Species
+from gillespy3d.solvers.build_expression import BuildExpression
+from gillespy3d.solvers.expression_optimizer import ExpressionOptimizer
+
+class TestExpressionOptimizer(unittest.TestCase):
+    '''
+    ################################################################################################
+    Unit tests for the ExpressionOptimizer, on the propensities of mass-action reactions.
+    ################################################################################################
+    '''
+    def setUp(self):
+        ''' Temperature-dependent dimerization: Arrhenius rates over a temperature field T. '''
+        monomer = Species(name="M", diffusion_coefficient=0.1)
+        dimer = Species(name="D", diffusion_coefficient=0.01)
+        product = Species(name="P", diffusion_coefficient=0.01)
+        rate = "{} * exp(-E_a / (R * T))"
+        self.reactions = [
+            Reaction(name="dimerization", reactants={monomer: 2}, products={dimer: 1}, rate=rate.format("A_f")),
+            Reaction(name="dissociation", reactants={dimer: 1}, products={monomer: 2}, rate=rate.format("A_b")),
+            Reaction(name="conversion", reactants={monomer: 1, dimer: 1}, products={product: 1},
+                     rate=rate.format("A_p")),
+        ]
+        # Sanitized names, as the solver writes them
+        self.namespace = {
+            "M": "x[0]", "D": "x[1]", "P": "x[2]", "T": "data_fn[0]",
+            "A_f": "P0", "A_b": "P1", "A_p": "P2", "E_a": "P3", "R": "P4", "vol": "vol", "t": "t", "exp": "exp",
+        }
+        self.expr = BuildExpression(namespace=self.namespace, sanitize=True)
+
+    def optimize(self, statements, state_type):
+        ''' Optimize statements as Solver does for one kind of propensity. '''
+        variables = {"data_fn[0]": "double", "x[0]": state_type, "x[1]": state_type, "x[2]": state_type,
+                     "vol": "double", "t": "double", "sd": "int"}
+        optimizer = ExpressionOptimizer(["P0", "P1", "P2", "P3", "P4"], variables, prefix="test")
+        for statement in statements:
+            optimizer.add(self.expr.getexpr_ast(statement))
+        return optimizer.optimize()
+
+    def test_mass_action_propensities(self):
+        ''' The constant factors of the Boltzmann factors are folded once the products are reordered. '''
+        for ode, state_type in ((False, "int"), (True, "double")):
+            with self.subTest(ode=ode):
+                statements = [
+                    reaction.ode_propensity_function if ode else reaction.propensity_function
+                    for reaction in self.reactions
+                ]
+                optimized = self.optimize(statements, state_type)
+                # -E_a / (R * T) is evaluated as test_c0 / T: two operations saved per reaction
+                self.assertGreater(optimized.report.operations_saved, 0)
+                self.assertEqual(optimized.report.operations_saved, 2 * len(self.reactions))
+                self.assertEqual(optimized.report.constants, 1)
+                self.assertEqual(optimized.constants[0][1], "(-P3/P4)")
+
+    def test_commutative_operands(self):
+        ''' Mass-action propensities differing in their rate share the factors reading the voxel. '''
+        optimized = self.optimize(["A_f * M * (M - 1) / vol", "(M - 1) * A_b * M / vol"], "int")
+        first, second = optimized.expressions
+        self.assertEqual(first, "(P0*((x[0]/vol)*(x[0]-1)))")
+        self.assertEqual(second, "(P1*((x[0]/vol)*(x[0]-1)))")